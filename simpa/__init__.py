@@ -2,56 +2,84 @@
 # SPDX-FileCopyrightText: 2021 Janek Groehl
 # SPDX-License-Identifier: MIT
 
+import importlib
+
 from .utils import *
 from .log import Logger
 
-from .core.simulation_modules.volume_creation_module.volume_creation_module_model_based_adapter import \
-    ModelBasedVolumeCreationAdapter
-from .core.simulation_modules.volume_creation_module.volume_creation_module_segmentation_based_adapter import \
-    SegmentationBasedVolumeCreationAdapter
-from .core.simulation_modules.optical_simulation_module.optical_forward_model_mcx_adapter import \
-    MCXAdapter
-from .core.simulation_modules.optical_simulation_module.optical_forward_model_mcx_reflectance_adapter import \
-    MCXAdapterReflectance
-from .core.simulation_modules.acoustic_forward_module.acoustic_forward_module_k_wave_adapter import \
-    KWaveAdapter
-from .core.simulation_modules.reconstruction_module.reconstruction_module_delay_and_sum_adapter import \
-    DelayAndSumAdapter
-from .core.simulation_modules.reconstruction_module.reconstruction_module_delay_multiply_and_sum_adapter import \
-    DelayMultiplyAndSumAdapter
-from .core.simulation_modules.reconstruction_module.reconstruction_module_signed_delay_multiply_and_sum_adapter import \
-    SignedDelayMultiplyAndSumAdapter
-from .core.simulation_modules.reconstruction_module.reconstruction_module_time_reversal_adapter import \
-    TimeReversalAdapter
-
-from .core.simulation_modules.reconstruction_module.reconstruction_module_delay_and_sum_adapter import \
-    reconstruct_delay_and_sum_pytorch
-from .core.simulation_modules.reconstruction_module.reconstruction_module_delay_multiply_and_sum_adapter import \
-    reconstruct_delay_multiply_and_sum_pytorch
-from .core.simulation_modules.reconstruction_module.reconstruction_module_signed_delay_multiply_and_sum_adapter import \
-    reconstruct_signed_delay_multiply_and_sum_pytorch
-from .core.simulation_modules.acoustic_forward_module.acoustic_forward_module_k_wave_adapter import \
-    perform_k_wave_acoustic_forward_simulation
-
-from simpa.core.processing_components.monospectral.noise import GaussianNoise
-from simpa.core.processing_components.monospectral.noise import GammaNoise
-from simpa.core.processing_components.monospectral.noise import PoissonNoise
-from simpa.core.processing_components.monospectral.noise import SaltAndPepperNoise
-from simpa.core.processing_components.monospectral.noise import UniformNoise
-from simpa.core.processing_components.monospectral.field_of_view_cropping import FieldOfViewCropping
-from simpa.core.processing_components.monospectral.iterative_qPAI_algorithm import IterativeqPAI
-from simpa.core.processing_components.multispectral.linear_unmixing import LinearUnmixing
-
 from .core.device_digital_twins import *
 
 from .core.simulation import simulate
 
-from .io_handling import load_data_field, load_hdf5, save_data_field, save_hdf5
-from .io_handling.zenodo_download import download_from_zenodo
-from .io_handling.ipasc import export_to_ipasc
-
-from .visualisation.matplotlib_data_visualisation import visualise_data
-from .visualisation.matplotlib_device_visualisation import visualise_device
+from .io_handling import load_data_field, load_hdf5, open_hdf5, save_data_field, save_hdf5
 
 from .utils.quality_assurance.data_sanity_testing import assert_equal_shapes
 from .utils.quality_assurance.data_sanity_testing import assert_array_well_defined
+
+# The simulation modules, processing components and tools below depend on heavy packages (e.g. torch, scipy.signal,
+# matplotlib or pacfish). They are only imported when they are accessed for the first time (PEP 562), such that
+# `import simpa` stays fast.
+_LAZY_ATTRIBUTES = {
+    "ModelBasedVolumeCreationAdapter":
+        ".core.simulation_modules.volume_creation_module.volume_creation_module_model_based_adapter",
+    "SegmentationBasedVolumeCreationAdapter":
+        ".core.simulation_modules.volume_creation_module.volume_creation_module_segmentation_based_adapter",
+    "MCXAdapter": ".core.simulation_modules.optical_simulation_module.optical_forward_model_mcx_adapter",
+    "MCXAdapterReflectance":
+        ".core.simulation_modules.optical_simulation_module.optical_forward_model_mcx_reflectance_adapter",
+    "DiffusionApproximationAdapter":
+        ".core.simulation_modules.optical_simulation_module.optical_forward_model_diffusion_adapter",
+    "KWaveAdapter": ".core.simulation_modules.acoustic_forward_module.acoustic_forward_module_k_wave_adapter",
+    "KSpacePseudospectralAdapter":
+        ".core.simulation_modules.acoustic_forward_module.acoustic_forward_module_k_space_adapter",
+    "DelayAndSumAdapter": ".core.simulation_modules.reconstruction_module.reconstruction_module_delay_and_sum_adapter",
+    "DelayMultiplyAndSumAdapter":
+        ".core.simulation_modules.reconstruction_module.reconstruction_module_delay_multiply_and_sum_adapter",
+    "SignedDelayMultiplyAndSumAdapter":
+        ".core.simulation_modules.reconstruction_module.reconstruction_module_signed_delay_multiply_and_sum_adapter",
+    "TimeReversalAdapter": ".core.simulation_modules.reconstruction_module.reconstruction_module_time_reversal_adapter",
+    "FourierDomainReconstructionAdapter":
+        ".core.simulation_modules.reconstruction_module.reconstruction_module_fourier_domain_adapter",
+
+    "reconstruct_delay_and_sum_pytorch":
+        ".core.simulation_modules.reconstruction_module.reconstruction_module_delay_and_sum_adapter",
+    "reconstruct_delay_multiply_and_sum_pytorch":
+        ".core.simulation_modules.reconstruction_module.reconstruction_module_delay_multiply_and_sum_adapter",
+    "reconstruct_signed_delay_multiply_and_sum_pytorch":
+        ".core.simulation_modules.reconstruction_module.reconstruction_module_signed_delay_multiply_and_sum_adapter",
+    "reconstruct_fourier_domain":
+        ".core.simulation_modules.reconstruction_module.reconstruction_module_fourier_domain_adapter",
+    "perform_k_wave_acoustic_forward_simulation":
+        ".core.simulation_modules.acoustic_forward_module.acoustic_forward_module_k_wave_adapter",
+
+    "GaussianNoise": ".core.processing_components.monospectral.noise",
+    "GammaNoise": ".core.processing_components.monospectral.noise",
+    "PoissonNoise": ".core.processing_components.monospectral.noise",
+    "SaltAndPepperNoise": ".core.processing_components.monospectral.noise",
+    "UniformNoise": ".core.processing_components.monospectral.noise",
+    "FieldOfViewCropping": ".core.processing_components.monospectral.field_of_view_cropping",
+    "IterativeqPAI": ".core.processing_components.monospectral.iterative_qPAI_algorithm",
+    "LinearUnmixing": ".core.processing_components.multispectral.linear_unmixing",
+
+    "download_from_zenodo": ".io_handling.zenodo_download",
+    "export_to_ipasc": ".io_handling.ipasc",
+
+    "visualise_data": ".visualisation.matplotlib_data_visualisation",
+    "visualise_device": ".visualisation.matplotlib_device_visualisation",
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name], __name__), name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY_ATTRIBUTES))
+
+
+__all__ = sorted(name for name in set(globals()) | set(_LAZY_ATTRIBUTES) if not name.startswith("_") and
+                 name != "importlib")
@@ -13,7 +13,10 @@ from simpa.utils.libraries.molecule_library import MolecularComposition
 from simpa.utils.calculate import calculate_gruneisen_parameter_from_temperature
 from simpa.core.simulation_modules.optical_simulation_module.optical_forward_model_mcx_adapter import \
     MCXAdapter
+from simpa.core.simulation_modules.optical_simulation_module.optical_forward_model_diffusion_adapter import \
+    DiffusionApproximationAdapter
 from simpa.utils import Settings
+from simpa.utils.profiling import get_current_stage_profile
 from simpa.io_handling import save_data_field, load_data_field
 from simpa.utils import TISSUE_LIBRARY
 from simpa.core.processing_components import ProcessingComponent
@@ -37,6 +40,10 @@ class IterativeqPAI(ProcessingComponent):
     Tags.ITERATIVE_RECONSTRUCTION_REGULARIZATION_SIGMA (default: 0.01)
     Tags.ITERATIVE_RECONSTRUCTION_SAVE_INTERMEDIATE_RESULTS (default: False)
     Tags.ITERATIVE_RECONSTRUCTION_STOPPING_LEVEL (default: 0.03)
+    Tags.ITERATIVE_RECONSTRUCTION_ADAPTIVE_PHOTON_BUDGET (default: False)
+    Tags.ITERATIVE_RECONSTRUCTION_MINIMUM_PHOTON_FRACTION (default: 1/16)
+    Tags.ITERATIVE_RECONSTRUCTION_RESOLUTION_LEVELS (default: 1)
+    Tags.ITERATIVE_RECONSTRUCTION_COARSE_LEVEL_MAX_ITERATION_NUMBER (default: 5)
     global_settings (required)
     component_settings_key (required)
 
@@ -58,18 +65,28 @@ class IterativeqPAI(ProcessingComponent):
         else:
             self.downscale_factor = 0.73
 
+        # the optical forward model is created once and re-used by all iterations
+        self.forward_model_implementation = None
+        # number of photons of the Monte Carlo simulation of every iteration (None for the diffusion approximation)
+        self.photon_budgets = []
+        # shape, spacing, number of iterations and wall time of every resolution level, from coarse to fine. They
+        # are also stored in the details of the stage profile of this pipeline element.
+        self.resolution_levels = []
+
     def run(self, pa_device):
         self.logger.info("Reconstructing absorption using iterative qPAI method...")
 
         # check if simulation_path and optical_model_binary_path exist
         self.logger.debug(f"Simulation path: {self.global_settings[Tags.SIMULATION_PATH]}")
-        self.logger.debug(f"Optical model binary path: {self.optical_settings[Tags.OPTICAL_MODEL_BINARY_PATH]}")
 
         if not os.path.exists(self.global_settings[Tags.SIMULATION_PATH]):
             print("Tags.SIMULATION_PATH tag in settings cannot be found.")
 
-        if not os.path.exists(self.optical_settings[Tags.OPTICAL_MODEL_BINARY_PATH]):
-            print("Tags.OPTICAL_MODEL_BINARY_PATH tag in settings cannot be found.")
+        # the diffusion approximation does not need a binary
+        if Tags.OPTICAL_MODEL_BINARY_PATH in self.optical_settings:
+            self.logger.debug(f"Optical model binary path: {self.optical_settings[Tags.OPTICAL_MODEL_BINARY_PATH]}")
+            if not os.path.exists(self.optical_settings[Tags.OPTICAL_MODEL_BINARY_PATH]):
+                print("Tags.OPTICAL_MODEL_BINARY_PATH tag in settings cannot be found.")
 
         # debug reconstruction settings
         self.logger.debug(f"Resampling factor: {self.downscale_factor}")
@@ -164,8 +181,10 @@ class IterativeqPAI(ProcessingComponent):
         sigma = self.regularization_sigma(target_intial_pressure, stacked_to_volume)
 
         # initialization
-        absorption = 1e-16 * np.ones(np.shape(target_intial_pressure))
-        y_pos = int(np.shape(absorption)[1] / 2)  # to extract middle slice
+        full_resolution_shape = np.shape(target_intial_pressure)
+        full_resolution_spacing = self.global_settings[Tags.SPACING_MM]
+        absorption = None
+        y_pos = int(full_resolution_shape[1] / 2)  # to extract middle slice
         list_of_intermediate_absorptions = []  # if intentional all intermediate iteration updates can be returned
         error_list = []
 
@@ -175,31 +194,118 @@ class IterativeqPAI(ProcessingComponent):
                 raise AssertionError("Tags.MAX_NUMBER_ITERATIVE_RECONSTRUCTION tag is invalid (equals zero).")
             nmax = int(self.iterative_method_settings[Tags.ITERATIVE_RECONSTRUCTION_MAX_ITERATION_NUMBER])
 
+        # the photon budget is only adapted for Monte Carlo simulations
+        monte_carlo_simulation = (Tags.OPTICAL_MODEL in self.optical_settings and
+                                  self.optical_settings[Tags.OPTICAL_MODEL] == Tags.OPTICAL_MODEL_MCX)
+        full_photon_budget = None
+        if monte_carlo_simulation and Tags.OPTICAL_MODEL_NUMBER_PHOTONS in self.optical_settings:
+            full_photon_budget = self.optical_settings[Tags.OPTICAL_MODEL_NUMBER_PHOTONS]
+        adaptive_photon_budget = False
+        if Tags.ITERATIVE_RECONSTRUCTION_ADAPTIVE_PHOTON_BUDGET in self.iterative_method_settings:
+            adaptive_photon_budget = bool(self.iterative_method_settings[
+                Tags.ITERATIVE_RECONSTRUCTION_ADAPTIVE_PHOTON_BUDGET]) and full_photon_budget is not None
+        photon_fraction = self.minimum_photon_fraction() if adaptive_photon_budget else 1
+        self.photon_budgets = []
+        self.resolution_levels = []
+
         # run algorithm
         start_time = time.time()
 
-        i = 0
-        while i < nmax:
-            print("Iteration: ", i)
-            # core method
-            fluence = self.forward_model_fluence(absorption, scattering, anisotropy, pa_device)
-            error_list.append(self.log_sum_squared_error(target_intial_pressure, absorption, fluence, sigma))
-            absorption = self.update_absorption_estimate(target_intial_pressure, fluence, sigma)
-
-            est_p0 = absorption * fluence
-
-            # only store middle slice (2-d image instead of 3-d volume) in iteration list for better performance
-            list_of_intermediate_absorptions.append(absorption[:, y_pos, :])
-
-            # check if current error did not change significantly in comparison to preceding error
-            if self.convergence_stopping_criterion(error_list, iteration=i):
-                if Tags.ITERATIVE_RECONSTRUCTION_SAVE_LAST_FLUENCE:
-                    dst = self.global_settings[Tags.SIMULATION_PATH] + "/last_fluence" + "_"
-                    np.save(dst + self.global_settings[Tags.VOLUME_NAME] + ".npy", fluence)
-                break
-            i += 1
-
-        print("--- %s seconds/iteration ---" % round((time.time() - start_time) / (i + 1), 2))
+        resolution_factors = self.resolution_level_factors()
+        try:
+            for level, resolution_factor in enumerate(resolution_factors):
+                final_level = level == len(resolution_factors) - 1
+                # coarse levels run on downsampled volumes, the final level on the full resolution volumes
+                if final_level:
+                    level_initial_pressure, level_scattering, level_anisotropy, level_sigma = \
+                        target_intial_pressure, scattering, anisotropy, sigma
+                    level_nmax = nmax
+                else:
+                    level_shape = tuple(max(1, int(round(size * resolution_factor))) for size in full_resolution_shape)
+                    level_initial_pressure = self.resample_to_shape(target_intial_pressure, level_shape)
+                    level_scattering = self.resample_to_shape(scattering, level_shape)
+                    level_anisotropy = self.resample_to_shape(anisotropy, level_shape)
+                    level_sigma = sigma if np.isscalar(sigma) else self.resample_to_shape(sigma, level_shape)
+                    level_nmax = self.coarse_level_max_iteration_number()
+                level_shape = np.shape(level_initial_pressure)
+                self.global_settings[Tags.SPACING_MM] = full_resolution_spacing / resolution_factor
+
+                # the estimate of the preceding (coarser) level is the initial guess of this level
+                if absorption is None:
+                    absorption = 1e-16 * np.ones(level_shape)
+                else:
+                    absorption = self.resample_to_shape(absorption, level_shape)
+                level_errors = []
+
+                # the levels are timed directly, a nested StageProfiler would reset the peak memory of the stage
+                level_start_time = time.perf_counter()
+                i = 0
+                while i < level_nmax:
+                    print("Iteration: ", i)
+                    if adaptive_photon_budget:
+                        # only the final level has to end with the full photon budget
+                        photon_fraction = self.photon_budget_fraction(
+                            level_errors, photon_fraction, iteration=i,
+                            maximum_iteration_number=level_nmax if final_level else np.inf)
+                        self.optical_settings[Tags.OPTICAL_MODEL_NUMBER_PHOTONS] = \
+                            max(1, int(round(full_photon_budget * photon_fraction)))
+                        self.logger.debug(f"Photon budget of iteration {i}: "
+                                          f"{self.optical_settings[Tags.OPTICAL_MODEL_NUMBER_PHOTONS]}")
+                    self.photon_budgets.append(self.optical_settings[Tags.OPTICAL_MODEL_NUMBER_PHOTONS]
+                                               if full_photon_budget is not None else None)
+                    # core method
+                    fluence = self.forward_model_fluence(absorption, level_scattering, level_anisotropy,
+                                                         pa_device)
+                    level_errors.append(self.log_sum_squared_error(level_initial_pressure, absorption, fluence,
+                                                                   level_sigma))
+                    absorption = self.update_absorption_estimate(level_initial_pressure, fluence, level_sigma)
+
+                    # only store middle slice (2-d image instead of 3-d volume) in iteration list for better
+                    # performance, the slices of coarse levels are upsampled to the full resolution
+                    if final_level:
+                        list_of_intermediate_absorptions.append(absorption[:, y_pos, :])
+                    else:
+                        list_of_intermediate_absorptions.append(self.resample_to_shape(
+                            absorption[:, int(level_shape[1] / 2), :],
+                            (full_resolution_shape[0], full_resolution_shape[2])))
+
+                    # check if current error did not change significantly in comparison to preceding error
+                    # the stopping criterion is only trusted for simulations with the full photon budget,
+                    # otherwise the next iteration is simulated with all photons. Coarse levels hand over to the
+                    # next level as soon as they converged
+                    converged = self.convergence_stopping_criterion(level_errors, iteration=i)
+                    i += 1
+                    if converged and not final_level:
+                        break
+                    if converged and photon_fraction >= 1:
+                        if Tags.ITERATIVE_RECONSTRUCTION_SAVE_LAST_FLUENCE:
+                            dst = self.global_settings[Tags.SIMULATION_PATH] + "/last_fluence" + "_"
+                            np.save(dst + self.global_settings[Tags.VOLUME_NAME] + ".npy", fluence)
+                        break
+
+                error_list += level_errors
+                self.resolution_levels.append({
+                    "shape": level_shape,
+                    "spacing_mm": self.global_settings[Tags.SPACING_MM],
+                    "iterations": i,
+                    "wall_time_in_s": time.perf_counter() - level_start_time
+                })
+                self.logger.info(f"Resolution level {level}: {i} iterations on a volume of shape {level_shape} with "
+                                 f"a spacing of {self.global_settings[Tags.SPACING_MM]:.3f} mm in "
+                                 f"{self.resolution_levels[-1]['wall_time_in_s']:.2f} s")
+        finally:
+            self.global_settings[Tags.SPACING_MM] = full_resolution_spacing
+            if adaptive_photon_budget:
+                self.optical_settings[Tags.OPTICAL_MODEL_NUMBER_PHOTONS] = full_photon_budget
+
+        if adaptive_photon_budget:
+            self.logger.info(f"Simulated {int(np.sum(self.photon_budgets))} photons in {len(self.photon_budgets)} "
+                             f"iterations instead of {int(full_photon_budget * len(self.photon_budgets))}.")
+        # the records of the resolution levels are stored with the profile of this pipeline element
+        stage_profile = get_current_stage_profile()
+        if stage_profile is not None:
+            stage_profile.details["resolution_levels"] = self.resolution_levels
+        print("--- %s seconds/iteration ---" % round((time.time() - start_time) / len(error_list), 2))
 
         # extracting field of view if input initial pressure was passed as a 2-d array
         if stacked_to_volume:
@@ -208,6 +314,117 @@ class IterativeqPAI(ProcessingComponent):
         # function returns the last iteration result as a numpy array and all iteration results in a list
         return absorption, list_of_intermediate_absorptions
 
+    def minimum_photon_fraction(self) -> float:
+        """
+        :return: the fraction of the photon budget that is used by the first iterations if the photon budget is
+            adapted (Tags.ITERATIVE_RECONSTRUCTION_MINIMUM_PHOTON_FRACTION, default: 1/16).
+        """
+        if Tags.ITERATIVE_RECONSTRUCTION_MINIMUM_PHOTON_FRACTION in self.iterative_method_settings:
+            minimum_fraction = self.iterative_method_settings[Tags.ITERATIVE_RECONSTRUCTION_MINIMUM_PHOTON_FRACTION]
+            return min(1.0, float(minimum_fraction))
+        return 1 / 16
+
+    def photon_budget_fraction(self, errors: list, previous_fraction: float, iteration: int,
+                               maximum_iteration_number: int) -> float:
+        """
+        Computes the fraction of the photon budget for the next iteration. The relative change of the error can only
+        be resolved if the Monte Carlo noise of the fluence is smaller than the change. As the noise decreases with
+        the square root of the number of photons and the full photon budget is assumed to resolve a change of the
+        size of the stopping level, the fraction is (stopping level / last relative change of the error)^2.
+        The fraction never decreases and the last possible iteration always uses the full photon budget.
+
+        :param errors: List of log (base 10) sum of squared errors of the preceding iterations.
+        :param previous_fraction: Photon budget fraction of the preceding iteration.
+        :param iteration: Number of the next iteration.
+        :param maximum_iteration_number: Maximum number of iterations.
+        :return: fraction of the photon budget between the minimum photon fraction and 1.
+        """
+        if iteration >= maximum_iteration_number - 1:
+            return 1.0
+        if len(errors) < 2:
+            return previous_fraction
+        share = np.abs(errors[-2] - errors[-1]) / np.abs(errors[-2])
+        if share == 0:
+            return 1.0
+        fraction = (self.stopping_level() / share) ** 2
+        return float(min(1.0, max(previous_fraction, fraction)))
+
+    def resolution_level_factors(self) -> list:
+        """
+        Returns the resolutions of the coarse-to-fine schedule relative to the (resampled) input data. Each level
+        halves the resolution of the next finer level, e.g. [0.25, 0.5, 1] for three levels.
+
+        :return: list of resolution factors from the coarsest to the full resolution.
+        :raises: AssertionError: if Tags.ITERATIVE_RECONSTRUCTION_RESOLUTION_LEVELS is smaller than one.
+        """
+        number_of_levels = 1
+        if Tags.ITERATIVE_RECONSTRUCTION_RESOLUTION_LEVELS in self.iterative_method_settings:
+            number_of_levels = int(self.iterative_method_settings[Tags.ITERATIVE_RECONSTRUCTION_RESOLUTION_LEVELS])
+            if number_of_levels < 1:
+                raise AssertionError("Tags.ITERATIVE_RECONSTRUCTION_RESOLUTION_LEVELS must be at least one.")
+        return [0.5 ** level for level in reversed(range(number_of_levels))]
+
+    def coarse_level_max_iteration_number(self) -> int:
+        """
+        :return: Maximum number of iterations on each coarse resolution level
+            (Tags.ITERATIVE_RECONSTRUCTION_COARSE_LEVEL_MAX_ITERATION_NUMBER, default: 5).
+        :raises: AssertionError: if Tags.ITERATIVE_RECONSTRUCTION_COARSE_LEVEL_MAX_ITERATION_NUMBER is zero.
+        """
+        if Tags.ITERATIVE_RECONSTRUCTION_COARSE_LEVEL_MAX_ITERATION_NUMBER in self.iterative_method_settings:
+            nmax = int(self.iterative_method_settings[Tags.ITERATIVE_RECONSTRUCTION_COARSE_LEVEL_MAX_ITERATION_NUMBER])
+            if nmax == 0:
+                raise AssertionError("Tags.ITERATIVE_RECONSTRUCTION_COARSE_LEVEL_MAX_ITERATION_NUMBER tag is invalid "
+                                     "(equals zero).")
+            return nmax
+        return 5
+
+    @staticmethod
+    def resample_to_shape(data: np.ndarray, shape: tuple) -> np.ndarray:
+        """
+        Resamples data to the given shape. Axes that are downsampled are averaged over the voxels that fall into each
+        new voxel, such that e.g. the initial pressure of a coarse voxel is consistent with the fluence averaged over
+        this voxel. Axes that are upsampled are interpolated linearly.
+
+        :param data: 2-d or 3-d data.
+        :param shape: Shape of the resampled data.
+        :return: Resampled data.
+        """
+        data = np.asarray(data)
+        for axis, (size, new_size) in enumerate(zip(np.shape(data), shape)):
+            if new_size < size:
+                bin_edges = (np.arange(new_size) * size) // new_size
+                bin_sizes = np.diff(np.append(bin_edges, size))
+                data = np.add.reduceat(data, bin_edges, axis=axis) / np.expand_dims(
+                    bin_sizes, tuple(index for index in range(data.ndim) if index != axis))
+        if np.shape(data) != tuple(shape):
+            data = zoom(data, np.divide(shape, np.shape(data)), order=1, mode="nearest")
+        return data
+
+    def get_forward_model_implementation(self):
+        """
+        Returns the optical forward model of the reconstruction. It is created on the first call and re-used by all
+        further iterations. The diffusion approximation starts its solver from the fluence of the preceding iteration.
+
+        :return: the optical forward model adapter.
+        :raises: AssertionError: if Tags.OPTICAL_MODEL tag was not or incorrectly defined in settings.
+        """
+        if self.forward_model_implementation is not None:
+            return self.forward_model_implementation
+
+        if Tags.OPTICAL_MODEL not in self.optical_settings:
+            raise AssertionError("Tags.OPTICAL_MODEL tag was not specified in the settings.")
+        model = self.optical_settings[Tags.OPTICAL_MODEL]
+
+        if model == Tags.OPTICAL_MODEL_MCX:
+            self.forward_model_implementation = MCXAdapter(self.global_settings)
+        elif model == Tags.OPTICAL_MODEL_DIFFUSION:
+            self.forward_model_implementation = DiffusionApproximationAdapter(self.global_settings)
+            self.forward_model_implementation.warm_start = True
+        else:
+            raise AssertionError("Tags.OPTICAL_MODEL tag must be Tags.OPTICAL_MODEL_MCX or "
+                                 "Tags.OPTICAL_MODEL_DIFFUSION.")
+        return self.forward_model_implementation
+
     def extract_initial_data_from_hdf5(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
         """
         Extract necessary information - initial pressure and scattering coefficients -
@@ -399,42 +616,16 @@ class IterativeqPAI(ProcessingComponent):
         :raises: AssertionError: if Tags.OPTICAL_MODEL tag was not or incorrectly defined in settings.
         """
 
-        if Tags.OPTICAL_MODEL not in self.optical_settings:
-            raise AssertionError("Tags.OPTICAL_MODEL tag was not specified in the settings.")
-        model = self.optical_settings[Tags.OPTICAL_MODEL]
-
         self.global_settings.get_optical_settings()[Tags.MCX_ASSUMED_ANISOTROPY] = np.mean(anisotropy)
-
-        if model == Tags.OPTICAL_MODEL_MCX:
-            forward_model_implementation = MCXAdapter(self.global_settings)
-        else:
-            raise AssertionError("Tags.OPTICAL_MODEL tag must be Tags.OPTICAL_MODEL_MCX.")
+        forward_model_implementation = self.get_forward_model_implementation()
 
         _device = pa_device.get_illumination_geometry()
-
-        if isinstance(_device, list):
-            # per convention this list has at least two elements
-            results = forward_model_implementation.forward_model(absorption_cm=absorption,
-                                                                 scattering_cm=scattering,
-                                                                 anisotropy=anisotropy,
-                                                                 illumination_geometry=_device[0])
-            fluence = results[Tags.DATA_FIELD_FLUENCE]
-            for idx in range(1, len(_device)):
-                # we already looked at the 0th element, so go from 1 to n-1
-                results = forward_model_implementation.forward_model(absorption_cm=absorption,
-                                                                     scattering_cm=scattering,
-                                                                     anisotropy=anisotropy,
-                                                                     illumination_geometry=_device[idx + 1])
-                fluence += results[Tags.DATA_FIELD_FLUENCE]
-
-            fluence = fluence / len(_device)
-
-        else:
-            results = forward_model_implementation.forward_model(absorption_cm=absorption,
-                                                                 scattering_cm=scattering,
-                                                                 anisotropy=anisotropy,
-                                                                 illumination_geometry=_device)
-            fluence = results[Tags.DATA_FIELD_FLUENCE]
+        results = forward_model_implementation.run_forward_model(_device=_device,
+                                                                 device=pa_device,
+                                                                 absorption=absorption,
+                                                                 scattering=scattering,
+                                                                 anisotropy=anisotropy)
+        fluence = results[Tags.DATA_FIELD_FLUENCE]
 
         print("Simulating the optical forward process...[Done]")
 
@@ -492,13 +683,10 @@ class IterativeqPAI(ProcessingComponent):
 
         return np.log10(sse)
 
-    def convergence_stopping_criterion(self, errors: list, iteration: int) -> bool:
+    def stopping_level(self) -> float:
         """
-        Serves as a stopping criterion for the iterative algorithm. If False the iterative algorithm continues.
-
-        :param errors: List of log (base 10) sum of squared errors.
-        :param iteration: Iteration number.
-        :return: if iteration method should be stopped.
+        :return: Ratio of improvement and preceding error at which the iterative method stops
+            (Tags.ITERATIVE_RECONSTRUCTION_STOPPING_LEVEL, default: 0.03).
         :raises: AssertionError: if Tags.ITERATIVE_RECONSTRUCTION_STOPPING_LEVEL tag is zero
         """
         epsilon = 0.03
@@ -507,6 +695,18 @@ class IterativeqPAI(ProcessingComponent):
             if self.iterative_method_settings[Tags.ITERATIVE_RECONSTRUCTION_STOPPING_LEVEL] == 0:
                 raise AssertionError("Tags.ITERATIVE_RECONSTRUCTION_STOPPING_LEVEL should be greater than zero.")
             epsilon = self.iterative_method_settings[Tags.ITERATIVE_RECONSTRUCTION_STOPPING_LEVEL]
+        return epsilon
+
+    def convergence_stopping_criterion(self, errors: list, iteration: int) -> bool:
+        """
+        Serves as a stopping criterion for the iterative algorithm. If False the iterative algorithm continues.
+
+        :param errors: List of log (base 10) sum of squared errors.
+        :param iteration: Iteration number.
+        :return: if iteration method should be stopped.
+        :raises: AssertionError: if Tags.ITERATIVE_RECONSTRUCTION_STOPPING_LEVEL tag is zero
+        """
+        epsilon = self.stopping_level()
 
         if iteration == 0:
             return False
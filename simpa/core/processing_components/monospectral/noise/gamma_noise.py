@@ -7,7 +7,7 @@ import numpy as np
 from simpa.core.processing_components import ProcessingComponent
 from simpa.io_handling import load_data_field, save_data_field
 from simpa.utils import Tags
-from simpa.utils.quality_assurance.data_sanity_testing import assert_array_well_defined
+from simpa.utils.quality_assurance.data_sanity_testing import assert_array_well_defined, get_qa_assertion_sample_size
 
 
 class GammaNoise(ProcessingComponent):
@@ -58,7 +58,7 @@ class GammaNoise(ProcessingComponent):
             data_array = data_array * np.random.gamma(shape, scale, size=np.shape(data_array))
 
         if not (Tags.IGNORE_QA_ASSERTIONS in self.global_settings and Tags.IGNORE_QA_ASSERTIONS):
-            assert_array_well_defined(data_array)
+            assert_array_well_defined(data_array, sample_size=get_qa_assertion_sample_size(self.global_settings))
 
         save_data_field(data_array, self.global_settings[Tags.SIMPA_OUTPUT_PATH], data_field, wavelength)
 
@@ -6,7 +6,7 @@ from simpa.utils import Tags
 from simpa.utils import EPS
 from simpa.io_handling import load_data_field, save_data_field
 from simpa.core.processing_components import ProcessingComponent
-from simpa.utils.quality_assurance.data_sanity_testing import assert_array_well_defined
+from simpa.utils.quality_assurance.data_sanity_testing import assert_array_well_defined, get_qa_assertion_sample_size
 import numpy as np
 
 
@@ -63,7 +63,7 @@ class GaussianNoise(ProcessingComponent):
             data_array = data_array * np.random.normal(mean, std, size=np.shape(data_array))
 
         if not (Tags.IGNORE_QA_ASSERTIONS in self.global_settings and Tags.IGNORE_QA_ASSERTIONS):
-            assert_array_well_defined(data_array)
+            assert_array_well_defined(data_array, sample_size=get_qa_assertion_sample_size(self.global_settings))
 
         if non_negative:
             data_array[data_array < EPS] = EPS
@@ -19,7 +19,7 @@ class MultispectralProcessingAlgorithm(ABC):
 
         Per default, this methods loads all data from a certain
         Tags.DATA_FIELD into a data array for all
-        Tags.WAVELENGTHS.
+        Tags.WAVELENGTHS (see `load_data`).
 
         """
         if component_settings_key is None:
@@ -37,16 +37,25 @@ class MultispectralProcessingAlgorithm(ABC):
         self.global_settings = global_settings
         self.wavelengths = self.component_settings[Tags.WAVELENGTHS]
         self.data_field = self.component_settings[Tags.DATA_FIELD]
+        self.data = self.load_data()
 
-        self.data = list()
+    def load_data(self):
+        """
+        Loads the data field for all wavelengths into one array of shape [number of wavelengths, data field shape].
+        Algorithms that read the data themselves (e.g. in tiles) can override this method.
+
+        :return: the multispectral data
+        """
+        data = list()
         for i in range(len(self.wavelengths)):
-            self.data.append(load_data_field(self.global_settings[Tags.SIMPA_OUTPUT_PATH],
-                                             self.data_field,
-                                             self.wavelengths[i]))
+            data.append(load_data_field(self.global_settings[Tags.SIMPA_OUTPUT_PATH],
+                                        self.data_field,
+                                        self.wavelengths[i]))
 
-        self.data = np.asarray(self.data)
+        data = np.asarray(data)
         if Tags.SIGNAL_THRESHOLD in self.component_settings:
-            self.data[self.data < self.component_settings[Tags.SIGNAL_THRESHOLD]*np.max(self.data)] = 0
+            data[data < self.component_settings[Tags.SIGNAL_THRESHOLD]*np.max(data)] = 0
+        return data
 
     @abstractmethod
     def run(self):
@@ -4,11 +4,144 @@
 
 from simpa.utils import Tags
 from simpa.io_handling import save_data_field
+from simpa.io_handling.io_hdf5 import get_in_memory_data_store, get_file_compression
+from simpa.utils.dict_path_manager import generate_dict_path
 from simpa.core.processing_components.multispectral import MultispectralProcessingAlgorithm
 from simpa.utils.libraries.spectrum_library import Spectrum
+import h5py
 import numpy as np
 import scipy.linalg as linalg
 from scipy.optimize import nnls
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+
+def batch_nnls(endmember_matrix: np.ndarray, data: np.ndarray, chunk_size: int = 100000,
+               number_of_workers: int = 1) -> np.ndarray:
+    """
+    Solves the non-negative least squares problem min ||A x - b||_2 subject to x >= 0 for all columns b of `data`
+    with the shared endmember matrix A. The result matches scipy.optimize.nnls applied to every column.
+
+    The pixels are processed in chunks of `chunk_size` columns, which can be distributed on `number_of_workers`
+    processes.
+
+    :param endmember_matrix: endmember matrix A of shape [number of wavelengths, number of endmembers]
+    :param data: measurements of shape [number of wavelengths, number of pixels]
+    :param chunk_size: maximum number of pixels that are solved together
+    :param number_of_workers: number of worker processes, 1 solves all chunks in the current process
+    :return: non-negative solution of shape [number of endmembers, number of pixels]
+    """
+    endmember_matrix = np.asarray(endmember_matrix, dtype=np.float64)
+    data = np.asarray(data)
+    if data.ndim != 2 or endmember_matrix.ndim != 2 or data.shape[0] != endmember_matrix.shape[0]:
+        raise ValueError(f"The endmember matrix {np.shape(endmember_matrix)} and the data {np.shape(data)} have "
+                         f"mismatching dimensions.")
+
+    number_of_pixels = data.shape[1]
+    chunk_size = max(1, int(chunk_size))
+    chunks = [slice(start, min(start + chunk_size, number_of_pixels))
+              for start in range(0, number_of_pixels, chunk_size)]
+    output = np.empty((endmember_matrix.shape[1], number_of_pixels), dtype=np.float64)
+
+    if number_of_workers > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=min(number_of_workers, len(chunks))) as executor:
+            futures = [executor.submit(_batch_nnls_chunk, endmember_matrix, data[:, chunk]) for chunk in chunks]
+            for chunk, future in zip(chunks, futures):
+                output[:, chunk] = future.result()
+    else:
+        for chunk in chunks:
+            output[:, chunk] = _batch_nnls_chunk(endmember_matrix, data[:, chunk])
+    return output
+
+
+def _batch_nnls_chunk(endmember_matrix: np.ndarray, data: np.ndarray) -> np.ndarray:
+    """
+    Vectorised Lawson-Hanson active set method (the algorithm behind scipy.optimize.nnls) for a chunk of pixels.
+    All pixels are iterated together and the unconstrained least squares problems on the passive sets are solved
+    once per distinct passive set via the normal equations, as proposed in
+    M. H. Van Benthem and M. R. Keenan 2004, "Fast algorithm for the solution of large-scale non-negativity-constrained
+    least squares problems", https://doi.org/10.1002/cem.889
+    Pixels that do not converge within the maximum number of iterations are solved with scipy.optimize.nnls.
+    """
+    data = np.asarray(data, dtype=np.float64)
+    number_of_endmembers = endmember_matrix.shape[1]
+    number_of_pixels = data.shape[1]
+    gram_matrix = endmember_matrix.T @ endmember_matrix
+    correlation = endmember_matrix.T @ data
+
+    # tolerances relative to the scale of each pixel
+    tolerance = 10 * np.finfo(np.float64).eps * np.linalg.norm(endmember_matrix, 1) * max(endmember_matrix.shape)
+    gradient_tolerance = tolerance * np.linalg.norm(data, axis=0)
+
+    solution = np.zeros((number_of_endmembers, number_of_pixels))
+    passive_set = np.zeros((number_of_endmembers, number_of_pixels), dtype=bool)
+    gradient = correlation.copy()
+    unconverged = np.arange(number_of_pixels)
+
+    for _ in range(3 * number_of_endmembers):
+        # move the endmember with the largest positive gradient into the passive set
+        candidates = np.where(passive_set[:, unconverged], -np.inf, gradient[:, unconverged])
+        new_passive_index = np.argmax(candidates, axis=0)
+        improvable = candidates[new_passive_index, np.arange(len(unconverged))] > gradient_tolerance[unconverged]
+        unconverged = unconverged[improvable]
+        if len(unconverged) == 0:
+            break
+        passive_set[new_passive_index[improvable], unconverged] = True
+
+        pixels = unconverged
+        while len(pixels) > 0:
+            candidate_solution = _solve_on_passive_sets(gram_matrix, correlation, passive_set, pixels)
+            infeasible = passive_set[:, pixels] & (candidate_solution <= 0)
+            needs_step = np.any(infeasible, axis=0)
+            solution[:, pixels[~needs_step]] = candidate_solution[:, ~needs_step]
+
+            # step back towards the previous feasible solution and remove the endmembers that reach zero
+            pixels = pixels[needs_step]
+            previous = solution[:, pixels]
+            candidate_solution = candidate_solution[:, needs_step]
+            infeasible = infeasible[:, needs_step]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                step = np.where(infeasible, previous / (previous - candidate_solution), np.inf).min(axis=0)
+            previous = previous + step * (candidate_solution - previous)
+            passive_set[:, pixels] &= previous > tolerance * np.abs(previous).max(axis=0, initial=0)
+            solution[:, pixels] = np.where(passive_set[:, pixels], previous, 0)
+
+        gradient[:, unconverged] = correlation[:, unconverged] - gram_matrix @ solution[:, unconverged]
+    else:
+        candidates = np.where(passive_set[:, unconverged], -np.inf, gradient[:, unconverged])
+        unconverged = unconverged[candidates.max(axis=0, initial=-np.inf) > gradient_tolerance[unconverged]]
+        for pixel in unconverged:
+            solution[:, pixel] = nnls(endmember_matrix, data[:, pixel])[0]
+
+    return solution
+
+
+def _solve_on_passive_sets(gram_matrix: np.ndarray, correlation: np.ndarray, passive_set: np.ndarray,
+                           pixels: np.ndarray) -> np.ndarray:
+    """
+    Solves the normal equations restricted to the passive set of each of the given pixels. Pixels that share the same
+    passive set are solved together.
+
+    :return: solutions of shape [number of endmembers, number of pixels], which are zero outside the passive sets
+    """
+    output = np.zeros((gram_matrix.shape[0], len(pixels)))
+    passive_set = passive_set[:, pixels]
+    if passive_set.shape[0] < 63:
+        # encode each passive set as an integer, which is much faster to group than boolean rows
+        codes = (np.left_shift(1, np.arange(passive_set.shape[0], dtype=np.int64)) @ passive_set).astype(np.int64)
+        unique_codes, group = np.unique(codes, return_inverse=True)
+        unique_passive_sets = (unique_codes[:, None] >> np.arange(passive_set.shape[0])) & 1
+    else:
+        unique_passive_sets, group = np.unique(passive_set.T, axis=0, return_inverse=True)
+    group = group.reshape(-1)
+    order = np.argsort(group, kind="stable")
+    boundaries = np.cumsum(np.bincount(group, minlength=len(unique_passive_sets)))[:-1]
+    for members, indices in zip(np.split(order, boundaries), unique_passive_sets):
+        if not np.any(indices):
+            continue
+        indices = np.flatnonzero(indices)
+        output[np.ix_(indices, members)] = linalg.pinv(gram_matrix[np.ix_(indices, indices)]) @ \
+            correlation[np.ix_(indices, pixels[members])]
+    return output
 
 
 class LinearUnmixing(MultispectralProcessingAlgorithm):
@@ -22,6 +155,9 @@ class LinearUnmixing(MultispectralProcessingAlgorithm):
     This component saves a dictionary containing the chromophore concentrations and corresponding wavelengths for
     each chromophore. If the tag LINEAR_UNMIXING_COMPUTE_SO2 is set True the blood oxygen saturation
     is saved as well, however, this is only possible if the chromophores oxy- and deoxyhemoglobin are specified.
+    If the tag LINEAR_UNMIXING_TILE_SIZE is set, the data field is never loaded for all wavelengths at once. Instead,
+    matching tiles of all wavelengths are read from the SIMPA output file, unmixed, and the results are written into
+    datasets that are allocated in the file beforehand, such that volumes larger than the memory can be unmixed.
     IMPORTANT:
     Linear unmixing should only be performed with at least two wavelengths:
     e.g. Tags.WAVELENGTHS: [750, 800]
@@ -32,6 +168,9 @@ class LinearUnmixing(MultispectralProcessingAlgorithm):
     Tags.WAVELENGTHS (default: None, if None, then settings[Tags.WAVELENGTHS] will be used.)
     Tags.LINEAR_UNMIXING_COMPUTE_SO2 (default: False)
     Tags.LINEAR_UNMIXING_NON_NEGATIVE (default: False)
+    Tags.LINEAR_UNMIXING_CHUNK_SIZE (default: 100000, only used for non-negative linear unmixing)
+    Tags.LINEAR_UNMIXING_NUMBER_OF_WORKERS (default: 1, only used for non-negative linear unmixing)
+    Tags.LINEAR_UNMIXING_TILE_SIZE (default: None, i.e. the data field is unmixed as a whole)
     global_settings (required)
     component_settings_key (required)
     """
@@ -44,10 +183,31 @@ class LinearUnmixing(MultispectralProcessingAlgorithm):
         self.absorption_matrix = []  # endmember matrix needed in LU
         self.pseudo_inverse_absorption_matrix = []
 
+        # the LU results are not kept in memory if the data field is unmixed in tiles
         self.chromophore_concentrations = []  # list of LU results
         self.chromophore_concentrations_dict = {}  # dictionary of LU results
         self.wavelengths = []  # list of wavelengths
 
+    def load_data(self):
+        """
+        Loads the data field for all wavelengths, unless it is unmixed tile by tile (Tags.LINEAR_UNMIXING_TILE_SIZE).
+
+        :return: the multispectral data or None
+        """
+        if self.tile_size() is not None:
+            return None
+        return super(LinearUnmixing, self).load_data()
+
+    def tile_size(self):
+        """
+        :return: maximum number of voxels of a tile (Tags.LINEAR_UNMIXING_TILE_SIZE) or None if the data field is
+            unmixed as a whole.
+        """
+        if Tags.LINEAR_UNMIXING_TILE_SIZE in self.component_settings and \
+                self.component_settings[Tags.LINEAR_UNMIXING_TILE_SIZE] is not None:
+            return max(1, int(self.component_settings[Tags.LINEAR_UNMIXING_TILE_SIZE]))
+        return None
+
     def run(self):
 
         self.logger.info("Performing linear spectral unmixing...")
@@ -79,13 +239,20 @@ class LinearUnmixing(MultispectralProcessingAlgorithm):
         # check if non-negative contraint should be used for linear unmixing
         non_negative = False
         if Tags.LINEAR_UNMIXING_NON_NEGATIVE in self.component_settings:
-            non_negative = Tags.LINEAR_UNMIXING_NON_NEGATIVE
+            non_negative = self.component_settings[Tags.LINEAR_UNMIXING_NON_NEGATIVE]
 
         # create the absorption matrix needed by FLUPAI
         # the matrix should have the shape [#global wavelengths, #chromophores]
         self.absorption_matrix = self.create_absorption_matrix()
         self.logger.debug(f"The absorption matrix has shape {np.shape(self.absorption_matrix)}.")
 
+        if self.tile_size() is not None:
+            compute_so2 = Tags.LINEAR_UNMIXING_COMPUTE_SO2 in self.component_settings and \
+                self.component_settings[Tags.LINEAR_UNMIXING_COMPUTE_SO2]
+            self.tiled_unmixing(non_negative=non_negative, compute_so2=compute_so2)
+            self.logger.info("Performing linear spectral unmixing......[Done]")
+            return
+
         # perform fast linear unmixing FLUPAI
         # the result saved in self.chromophore_concentrations is a list with the unmixed images
         # containing the chromophore concentration
@@ -161,20 +328,23 @@ class LinearUnmixing(MultispectralProcessingAlgorithm):
 
         return endmemberMatrix
 
-    def flupai(self, non_negative=False) -> list:
+    def flupai(self, non_negative=False, data: np.ndarray = None) -> list:
         """
         Fast Linear Unmixing for PhotoAcoustic Imaging (FLUPAI) is based on
         SVD decomposition with a pseudo inverse, which is equivalent to a least squares
         ansatz for linear spectral unmixing of multi-spectral photoacoustic images.
 
+        :param data: multispectral data of shape [number of wavelengths, image shape], self.data if None.
         :return: list with unmixed images containing the chromophore concentration.
         :raise: SystemExit.
         """
 
+        if data is None:
+            data = self.data
         # reshape image data to [number of wavelength, number of pixel]
-        dims_raw = np.shape(self.data)
+        dims_raw = np.shape(data)
         try:
-            reshapedData = np.reshape(self.data, (dims_raw[0], -1))
+            reshapedData = np.reshape(data, (dims_raw[0], -1))
         except Exception:
             self.logger.critical(f"FLUPAI failed probably caused by wrong input dimensions of {dims_raw}!")
             raise ValueError("Reshaping of input data failed. FLUPAI expects a 4 dimensional numpy array, "
@@ -186,12 +356,11 @@ class LinearUnmixing(MultispectralProcessingAlgorithm):
         # else non-negative least squares is performed.
         try:
             if non_negative:
-                output = []
-                for i in range(np.shape(reshapedData)[1]):
-                    foo, ris = nnls(np.array(self.absorption_matrix), reshapedData[:, i])
-                    output.append(foo)
-
-                output = np.swapaxes(output, axis1=0, axis2=1)
+                chunk_size = self.component_settings[Tags.LINEAR_UNMIXING_CHUNK_SIZE] \
+                    if Tags.LINEAR_UNMIXING_CHUNK_SIZE in self.component_settings else 100000
+                number_of_workers = self.component_settings[Tags.LINEAR_UNMIXING_NUMBER_OF_WORKERS] \
+                    if Tags.LINEAR_UNMIXING_NUMBER_OF_WORKERS in self.component_settings else 1
+                output = batch_nnls(np.array(self.absorption_matrix), reshapedData, chunk_size, number_of_workers)
             else:
                 self.pseudo_inverse_absorption_matrix = linalg.pinv(self.absorption_matrix)
                 output = np.matmul(self.pseudo_inverse_absorption_matrix, reshapedData)
@@ -210,16 +379,20 @@ class LinearUnmixing(MultispectralProcessingAlgorithm):
             chromophores_concentrations.append(np.reshape(output[chromophore, :], (dims_raw[1:])))
         return chromophores_concentrations
 
-    def calculate_sO2(self) -> np.ndarray:
+    def calculate_sO2(self, chromophore_concentrations: dict = None) -> np.ndarray:
         """
         Function calculates sO2 (blood oxygen saturation) values for given concentrations
         of oxyhemoglobin and deoxyhemoglobin. Of course this is only possible if the concentrations of both
         chromophores were calculated by this component/were specified in settings.
+
+        :param chromophore_concentrations: concentrations by chromophore, self.chromophore_concentrations_dict if None.
         """
 
+        if chromophore_concentrations is None:
+            chromophore_concentrations = self.chromophore_concentrations_dict
         try:
-            concentration_oxy = self.chromophore_concentrations_dict["Oxyhemoglobin"]
-            concentration_deoxy = self.chromophore_concentrations_dict["Deoxyhemoglobin"]
+            concentration_oxy = chromophore_concentrations["Oxyhemoglobin"]
+            concentration_deoxy = chromophore_concentrations["Deoxyhemoglobin"]
 
             sO2 = concentration_oxy / (concentration_oxy + concentration_deoxy)
             # if total hemoglobin is zero handle NaN by setting sO2 to zero
@@ -230,3 +403,112 @@ class LinearUnmixing(MultispectralProcessingAlgorithm):
         except Exception:
             raise KeyError("Chromophores oxy- and/or deoxyhemoglobin were not specified in component settings, "
                            "so so2 cannot be calculated!")
+
+    def tiled_unmixing(self, non_negative: bool = False, compute_so2: bool = False):
+        """
+        Unmixes the data field tile by tile (see Tags.LINEAR_UNMIXING_TILE_SIZE). Matching tiles of all wavelengths are
+        read from the SIMPA output file and unmixed with `self.flupai`. The chromophore concentrations (and sO2) are
+        written into datasets of the linear unmixing result that are allocated in the file beforehand. A thread pool
+        reads the next tile and writes the results of the previous tile while the current tile is unmixed.
+
+        :param non_negative: if True, non-negative linear unmixing is performed.
+        :param compute_so2: if True, the blood oxygen saturation is computed and saved.
+        :raises ValueError: if the data field does not have the same shape for all wavelengths.
+        """
+        file_path = self.global_settings[Tags.SIMPA_OUTPUT_PATH]
+        input_paths = [generate_dict_path(self.data_field, wavelength=wavelength)[:-1]
+                       for wavelength in self.wavelengths]
+        result_path = generate_dict_path(Tags.LINEAR_UNMIXING_RESULT)
+        output_paths = {chromophore: result_path + "chromophore_concentrations/" + chromophore
+                        for chromophore in self.chromophore_spectra_dict.keys()}
+        if compute_so2:
+            output_paths["sO2"] = result_path + "sO2"
+
+        save_data_field({"wavelengths": self.wavelengths}, file_path, Tags.LINEAR_UNMIXING_RESULT)
+        # the tiles are read from and written into the file, so neither the input nor the results may be in memory
+        data_store = get_in_memory_data_store(file_path)
+        if data_store is not None:
+            for input_path in input_paths:
+                data_store.persist(input_path)
+            for output_path in output_paths.values():
+                data_store.discard(output_path)
+
+        threshold = self.component_settings[Tags.SIGNAL_THRESHOLD] \
+            if Tags.SIGNAL_THRESHOLD in self.component_settings else None
+
+        with h5py.File(file_path, "a") as h5file, ThreadPoolExecutor(max_workers=2) as executor:
+            input_datasets = [h5file[input_path] for input_path in input_paths]
+            shape = input_datasets[0].shape
+            if any(dataset.shape != shape for dataset in input_datasets):
+                raise ValueError(f"The data field {self.data_field} must have the same shape for all wavelengths to be "
+                                 f"unmixed, but has the shapes {[dataset.shape for dataset in input_datasets]}.")
+            tiles = self.get_tiles(shape)
+            self.logger.debug(f"Unmixing the data field of shape {shape} in {len(tiles)} tiles.")
+
+            def read_tile(tile):
+                return np.asarray([dataset[tile] for dataset in input_datasets])
+
+            if threshold is not None:
+                # the threshold is relative to the maximum of all wavelengths, which needs a pass over all tiles
+                maximum = max(np.max(data) for _, data in self.prefetch_tiles(executor, read_tile, tiles))
+                threshold = threshold * maximum
+
+            compression, compression_level = get_file_compression(h5file)
+            output_datasets = dict()
+            for name, output_path in output_paths.items():
+                if output_path in h5file:
+                    del h5file[output_path]
+                output_datasets[name] = h5file.create_dataset(output_path, shape=shape, dtype=np.float64, chunks=True,
+                                                              compression=compression,
+                                                              compression_opts=compression_level)
+
+            def write_tile(tile, results):
+                for name, result in results.items():
+                    output_datasets[name][tile] = result
+
+            write_future = None
+            for tile, data in self.prefetch_tiles(executor, read_tile, tiles):
+                if threshold is not None:
+                    data[data < threshold] = 0
+                concentrations = self.flupai(non_negative=non_negative, data=data)
+                results = {chromophore: concentrations[index]
+                           for index, chromophore in enumerate(self.chromophore_spectra_dict.keys())}
+                if compute_so2:
+                    results["sO2"] = self.calculate_sO2(results)
+                # at most the results of one tile are written while the next one is unmixed
+                if write_future is not None:
+                    write_future.result()
+                write_future = executor.submit(write_tile, tile, results)
+            if write_future is not None:
+                write_future.result()
+
+        self.logger.info(f"The chromophore concentration was computed for chromophores: "
+                         f"{self.chromophore_spectra_dict.keys()}")
+
+    def get_tiles(self, shape: tuple) -> list:
+        """
+        :param shape: shape of the data field.
+        :return: selections of the tiles of the data field, which are slabs along its first axis with at most
+            `self.tile_size()` voxels, but at least one slice.
+        """
+        slice_size = int(np.prod(shape[1:]))
+        slices_per_tile = max(1, self.tile_size() // max(1, slice_size))
+        return [np.s_[start:min(start + slices_per_tile, shape[0])]
+                for start in range(0, shape[0], slices_per_tile)]
+
+    @staticmethod
+    def prefetch_tiles(executor: ThreadPoolExecutor, read_tile, tiles: list):
+        """
+        Yields the tiles together with their data, the data of the next tile is read by the executor while the
+        current tile is processed.
+
+        :param executor: executor that reads the tiles.
+        :param read_tile: function that reads the data of a tile.
+        :param tiles: selections of the tiles.
+        """
+        future = executor.submit(read_tile, tiles[0]) if len(tiles) > 0 else None
+        for index, tile in enumerate(tiles):
+            data = future.result()
+            if index + 1 < len(tiles):
+                future = executor.submit(read_tile, tiles[index + 1])
+            yield tile, data
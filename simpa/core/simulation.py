@@ -3,17 +3,21 @@
 # SPDX-License-Identifier: MIT
 
 from simpa.utils import Tags
-from simpa.io_handling.io_hdf5 import save_hdf5, load_hdf5
-from simpa.io_handling.ipasc import export_to_ipasc
+from simpa.io_handling.io_hdf5 import save_hdf5
+from simpa.io_handling.in_memory_data_store import InMemoryDataStore
 from simpa.utils.settings import Settings
+from simpa.utils.dict_path_manager import generate_dict_path
 from simpa.log import Logger
+from simpa.utils.profiling import SimulationProfile, StageProfiler
 from .device_digital_twins.digital_device_twin_base import DigitalDeviceTwinBase
 
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import numpy as np
+import h5py
 import os
 import time
-import pkg_resources
+from importlib.metadata import version
 
 
 def simulate(simulation_pipeline: list, settings: Settings, digital_device_twin: DigitalDeviceTwinBase):
@@ -27,7 +31,8 @@ def simulate(simulation_pipeline: list, settings: Settings, digital_device_twin:
         class.
     :raises TypeError: if one of the given parameters is not of the correct type
     :raises AssertionError: if the digital device twin is not able to simulate the settings specification
-    :return: list with the save paths of the simulated data within the HDF5 file.
+    :return: the SimulationProfile with the resources used by every pipeline element for every wavelength, which is
+        also stored under Tags.SIMULATION_PROFILE in the SIMPA output file.
     """
     start_time = time.time()
     logger = Logger()
@@ -56,48 +61,235 @@ def simulate(simulation_pipeline: list, settings: Settings, digital_device_twin:
         simpa_output_path = path + settings[Tags.VOLUME_NAME]
 
     settings[Tags.SIMPA_OUTPUT_PATH] = simpa_output_path + ".hdf5"    
-    settings[Tags.SIMPA_VERSION] = pkg_resources.require("simpa")[0].version 
+    settings[Tags.SIMPA_VERSION] = version("simpa")
 
     simpa_output[Tags.SETTINGS] = settings
     simpa_output[Tags.DIGITAL_DEVICE] = digital_device_twin
     simpa_output[Tags.SIMULATION_PIPELINE] = [type(x).__name__ for x in simulation_pipeline]
 
     logger.debug("Saving settings dictionary...")
-    save_hdf5(simpa_output, settings[Tags.SIMPA_OUTPUT_PATH])
+    file_compression, compression_level = _get_file_compression(settings)
+    save_hdf5(simpa_output, settings[Tags.SIMPA_OUTPUT_PATH], file_compression=file_compression,
+              compression_level=compression_level)
     logger.debug("Saving settings dictionary...[Done]")
 
-    for wavelength in settings[Tags.WAVELENGTHS]:
-        logger.debug(f"Running pipeline for wavelength {wavelength}nm...")
-
-        if settings[Tags.RANDOM_SEED] is not None:
-            np.random.seed(settings[Tags.RANDOM_SEED])
-        else:
-            np.random.seed(None)
-
-        settings[Tags.WAVELENGTH] = wavelength
-
-        for pipeline_element in simulation_pipeline:
-            logger.debug(f"Running {type(pipeline_element)}")
-            pipeline_element.run(digital_device_twin)
+    if Tags.PARALLEL_WAVELENGTH_EXECUTION in settings and settings[Tags.PARALLEL_WAVELENGTH_EXECUTION]:
+        simulation_profile = run_wavelengths_in_parallel(simulation_pipeline, settings, digital_device_twin,
+                                                         simpa_output)
+    else:
+        simulation_profile = run_pipeline_for_wavelengths(simulation_pipeline, settings, digital_device_twin,
+                                                          settings[Tags.WAVELENGTHS])
 
-        logger.debug(f"Running pipeline for wavelength {wavelength}nm... [Done]")
-
-    # If the dimensions of the simulation results are changed after calling the respective module
-    # adapter / processing components, the amount of space on the hard drive that is allocated by the HDF5
-    # code does not dynamically change. This can be remedied by re-writing the file after the simulation
-    # terminates. As it might have a negative impact on simulation performance, it must be activated
-    # by the user manually. Active by default.
-    if not(Tags.DO_FILE_COMPRESSION in settings and
-            not settings[Tags.DO_FILE_COMPRESSION]):
-        all_data = load_hdf5(settings[Tags.SIMPA_OUTPUT_PATH])
-        if Tags.VOLUME_CREATION_MODEL_SETTINGS in all_data[Tags.SETTINGS] and \
-                Tags.INPUT_SEGMENTATION_VOLUME in all_data[Tags.SETTINGS][Tags.VOLUME_CREATION_MODEL_SETTINGS]:
-            del all_data[Tags.SETTINGS][Tags.VOLUME_CREATION_MODEL_SETTINGS][Tags.INPUT_SEGMENTATION_VOLUME]
-        save_hdf5(all_data, settings[Tags.SIMPA_OUTPUT_PATH], file_compression="gzip")
+    # The datasets are compressed while they are written, only the input segmentation volume, which was needed
+    # by the simulation, is removed from the stored settings to minimise the file size.
+    if _get_file_compression(settings)[0] is not None:
+        with h5py.File(settings[Tags.SIMPA_OUTPUT_PATH], "a") as h5file:
+            segmentation_volume_path = (generate_dict_path(Tags.SETTINGS) + Tags.VOLUME_CREATION_MODEL_SETTINGS[0] +
+                                        "/" + Tags.INPUT_SEGMENTATION_VOLUME[0])
+            if segmentation_volume_path in h5file:
+                del h5file[segmentation_volume_path]
 
     # Export simulation result to the IPASC format.
     if Tags.DO_IPASC_EXPORT in settings and settings[Tags.DO_IPASC_EXPORT]:
         logger.info("Exporting to IPASC....")
+        # pacfish is only imported when it is needed
+        from simpa.io_handling.ipasc import export_to_ipasc
         export_to_ipasc(settings[Tags.SIMPA_OUTPUT_PATH], device=digital_device_twin)
 
     logger.info(f"The entire simulation pipeline required {time.time() - start_time} seconds.")
+    return simulation_profile
+
+
+def _get_file_compression(settings: Settings) -> tuple:
+    """
+    Returns the compression and the compression level of the datasets in the SIMPA output file. Unless
+    Tags.DO_FILE_COMPRESSION is set to False, the datasets are compressed with Tags.FILE_COMPRESSION (default: gzip).
+
+    :return: tuple with the compression (None if the file should not be compressed) and the compression level
+    """
+    if Tags.DO_FILE_COMPRESSION in settings and not settings[Tags.DO_FILE_COMPRESSION]:
+        return None, None
+    file_compression = settings[Tags.FILE_COMPRESSION] if Tags.FILE_COMPRESSION in settings else "gzip"
+    compression_level = settings[Tags.FILE_COMPRESSION_LEVEL] if Tags.FILE_COMPRESSION_LEVEL in settings else None
+    return file_compression, compression_level
+
+
+def run_pipeline_for_wavelengths(simulation_pipeline: list, settings: Settings,
+                                 digital_device_twin: DigitalDeviceTwinBase, wavelengths) -> SimulationProfile:
+    """
+    Runs the simulation pipeline for the given wavelengths one after another. If Tags.IN_MEMORY_DATA_STORE is True,
+    the pipeline elements exchange their results through an InMemoryDataStore, which writes them into the SIMPA
+    output file once all wavelengths are done. The time needed for this is profiled as a separate stage.
+
+    :param simulation_pipeline: a list of callable functions
+    :param settings: settings dictionary containing the simulation instructions
+    :param digital_device_twin: a digital device twin of an imaging device as specified by the DigitalDeviceTwinBase
+        class.
+    :param wavelengths: the wavelengths that should be simulated
+    :return: the SimulationProfile of the pipeline elements for all wavelengths
+    """
+    simulation_profile = SimulationProfile()
+    if not (Tags.IN_MEMORY_DATA_STORE in settings and settings[Tags.IN_MEMORY_DATA_STORE]):
+        for wavelength in wavelengths:
+            simulation_profile.extend(run_pipeline_for_wavelength(simulation_pipeline, settings,
+                                                                  digital_device_twin, wavelength))
+        return simulation_profile
+
+    if Tags.IN_MEMORY_DATA_STORE_BUDGET_IN_MB in settings:
+        data_store = InMemoryDataStore(settings[Tags.SIMPA_OUTPUT_PATH],
+                                       settings[Tags.IN_MEMORY_DATA_STORE_BUDGET_IN_MB])
+    else:
+        data_store = InMemoryDataStore(settings[Tags.SIMPA_OUTPUT_PATH])
+    data_store.open()
+    try:
+        for wavelength in wavelengths:
+            simulation_profile.extend(run_pipeline_for_wavelength(simulation_pipeline, settings,
+                                                                  digital_device_twin, wavelength))
+    finally:
+        with StageProfiler(type(data_store).__name__) as profiler:
+            data_store.close()
+    Logger().debug(f"Writing the in-memory data store into the SIMPA output file required "
+                   f"{profiler.profile.wall_time_in_s:.3f} s, {data_store.number_of_spilled_arrays} arrays were "
+                   f"spilled to the file before.")
+    simulation_profile.add(profiler.profile)
+    simulation_profile.save(settings[Tags.SIMPA_OUTPUT_PATH])
+    return simulation_profile
+
+
+def run_pipeline_for_wavelength(simulation_pipeline: list, settings: Settings,
+                                digital_device_twin: DigitalDeviceTwinBase, wavelength) -> SimulationProfile:
+    """
+    Runs every element of the simulation pipeline for a single wavelength. The random number generator is re-seeded
+    with Tags.RANDOM_SEED before the pipeline starts, so that the result of one wavelength does not depend on the
+    order in which the wavelengths are simulated. The resources used by every pipeline element are stored under
+    Tags.SIMULATION_PROFILE in the SIMPA output file.
+
+    :param simulation_pipeline: a list of callable functions
+    :param settings: settings dictionary containing the simulation instructions
+    :param digital_device_twin: a digital device twin of an imaging device as specified by the DigitalDeviceTwinBase
+        class.
+    :param wavelength: the wavelength that should be simulated
+    :return: the SimulationProfile of the pipeline elements for this wavelength
+    """
+    logger = Logger()
+    logger.debug(f"Running pipeline for wavelength {wavelength}nm...")
+
+    if settings[Tags.RANDOM_SEED] is not None:
+        np.random.seed(settings[Tags.RANDOM_SEED])
+    else:
+        np.random.seed(None)
+
+    settings[Tags.WAVELENGTH] = wavelength
+
+    simulation_profile = SimulationProfile()
+    for pipeline_element in simulation_pipeline:
+        logger.debug(f"Running {type(pipeline_element)}")
+        with StageProfiler(type(pipeline_element).__name__, wavelength) as profiler:
+            pipeline_element.run(digital_device_twin)
+        logger.debug(f"Running {type(pipeline_element)} required {profiler.profile.wall_time_in_s:.3f} s wall time, "
+                     f"{profiler.profile.cpu_time_in_s:.3f} s CPU time and at most "
+                     f"{profiler.profile.peak_memory_in_mb:.1f} MB memory.")
+        simulation_profile.add(profiler.profile)
+
+    simulation_profile.save(settings[Tags.SIMPA_OUTPUT_PATH])
+    logger.debug(f"Running pipeline for wavelength {wavelength}nm... [Done]")
+    return simulation_profile
+
+
+def run_wavelengths_in_parallel(simulation_pipeline: list, settings: Settings,
+                                digital_device_twin: DigitalDeviceTwinBase, simpa_output: dict) -> SimulationProfile:
+    """
+    Runs the simulation pipeline for every wavelength in a separate worker process.
+    Every worker receives its own copy of the pipeline, the settings and the digital device twin, writes its results
+    into a temporary HDF5 file and the temporary files are merged into the SIMPA output file in the order of
+    Tags.WAVELENGTHS afterwards. The settings returned by the worker of the last wavelength are written back into
+    `settings`, such that the settings look the same as after a sequential run.
+
+    :param simulation_pipeline: a list of callable functions
+    :param settings: settings dictionary containing the simulation instructions
+    :param digital_device_twin: a digital device twin of an imaging device as specified by the DigitalDeviceTwinBase
+        class.
+    :param simpa_output: the dictionary that was written to the SIMPA output file before the simulation started.
+    :return: the SimulationProfile of all wavelengths, as measured in the worker processes
+    """
+    logger = Logger()
+    wavelengths = list(settings[Tags.WAVELENGTHS])
+    if Tags.NUMBER_OF_WAVELENGTH_WORKERS in settings and settings[Tags.NUMBER_OF_WAVELENGTH_WORKERS]:
+        number_of_workers = int(settings[Tags.NUMBER_OF_WAVELENGTH_WORKERS])
+    else:
+        number_of_workers = os.cpu_count() or 1
+    number_of_workers = max(1, min(number_of_workers, len(wavelengths)))
+    logger.info(f"Running the pipeline for {len(wavelengths)} wavelengths on {number_of_workers} worker processes...")
+
+    simpa_output_path = settings[Tags.SIMPA_OUTPUT_PATH]
+    output_path_root, output_path_extension = os.path.splitext(simpa_output_path)
+    wavelength_output_paths = [f"{output_path_root}_wavelength_{wavelength}{output_path_extension}"
+                               for wavelength in wavelengths]
+    worker_settings = None
+    simulation_profile = SimulationProfile()
+    try:
+        with ProcessPoolExecutor(max_workers=number_of_workers) as executor:
+            futures = [executor.submit(_run_pipeline_for_wavelength_in_worker, simulation_pipeline, settings,
+                                       digital_device_twin, simpa_output, wavelength, wavelength_output_path)
+                       for wavelength, wavelength_output_path in zip(wavelengths, wavelength_output_paths)]
+            for wavelength, future in zip(wavelengths, futures):
+                worker_settings, wavelength_profile = future.result()
+                simulation_profile.extend(wavelength_profile)
+                logger.debug(f"Worker for wavelength {wavelength}nm finished.")
+
+        with h5py.File(simpa_output_path, "a") as target_file:
+            for wavelength_output_path in wavelength_output_paths:
+                with h5py.File(wavelength_output_path, "r") as source_file:
+                    _merge_hdf5_groups(source_file, target_file,
+                                       skip_keys=[Tags.SETTINGS, Tags.DIGITAL_DEVICE, Tags.SIMULATION_PIPELINE])
+    finally:
+        for wavelength_output_path in wavelength_output_paths:
+            if os.path.exists(wavelength_output_path):
+                os.remove(wavelength_output_path)
+
+    worker_settings[Tags.SIMPA_OUTPUT_PATH] = simpa_output_path
+    worker_settings[Tags.VOLUME_NAME] = settings[Tags.VOLUME_NAME]
+    settings.update(worker_settings)
+    save_hdf5(settings, simpa_output_path, generate_dict_path(Tags.SETTINGS))
+    # stages without a wavelength (e.g. writing an in-memory data store) are merged from all workers
+    simulation_profile.save(simpa_output_path)
+    logger.info(f"Running the pipeline for {len(wavelengths)} wavelengths on {number_of_workers} "
+                f"worker processes...[Done]")
+    return simulation_profile
+
+
+def _run_pipeline_for_wavelength_in_worker(simulation_pipeline: list, settings: Settings,
+                                           digital_device_twin: DigitalDeviceTwinBase, simpa_output: dict,
+                                           wavelength, wavelength_output_path: str) -> tuple:
+    """
+    Entry point of a worker process of `run_wavelengths_in_parallel`. The pipeline elements refer to the same
+    settings instance that is passed here, so redirecting the output path in `settings` redirects all of them.
+    The volume name is made unique per wavelength, as external simulators use it to name their temporary files.
+
+    :return: tuple with the settings after the pipeline was run and the SimulationProfile of the wavelength.
+    """
+    settings[Tags.SIMPA_OUTPUT_PATH] = wavelength_output_path
+    simpa_output[Tags.SETTINGS] = settings
+    file_compression, compression_level = _get_file_compression(settings)
+    save_hdf5(simpa_output, wavelength_output_path, file_compression=file_compression,
+              compression_level=compression_level)
+    settings[Tags.VOLUME_NAME] = f"{settings[Tags.VOLUME_NAME]}_wavelength_{wavelength}"
+    simulation_profile = run_pipeline_for_wavelengths(simulation_pipeline, settings, digital_device_twin,
+                                                      [wavelength])
+    return settings, simulation_profile
+
+
+def _merge_hdf5_groups(source_group: h5py.Group, target_group: h5py.Group, skip_keys: list = None):
+    """
+    Recursively copies all datasets of `source_group` into `target_group`. Groups that exist in both are merged,
+    datasets that exist in both are overwritten by the ones in `source_group`.
+    """
+    for key, item in source_group.items():
+        if skip_keys is not None and key in skip_keys:
+            continue
+        if isinstance(item, h5py.Group) and key in target_group and isinstance(target_group[key], h5py.Group):
+            _merge_hdf5_groups(item, target_group[key])
+        else:
+            if key in target_group:
+                del target_group[key]
+            source_group.copy(item, target_group, name=key)
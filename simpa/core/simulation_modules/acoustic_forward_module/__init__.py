@@ -9,7 +9,7 @@ from simpa.utils import Tags, Settings
 from simpa.io_handling.io_hdf5 import save_hdf5
 from simpa.utils.dict_path_manager import generate_dict_path
 from simpa.core.device_digital_twins import PhotoacousticDevice, DetectionGeometryBase
-from simpa.utils.quality_assurance.data_sanity_testing import assert_array_well_defined
+from simpa.utils.quality_assurance.data_sanity_testing import assert_array_well_defined, get_qa_assertion_sample_size
 
 
 class AcousticForwardModelBaseAdapter(SimulationModule):
@@ -67,7 +67,8 @@ class AcousticForwardModelBaseAdapter(SimulationModule):
         time_series_data = self.forward_model(_device)
 
         if not (Tags.IGNORE_QA_ASSERTIONS in self.global_settings and Tags.IGNORE_QA_ASSERTIONS):
-            assert_array_well_defined(time_series_data, array_name="time_series_data")
+            assert_array_well_defined(time_series_data, array_name="time_series_data",
+                                      sample_size=get_qa_assertion_sample_size(self.global_settings))
 
         acoustic_output_path = generate_dict_path(Tags.DATA_FIELD_TIME_SERIES_DATA, wavelength=self.global_settings[Tags.WAVELENGTH])
 
@@ -0,0 +1,438 @@
+# SPDX-FileCopyrightText: 2021 Division of Intelligent Medical Systems, DKFZ
+# SPDX-FileCopyrightText: 2021 Janek Groehl
+# SPDX-License-Identifier: MIT
+
+from typing import Tuple
+import numpy as np
+import scipy.fft
+import scipy.sparse
+from simpa.utils import Tags
+from simpa.io_handling.io_hdf5 import save_hdf5, load_data_field
+from simpa.core.device_digital_twins import DetectionGeometryBase
+from simpa.core.simulation_modules.acoustic_forward_module import AcousticForwardModelBaseAdapter
+
+# number of voxels that are added between the sensor elements and the boundary of the simulation grid
+SENSOR_MARGIN_IN_VOXELS = 3
+
+
+class KSpacePseudospectralAdapter(AcousticForwardModelBaseAdapter):
+    """
+    The KSpacePseudospectralAdapter simulates the acoustic forward process with the k-space pseudospectral method
+    of the k-Wave toolbox (kspaceFirstOrder2D/3D), implemented with the FFTs of scipy. It does not need MATLAB
+    and reads the same settings as the KWaveAdapter::
+
+        The initial pressure distribution:
+            Tags.DATA_FIELD_INITIAL_PRESSURE
+        Acoustic tissue properties:
+            Tags.DATA_FIELD_SPEED_OF_SOUND
+            Tags.DATA_FIELD_DENSITY
+            Tags.DATA_FIELD_ALPHA_COEFF
+        The digital twin of the imaging device:
+            Tags.DIGITAL_DEVICE
+        Other parameters:
+            Tags.SPACING_MM
+            Tags.ACOUSTIC_SIMULATION_3D
+            Tags.KWAVE_PROPERTY_ALPHA_POWER
+            Tags.KWAVE_PROPERTY_PMLSize
+            Tags.KWAVE_PROPERTY_PMLInside
+            Tags.KWAVE_PROPERTY_PMLAlpha
+            Tags.KWAVE_PROPERTY_INITIAL_PRESSURE_SMOOTHING
+            Tags.MODEL_SENSOR_FREQUENCY_RESPONSE
+
+    The simulation runs in the coordinate system of the simulated volume, where the voxel with index i is located at
+    i * spacing. If the detection geometry is a line of detectors, the plane of the volume that contains the
+    detectors is simulated in 2D, otherwise the complete volume is simulated in 3D.
+    The grid is extended by replicating the outermost voxels, if sensor elements are located outside of the volume.
+    Each detection element is modelled as a line with the width of the element perpendicular to its orientation,
+    which gives the elements their directivity. Absorption is modelled with the power law of k-Wave's
+    'no_dispersion' mode.
+
+    The time step and the number of time steps are chosen like in the k-Wave scripts of SIMPA and are stored in
+    the settings as Tags.K_WAVE_SPECIFIC_DT and Tags.K_WAVE_SPECIFIC_NT.
+    """
+
+    def get_parameter(self, tag, default=None):
+        """
+        Looks up a parameter in the component settings first and in the global settings second.
+        """
+        if tag in self.component_settings and self.component_settings[tag] is not None:
+            return self.component_settings[tag]
+        if tag in self.global_settings and self.global_settings[tag] is not None:
+            return self.global_settings[tag]
+        return default
+
+    def forward_model(self, detection_geometry: DetectionGeometryBase) -> np.ndarray:
+        """
+        Reads the initial pressure and the acoustic properties from the hdf5 file, runs the k-space pseudospectral
+        simulation and saves the updated settings afterwards.
+
+        :param detection_geometry:
+        :return: simulated time series data (numpy array)
+        """
+
+        file_path = self.global_settings[Tags.SIMPA_OUTPUT_PATH]
+        wavelength = self.global_settings[Tags.WAVELENGTH]
+        spacing_mm = self.global_settings[Tags.SPACING_MM]
+
+        detection_geometry.check_settings_prerequisites(self.global_settings)
+        field_of_view = detection_geometry.get_field_of_view_mm()
+        positions_mm = detection_geometry.get_detector_element_positions_accounting_for_device_position_mm()
+        orientations = detection_geometry.get_detector_element_orientations()
+
+        detectors_are_aligned_along_x_axis = np.abs(field_of_view[2] - field_of_view[3]) < 1e-5
+        detectors_are_aligned_along_y_axis = np.abs(field_of_view[0] - field_of_view[1]) < 1e-5
+        simulate_2d = not self.get_parameter(Tags.ACOUSTIC_SIMULATION_3D, False) and \
+            (detectors_are_aligned_along_x_axis or detectors_are_aligned_along_y_axis)
+
+        if simulate_2d:
+            lateral_axis = 1 if detectors_are_aligned_along_y_axis else 0
+            plane_axis = 1 - lateral_axis
+            plane_index = int(round(positions_mm[0, plane_axis] / spacing_mm))
+            plane_axis_dimension_mm = self.global_settings[[Tags.DIM_VOLUME_X_MM, Tags.DIM_VOLUME_Y_MM][plane_axis]]
+            number_of_planes = int(round(plane_axis_dimension_mm / spacing_mm))
+            image_slice = [slice(None)] * 3
+            image_slice[plane_axis] = min(max(0, plane_index), number_of_planes - 1)
+            image_slice = tuple(image_slice)
+            axes = [lateral_axis, 2]
+            self.logger.info("Simulating 2D....")
+        else:
+            image_slice = None
+            axes = [0, 1, 2]
+            self.logger.info("Simulating 3D....")
+
+        data = dict()
+        for data_field in [Tags.DATA_FIELD_SPEED_OF_SOUND, Tags.DATA_FIELD_DENSITY, Tags.DATA_FIELD_ALPHA_COEFF]:
+            data[data_field] = load_data_field(file_path, data_field, selection=image_slice)
+        initial_pressure = load_data_field(file_path, Tags.DATA_FIELD_INITIAL_PRESSURE, wavelength,
+                                           selection=image_slice)
+
+        time_series_data, time_step, number_time_steps = self.k_space_acoustic_forward_model(
+            initial_pressure, data[Tags.DATA_FIELD_SPEED_OF_SOUND], data[Tags.DATA_FIELD_DENSITY],
+            data[Tags.DATA_FIELD_ALPHA_COEFF], positions_mm[:, axes], orientations[:, axes],
+            detection_geometry.detector_element_width_mm, detection_geometry.sampling_frequency_MHz,
+            detection_geometry.center_frequency_Hz, detection_geometry.bandwidth_percent)
+
+        self.global_settings[Tags.K_WAVE_SPECIFIC_DT] = time_step
+        self.global_settings[Tags.K_WAVE_SPECIFIC_NT] = number_time_steps
+        save_hdf5(self.global_settings, file_path, "/settings/")
+
+        return time_series_data
+
+    def k_space_acoustic_forward_model(self, initial_pressure: np.ndarray, speed_of_sound: np.ndarray,
+                                       density: np.ndarray, alpha_coeff: np.ndarray, sensor_positions_mm: np.ndarray,
+                                       sensor_orientations: np.ndarray, element_width_mm: float,
+                                       sampling_frequency_mhz: float, center_frequency_hz: float = None,
+                                       bandwidth_percent: float = None) -> Tuple[np.ndarray, float, int]:
+        """
+        Runs the k-space pseudospectral simulation for the given 2D or 3D volumes. The sensor positions and
+        orientations have to be given in the coordinates of the simulated volume.
+
+        :param initial_pressure: initial pressure distribution in Pa
+        :param speed_of_sound: speed of sound in m/s, either a volume or a number
+        :param density: density in kg/m^3, either a volume or a number
+        :param alpha_coeff: acoustic attenuation in dB/(MHz^y cm), either a volume or a number
+        :param sensor_positions_mm: positions of the detection elements (number of elements x dimensions)
+        :param sensor_orientations: orientations of the detection elements (number of elements x dimensions)
+        :param element_width_mm: width of a detection element
+        :param sampling_frequency_mhz: sampling frequency of the detection elements
+        :param center_frequency_hz: center frequency of the detection elements, used if
+            Tags.MODEL_SENSOR_FREQUENCY_RESPONSE is set
+        :param bandwidth_percent: bandwidth of the detection elements, used if Tags.MODEL_SENSOR_FREQUENCY_RESPONSE
+            is set
+        :return: tuple with the time series data (number of elements x number of time steps), the time step in s and
+            the number of time steps
+        """
+        spacing_mm = self.global_settings[Tags.SPACING_MM]
+        initial_pressure = np.asarray(initial_pressure, dtype=np.float32)
+        dimensions = initial_pressure.ndim
+        speed_of_sound = np.broadcast_to(np.asarray(speed_of_sound, dtype=np.float32), initial_pressure.shape)
+        density = np.broadcast_to(np.asarray(density, dtype=np.float32), initial_pressure.shape)
+        alpha_coeff = np.broadcast_to(np.asarray(alpha_coeff, dtype=np.float32), initial_pressure.shape)
+
+        if self.get_parameter(Tags.KWAVE_PROPERTY_INITIAL_PRESSURE_SMOOTHING, True):
+            initial_pressure = smooth_initial_pressure(initial_pressure)
+
+        sensor_points, sensor_elements = compute_sensor_points(np.asarray(sensor_positions_mm) / spacing_mm,
+                                                               np.asarray(sensor_orientations),
+                                                               element_width_mm / spacing_mm)
+
+        # extend the grid such that all sensor points are inside of it
+        padding = list()
+        for axis in range(dimensions):
+            before = max(0, int(np.ceil(-np.min(sensor_points[:, axis]))) + SENSOR_MARGIN_IN_VOXELS)
+            after = max(0, int(np.ceil(np.max(sensor_points[:, axis]) - (initial_pressure.shape[axis] - 1))) +
+                        SENSOR_MARGIN_IN_VOXELS)
+            padding.append((before, after))
+        volume_shape = tuple(size + before + after for size, (before, after) in zip(initial_pressure.shape, padding))
+
+        time_step, number_time_steps = compute_time_step(volume_shape, spacing_mm / 1000, speed_of_sound,
+                                                         sampling_frequency_mhz)
+        self.logger.debug(f"Simulating {number_time_steps} time steps of {time_step} s")
+
+        pml_size = np.atleast_1d(self.get_parameter(Tags.KWAVE_PROPERTY_PMLSize,
+                                                    20 if dimensions == 2 else 10)).astype(int)
+        if len(pml_size) != dimensions:
+            pml_size = np.full(dimensions, pml_size[0])
+        if not self.get_parameter(Tags.KWAVE_PROPERTY_PMLInside, False):
+            padding = [(before + size, after + size) for (before, after), size in zip(padding, pml_size)]
+
+        sensor_points = sensor_points + np.asarray([before for before, _ in padding])
+        initial_pressure = np.pad(initial_pressure, padding, mode="constant")
+        speed_of_sound = np.pad(speed_of_sound, padding, mode="edge")
+        density = np.pad(density, padding, mode="edge")
+        alpha_coeff = np.pad(alpha_coeff, padding, mode="edge")
+
+        sensor_matrix = compute_sensor_matrix(sensor_points, sensor_elements, initial_pressure.shape)
+
+        time_series_data = k_space_first_order(initial_pressure, speed_of_sound, density, spacing_mm / 1000,
+                                               time_step, number_time_steps, sensor_matrix,
+                                               alpha_coeff=alpha_coeff,
+                                               alpha_power=self.get_parameter(Tags.KWAVE_PROPERTY_ALPHA_POWER, 0.0),
+                                               pml_size=pml_size,
+                                               pml_alpha=self.get_parameter(Tags.KWAVE_PROPERTY_PMLAlpha, 2.0))
+
+        if self.get_parameter(Tags.MODEL_SENSOR_FREQUENCY_RESPONSE, False):
+            time_series_data = apply_sensor_frequency_response(time_series_data, time_step, center_frequency_hz,
+                                                               bandwidth_percent)
+
+        return time_series_data, time_step, number_time_steps
+
+
+def compute_time_step(shape: tuple, dx: float, speed_of_sound: np.ndarray,
+                      sampling_frequency_mhz: float) -> Tuple[float, int]:
+    """
+    Computes the time step and the number of time steps such that a wave can traverse the grid diagonally.
+    The sampling rate of the detector is used as the time step, if the resulting CFL number is below 0.3,
+    otherwise a time step with a CFL number of 0.3 is used (like makeTime in k-Wave).
+
+    :param shape: shape of the simulation grid (without the PML)
+    :param dx: grid spacing in m
+    :param speed_of_sound: speed of sound in m/s
+    :param sampling_frequency_mhz: sampling frequency of the detector
+    :return: tuple with the time step in s and the number of time steps
+    """
+    diagonal = np.sqrt(np.sum(np.asarray(shape, dtype=float) ** 2)) * dx
+    time_step = 1.0 / (sampling_frequency_mhz * 1e6)
+    mean_speed_of_sound = float(np.mean(speed_of_sound))
+    if time_step / dx * mean_speed_of_sound < 0.3:
+        return time_step, int(np.round(diagonal / mean_speed_of_sound / time_step))
+    time_step = 0.3 * dx / float(np.max(speed_of_sound))
+    return time_step, int(np.floor(diagonal / float(np.min(speed_of_sound)) / time_step)) + 1
+
+
+def smooth_initial_pressure(initial_pressure: np.ndarray) -> np.ndarray:
+    """
+    Smooths the initial pressure with a radially symmetric Blackman window in k-space and restores the maximum
+    amplitude afterwards, which reduces the Gibbs phenomenon of discontinuous initial pressure distributions.
+
+    :param initial_pressure: initial pressure distribution
+    :return: smoothed initial pressure distribution
+    """
+    maximum = np.max(np.abs(initial_pressure))
+    if maximum == 0:
+        return initial_pressure
+    radius = np.zeros(initial_pressure.shape[:-1] + (initial_pressure.shape[-1] // 2 + 1, ))
+    for axis, size in enumerate(initial_pressure.shape):
+        frequencies = scipy.fft.rfftfreq(size) if axis == initial_pressure.ndim - 1 else scipy.fft.fftfreq(size)
+        shape = [1] * initial_pressure.ndim
+        shape[axis] = -1
+        radius = radius + (2 * frequencies.reshape(shape)) ** 2
+    radius = np.sqrt(radius)
+    window = np.where(radius <= 1, 0.42 + 0.5 * np.cos(np.pi * radius) + 0.08 * np.cos(2 * np.pi * radius), 0)
+    smoothed = scipy.fft.irfftn(scipy.fft.rfftn(initial_pressure) * window, s=initial_pressure.shape)
+    return (smoothed * (maximum / np.max(np.abs(smoothed)))).astype(initial_pressure.dtype)
+
+
+def compute_sensor_points(positions: np.ndarray, orientations: np.ndarray,
+                          element_width: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Samples every detection element with points along its width. The width direction is perpendicular to the
+    orientation of the element, within the imaging plane in 2D and perpendicular to the y axis in 3D.
+
+    :param positions: element positions in voxels (number of elements x dimensions)
+    :param orientations: element orientations (number of elements x dimensions)
+    :param element_width: element width in voxels
+    :return: tuple with the point positions in voxels and the index of the element of each point
+    """
+    if positions.shape[1] == 2:
+        width_directions = np.stack([orientations[:, 1], -orientations[:, 0]], axis=1)
+        fallback = np.array([1.0, 0.0])
+    else:
+        width_directions = np.cross(orientations, np.array([0.0, 1.0, 0.0]))
+        fallback = np.array([1.0, 0.0, 0.0])
+    norms = np.linalg.norm(width_directions, axis=1, keepdims=True)
+    width_directions = np.where(norms > 1e-6, width_directions / np.maximum(norms, 1e-6), fallback)
+
+    number_of_points = max(1, int(np.ceil(2 * element_width)))
+    offsets = ((np.arange(number_of_points) + 0.5) / number_of_points - 0.5) * element_width
+    points = positions[:, None, :] + offsets[None, :, None] * width_directions[:, None, :]
+    elements = np.repeat(np.arange(len(positions)), number_of_points)
+    return points.reshape(-1, positions.shape[1]), elements
+
+
+def compute_sensor_matrix(points: np.ndarray, elements: np.ndarray, shape: tuple) -> scipy.sparse.csr_matrix:
+    """
+    Computes the sparse matrix that averages the (linearly interpolated) pressure of all points of an element.
+
+    :param points: point positions in voxels of the simulation grid
+    :param elements: index of the element of each point
+    :param shape: shape of the simulation grid
+    :return: sparse matrix of shape (number of elements x number of voxels)
+    """
+    points = np.clip(points, 0, np.asarray(shape) - 1)
+    lower = np.minimum(np.floor(points).astype(int), np.asarray(shape) - 2).clip(0)
+    fraction = points - lower
+    number_of_elements = int(np.max(elements)) + 1
+    points_per_element = np.bincount(elements, minlength=number_of_elements)
+
+    rows, columns, weights = list(), list(), list()
+    for corner in np.ndindex(*([2] * len(shape))):
+        corner = np.asarray(corner)
+        indices = np.minimum(lower + corner, np.asarray(shape) - 1)
+        weight = np.prod(np.where(corner == 1, fraction, 1 - fraction), axis=1)
+        rows.append(elements)
+        columns.append(np.ravel_multi_index(tuple(indices.T), shape))
+        weights.append(weight / points_per_element[elements])
+    return scipy.sparse.coo_matrix((np.concatenate(weights), (np.concatenate(rows), np.concatenate(columns))),
+                                   shape=(number_of_elements, int(np.prod(shape)))).tocsr()
+
+
+def get_pml(number_of_voxels: int, dx: float, dt: float, speed_of_sound: float, pml_size: int, pml_alpha: float,
+            staggered: bool) -> np.ndarray:
+    """
+    Computes the 1D absorption profile of a perfectly matched layer (PML) at both ends of an axis (like getPML of
+    k-Wave).
+
+    :return: multiplicative damping factors for every voxel along the axis
+    """
+    pml = np.ones(number_of_voxels, dtype=np.float32)
+    if pml_size < 1:
+        return pml
+    x = np.arange(1, pml_size + 1, dtype=float) + (0.5 if staggered else 0)
+    left = pml_alpha * (speed_of_sound / dx) * (((x - pml_size - 1) / (0 - pml_size)) ** 4)
+    right = pml_alpha * (speed_of_sound / dx) * ((x / pml_size) ** 4)
+    pml[:pml_size] = np.exp(-left * dt / 2)
+    pml[-pml_size:] = np.exp(-right * dt / 2)
+    return pml
+
+
+def k_space_first_order(initial_pressure: np.ndarray, speed_of_sound: np.ndarray, density: np.ndarray, dx: float,
+                        dt: float, number_time_steps: int, sensor_matrix: scipy.sparse.spmatrix,
+                        alpha_coeff: np.ndarray = None, alpha_power: float = 0.0, pml_size=None,
+                        pml_alpha: float = 2.0) -> np.ndarray:
+    """
+    Solves the coupled first order acoustic equations for an initial pressure distribution with the k-space
+    pseudospectral method on a staggered grid (like kspaceFirstOrder2D/3D of k-Wave). The PML is located inside of
+    the given grid.
+
+    :param initial_pressure: initial pressure distribution in Pa (2D or 3D)
+    :param speed_of_sound: speed of sound in m/s with the shape of the initial pressure
+    :param density: density in kg/m^3 with the shape of the initial pressure
+    :param dx: grid spacing in m
+    :param dt: time step in s
+    :param number_time_steps: number of recorded time steps (including t = 0)
+    :param sensor_matrix: sparse matrix that maps the pressure on the grid to the sensor data
+    :param alpha_coeff: acoustic attenuation in dB/(MHz^y cm) with the shape of the initial pressure
+    :param alpha_power: exponent y of the frequency power law of the attenuation
+    :param pml_size: size of the PML in voxels for every axis
+    :param pml_alpha: absorption coefficient of the PML in Nepers per grid point
+    :return: the recorded pressure (number of sensors x number of time steps)
+    """
+    shape = initial_pressure.shape
+    dimensions = len(shape)
+    if pml_size is None:
+        pml_size = [20 if dimensions == 2 else 10] * dimensions
+    speed_of_sound = np.asarray(speed_of_sound, dtype=np.float32)
+    density = np.asarray(density, dtype=np.float32)
+    reference_speed_of_sound = float(np.max(speed_of_sound))
+
+    def rfftn(data):
+        return scipy.fft.rfftn(data, workers=-1)
+
+    def irfftn(data):
+        return scipy.fft.irfftn(data, s=shape, workers=-1)
+
+    wavenumbers = list()
+    for axis, size in enumerate(shape):
+        k = 2 * np.pi * (scipy.fft.rfftfreq(size, dx) if axis == dimensions - 1 else scipy.fft.fftfreq(size, dx))
+        wavenumber_shape = [1] * dimensions
+        wavenumber_shape[axis] = -1
+        wavenumbers.append(k.reshape(wavenumber_shape))
+    k_magnitude = np.sqrt(sum(k ** 2 for k in wavenumbers))
+    kappa = np.sinc(reference_speed_of_sound * k_magnitude * dt / (2 * np.pi))
+
+    # staggered grid derivative operators including the k-space correction
+    derivatives_forward = [(1j * k * np.exp(1j * k * dx / 2) * kappa).astype(np.complex64) for k in wavenumbers]
+    derivatives_backward = [(1j * k * np.exp(-1j * k * dx / 2) * kappa).astype(np.complex64) for k in wavenumbers]
+
+    pmls, pmls_staggered, densities_staggered = list(), list(), list()
+    for axis, size in enumerate(shape):
+        pml_shape = [1] * dimensions
+        pml_shape[axis] = -1
+        pmls.append(get_pml(size, dx, dt, reference_speed_of_sound, int(pml_size[axis]), pml_alpha,
+                            False).reshape(pml_shape))
+        pmls_staggered.append(get_pml(size, dx, dt, reference_speed_of_sound, int(pml_size[axis]), pml_alpha,
+                                      True).reshape(pml_shape))
+        density_staggered = density.copy()
+        interior = [slice(None)] * dimensions
+        interior[axis] = slice(0, -1)
+        density_staggered[tuple(interior)] = 0.5 * (density + np.roll(density, -1, axis=axis))[tuple(interior)]
+        densities_staggered.append(dt / density_staggered)
+
+    absorbing = alpha_coeff is not None and np.any(np.asarray(alpha_coeff) > 0)
+    if absorbing:
+        alpha_coeff_neper = 100 * np.asarray(alpha_coeff, dtype=np.float32) * (1e-6 / (2 * np.pi)) ** alpha_power / \
+            (20 * np.log10(np.e))
+        absorption_tau = (-2 * alpha_coeff_neper * speed_of_sound ** (alpha_power - 1)).astype(np.float32)
+        with np.errstate(divide="ignore"):
+            absorption_nabla = np.where(k_magnitude > 0, k_magnitude ** (alpha_power - 2), 0).astype(np.float32)
+
+    squared_speed_of_sound = speed_of_sound ** 2
+    pressure = np.asarray(initial_pressure, dtype=np.float32)
+    split_densities = [pressure / (dimensions * squared_speed_of_sound) for _ in range(dimensions)]
+    # u(t = -dt/2) such that the particle velocity vanishes at t = 0
+    pressure_k = rfftn(pressure)
+    velocities = [(densities_staggered[axis] / 2 * irfftn(derivatives_forward[axis] * pressure_k)).astype(np.float32)
+                  for axis in range(dimensions)]
+
+    time_series_data = np.zeros((sensor_matrix.shape[0], number_time_steps), dtype=np.float32)
+    time_series_data[:, 0] = sensor_matrix @ pressure.ravel()
+    for time_index in range(1, number_time_steps):
+        pressure_k = rfftn(pressure)
+        divergence = 0
+        for axis in range(dimensions):
+            velocities[axis] = pmls_staggered[axis] * (pmls_staggered[axis] * velocities[axis] -
+                                                       densities_staggered[axis] *
+                                                       irfftn(derivatives_forward[axis] * pressure_k))
+            velocity_derivative = irfftn(derivatives_backward[axis] * rfftn(velocities[axis]))
+            split_densities[axis] = pmls[axis] * (pmls[axis] * split_densities[axis] -
+                                                  dt * density * velocity_derivative)
+            divergence = divergence + velocity_derivative
+
+        total_density = sum(split_densities)
+        if absorbing:
+            total_density = total_density + absorption_tau * irfftn(absorption_nabla * rfftn(density * divergence))
+        pressure = (squared_speed_of_sound * total_density).astype(np.float32)
+        time_series_data[:, time_index] = sensor_matrix @ pressure.ravel()
+
+    return time_series_data
+
+
+def apply_sensor_frequency_response(time_series_data: np.ndarray, dt: float, center_frequency_hz: float,
+                                    bandwidth_percent: float) -> np.ndarray:
+    """
+    Filters the time series data with a Gaussian frequency response of the sensor (like gaussianFilter of k-Wave).
+
+    :param time_series_data: time series data (number of sensors x number of time steps)
+    :param dt: time step in s
+    :param center_frequency_hz: center frequency of the sensor in Hz
+    :param bandwidth_percent: full width at half maximum of the response in percent of the center frequency
+    :return: filtered time series data
+    """
+    frequencies = scipy.fft.rfftfreq(time_series_data.shape[-1], dt)
+    standard_deviation = bandwidth_percent / 100 * center_frequency_hz / (2 * np.sqrt(2 * np.log(2)))
+    response = np.exp(-(frequencies - center_frequency_hz) ** 2 / (2 * standard_deviation ** 2)) + \
+        np.exp(-(frequencies + center_frequency_hz) ** 2 / (2 * standard_deviation ** 2))
+    filtered = scipy.fft.irfft(scipy.fft.rfft(time_series_data, axis=-1) * response, n=time_series_data.shape[-1],
+                               axis=-1)
+    return filtered.astype(time_series_data.dtype)
@@ -6,8 +6,7 @@ from simpa.utils.path_manager import PathManager
 import numpy as np
 import subprocess
 from simpa.utils import Tags
-from simpa.io_handling.io_hdf5 import load_hdf5, save_hdf5, load_data_field
-from simpa.utils.dict_path_manager import generate_dict_path
+from simpa.io_handling.io_hdf5 import save_hdf5, load_data_field
 from simpa.utils.settings import Settings
 from simpa.utils.calculate import rotation_matrix_between_vectors
 from simpa.core.device_digital_twins import CurvedArrayDetectionGeometry, DetectionGeometryBase
@@ -72,18 +71,7 @@ class KWaveAdapter(AcousticForwardModelBaseAdapter):
 
         """
 
-        optical_path = generate_dict_path(Tags.OPTICAL_MODEL_OUTPUT_NAME,
-                                          wavelength=self.global_settings[Tags.WAVELENGTH])
-
-        self.logger.debug(f"OPTICAL_PATH: {str(optical_path)}")
-
-        data_dict = load_hdf5(self.global_settings[Tags.SIMPA_OUTPUT_PATH], optical_path)
-        if Tags.DATA_FIELD_FLUENCE in data_dict:
-            del data_dict[Tags.DATA_FIELD_FLUENCE]
-        gc.collect()
-
-        tmp_ac_data = load_data_field(self.global_settings[Tags.SIMPA_OUTPUT_PATH], Tags.SIMULATION_PROPERTIES,
-                                      self.global_settings[Tags.WAVELENGTH])
+        file_path = self.global_settings[Tags.SIMPA_OUTPUT_PATH]
 
         pa_device = detection_geometry
         pa_device.check_settings_prerequisites(self.global_settings)
@@ -105,15 +93,16 @@ class KWaveAdapter(AcousticForwardModelBaseAdapter):
             axes = (0, 2)
             image_slice = np.s_[:]
         
-        wavelength = str(self.global_settings[Tags.WAVELENGTH])
-        data_dict[Tags.DATA_FIELD_SPEED_OF_SOUND] = np.rot90(tmp_ac_data[Tags.DATA_FIELD_SPEED_OF_SOUND][image_slice],
-                                                             3, axes=axes)
-        data_dict[Tags.DATA_FIELD_DENSITY] = np.rot90(tmp_ac_data[Tags.DATA_FIELD_DENSITY][image_slice],
-                                                      3, axes=axes)
-        data_dict[Tags.DATA_FIELD_ALPHA_COEFF] = np.rot90(tmp_ac_data[Tags.DATA_FIELD_ALPHA_COEFF][image_slice],
-                                                          3, axes=axes)
-        data_dict[Tags.DATA_FIELD_INITIAL_PRESSURE] = np.rot90(data_dict[Tags.DATA_FIELD_INITIAL_PRESSURE]
-                                                                  [wavelength][image_slice], 3, axes=axes)
+        # only read the slice of the volumes that is needed for the simulation
+        wavelength = self.global_settings[Tags.WAVELENGTH]
+        data_dict = dict()
+        for data_field in [Tags.DATA_FIELD_SPEED_OF_SOUND, Tags.DATA_FIELD_DENSITY, Tags.DATA_FIELD_ALPHA_COEFF]:
+            data_dict[data_field] = np.rot90(load_data_field(file_path, data_field, selection=image_slice), 3,
+                                             axes=axes)
+        data_dict[Tags.DATA_FIELD_INITIAL_PRESSURE] = np.rot90(load_data_field(file_path,
+                                                                               Tags.DATA_FIELD_INITIAL_PRESSURE,
+                                                                               wavelength, selection=image_slice),
+                                                               3, axes=axes)
 
         time_series_data, global_settings = self.k_wave_acoustic_forward_model(
             detection_geometry,
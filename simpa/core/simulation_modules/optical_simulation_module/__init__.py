@@ -1,17 +1,18 @@
 # SPDX-FileCopyrightText: 2021 Division of Intelligent Medical Systems, DKFZ
 # SPDX-FileCopyrightText: 2021 Janek Groehl
 # SPDX-License-Identifier: MIT
+import copy
 import numpy as np
-from typing import Union, Dict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Union, Dict, Iterator, List
 from abc import abstractmethod
-import gc
 
 from simpa.utils import Tags, Settings
 from simpa.core import SimulationModule
 from simpa.utils.dict_path_manager import generate_dict_path
-from simpa.io_handling.io_hdf5 import save_hdf5, load_hdf5
+from simpa.io_handling.io_hdf5 import save_hdf5, load_data_field
 from simpa.core.device_digital_twins import IlluminationGeometryBase, PhotoacousticDevice
-from simpa.utils.quality_assurance.data_sanity_testing import assert_array_well_defined
+from simpa.utils.quality_assurance.data_sanity_testing import assert_array_well_defined, get_qa_assertion_sample_size
 
 
 class OpticalForwardModuleBase(SimulationModule):
@@ -57,16 +58,12 @@ class OpticalForwardModuleBase(SimulationModule):
 
         self.logger.info("Simulating the optical forward process...")
 
-        properties_path = generate_dict_path(Tags.SIMULATION_PROPERTIES,
-                                             wavelength=self.global_settings[Tags.WAVELENGTH])
-
-        optical_properties = load_hdf5(self.global_settings[Tags.SIMPA_OUTPUT_PATH], properties_path)
-        absorption = optical_properties[Tags.DATA_FIELD_ABSORPTION_PER_CM][str(self.global_settings[Tags.WAVELENGTH])]
-        scattering = optical_properties[Tags.DATA_FIELD_SCATTERING_PER_CM][str(self.global_settings[Tags.WAVELENGTH])]
-        anisotropy = optical_properties[Tags.DATA_FIELD_ANISOTROPY][str(self.global_settings[Tags.WAVELENGTH])]
-        gruneisen_parameter = optical_properties[Tags.DATA_FIELD_GRUNEISEN_PARAMETER]
-        del optical_properties
-        gc.collect()
+        file_path = self.global_settings[Tags.SIMPA_OUTPUT_PATH]
+        wavelength = self.global_settings[Tags.WAVELENGTH]
+        absorption = load_data_field(file_path, Tags.DATA_FIELD_ABSORPTION_PER_CM, wavelength)
+        scattering = load_data_field(file_path, Tags.DATA_FIELD_SCATTERING_PER_CM, wavelength)
+        anisotropy = load_data_field(file_path, Tags.DATA_FIELD_ANISOTROPY, wavelength)
+        gruneisen_parameter = load_data_field(file_path, Tags.DATA_FIELD_GRUNEISEN_PARAMETER)
 
         _device = None
         if isinstance(device, IlluminationGeometryBase):
@@ -83,7 +80,8 @@ class OpticalForwardModuleBase(SimulationModule):
                                          anisotropy=anisotropy)
         fluence = results[Tags.DATA_FIELD_FLUENCE]
         if not (Tags.IGNORE_QA_ASSERTIONS in self.global_settings and Tags.IGNORE_QA_ASSERTIONS):
-            assert_array_well_defined(fluence, assume_non_negativity=True, array_name="fluence")
+            assert_array_well_defined(fluence, assume_non_negativity=True, array_name="fluence",
+                                      sample_size=get_qa_assertion_sample_size(self.global_settings))
 
         if Tags.LASER_PULSE_ENERGY_IN_MILLIJOULE in self.component_settings:
             units = Tags.UNITS_PRESSURE
@@ -97,7 +95,8 @@ class OpticalForwardModuleBase(SimulationModule):
             initial_pressure = absorption * fluence
 
         if not (Tags.IGNORE_QA_ASSERTIONS in self.global_settings and Tags.IGNORE_QA_ASSERTIONS):
-            assert_array_well_defined(initial_pressure, assume_non_negativity=True, array_name="initial_pressure")
+            assert_array_well_defined(initial_pressure, assume_non_negativity=True, array_name="initial_pressure",
+                                      sample_size=get_qa_assertion_sample_size(self.global_settings))
 
         results[Tags.DATA_FIELD_FLUENCE] = fluence
         results[Tags.OPTICAL_MODEL_UNITS] = units
@@ -110,6 +109,73 @@ class OpticalForwardModuleBase(SimulationModule):
         save_hdf5(optical_output, self.global_settings[Tags.SIMPA_OUTPUT_PATH], optical_output_path)
         self.logger.info("Simulating the optical forward process...[Done]")
 
+    def get_number_of_concurrent_illuminations(self, number_of_illuminations: int) -> int:
+        """
+        :param number_of_illuminations: number of illumination geometries that are simulated.
+        :return: the number of illumination geometries that are simulated at the same time, as given by
+            Tags.OPTICAL_MODEL_CONCURRENT_ILLUMINATIONS (default: 1).
+        """
+        if Tags.OPTICAL_MODEL_CONCURRENT_ILLUMINATIONS in self.component_settings:
+            number_of_slots = int(self.component_settings[Tags.OPTICAL_MODEL_CONCURRENT_ILLUMINATIONS])
+        else:
+            number_of_slots = 1
+        return max(1, min(number_of_slots, number_of_illuminations))
+
+    def _forward_model_of_copy(self, **kwargs) -> Dict:
+        """
+        Runs `self.forward_model` on a shallow copy of this adapter, such that simulations of different illumination
+        geometries that run at the same time do not share the attributes that are set during a simulation.
+        """
+        adapter = copy.copy(self)
+        adapter.temporary_output_files = []
+        return adapter.forward_model(**kwargs)
+
+    def iterate_forward_models(self,
+                               illumination_geometries: List[IlluminationGeometryBase],
+                               absorption: np.ndarray,
+                               scattering: np.ndarray,
+                               anisotropy: np.ndarray) -> Iterator[Dict]:
+        """
+        runs `self.forward_model` for every illumination geometry and yields the results in the order of the
+        illumination geometries. If Tags.OPTICAL_MODEL_CONCURRENT_ILLUMINATIONS is larger than 1, that many
+        illumination geometries are simulated at the same time and every result is yielded as soon as it and all
+        results before it are done.
+
+        :param illumination_geometries: list of illumination geometries
+        :param absorption: Absorption volume
+        :param scattering: Scattering volume
+        :param anisotropy: Dimensionless scattering anisotropy
+        :return: iterator over the results of `self.forward_model`
+        """
+        number_of_slots = self.get_number_of_concurrent_illuminations(len(illumination_geometries))
+        if number_of_slots == 1:
+            for illumination_geometry in illumination_geometries:
+                yield self.forward_model(absorption_cm=absorption,
+                                         scattering_cm=scattering,
+                                         anisotropy=anisotropy,
+                                         illumination_geometry=illumination_geometry)
+            return
+
+        self.logger.debug(f"Simulating {len(illumination_geometries)} illumination geometries, {number_of_slots} at "
+                          f"a time")
+        with ThreadPoolExecutor(max_workers=number_of_slots) as executor:
+            futures = [executor.submit(self._forward_model_of_copy,
+                                       absorption_cm=absorption,
+                                       scattering_cm=scattering,
+                                       anisotropy=anisotropy,
+                                       illumination_geometry=illumination_geometry)
+                       for illumination_geometry in illumination_geometries]
+            try:
+                for index in range(len(futures)):
+                    results = futures[index].result()
+                    # release the results as soon as they are consumed
+                    futures[index] = None
+                    yield results
+            finally:
+                for future in futures:
+                    if future is not None:
+                        future.cancel()
+
     def run_forward_model(self,
                           _device,
                           device: Union[IlluminationGeometryBase, PhotoacousticDevice],
@@ -126,27 +192,15 @@ class OpticalForwardModuleBase(SimulationModule):
         :param anisotropy: Dimensionless scattering anisotropy
         :return:
         """
-        if isinstance(_device, list):
-            # per convention this list has at least two elements
-            results = self.forward_model(absorption_cm=absorption,
-                                         scattering_cm=scattering,
-                                         anisotropy=anisotropy,
-                                         illumination_geometry=_device[0])
-            fluence = results[Tags.DATA_FIELD_FLUENCE]
-            for idx in range(1, len(_device)):
-                # we already looked at the 0th element, so go from 1 to n-1
-                results = self.forward_model(absorption_cm=absorption,
-                                             scattering_cm=scattering,
-                                             anisotropy=anisotropy,
-                                             illumination_geometry=_device[idx])
+        # per convention a list of illumination geometries has at least two elements
+        illumination_geometries = _device if isinstance(_device, list) else [_device]
+        fluence = None
+        for results in self.iterate_forward_models(illumination_geometries, absorption, scattering, anisotropy):
+            if fluence is None:
+                fluence = results[Tags.DATA_FIELD_FLUENCE]
+            else:
                 fluence += results[Tags.DATA_FIELD_FLUENCE]
 
+        if isinstance(_device, list):
             fluence = fluence / len(_device)
-
-        else:
-            results = self.forward_model(absorption_cm=absorption,
-                                         scattering_cm=scattering,
-                                         anisotropy=anisotropy,
-                                         illumination_geometry=_device)
-            fluence = results[Tags.DATA_FIELD_FLUENCE]
         return {Tags.DATA_FIELD_FLUENCE: fluence}
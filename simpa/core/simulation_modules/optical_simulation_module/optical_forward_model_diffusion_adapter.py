@@ -0,0 +1,358 @@
+# SPDX-FileCopyrightText: 2021 Division of Intelligent Medical Systems, DKFZ
+# SPDX-FileCopyrightText: 2021 Janek Groehl
+# SPDX-License-Identifier: MIT
+
+import numpy as np
+from scipy.sparse import coo_matrix
+from scipy.sparse.linalg import LinearOperator, cg
+from typing import Dict, Tuple
+
+from simpa.utils import Tags, Settings
+from simpa.core.simulation_modules.optical_simulation_module import OpticalForwardModuleBase
+from simpa.core.device_digital_twins.illumination_geometries.illumination_geometry_base import IlluminationGeometryBase
+
+
+class DiffusionApproximationAdapter(OpticalForwardModuleBase):
+    """
+    This class implements an optical forward model that solves the steady-state diffusion approximation of the
+    radiative transfer equation on the SIMPA voxel grid. It runs on the CPU and does not need any external binary,
+    which makes it suitable for large parameter sweeps or as the forward model of iterative methods, where an
+    approximate fluence is sufficient.
+
+    The light of the illumination geometry is split into a collimated part and a diffuse part:
+
+    1. The collimated beam is traced through the volume along the source direction and is attenuated by the
+       reduced total attenuation coefficient :math:`\\mu_a + \\mu_s'`.
+    2. The collimated light that is scattered acts as an isotropic source :math:`S = \\mu_s' \\Phi_c` of the
+       diffusion equation :math:`-\\nabla \\cdot (D \\nabla \\Phi_d) + \\mu_a \\Phi_d = S` with
+       :math:`D = 1 / (3 (\\mu_a + \\mu_s'))`. The equation is discretised with a cell-centred finite volume scheme
+       and Robin boundary conditions (no refractive index mismatch) and solved with the conjugate gradient method,
+       preconditioned with the diagonal of the system matrix.
+
+    The returned fluence :math:`\\Phi_c + \\Phi_d` is normalised like the MCX output, i.e. it is given in
+    units of 1/cm^2 for a total source energy of 1.
+
+    The source definitions of the illumination geometries are re-used via `get_mcx_illuminator_definition`.
+    Supported are pencil, pencil array, disk, gaussian, slit and planar sources.
+    The illuminations of device digital twins whose sources are only defined inside MCX, such as the
+    MSOTAcuityIlluminationGeometry and the MSOTInVisionIlluminationGeometry, are not supported and raise a
+    ValueError when the adapter is run.
+    Dimensions of the volume with a size of one voxel are treated as translation invariant, so a volume with the
+    shape (nx, 1, nz) or a two-dimensional (nx, nz) volume results in a two-dimensional simulation.
+
+    The solver can be configured in the optical settings with Tags.DIFFUSION_SOLVER_TOLERANCE,
+    Tags.DIFFUSION_SOLVER_MAX_ITERATIONS and Tags.DIFFUSION_SOLVER_WARM_START.
+    """
+
+    SUPPORTED_SOURCE_TYPES = [Tags.ILLUMINATION_TYPE_PENCIL,
+                              Tags.ILLUMINATION_TYPE_PENCILARRAY,
+                              Tags.ILLUMINATION_TYPE_DISK,
+                              Tags.ILLUMINATION_TYPE_GAUSSIAN,
+                              Tags.ILLUMINATION_TYPE_SLIT,
+                              Tags.ILLUMINATION_TYPE_PLANAR]
+
+    def __init__(self, global_settings: Settings):
+        """
+        initializes the solver configuration of the diffusion approximation
+
+        :param global_settings: global settings used during simulations
+        """
+        super(DiffusionApproximationAdapter, self).__init__(global_settings=global_settings)
+
+        if Tags.DIFFUSION_SOLVER_TOLERANCE in self.component_settings:
+            self.solver_tolerance = self.component_settings[Tags.DIFFUSION_SOLVER_TOLERANCE]
+        else:
+            self.solver_tolerance = 1e-6
+
+        if Tags.DIFFUSION_SOLVER_MAX_ITERATIONS in self.component_settings:
+            self.solver_max_iterations = self.component_settings[Tags.DIFFUSION_SOLVER_MAX_ITERATIONS]
+        else:
+            self.solver_max_iterations = 10000
+
+        if Tags.DIFFUSION_SOLVER_WARM_START in self.component_settings:
+            self.warm_start = self.component_settings[Tags.DIFFUSION_SOLVER_WARM_START]
+        else:
+            self.warm_start = False
+        # diffuse fluences of the previous simulations by source definition and volume shape, used if warm_start
+        self.previous_diffuse_fluences = dict()
+        self.number_of_solver_iterations = None
+
+    def forward_model(self,
+                      absorption_cm: np.ndarray,
+                      scattering_cm: np.ndarray,
+                      anisotropy: np.ndarray,
+                      illumination_geometry: IlluminationGeometryBase) -> Dict:
+        """
+        computes the fluence of the given illumination geometry with the diffusion approximation.
+
+        :param absorption_cm: array containing the absorption of the tissue in `cm` units
+        :param scattering_cm: array containing the scattering of the tissue in `cm` units
+        :param anisotropy: array containing the anisotropy of the volume defined by `absorption_cm` and `scattering_cm`
+        :param illumination_geometry: and instance of `IlluminationGeometryBase` defining the illumination geometry
+        :return: `Dict` containing the fluence in units of 1/cm^2
+        """
+        two_dimensional_input = np.ndim(absorption_cm) == 2
+        if two_dimensional_input:
+            absorption_cm = absorption_cm[:, np.newaxis, :]
+            scattering_cm = scattering_cm[:, np.newaxis, :]
+            anisotropy = np.asarray(anisotropy)[:, np.newaxis, :] if np.ndim(anisotropy) == 2 else anisotropy
+
+        [self.nx, self.ny, self.nz] = np.shape(absorption_cm)
+        spacing = self.global_settings[Tags.SPACING_MM]
+
+        absorption_mm = np.asarray(absorption_cm, dtype=np.float64) / 10
+        reduced_scattering_mm = np.asarray(scattering_cm, dtype=np.float64) * (1 - np.asarray(anisotropy)) / 10
+        # the diffusion coefficient is not defined for vanishing attenuation
+        reduced_attenuation_mm = np.maximum(absorption_mm + reduced_scattering_mm, 1e-10)
+
+        source_definition = illumination_geometry.get_mcx_illuminator_definition(self.global_settings)
+        positions, weights = self.get_source_positions_and_weights(source_definition)
+        direction = np.asarray(source_definition["Dir"][:3], dtype=np.float64)
+        direction = direction / np.linalg.norm(direction)
+
+        collimated_fluence = self.propagate_collimated_light(positions, weights, direction,
+                                                            reduced_attenuation_mm, spacing)
+        warm_start_key = (str(source_definition), np.shape(absorption_mm), spacing)
+        initial_guess = self.previous_diffuse_fluences.get(warm_start_key) if self.warm_start else None
+        diffuse_fluence = self.solve_diffusion_equation(absorption_mm, reduced_attenuation_mm,
+                                                        reduced_scattering_mm * collimated_fluence, spacing,
+                                                        initial_guess=initial_guess)
+        if self.warm_start:
+            self.previous_diffuse_fluences[warm_start_key] = diffuse_fluence
+
+        fluence = (collimated_fluence + diffuse_fluence) * 100  # Convert from 1/mm^2 to 1/cm^2
+        if two_dimensional_input:
+            fluence = fluence[:, 0, :]
+        return {Tags.DATA_FIELD_FLUENCE: fluence}
+
+    def get_source_positions_and_weights(self, source_definition: dict) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        samples the source area of an MCX source definition with pencil beams that are spaced by half a voxel.
+
+        :param source_definition: source definition as returned by `get_mcx_illuminator_definition`
+        :return: `Tuple` of the beam positions in voxel coordinates with the shape (n, 3) and their relative
+            energies, which sum up to one
+        """
+        source_type = source_definition["Type"]
+        position = np.asarray(source_definition["Pos"][:3], dtype=np.float64)
+        direction = np.asarray(source_definition["Dir"][:3], dtype=np.float64)
+        direction = direction / np.linalg.norm(direction)
+        param1 = np.asarray(source_definition["Param1"], dtype=np.float64)
+        param2 = np.asarray(source_definition["Param2"], dtype=np.float64)
+        sampling = 0.5
+
+        if source_type == Tags.ILLUMINATION_TYPE_PENCIL:
+            offsets = np.zeros((1, 3))
+            weights = np.ones(1)
+        elif source_type == Tags.ILLUMINATION_TYPE_PENCILARRAY:
+            number_x = max(int(param1[3]), 1)
+            number_y = max(int(param2[3]), 1)
+            index_x, index_y = np.meshgrid(np.arange(number_x), np.arange(number_y), indexing="ij")
+            offsets = (index_x.reshape(-1, 1) / number_x * param1[np.newaxis, :3] +
+                       index_y.reshape(-1, 1) / number_y * param2[np.newaxis, :3])
+            weights = np.ones(len(offsets))
+        elif source_type in [Tags.ILLUMINATION_TYPE_DISK, Tags.ILLUMINATION_TYPE_GAUSSIAN]:
+            radius = param1[0]
+            if source_type == Tags.ILLUMINATION_TYPE_GAUSSIAN:
+                # param1[0] is the waist, i.e. the radius at which the intensity has decayed to 1/e^2
+                extent = 2 * radius
+            else:
+                extent = radius
+            # the sampling points are placed symmetrically around the centre of the beam
+            number_of_samples = int(np.ceil(extent / sampling))
+            coordinates = (np.arange(-number_of_samples, number_of_samples) + 0.5) * sampling
+            u, v = np.meshgrid(coordinates, coordinates, indexing="ij")
+            u, v = u.reshape(-1), v.reshape(-1)
+            squared_distances = u ** 2 + v ** 2
+            inside = squared_distances <= extent ** 2
+            u, v, squared_distances = u[inside], v[inside], squared_distances[inside]
+            if len(u) == 0:
+                u, v, squared_distances = np.zeros(1), np.zeros(1), np.zeros(1)
+            if source_type == Tags.ILLUMINATION_TYPE_GAUSSIAN and radius > 0:
+                weights = np.exp(-2 * squared_distances / radius ** 2)
+            else:
+                weights = np.ones(len(u))
+            basis_u, basis_v = self.get_orthonormal_basis(direction)
+            offsets = u[:, np.newaxis] * basis_u + v[:, np.newaxis] * basis_v
+        elif source_type == Tags.ILLUMINATION_TYPE_SLIT:
+            number_of_samples = max(int(np.ceil(np.linalg.norm(param1[:3]) / sampling)), 1)
+            fractions = (np.arange(number_of_samples) + 0.5) / number_of_samples
+            offsets = fractions[:, np.newaxis] * param1[np.newaxis, :3]
+            weights = np.ones(number_of_samples)
+        elif source_type == Tags.ILLUMINATION_TYPE_PLANAR:
+            number_a = max(int(np.ceil(np.linalg.norm(param1[:3]) / sampling)), 1)
+            number_b = max(int(np.ceil(np.linalg.norm(param2[:3]) / sampling)), 1)
+            fraction_a, fraction_b = np.meshgrid((np.arange(number_a) + 0.5) / number_a,
+                                                 (np.arange(number_b) + 0.5) / number_b, indexing="ij")
+            offsets = (fraction_a.reshape(-1, 1) * param1[np.newaxis, :3] +
+                       fraction_b.reshape(-1, 1) * param2[np.newaxis, :3])
+            weights = np.ones(len(offsets))
+        else:
+            raise ValueError(f"The illumination type {source_type} is not supported by the diffusion approximation. "
+                             f"Supported types are {self.SUPPORTED_SOURCE_TYPES}.")
+
+        return position[np.newaxis, :] + offsets, weights / np.sum(weights)
+
+    @staticmethod
+    def get_orthonormal_basis(direction: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        computes two unit vectors that are orthogonal to each other and to the given direction.
+
+        :param direction: normalised direction vector
+        :return: `Tuple` of the two basis vectors
+        """
+        helper = np.array([1.0, 0.0, 0.0]) if abs(direction[0]) < 0.9 else np.array([0.0, 1.0, 0.0])
+        basis_u = np.cross(direction, helper)
+        basis_u = basis_u / np.linalg.norm(basis_u)
+        basis_v = np.cross(direction, basis_u)
+        return basis_u, basis_v
+
+    @staticmethod
+    def propagate_collimated_light(positions: np.ndarray,
+                                   weights: np.ndarray,
+                                   direction: np.ndarray,
+                                   reduced_attenuation_mm: np.ndarray,
+                                   spacing: float) -> np.ndarray:
+        """
+        traces the pencil beams of the source through the volume in steps of half a voxel and computes the fluence of
+        the light that has not been scattered yet.
+        Dimensions of the volume with a size of one voxel are treated as translation invariant.
+
+        :param positions: beam positions in voxel coordinates with the shape (n, 3)
+        :param weights: relative energies of the beams
+        :param direction: normalised direction of all beams
+        :param reduced_attenuation_mm: reduced total attenuation coefficient in units of 1/mm
+        :param spacing: voxel spacing in mm
+        :return: collimated fluence in units of 1/mm^2 for a total source energy of 1
+        """
+        shape = np.asarray(np.shape(reduced_attenuation_mm))
+        bounded_axes = [axis for axis in range(3) if shape[axis] > 1]
+
+        # find the part of every beam that is within the volume (slab method)
+        t_entry = np.zeros(len(positions))
+        t_exit = np.full(len(positions), np.inf)
+        for axis in bounded_axes:
+            if direction[axis] == 0:
+                outside = (positions[:, axis] < 0) | (positions[:, axis] >= shape[axis])
+                t_exit[outside] = -np.inf
+                continue
+            t_lower = (0 - positions[:, axis]) / direction[axis]
+            t_upper = (shape[axis] - positions[:, axis]) / direction[axis]
+            t_entry = np.maximum(t_entry, np.minimum(t_lower, t_upper))
+            t_exit = np.minimum(t_exit, np.maximum(t_lower, t_upper))
+        if len(bounded_axes) == 0:
+            t_exit[:] = 1
+
+        step = 0.5
+        number_of_steps = np.where(t_exit > t_entry, np.ceil((t_exit - t_entry) / step), 0).astype(int)
+        optical_depth = np.zeros(len(positions))
+        flat_attenuation = reduced_attenuation_mm.reshape(-1)
+        deposited_indices = list()
+        deposited_values = list()
+        for step_index in range(int(np.max(number_of_steps, initial=0))):
+            active = step_index < number_of_steps
+            t = t_entry[active] + (step_index + 0.5) * step
+            sample_positions = positions[active] + t[:, np.newaxis] * direction[np.newaxis, :]
+            voxel_indices = np.floor(sample_positions).astype(int)
+            for axis in range(3):
+                np.clip(voxel_indices[:, axis], 0, shape[axis] - 1, out=voxel_indices[:, axis])
+            flat_indices = np.ravel_multi_index(voxel_indices.T, shape)
+            step_attenuation = flat_attenuation[flat_indices] * step * spacing
+            # the fluence of a voxel is the path length of the light within the voxel divided by its volume
+            deposited_indices.append(flat_indices)
+            deposited_values.append(weights[active] * np.exp(-(optical_depth[active] + step_attenuation / 2)) *
+                                    step * spacing / spacing ** 3)
+            optical_depth[active] += step_attenuation
+
+        if len(deposited_indices) == 0:
+            return np.zeros(shape)
+        collimated_fluence = np.bincount(np.concatenate(deposited_indices), weights=np.concatenate(deposited_values),
+                                         minlength=int(np.prod(shape)))
+        return collimated_fluence.reshape(shape)
+
+    def solve_diffusion_equation(self,
+                                 absorption_mm: np.ndarray,
+                                 reduced_attenuation_mm: np.ndarray,
+                                 source: np.ndarray,
+                                 spacing: float,
+                                 initial_guess: np.ndarray = None) -> np.ndarray:
+        """
+        solves the steady-state diffusion equation with a cell-centred finite volume scheme. The diffusion
+        coefficient between two voxels is the harmonic mean of their diffusion coefficients. Robin boundary
+        conditions without refractive index mismatch are applied at all faces of the volume, except for dimensions
+        with a size of one voxel, which are treated as translation invariant.
+
+        :param absorption_mm: absorption coefficient in units of 1/mm
+        :param reduced_attenuation_mm: reduced total attenuation coefficient in units of 1/mm
+        :param source: isotropic source term in units of 1/mm^3
+        :param spacing: voxel spacing in mm
+        :param initial_guess: optional diffuse fluence in units of 1/mm^2 from which the solver starts
+        :return: diffuse fluence in units of 1/mm^2
+        """
+        shape = np.shape(absorption_mm)
+        number_of_voxels = int(np.prod(shape))
+        diffusion_coefficient = 1 / (3 * reduced_attenuation_mm)
+        voxel_indices = np.arange(number_of_voxels).reshape(shape)
+        # the extrapolation length factor for matched refractive indices
+        boundary_factor = 1
+
+        diagonal = absorption_mm.astype(np.float64).reshape(-1).copy()
+        rows, columns, values = list(), list(), list()
+        for axis in range(len(shape)):
+            if shape[axis] == 1:
+                continue
+            lower = [slice(None)] * len(shape)
+            upper = [slice(None)] * len(shape)
+            lower[axis] = slice(0, -1)
+            upper[axis] = slice(1, None)
+            lower, upper = tuple(lower), tuple(upper)
+
+            coefficient_lower = diffusion_coefficient[lower]
+            coefficient_upper = diffusion_coefficient[upper]
+            face_coupling = (2 * coefficient_lower * coefficient_upper /
+                             (coefficient_lower + coefficient_upper) / spacing ** 2).reshape(-1)
+            indices_lower = voxel_indices[lower].reshape(-1)
+            indices_upper = voxel_indices[upper].reshape(-1)
+            np.add.at(diagonal, indices_lower, face_coupling)
+            np.add.at(diagonal, indices_upper, face_coupling)
+            rows.extend([indices_lower, indices_upper])
+            columns.extend([indices_upper, indices_lower])
+            values.extend([-face_coupling, -face_coupling])
+
+            for boundary in [0, shape[axis] - 1]:
+                boundary_slice = [slice(None)] * len(shape)
+                boundary_slice[axis] = boundary
+                boundary_slice = tuple(boundary_slice)
+                boundary_coupling = 1 / (spacing / (2 * diffusion_coefficient[boundary_slice]) +
+                                         2 * boundary_factor) / spacing
+                np.add.at(diagonal, voxel_indices[boundary_slice].reshape(-1), boundary_coupling.reshape(-1))
+
+        rows.append(np.arange(number_of_voxels))
+        columns.append(np.arange(number_of_voxels))
+        values.append(diagonal)
+        system_matrix = coo_matrix((np.concatenate(values), (np.concatenate(rows), np.concatenate(columns))),
+                                   shape=(number_of_voxels, number_of_voxels)).tocsr()
+
+        preconditioner = LinearOperator(system_matrix.shape, matvec=lambda x: x / diagonal)
+
+        number_of_iterations = [0]
+
+        def count_iterations(_):
+            number_of_iterations[0] += 1
+
+        right_hand_side = source.reshape(-1)
+        x0 = None if initial_guess is None else np.asarray(initial_guess, dtype=np.float64).reshape(-1)
+        try:
+            fluence, info = cg(system_matrix, right_hand_side, x0=x0, rtol=self.solver_tolerance, atol=0,
+                               maxiter=self.solver_max_iterations, M=preconditioner, callback=count_iterations)
+        except TypeError:
+            # scipy versions before 1.12 call the relative tolerance tol
+            fluence, info = cg(system_matrix, right_hand_side, x0=x0, tol=self.solver_tolerance, atol=0,
+                               maxiter=self.solver_max_iterations, M=preconditioner, callback=count_iterations)
+        self.number_of_solver_iterations = number_of_iterations[0]
+        if info > 0:
+            self.logger.warning(f"The diffusion solver did not converge to a relative tolerance of "
+                                f"{self.solver_tolerance} within {info} iterations.")
+        else:
+            self.logger.debug(f"The diffusion solver converged after {number_of_iterations[0]} iterations.")
+        return fluence.reshape(shape)
@@ -3,14 +3,14 @@
 # SPDX-License-Identifier: MIT
 
 import numpy as np
-import struct
 import subprocess
 from simpa.utils import Tags, Settings
 from simpa.core.simulation_modules.optical_simulation_module import OpticalForwardModuleBase
 from simpa.core.device_digital_twins.illumination_geometries.illumination_geometry_base import IlluminationGeometryBase
 import json
 import os
-import gc
+import shutil
+import tempfile
 from typing import List, Dict, Tuple
 
 
@@ -38,6 +38,7 @@ class MCXAdapter(OpticalForwardModuleBase):
         self.mcx_volumetric_data_file = None
         self.frames = None
         self.mcx_output_suffixes = {'mcx_volumetric_data_file': '.mc2'}
+        self.workspace = None
 
     def forward_model(self,
                       absorption_cm: np.ndarray,
@@ -62,28 +63,53 @@ class MCXAdapter(OpticalForwardModuleBase):
         else:
             _assumed_anisotropy = 0.9
 
-        self.generate_mcx_bin_input(absorption_cm=absorption_cm,
-                                    scattering_cm=scattering_cm,
-                                    anisotropy=anisotropy,
-                                    assumed_anisotropy=_assumed_anisotropy)
-
-        settings_dict = self.get_mcx_settings(illumination_geometry=illumination_geometry,
-                                              assumed_anisotropy=_assumed_anisotropy)
-
-        print(settings_dict)
-        self.generate_mcx_json_input(settings_dict=settings_dict)
-        # run the simulation
-        cmd = self.get_command()
-        self.run_mcx(cmd)
+        self.create_workspace()
+        try:
+            self.generate_mcx_bin_input(absorption_cm=absorption_cm,
+                                        scattering_cm=scattering_cm,
+                                        anisotropy=anisotropy,
+                                        assumed_anisotropy=_assumed_anisotropy)
+
+            settings_dict = self.get_mcx_settings(illumination_geometry=illumination_geometry,
+                                                  assumed_anisotropy=_assumed_anisotropy)
+
+            print(settings_dict)
+            self.generate_mcx_json_input(settings_dict=settings_dict)
+            # run the simulation
+            cmd = self.get_command()
+            self.run_mcx(cmd)
+
+            # Read output
+            results = self.read_mcx_output()
+        finally:
+            # clean temporary files
+            self.remove_mcx_output()
+        return results
 
-        # Read output
-        results = self.read_mcx_output()
+    def create_workspace(self) -> str:
+        """
+        creates a uniquely named directory for the temporary files of a single MCX simulation in
+        Tags.OPTICAL_MODEL_SCRATCH_PATH (default: Tags.SIMULATION_PATH), such that simulations with the same volume
+        name can run at the same time. The directory is removed by `self.remove_mcx_output`.
 
-        struct._clearcache()
+        :return: path of the workspace
+        """
+        if Tags.OPTICAL_MODEL_SCRATCH_PATH in self.component_settings:
+            scratch_path = self.component_settings[Tags.OPTICAL_MODEL_SCRATCH_PATH]
+        else:
+            scratch_path = self.global_settings[Tags.SIMULATION_PATH]
+        os.makedirs(scratch_path, exist_ok=True)
+        self.workspace = tempfile.mkdtemp(prefix=self.global_settings[Tags.VOLUME_NAME] + "_", dir=scratch_path)
+        return self.workspace
 
-        # clean temporary files
-        self.remove_mcx_output()
-        return results
+    def get_temporary_file_path(self, suffix: str) -> str:
+        """
+        :param suffix: suffix of the temporary file, e.g. `.bin`
+        :return: path of a temporary file in the workspace of the current simulation, or in Tags.SIMULATION_PATH if
+            there is no workspace.
+        """
+        directory = self.workspace if self.workspace is not None else self.global_settings[Tags.SIMULATION_PATH]
+        return directory + "/" + self.global_settings[Tags.VOLUME_NAME] + suffix
 
     def generate_mcx_json_input(self, settings_dict: Dict) -> None:
         """
@@ -92,8 +118,7 @@ class MCXAdapter(OpticalForwardModuleBase):
         :param settings_dict: dictionary to be saved as .json
         :return: None
         """
-        tmp_json_filename = self.global_settings[Tags.SIMULATION_PATH] + "/" + \
-                            self.global_settings[Tags.VOLUME_NAME] + ".json"
+        tmp_json_filename = self.get_temporary_file_path(".json")
         self.mcx_json_config_file = tmp_json_filename
         self.temporary_output_files.append(tmp_json_filename)
         with open(tmp_json_filename, "w") as json_file:
@@ -112,8 +137,7 @@ class MCXAdapter(OpticalForwardModuleBase):
         :param kwargs: dummy, used for class inheritance
         :return: dictionary with settings to be used by MCX
         """
-        mcx_volumetric_data_file = self.global_settings[Tags.SIMULATION_PATH] + "/" + \
-                                   self.global_settings[Tags.VOLUME_NAME] + "_output"
+        mcx_volumetric_data_file = self.get_temporary_file_path("_output")
         for name, suffix in self.mcx_output_suffixes.items():
             self.__setattr__(name, mcx_volumetric_data_file + suffix)
             self.temporary_output_files.append(mcx_volumetric_data_file + suffix)
@@ -160,8 +184,7 @@ class MCXAdapter(OpticalForwardModuleBase):
                 ],
                 "MediaFormat": "muamus_float",
                 "Dim": [self.nx, self.ny, self.nz],
-                "VolumeFile": self.global_settings[Tags.SIMULATION_PATH] + "/" +
-                              self.global_settings[Tags.VOLUME_NAME] + ".bin"
+                "VolumeFile": self.get_temporary_file_path(".bin")
             }}
         if Tags.MCX_SEED not in self.component_settings:
             if Tags.RANDOM_SEED in self.global_settings:
@@ -217,27 +240,19 @@ class MCXAdapter(OpticalForwardModuleBase):
                                                                    'scattering_cm': scattering_cm,
                                                                    'anisotropy': anisotropy,
                                                                    'assumed_anisotropy': assumed_anisotropy})
-        op_array = np.asarray([absorption_mm, scattering_mm])
+        [self.nx, self.ny, self.nz] = np.shape(absorption_mm)
 
-        [_, self.nx, self.ny, self.nz] = np.shape(op_array)
+        # MCX expects the absorption and scattering of every voxel next to each other, i.e. the array
+        # [absorption_mm, scattering_mm] in Fortran order. The transposed view of a Fortran-ordered array is C-ordered,
+        # so the float32 buffer can be written to the file without creating any further copies.
+        op_array = np.empty((2, self.nx, self.ny, self.nz), dtype=np.float32, order="F")
+        op_array[0] = absorption_mm
+        op_array[1] = scattering_mm
+        del absorption_cm, absorption_mm, scattering_cm, scattering_mm
 
-        # create a binary of the volume
-
-        optical_properties_list = list(np.reshape(op_array, op_array.size, "F"))
-        del absorption_cm, absorption_mm, scattering_cm, scattering_mm, op_array
-        gc.collect()
-        mcx_input = struct.pack("f" * len(optical_properties_list), *optical_properties_list)
-        del optical_properties_list
-        gc.collect()
-        tmp_input_path = self.global_settings[Tags.SIMULATION_PATH] + "/" + \
-                         self.global_settings[Tags.VOLUME_NAME] + ".bin"
+        tmp_input_path = self.get_temporary_file_path(".bin")
         self.temporary_output_files.append(tmp_input_path)
-        with open(tmp_input_path, "wb") as input_file:
-            input_file.write(mcx_input)
-
-        del mcx_input, input_file
-        struct._clearcache()
-        gc.collect()
+        op_array.T.tofile(tmp_input_path)
 
     def read_mcx_output(self, **kwargs) -> Dict:
         """
@@ -246,26 +261,43 @@ class MCXAdapter(OpticalForwardModuleBase):
         :param kwargs: dummy, used for class inheritance compatibility
         :return: `Dict` instance containing the MCX output
         """
-        with open(self.mcx_volumetric_data_file, 'rb') as f:
-            data = f.read()
-        data = struct.unpack('%df' % (len(data) / 4), data)
-        fluence = np.asarray(data).reshape([self.nx, self.ny, self.nz, self.frames], order='F')
-        fluence *= 100  # Convert from J/mm^2 to J/cm^2
-        if np.shape(fluence)[3] == 1:
-            fluence = np.squeeze(fluence, 3)
+        data = self.read_mcx_volume()
+        # Convert from J/mm^2 to J/cm^2. The result is computed in double precision, as it is used by all further steps
+        fluence = np.multiply(data, 100, dtype=np.float64)
+        del data
         results = dict()
         results[Tags.DATA_FIELD_FLUENCE] = fluence
         return results
 
+    def read_mcx_volume(self) -> np.ndarray:
+        """
+        reads the binary (.mc2) volume written by MCX without any conversion. A volume with a single time frame is
+        returned with the shape (nx, ny, nz), otherwise with the shape (nx, ny, nz, frames).
+
+        :return: `np.ndarray` of type float32 in Fortran order
+        :raises FileNotFoundError: if MCX did not write the volume
+        """
+        if not os.path.isfile(self.mcx_volumetric_data_file):
+            raise FileNotFoundError(f"Could not find the MCX output {self.mcx_volumetric_data_file}")
+        data = np.fromfile(self.mcx_volumetric_data_file, dtype=np.float32)
+        data = data.reshape([self.nx, self.ny, self.nz, self.frames], order='F')
+        if np.shape(data)[3] == 1:
+            data = np.squeeze(data, 3)
+        return data
+
     def remove_mcx_output(self) -> None:
         """
-        deletes temporary MCX output files from the file system
+        deletes temporary MCX output files and the workspace of the simulation from the file system
 
         :return: None
         """
         for f in self.temporary_output_files:
             if os.path.isfile(f):
                 os.remove(f)
+        self.temporary_output_files = []
+        if self.workspace is not None:
+            shutil.rmtree(self.workspace, ignore_errors=True)
+            self.workspace = None
 
     def pre_process_volumes(self, **kwargs) -> Tuple:
         """
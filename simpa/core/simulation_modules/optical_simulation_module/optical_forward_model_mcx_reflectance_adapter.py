@@ -4,12 +4,11 @@ SPDX-FileCopyrightText: 2021 VISION Lab, Cancer Research UK Cambridge Institute
 SPDX-License-Identifier: MIT
 """
 import numpy as np
-import struct
-import jdata
 import os
 from typing import List, Tuple, Dict, Union
 
 from simpa.utils import Tags, Settings
+from simpa.io_handling.io_hdf5 import append_data_field
 from simpa.core.simulation_modules.optical_simulation_module.optical_forward_model_mcx_adapter import MCXAdapter
 from simpa.core.device_digital_twins import IlluminationGeometryBase, PhotoacousticDevice
 
@@ -29,8 +28,23 @@ class MCXAdapterReflectance(MCXAdapter):
         turbid media accelerated by graphics processing units."
         Optics express 17.22 (2009): 20178-20190.
 
+    MCX writes the fluence into a binary .mc2 volume and the detected photons into a binary .mch file, which are both
+    read without parsing. When the adapter runs as part of a simulation pipeline, the photon exit positions and
+    directions of every illumination are appended to the SIMPA output file as soon as the illumination is simulated,
+    such that the photons of all illuminations never have to be held in memory at the same time.
     """
 
+    # header of a block of detected photons in an .mch file, see MCXHistoryHeader in mcx_utils.h of MCX
+    MCH_HEADER = np.dtype([("magic", "S4"), ("version", "<u4"), ("maxmedia", "<u4"), ("detnum", "<u4"),
+                           ("colcount", "<u4"), ("totalphoton", "<u4"), ("detected", "<u4"), ("savedphoton", "<u4"),
+                           ("unitinmm", "<f4"), ("seedbyte", "<u4"), ("normalizer", "<f4"), ("respin", "<i4"),
+                           ("srcnum", "<u4"), ("savedetflag", "<u4"), ("totalsource", "<u4"), ("reserved", "<i4")])
+
+    # columns of a detected photon in the order in which MCX stores them, as (name, bit of the savedetflag, width)
+    # where a width of None stands for one column per medium
+    MCH_COLUMNS = [("detid", 1, 1), ("nscat", 2, None), ("ppath", 4, None), ("mom", 8, None), ("p", 16, 3),
+                   ("v", 32, 3), ("w0", 64, 1)]
+
     def __init__(self, global_settings: Settings):
         """
         initializes MCX-specific configuration and clean-up instances
@@ -40,8 +54,10 @@ class MCXAdapterReflectance(MCXAdapter):
         super(MCXAdapterReflectance, self).__init__(global_settings=global_settings)
         self.mcx_photon_data_file = None
         self.padded = None
-        self.mcx_output_suffixes = {'mcx_volumetric_data_file': '.jnii',
-                                    'mcx_photon_data_file': '_detp.jdat'}
+        self.mcx_output_suffixes = {'mcx_volumetric_data_file': '.mc2',
+                                    'mcx_photon_data_file': '.mch'}
+        # SIMPA output file into which the photon exit data is streamed, only set while `self.run` is running
+        self.photon_exit_data_file = None
 
     def forward_model(self,
                       absorption_cm: np.ndarray,
@@ -68,27 +84,28 @@ class MCXAdapterReflectance(MCXAdapter):
         else:
             _assumed_anisotropy = 0.9
 
-        self.generate_mcx_bin_input(absorption_cm=absorption_cm,
-                                    scattering_cm=scattering_cm,
-                                    anisotropy=_assumed_anisotropy,
-                                    assumed_anisotropy=_assumed_anisotropy)
+        self.create_workspace()
+        try:
+            self.generate_mcx_bin_input(absorption_cm=absorption_cm,
+                                        scattering_cm=scattering_cm,
+                                        anisotropy=_assumed_anisotropy,
+                                        assumed_anisotropy=_assumed_anisotropy)
 
-        settings_dict = self.get_mcx_settings(illumination_geometry=illumination_geometry,
-                                              assumed_anisotropy=_assumed_anisotropy,
-                                              )
+            settings_dict = self.get_mcx_settings(illumination_geometry=illumination_geometry,
+                                                  assumed_anisotropy=_assumed_anisotropy,
+                                                  )
 
-        print(settings_dict)
-        self.generate_mcx_json_input(settings_dict=settings_dict)
-        # run the simulation
-        cmd = self.get_command()
-        self.run_mcx(cmd)
+            print(settings_dict)
+            self.generate_mcx_json_input(settings_dict=settings_dict)
+            # run the simulation
+            cmd = self.get_command()
+            self.run_mcx(cmd)
 
-        # Read output
-        results = self.read_mcx_output()
-        struct._clearcache()
-
-        # clean temporary files
-        self.remove_mcx_output()
+            # Read output
+            results = self.read_mcx_output()
+        finally:
+            # clean temporary files
+            self.remove_mcx_output()
         return results
 
     def get_command(self) -> List:
@@ -103,18 +120,14 @@ class MCXAdapterReflectance(MCXAdapter):
         cmd.append(self.mcx_json_config_file)
         cmd.append("-O")
         cmd.append("F")
-        cmd.append("-F")
-        cmd.append("jnii")
-        if Tags.COMPUTE_PHOTON_DIRECTION_AT_EXIT in self.component_settings and \
-                self.component_settings[Tags.COMPUTE_PHOTON_DIRECTION_AT_EXIT]:
+        if self.computes_photon_exit_data():
             cmd.append("-H")
             cmd.append(f"{int(self.component_settings[Tags.OPTICAL_MODEL_NUMBER_PHOTONS])}")
             cmd.append("--bc")  # save photon exit position and direction
             cmd.append("______000010")
             cmd.append("--savedetflag")
             cmd.append("XV")
-        if Tags.COMPUTE_DIFFUSE_REFLECTANCE in self.component_settings and \
-                self.component_settings[Tags.COMPUTE_DIFFUSE_REFLECTANCE]:
+        if self.computes_diffuse_reflectance():
             cmd.append("--saveref")  # save diffuse reflectance at 0 filled voxels outside of domain
         return cmd
 
@@ -126,48 +139,108 @@ class MCXAdapterReflectance(MCXAdapter):
         :return: `Settings` instance containing the MCX output
         """
         results = dict()
-        if os.path.isfile(self.mcx_volumetric_data_file) and self.mcx_volumetric_data_file.endswith(
-                self.mcx_output_suffixes['mcx_volumetric_data_file']):
-            content = jdata.load(self.mcx_volumetric_data_file)
-            fluence = content['NIFTIData']
-            ref, ref_pos, fluence = self.extract_reflectance_from_fluence(fluence=fluence)
-            fluence = self.post_process_volumes(**{'arrays': (fluence,)})[0]
-            fluence *= 100  # Convert from J/mm^2 to J/cm^2
-            results[Tags.DATA_FIELD_FLUENCE] = fluence
-        else:
-            raise FileNotFoundError(f"Could not find .jnii file for {self.mcx_volumetric_data_file}")
-        if Tags.COMPUTE_DIFFUSE_REFLECTANCE in self.component_settings and \
-                self.component_settings[Tags.COMPUTE_DIFFUSE_REFLECTANCE]:
+        ref, ref_pos, fluence = self.extract_reflectance_from_fluence(fluence=self.read_mcx_volume())
+        fluence = self.post_process_volumes(**{'arrays': (fluence,)})[0]
+        # Convert from J/mm^2 to J/cm^2. The result is computed in double precision, as it is used by all further steps
+        results[Tags.DATA_FIELD_FLUENCE] = np.multiply(fluence, 100, dtype=np.float64)
+        del fluence
+        if self.computes_diffuse_reflectance():
             results[Tags.DATA_FIELD_DIFFUSE_REFLECTANCE] = ref
             results[Tags.DATA_FIELD_DIFFUSE_REFLECTANCE_POS] = ref_pos
-        if Tags.COMPUTE_PHOTON_DIRECTION_AT_EXIT in self.component_settings and \
-                self.component_settings[Tags.COMPUTE_PHOTON_DIRECTION_AT_EXIT]:
-            content = jdata.load(self.mcx_photon_data_file)
-            photon_pos = content['MCXData']['PhotonData']['p']
-            photon_dir = content['MCXData']['PhotonData']['v']
+        if self.computes_photon_exit_data():
+            photon_pos, photon_dir = self.read_mcx_photon_data()
             results[Tags.DATA_FIELD_PHOTON_EXIT_POS] = photon_pos
             results[Tags.DATA_FIELD_PHOTON_EXIT_DIR] = photon_dir
         return results
 
+    def read_mcx_photon_data(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        reads the exit positions and directions of the detected photons from the binary .mch file written by MCX.
+        The file consists of one or more blocks, each made up of a header and a float32 record per photon.
+
+        :return: tuple of the photon exit positions and directions, each of shape (number of photons, 3)
+        :raises FileNotFoundError: if MCX did not write the file
+        :raises ValueError: if the file is not an .mch file or does not contain the exit positions and directions
+        """
+        if not os.path.isfile(self.mcx_photon_data_file):
+            raise FileNotFoundError(f"Could not find the MCX output {self.mcx_photon_data_file}")
+        positions = []
+        directions = []
+        with open(self.mcx_photon_data_file, "rb") as photon_data_file:
+            while True:
+                header = np.fromfile(photon_data_file, dtype=self.MCH_HEADER, count=1)
+                if len(header) == 0:
+                    break
+                header = header[0]
+                if header["magic"] != b"MCXH":
+                    raise ValueError(f"{self.mcx_photon_data_file} is not an MCX photon history (.mch) file")
+                columns = self.get_mch_columns(int(header["savedetflag"]), int(header["maxmedia"]))
+                if "p" not in columns or "v" not in columns:
+                    raise ValueError(f"{self.mcx_photon_data_file} does not contain the photon exit positions and "
+                                     f"directions, MCX has to be run with --savedetflag XV")
+                number_of_photons = int(header["savedphoton"])
+                number_of_columns = int(header["colcount"])
+                data = np.fromfile(photon_data_file, dtype="<f4", count=number_of_photons * number_of_columns)
+                data = data.reshape((number_of_photons, number_of_columns))
+                positions.append(data[:, columns["p"]])
+                directions.append(data[:, columns["v"]])
+                # skip the random number generator seeds of the photons, which are saved for replays
+                photon_data_file.seek(int(header["seedbyte"]) * number_of_photons, os.SEEK_CUR)
+        if len(positions) == 0:
+            raise ValueError(f"{self.mcx_photon_data_file} does not contain any photon data")
+        if len(positions) == 1:
+            return positions[0], directions[0]
+        return np.concatenate(positions, axis=0), np.concatenate(directions, axis=0)
+
+    @classmethod
+    def get_mch_columns(cls, savedetflag: int, maxmedia: int) -> Dict:
+        """
+        :param savedetflag: bit mask of the photon data saved by MCX, see `--savedetflag`
+        :param maxmedia: number of media of the simulation
+        :return: dictionary with the column slice of every saved photon property
+        """
+        columns = dict()
+        start = 0
+        for name, bit, width in cls.MCH_COLUMNS:
+            if savedetflag & bit:
+                width = maxmedia if width is None else width
+                columns[name] = slice(start, start + width)
+                start += width
+        return columns
+
+    def computes_diffuse_reflectance(self) -> bool:
+        """
+        :return: True if the diffuse reflectance is computed (Tags.COMPUTE_DIFFUSE_REFLECTANCE)
+        """
+        return bool(Tags.COMPUTE_DIFFUSE_REFLECTANCE in self.component_settings and
+                    self.component_settings[Tags.COMPUTE_DIFFUSE_REFLECTANCE])
+
+    def computes_photon_exit_data(self) -> bool:
+        """
+        :return: True if the photon exit positions and directions are computed (Tags.COMPUTE_PHOTON_DIRECTION_AT_EXIT)
+        """
+        return bool(Tags.COMPUTE_PHOTON_DIRECTION_AT_EXIT in self.component_settings and
+                    self.component_settings[Tags.COMPUTE_PHOTON_DIRECTION_AT_EXIT])
+
     @staticmethod
     def extract_reflectance_from_fluence(fluence: np.ndarray) -> Tuple:
         """
         extracts diffuse reflectance from volumes. MCX stores diffuse reflectance as negative values in the fluence
         volume. The position where the reflectance is stored is also returned. If there are no negative values in the
         fluence, `None` is returned instead of reflectance and reflectance position. Negative values in fluence are
-        set to `0` after extraction of the reflectance.
+        set to `0` after extraction of the reflectance. The volume is only compared once, all further steps only
+        access the voxels with negative values.
 
         :param fluence: array containing fluence as generated by MCX
         :return: tuple of reflectance, reflectance position and transformed fluence
         """
-        if np.any(fluence < 0):
-            pos = np.where(fluence < 0)
-            ref = fluence[pos] * -1
-            pos = np.array(pos).T  # reformatting to aggregate results after for multi illuminant geometries
-            fluence[fluence < 0] = 0
-            return ref, pos, fluence
-        else:
+        pos = np.nonzero(fluence < 0)
+        if len(pos[0]) == 0:
             return None, None, fluence
+        ref = fluence[pos] * -1
+        fluence[pos] = 0
+        pos = np.array(pos).T  # reformatting to aggregate results after for multi illuminant geometries
+        return ref, pos, fluence
 
     def pre_process_volumes(self, **kwargs) -> Tuple:
         """
@@ -181,10 +254,7 @@ class MCXAdapterReflectance(MCXAdapter):
         """
         arrays = self.volumes_to_mm(**kwargs)
         assert np.all([len(a.shape) == 3] for a in arrays)
-        check_padding = (Tags.COMPUTE_DIFFUSE_REFLECTANCE in self.component_settings and
-                         self.component_settings[Tags.COMPUTE_DIFFUSE_REFLECTANCE]) or \
-                        (Tags.COMPUTE_PHOTON_DIRECTION_AT_EXIT in self.component_settings and
-                         self.component_settings[Tags.COMPUTE_PHOTON_DIRECTION_AT_EXIT])
+        check_padding = self.computes_diffuse_reflectance() or self.computes_photon_exit_data()
         # check that all volumes on first layer along z have only 0 values
         if np.any([np.any(a[:, :, 0] != 0)] for a in arrays) and check_padding:
             results = tuple(np.pad(a, ((0, 0), (0, 0), (1, 0)), "constant", constant_values=0) for a in arrays)
@@ -236,44 +306,29 @@ class MCXAdapterReflectance(MCXAdapter):
         reflectance_position = []
         photon_position = []
         photon_direction = []
-        if isinstance(_device, list):
-            # per convention this list has at least two elements
-            results = self.forward_model(absorption_cm=absorption,
-                                         scattering_cm=scattering,
-                                         anisotropy=anisotropy,
-                                         illumination_geometry=_device[0])
+        # per convention a list of illumination geometries has at least two elements
+        illumination_geometries = _device if isinstance(_device, list) else [_device]
+        fluence = None
+        for index, results in enumerate(self.iterate_forward_models(illumination_geometries, absorption, scattering,
+                                                                    anisotropy)):
+            if self.photon_exit_data_file is not None and Tags.DATA_FIELD_PHOTON_EXIT_POS in results:
+                # the first illumination replaces the photons of a previous simulation of this wavelength
+                for data_field in [Tags.DATA_FIELD_PHOTON_EXIT_POS, Tags.DATA_FIELD_PHOTON_EXIT_DIR]:
+                    append_data_field(results.pop(data_field), self.photon_exit_data_file, data_field,
+                                      self.global_settings[Tags.WAVELENGTH], replace=index == 0)
             self._append_results(results=results,
                                  reflectance=reflectance,
                                  reflectance_position=reflectance_position,
                                  photon_position=photon_position,
                                  photon_direction=photon_direction)
-            fluence = results[Tags.DATA_FIELD_FLUENCE]
-            for idx in range(1, len(_device)):
-                # we already looked at the 0th element, so go from 1 to n-1
-                results = self.forward_model(absorption_cm=absorption,
-                                             scattering_cm=scattering,
-                                             anisotropy=anisotropy,
-                                             illumination_geometry=_device[idx])
-                self._append_results(results=results,
-                                     reflectance=reflectance,
-                                     reflectance_position=reflectance_position,
-                                     photon_position=photon_position,
-                                     photon_direction=photon_direction)
+            if fluence is None:
+                fluence = results[Tags.DATA_FIELD_FLUENCE]
+            else:
                 fluence += results[Tags.DATA_FIELD_FLUENCE]
 
+        if isinstance(_device, list):
             fluence = fluence / len(_device)
 
-        else:
-            results = self.forward_model(absorption_cm=absorption,
-                                         scattering_cm=scattering,
-                                         anisotropy=anisotropy,
-                                         illumination_geometry=_device)
-            self._append_results(results=results,
-                                 reflectance=reflectance,
-                                 reflectance_position=reflectance_position,
-                                 photon_position=photon_position,
-                                 photon_direction=photon_direction)
-            fluence = results[Tags.DATA_FIELD_FLUENCE]
         aggregated_results = dict()
         aggregated_results[Tags.DATA_FIELD_FLUENCE] = fluence
         if reflectance:
@@ -284,6 +339,21 @@ class MCXAdapterReflectance(MCXAdapter):
             aggregated_results[Tags.DATA_FIELD_PHOTON_EXIT_DIR] = np.concatenate(photon_direction, axis=0)
         return aggregated_results
 
+    def run(self, device: Union[IlluminationGeometryBase, PhotoacousticDevice]) -> None:
+        """
+        runs the optical simulations as described in `OpticalForwardModuleBase.run`. If the photon exit positions and
+        directions are computed, they are written into the SIMPA output file illumination by illumination.
+
+        :param device: Illumination or Photoacoustic device that defines the illumination geometry
+        :return: None
+        """
+        if self.computes_photon_exit_data():
+            self.photon_exit_data_file = self.global_settings[Tags.SIMPA_OUTPUT_PATH]
+        try:
+            super(MCXAdapterReflectance, self).run(device)
+        finally:
+            self.photon_exit_data_file = None
+
     @staticmethod
     def _append_results(results,
                         reflectance,
@@ -13,7 +13,7 @@ from simpa.io_handling.io_hdf5 import save_hdf5
 import numpy as np
 from simpa.utils import Settings
 from simpa.core.simulation_modules.reconstruction_module.reconstruction_utils import bandpass_filter_with_settings, apply_b_mode
-from simpa.utils.quality_assurance.data_sanity_testing import assert_array_well_defined
+from simpa.utils.quality_assurance.data_sanity_testing import assert_array_well_defined, get_qa_assertion_sample_size
 
 
 class ReconstructionAdapterBase(SimulationModule):
@@ -39,19 +39,56 @@ class ReconstructionAdapterBase(SimulationModule):
         """
         pass
 
-    def run(self, device):
-        self.logger.info("Performing reconstruction...")
+    def reconstruction_algorithm_batch(self, time_series_sensor_data: np.ndarray,
+                                       detection_geometry: DetectionGeometryBase) -> np.ndarray:
+        """
+        Reconstructs a batch of frames of shape (batch, sensor elements, time steps) that were recorded with the same
+        detection geometry. By default, the frames are reconstructed one after another with
+        `reconstruction_algorithm`. Deriving classes that can share the computations between frames override this
+        method.
 
-        time_series_sensor_data = load_data_field(self.global_settings[Tags.SIMPA_OUTPUT_PATH],
-                                                  Tags.DATA_FIELD_TIME_SERIES_DATA, self.global_settings[Tags.WAVELENGTH])
+        :param time_series_sensor_data: the time series sensor data of all frames
+        :param detection_geometry:
+        :return: the reconstructed photoacoustic images of shape (batch, ...)
+        """
+        return np.stack([self.reconstruction_algorithm(frame, detection_geometry)
+                         for frame in time_series_sensor_data])
 
-        _device = None
-        if isinstance(device, DetectionGeometryBase):
-            _device = device
-        elif isinstance(device, PhotoacousticDevice):
-            _device = device.get_detection_geometry()
-        else:
-            raise TypeError(f"Type {type(device)} is not supported for performing image reconstruction.")
+    def reconstruct_batch(self, time_series_sensor_data: np.ndarray,
+                          detection_geometry: DetectionGeometryBase) -> np.ndarray:
+        """
+        Reconstructs a single frame of shape (sensor elements, time steps), a batch of frames of shape
+        (batch, sensor elements, time steps) or IPASC-style time series data of shape
+        (sensor elements, time steps, wavelengths, frames).
+
+        :param time_series_sensor_data: the time series sensor data
+        :param detection_geometry:
+        :return: the reconstructed image, or the reconstructed images of shape (batch, ...) or
+            (wavelengths, frames, ...) respectively
+        """
+        if time_series_sensor_data.ndim == 2:
+            return self.reconstruction_algorithm(time_series_sensor_data, detection_geometry)
+        if time_series_sensor_data.ndim == 3:
+            return self.reconstruction_algorithm_batch(time_series_sensor_data, detection_geometry)
+        if time_series_sensor_data.ndim == 4:
+            n_sensor_elements, n_time_steps, n_wavelengths, n_frames = time_series_sensor_data.shape
+            batch = np.moveaxis(time_series_sensor_data, (2, 3), (0, 1)).reshape(-1, n_sensor_elements, n_time_steps)
+            reconstruction = self.reconstruction_algorithm_batch(np.ascontiguousarray(batch), detection_geometry)
+            return reconstruction.reshape((n_wavelengths, n_frames) + reconstruction.shape[1:])
+        raise ValueError(f"Time series data with {time_series_sensor_data.ndim} dimensions can not be reconstructed, "
+                         f"it must have 2 (single frame), 3 (batch of frames) or 4 (IPASC) dimensions.")
+
+    def reconstruct(self, time_series_sensor_data: np.ndarray, detection_geometry: DetectionGeometryBase) -> np.ndarray:
+        """
+        Reconstructs a single frame of shape (sensor elements, time steps) or a batch of frames of shape
+        (batch, sensor elements, time steps), including the bandpass filtering and B-mode processing that is
+        specified in the component settings.
+
+        :param time_series_sensor_data: the time series sensor data
+        :param detection_geometry:
+        :return: the reconstructed image or the batch of reconstructed images
+        """
+        batched = time_series_sensor_data.ndim == 3
 
         if Tags.RECONSTRUCTION_PERFORM_BANDPASS_FILTERING in self.component_settings and \
                 self.component_settings[Tags.RECONSTRUCTION_PERFORM_BANDPASS_FILTERING]:
@@ -59,26 +96,52 @@ class ReconstructionAdapterBase(SimulationModule):
             time_series_sensor_data = bandpass_filter_with_settings(time_series_sensor_data,
                                                                        self.global_settings,
                                                                        self.component_settings,
-                                                                       _device)
-            
+                                                                       detection_geometry)
+
         # check for B-mode methods and perform envelope detection on time series data if specified
         if Tags.RECONSTRUCTION_BMODE_BEFORE_RECONSTRUCTION in self.component_settings \
                 and self.component_settings[Tags.RECONSTRUCTION_BMODE_BEFORE_RECONSTRUCTION] \
                 and Tags.RECONSTRUCTION_BMODE_METHOD in self.component_settings:
-            time_series_sensor_data = apply_b_mode(
-                time_series_sensor_data, method=self.component_settings[Tags.RECONSTRUCTION_BMODE_METHOD])
+            time_series_sensor_data = self.apply_b_mode_to_frames(time_series_sensor_data, batched)
 
-        reconstruction = self.reconstruction_algorithm(time_series_sensor_data, _device)
+        reconstruction = self.reconstruct_batch(time_series_sensor_data, detection_geometry)
 
         # check for B-mode methods and perform envelope detection on time series data if specified
         if Tags.RECONSTRUCTION_BMODE_AFTER_RECONSTRUCTION in self.component_settings \
                 and self.component_settings[Tags.RECONSTRUCTION_BMODE_AFTER_RECONSTRUCTION] \
                 and Tags.RECONSTRUCTION_BMODE_METHOD in self.component_settings:
-            reconstruction = apply_b_mode(
-                reconstruction, method=self.component_settings[Tags.RECONSTRUCTION_BMODE_METHOD])
+            reconstruction = self.apply_b_mode_to_frames(reconstruction, batched)
 
         if not (Tags.IGNORE_QA_ASSERTIONS in self.global_settings and Tags.IGNORE_QA_ASSERTIONS):
-            assert_array_well_defined(reconstruction, array_name="reconstruction")
+            assert_array_well_defined(reconstruction, array_name="reconstruction",
+                                      sample_size=get_qa_assertion_sample_size(self.global_settings))
+
+        return reconstruction
+
+    def apply_b_mode_to_frames(self, data: np.ndarray, batched: bool) -> np.ndarray:
+        """
+        Applies the B-mode method of the component settings to a single frame or to every frame of a batch.
+        """
+        method = self.component_settings[Tags.RECONSTRUCTION_BMODE_METHOD]
+        if not batched:
+            return apply_b_mode(data, method=method)
+        return np.stack([apply_b_mode(frame, method=method) for frame in data])
+
+    def get_detection_geometry(self, device) -> DetectionGeometryBase:
+        if isinstance(device, DetectionGeometryBase):
+            return device
+        elif isinstance(device, PhotoacousticDevice):
+            return device.get_detection_geometry()
+        else:
+            raise TypeError(f"Type {type(device)} is not supported for performing image reconstruction.")
+
+    def run(self, device):
+        self.logger.info("Performing reconstruction...")
+
+        time_series_sensor_data = load_data_field(self.global_settings[Tags.SIMPA_OUTPUT_PATH],
+                                                  Tags.DATA_FIELD_TIME_SERIES_DATA, self.global_settings[Tags.WAVELENGTH])
+
+        reconstruction = self.reconstruct(time_series_sensor_data, self.get_detection_geometry(device))
 
         reconstruction_output_path = generate_dict_path(
             Tags.DATA_FIELD_RECONSTRUCTED_DATA, self.global_settings[Tags.WAVELENGTH])
@@ -88,6 +151,34 @@ class ReconstructionAdapterBase(SimulationModule):
 
         self.logger.info("Performing reconstruction...[Done]")
 
+    def run_batch(self, device, wavelengths: list = None):
+        """
+        Reconstructs the time series data of several wavelengths of a simulation at once. The time series data of
+        all wavelengths is reconstructed as one batch, such that the setup of the reconstruction (e.g. the delays of
+        the delay and sum based algorithms) is shared between the wavelengths, and all reconstructions are written
+        into the SIMPA output file in one pass.
+
+        :param device: the photoacoustic device or detection geometry that recorded the time series data
+        :param wavelengths: the wavelengths to reconstruct (default: Tags.WAVELENGTHS of the global settings)
+        """
+        if wavelengths is None:
+            wavelengths = self.global_settings[Tags.WAVELENGTHS]
+        self.logger.info(f"Performing reconstruction of {len(wavelengths)} wavelengths...")
+
+        time_series_sensor_data = np.stack([load_data_field(self.global_settings[Tags.SIMPA_OUTPUT_PATH],
+                                                            Tags.DATA_FIELD_TIME_SERIES_DATA, wavelength)
+                                            for wavelength in wavelengths])
+
+        reconstructions = self.reconstruct(time_series_sensor_data, self.get_detection_geometry(device))
+
+        # the reconstructions of all wavelengths are stored next to each other in the parent group
+        reconstruction_output_path = generate_dict_path(Tags.DATA_FIELD_RECONSTRUCTED_DATA,
+                                                        wavelengths[0]).rstrip("/").rsplit("/", 1)[0] + "/"
+        save_hdf5({str(wavelength): reconstruction for wavelength, reconstruction in zip(wavelengths, reconstructions)},
+                  self.global_settings[Tags.SIMPA_OUTPUT_PATH], reconstruction_output_path)
+
+        self.logger.info(f"Performing reconstruction of {len(wavelengths)} wavelengths...[Done]")
+
 
 def create_reconstruction_settings(speed_of_sound_in_m_per_s: int = 1540, time_spacing_in_s: float = 2.5e-8,
                                    sensor_spacing_in_mm: float = 0.1,
@@ -7,8 +7,8 @@ from simpa.core.simulation_modules.reconstruction_module import ReconstructionAd
 from simpa.core.device_digital_twins import DetectionGeometryBase
 import numpy as np
 import torch
-from simpa.core.simulation_modules.reconstruction_module.reconstruction_utils import compute_delay_and_sum_values, \
-    preparing_reconstruction_and_obtaining_reconstruction_settings, compute_image_dimensions
+from simpa.core.simulation_modules.reconstruction_module.reconstruction_utils import compute_delay_multiply_and_sum, \
+    preparing_reconstruction_and_obtaining_reconstruction_settings, compute_image_dimensions, squeeze_reconstruction
 from simpa.core.simulation_modules.reconstruction_module import create_reconstruction_settings
 
 
@@ -20,6 +20,8 @@ class DelayMultiplyAndSumAdapter(ReconstructionAdapterBase):
         first dimension corresponds to the sensor elements and the second to the recorded time steps) with the given
         beamforming settings (dictionary).
         A reconstructed image (2D numpy array) is returned.
+        A batch of frames of shape (batch, sensor elements, time steps) that were recorded with the same detection
+        geometry is reconstructed at once and a batch of reconstructed images is returned.
         This implementation uses PyTorch Tensors to perform computations and is able to run on GPUs.
 
         [1] T. Kirchner et al. 2018, "Signed Real-Time Delay Multiply and Sum Beamforming for Multispectral
@@ -38,27 +40,23 @@ class DelayMultiplyAndSumAdapter(ReconstructionAdapterBase):
             sensor_positions[:, 1] = 0  # Assume imaging plane
 
         # construct output image
-        output = torch.zeros((xdim, ydim, zdim), dtype=torch.float32, device=torch_device)
-
-        values, n_sensor_elements = compute_delay_and_sum_values(time_series_sensor_data, sensor_positions, xdim,
-                                                                 ydim, zdim, xdim_start, xdim_end, ydim_start, ydim_end,
-                                                                 zdim_start, zdim_end, spacing_in_mm, speed_of_sound_in_m_per_s,
-                                                                 time_spacing_in_ms, self.logger, torch_device,
-                                                                 self.component_settings)
-
-        for x in range(xdim):
-            yy, zz, nn, mm = torch.meshgrid(torch.arange(ydim, device=torch_device),
-                                            torch.arange(zdim, device=torch_device),
-                                            torch.arange(n_sensor_elements, device=torch_device),
-                                            torch.arange(n_sensor_elements, device=torch_device))
-            M = values[x, yy, zz, nn] * values[x, yy, zz, mm]
-            M = torch.sign(M) * torch.sqrt(torch.abs(M))
-            # only take upper triangle without diagonal and sum up along n and m axis (last two)
-            output[x] = torch.triu(M, diagonal=1).sum(dim=(-1, -2))
-
+        output = torch.zeros(time_series_sensor_data.shape[:-2] + (xdim, ydim, zdim), dtype=torch.float32,
+                             device=torch_device)
+
+        DMAS, DAS = compute_delay_multiply_and_sum(time_series_sensor_data, sensor_positions, xdim, ydim, zdim,
+                                                   xdim_start, ydim_start, zdim_start, spacing_in_mm,
+                                                   speed_of_sound_in_m_per_s, time_spacing_in_ms, self.logger,
+                                                   torch_device, self.component_settings)
+        output[:] = DMAS
         reconstructed = output.cpu().numpy()
 
-        return reconstructed.squeeze()
+        return squeeze_reconstruction(reconstructed)
+
+    def reconstruction_algorithm_batch(self, time_series_sensor_data, detection_geometry: DetectionGeometryBase):
+        """
+        Reconstructs all frames of the batch at once, such that they share the delays and interpolation weights.
+        """
+        return self.reconstruction_algorithm(time_series_sensor_data, detection_geometry)
 
 
 def reconstruct_delay_multiply_and_sum_pytorch(time_series_sensor_data: np.ndarray,
@@ -71,17 +69,19 @@ def reconstruct_delay_multiply_and_sum_pytorch(time_series_sensor_data: np.ndarr
     """
     Convenience function for reconstructing time series data using Delay and Sum algorithm implemented in PyTorch
 
-    :param time_series_sensor_data: (2D numpy array) sensor data of shape (sensor elements, time steps)
+    :param time_series_sensor_data: (numpy array) sensor data of shape (sensor elements, time steps), a batch of
+        shape (batch, sensor elements, time steps) or IPASC-style data of shape
+        (sensor elements, time steps, wavelengths, frames)
     :param detection_geometry: The DetectioNGeometryBase to use for the reconstruction of the given time series data
     :param speed_of_sound_in_m_per_s: (int) speed of sound in medium in meters per second (default: 1540 m/s)
     :param time_spacing_in_s: (float) time between sampling points in seconds (default: 2.5e-8 s which is equal to 40 MHz)
     :param sensor_spacing_in_mm: (float) space between sensor elements in millimeters (default: 0.1 mm)
     :param recon_mode: SIMPA Tag defining the reconstruction mode - pressure default OR differential
     :param apodization: SIMPA Tag defining the apodization function (default box)
-    :return: (2D numpy array) reconstructed image as 2D numpy array
+    :return: (numpy array) reconstructed image, with the leading batch dimensions of the input for batches
     """
     # create settings
     settings = create_reconstruction_settings(speed_of_sound_in_m_per_s, time_spacing_in_s, sensor_spacing_in_mm,
                                               recon_mode, apodization)
     adapter = DelayMultiplyAndSumAdapter(settings)
-    return adapter.reconstruction_algorithm(time_series_sensor_data, detection_geometry)
+    return adapter.reconstruct_batch(time_series_sensor_data, detection_geometry)
@@ -0,0 +1,225 @@
+# SPDX-FileCopyrightText: 2021 Division of Intelligent Medical Systems, DKFZ
+# SPDX-FileCopyrightText: 2021 Janek Groehl
+# SPDX-License-Identifier: MIT
+
+from typing import List, Tuple
+import numpy as np
+import scipy.fft
+from scipy.interpolate import RegularGridInterpolator
+from simpa.utils import Tags
+from simpa.core.simulation_modules.reconstruction_module import ReconstructionAdapterBase, \
+    create_reconstruction_settings
+from simpa.core.simulation_modules.reconstruction_module.reconstruction_utils import compute_image_dimensions, \
+    compute_pixel_coordinates, preparing_reconstruction_and_obtaining_reconstruction_settings, squeeze_reconstruction
+from simpa.core.device_digital_twins import DetectionGeometryBase, LinearArrayDetectionGeometry, \
+    PlanarArrayDetectionGeometry
+
+
+class FourierDomainReconstructionAdapter(ReconstructionAdapterBase):
+    """
+    Fourier domain (k-space) reconstruction [1, 2] for linear and planar arrays, which maps the frequency spectrum of
+    the time series data onto the wavenumbers of the image (Stolt mapping) and needs O(N log N) operations instead of
+    the O(pixels x sensor elements) operations of the delay and sum based algorithms. The image is reconstructed
+    with the depth spacing c * dt and the lateral spacing of the sensor elements and interpolated onto the same
+    image grid that the delay and sum based algorithms use.
+    The sensor elements are assumed to be point like and to cover a (uniformly sampled) line or plane. Pixels
+    that are laterally outside of the array are set to zero.
+
+    [1] Koestli et al. 2001, "Temporal backward projection of optoacoustic pressure transients using Fourier
+    transform methods", https://doi.org/10.1088/0031-9155/46/7/309
+
+    [2] Treeby and Cox 2010, "k-Wave: MATLAB toolbox for the simulation and reconstruction of photoacoustic wave
+    fields", https://doi.org/10.1117/1.3360308
+    """
+
+    def reconstruction_algorithm(self, time_series_sensor_data, detection_geometry: DetectionGeometryBase):
+        """
+        Reconstructs the time series sensor data (2D numpy array where the first dimension corresponds to the sensor
+        elements and the second to the recorded time steps) of a linear or planar array.
+        A batch of frames of shape (batch, sensor elements, time steps) is reconstructed at once.
+
+        :return: the reconstructed image, or the batch of reconstructed images
+        """
+        time_series_sensor_data, sensor_positions, speed_of_sound_in_m_per_s, spacing_in_mm, time_spacing_in_ms, \
+            _ = preparing_reconstruction_and_obtaining_reconstruction_settings(
+                time_series_sensor_data, self.component_settings, self.global_settings, detection_geometry,
+                self.logger)
+        time_series_sensor_data = time_series_sensor_data.cpu().numpy()
+        sensor_positions = sensor_positions.cpu().numpy()
+
+        xdim, zdim, ydim, xdim_start, xdim_end, ydim_start, ydim_end, zdim_start, zdim_end = compute_image_dimensions(
+            detection_geometry, spacing_in_mm, self.logger)
+
+        time_series_sensor_data, lateral_positions_mm = arrange_time_series_on_sensor_grid(
+            time_series_sensor_data, sensor_positions, detection_geometry)
+        if len(lateral_positions_mm) == 1 and zdim > 1:
+            raise ValueError("A linear array can only reconstruct an image plane, the field of view must not extend "
+                             "in y direction.")
+
+        lateral_spacings_in_m = [(positions[1] - positions[0]) / 1000 for positions in lateral_positions_mm]
+        initial_pressure = fourier_domain_reconstruction(time_series_sensor_data, lateral_spacings_in_m,
+                                                         time_spacing_in_ms / 1000, speed_of_sound_in_m_per_s)
+
+        # the axes of the reconstruction are (batch, [y,] x, depth) and depth is sampled every c * dt
+        depth_positions_mm = np.arange(initial_pressure.shape[-1]) * speed_of_sound_in_m_per_s * time_spacing_in_ms
+        x, y, z = [coordinates.numpy().astype(np.float64) * spacing_in_mm
+                   for coordinates in compute_pixel_coordinates(xdim, ydim, zdim, xdim_start, ydim_start, zdim_start,
+                                                                "cpu")]
+        x, depth, elevation = np.meshgrid(x, np.abs(y), z, indexing="ij")
+        if len(lateral_positions_mm) == 1:
+            grid = (lateral_positions_mm[0], depth_positions_mm)
+            points = np.stack([x.ravel(), depth.ravel()], axis=-1)
+        else:
+            grid = (lateral_positions_mm[0], lateral_positions_mm[1], depth_positions_mm)
+            points = np.stack([elevation.ravel(), x.ravel(), depth.ravel()], axis=-1)
+
+        batch_shape = initial_pressure.shape[:-len(grid)]
+        values = np.moveaxis(initial_pressure, range(len(batch_shape)), range(-len(batch_shape), 0))
+        interpolator = RegularGridInterpolator(grid, values, bounds_error=False, fill_value=0)
+        reconstructed = interpolator(points).reshape((xdim, ydim, zdim) + batch_shape)
+        reconstructed = np.moveaxis(reconstructed, range(3, reconstructed.ndim), range(len(batch_shape)))
+
+        return squeeze_reconstruction(reconstructed.astype(np.float32))
+
+    def reconstruction_algorithm_batch(self, time_series_sensor_data, detection_geometry: DetectionGeometryBase):
+        """
+        Reconstructs all frames of the batch at once.
+        """
+        return self.reconstruction_algorithm(time_series_sensor_data, detection_geometry)
+
+
+def arrange_time_series_on_sensor_grid(time_series_sensor_data: np.ndarray, sensor_positions: np.ndarray,
+                                       detection_geometry: DetectionGeometryBase
+                                       ) -> Tuple[np.ndarray, List[np.ndarray]]:
+    """
+    Arranges the time series data of the sensor elements of a linear or planar array on a regular grid.
+
+    :param time_series_sensor_data: (numpy array) time series data of shape (..., sensor elements, time steps)
+    :param sensor_positions: (numpy array) positions of the sensor elements in mm
+    :param detection_geometry: the linear or planar array that recorded the data
+    :return: tuple with the time series data of shape (..., x elements, time steps) for linear arrays or
+        (..., y elements, x elements, time steps) for planar arrays and the list of the element positions in mm
+        along each of these lateral axes
+    :raises TypeError: if the detection geometry is neither a linear nor a planar array
+    :raises ValueError: if the sensor elements are not uniformly spaced
+    """
+    batch_shape = time_series_sensor_data.shape[:-2]
+    n_time_steps = time_series_sensor_data.shape[-1]
+    if isinstance(detection_geometry, LinearArrayDetectionGeometry):
+        order = np.argsort(sensor_positions[:, 0])
+        time_series_sensor_data = time_series_sensor_data[..., order, :]
+        lateral_positions_mm = [sensor_positions[order, 0]]
+    elif isinstance(detection_geometry, PlanarArrayDetectionGeometry):
+        n_x = detection_geometry.number_detector_elements_x
+        n_y = detection_geometry.number_detector_elements_y
+        # the element index runs along x first
+        time_series_sensor_data = time_series_sensor_data.reshape(batch_shape + (n_y, n_x, n_time_steps))
+        positions = sensor_positions.reshape(n_y, n_x, 3)
+        if not (np.allclose(positions[:, :, 0], positions[:1, :, 0]) and
+                np.allclose(positions[:, :, 1], positions[:, :1, 1])):
+            raise ValueError("The sensor elements of the planar array are not arranged on a regular grid.")
+        lateral_positions_mm = [positions[:, 0, 1], positions[0, :, 0]]
+    else:
+        raise TypeError(f"The Fourier domain reconstruction only supports linear and planar arrays, but not "
+                        f"{type(detection_geometry)}.")
+
+    for positions in lateral_positions_mm:
+        if len(positions) < 2 or not np.allclose(np.diff(positions), positions[1] - positions[0]):
+            raise ValueError("The Fourier domain reconstruction needs at least two uniformly spaced sensor elements "
+                             "along every lateral axis.")
+    return time_series_sensor_data, lateral_positions_mm
+
+
+def fourier_domain_reconstruction(time_series_sensor_data: np.ndarray, lateral_spacings_in_m: List[float],
+                                  time_spacing_in_s: float, speed_of_sound_in_m_per_s: float) -> np.ndarray:
+    """
+    Reconstructs the initial pressure from time series data that was recorded on a regular line or plane of point
+    like sensors, assuming that all sources lie on one side of the sensors. The frequency spectrum of the data is
+    mapped onto the wavenumbers of the image with w = c * sqrt(k_depth^2 + k_lateral^2) by linear interpolation.
+    This corresponds to `kspaceLineRecon` and `kspacePlaneRecon` of k-Wave.
+
+    :param time_series_sensor_data: (numpy array) time series data of shape (..., x elements, time steps) for a line
+        or (..., y elements, x elements, time steps) for a plane of sensors
+    :param lateral_spacings_in_m: spacing of the sensor elements along each lateral axis in m
+    :param time_spacing_in_s: time between two samples in s
+    :param speed_of_sound_in_m_per_s: speed of sound in m/s
+    :return: (numpy array) initial pressure of shape (..., [y elements,] x elements, time steps), where the last axis
+        is the depth, sampled every speed_of_sound * time_spacing
+    """
+    c = speed_of_sound_in_m_per_s
+    n_lateral_axes = len(lateral_spacings_in_m)
+    n_time_steps = time_series_sensor_data.shape[-1]
+    lateral_shape = time_series_sensor_data.shape[-1 - n_lateral_axes:-1]
+    axes = tuple(range(-1 - n_lateral_axes, 0))
+
+    # the data is mirrored in time, the zero padding in between corresponds to large positive and negative times
+    fft_shape = tuple(scipy.fft.next_fast_len(size) for size in lateral_shape) + \
+        (scipy.fft.next_fast_len(2 * n_time_steps - 1), )
+    n_mirrored = fft_shape[-1]
+    mirrored = np.zeros(time_series_sensor_data.shape[:-1 - n_lateral_axes] + fft_shape,
+                        dtype=np.result_type(time_series_sensor_data.dtype, np.float32))
+    lateral_slices = tuple(slice(0, size) for size in lateral_shape)
+    mirrored[(Ellipsis, ) + lateral_slices + (slice(0, n_time_steps), )] = time_series_sensor_data
+    mirrored[(Ellipsis, ) + lateral_slices + (slice(n_mirrored - n_time_steps + 1, None), )] = \
+        time_series_sensor_data[..., :0:-1]
+    spectrum = scipy.fft.fftn(mirrored, axes=axes, workers=-1)
+    del mirrored
+
+    lateral_wavenumbers_squared = 0
+    for axis, (size, spacing) in enumerate(zip(fft_shape[:-1], lateral_spacings_in_m)):
+        wavenumbers = 2 * np.pi * scipy.fft.fftfreq(size, spacing)
+        lateral_wavenumbers_squared = lateral_wavenumbers_squared + \
+            wavenumbers.reshape((-1, ) + (1, ) * (n_lateral_axes - axis)) ** 2
+    depth_wavenumbers = 2 * np.pi * scipy.fft.fftfreq(n_mirrored, c * time_spacing_in_s)
+    angular_frequencies = c * depth_wavenumbers
+
+    # scale with the Jacobian of the mapping and remove the evanescent part, which is not mapped onto the image
+    depth_wavenumbers_squared = (angular_frequencies / c) ** 2 - lateral_wavenumbers_squared
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scaling = c ** 2 * np.sqrt(np.maximum(depth_wavenumbers_squared, 0)) / (2 * angular_frequencies)
+    scaling = np.where(depth_wavenumbers_squared < 0, 0, scaling)
+    scaling = np.where((angular_frequencies == 0) & (lateral_wavenumbers_squared == 0), c / 2, scaling)
+    spectrum *= scaling
+
+    # linear interpolation of the spectrum at the (non-negative) frequencies that belong to the image wavenumbers
+    frequency_index = np.sqrt(depth_wavenumbers ** 2 + lateral_wavenumbers_squared) * c * time_spacing_in_s * \
+        n_mirrored / (2 * np.pi)
+    highest_index = (n_mirrored - 1) // 2
+    lower_index = np.minimum(np.floor(frequency_index).astype(int), highest_index)
+    upper_weight = frequency_index - lower_index
+    upper_index = np.minimum(lower_index + 1, highest_index)
+    spectrum = np.take_along_axis(spectrum, np.broadcast_to(lower_index, spectrum.shape), axis=-1) * \
+        (1 - upper_weight) + \
+        np.take_along_axis(spectrum, np.broadcast_to(upper_index, spectrum.shape), axis=-1) * upper_weight
+    spectrum = np.where(frequency_index <= highest_index, spectrum, 0)
+
+    initial_pressure = scipy.fft.ifftn(spectrum, axes=axes, workers=-1).real
+    # the data only covers one half space of the sensors, which is compensated by a factor of two
+    return 4 * initial_pressure[(Ellipsis, ) + lateral_slices + (slice(0, n_time_steps), )] / c
+
+
+def reconstruct_fourier_domain(time_series_sensor_data: np.ndarray,
+                               detection_geometry: DetectionGeometryBase,
+                               speed_of_sound_in_m_per_s: int = 1540,
+                               time_spacing_in_s: float = 2.5e-8,
+                               sensor_spacing_in_mm: float = 0.1,
+                               recon_mode: str = Tags.RECONSTRUCTION_MODE_PRESSURE) -> np.ndarray:
+    """
+    Convenience function for reconstructing time series data of a linear or planar array with the Fourier domain
+    reconstruction.
+
+    :param time_series_sensor_data: (numpy array) sensor data of shape (sensor elements, time steps), a batch of
+        shape (batch, sensor elements, time steps) or IPASC-style data of shape
+        (sensor elements, time steps, wavelengths, frames)
+    :param detection_geometry: The linear or planar array that recorded the given time series data
+    :param speed_of_sound_in_m_per_s: (int) speed of sound in medium in meters per second (default: 1540 m/s)
+    :param time_spacing_in_s: (float) time between sampling points in seconds (default: 2.5e-8 s which is equal to 40 MHz)
+    :param sensor_spacing_in_mm: (float) space between the pixels of the reconstructed image in millimeters
+        (default: 0.1 mm)
+    :param recon_mode: SIMPA Tag defining the reconstruction mode - pressure default OR differential
+    :return: (numpy array) reconstructed image, with the leading batch dimensions of the input for batches
+    """
+    settings = create_reconstruction_settings(speed_of_sound_in_m_per_s, time_spacing_in_s, sensor_spacing_in_mm,
+                                              recon_mode)
+    adapter = FourierDomainReconstructionAdapter(settings)
+    return adapter.reconstruct_batch(time_series_sensor_data, detection_geometry)
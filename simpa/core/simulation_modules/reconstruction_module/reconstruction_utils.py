@@ -2,7 +2,9 @@
 # SPDX-FileCopyrightText: 2021 Janek Groehl
 # SPDX-License-Identifier: MIT
 
-from typing import Tuple
+from collections import OrderedDict
+from typing import Callable, Iterator, Tuple
+import hashlib
 from simpa.log.file_logger import Logger
 from simpa.core.device_digital_twins import DetectionGeometryBase
 from simpa.utils.processing_device import get_processing_device
@@ -17,6 +19,9 @@ from scipy.signal import hilbert, butter, lfilter
 from scipy.signal.windows import tukey
 from scipy.ndimage import zoom
 
+# approximate size of the intermediate tensors per (pixel, sensor element) entry of the delay and sum computation
+DELAY_AND_SUM_BYTES_PER_ELEMENT = 96
+
 
 def get_apodization_factor(apodization_method: str = Tags.RECONSTRUCTION_APODIZATION_BOX,
                            dimensions: tuple = None, n_sensor_elements=None,
@@ -289,7 +294,7 @@ def reconstruction_mode_transformation(time_series_sensor_data: torch.tensor = N
     Transformes `time_series_sensor_data` for other modes, for example `Tags.RECONSTRUCTION_MODE_DIFFERENTIAL`.
     Default mode is `Tags.RECONSTRUCTION_MODE_PRESSURE`.
 
-    :param time_series_sensor_data: (torch tensor) Time series data to be transformed
+    :param time_series_sensor_data: (torch tensor) Time series data to be transformed, time is the last dimension
     :param mode: (str) reconstruction mode: Tags.RECONSTRUCTION_MODE_PRESSURE (default)
                 or Tags.RECONSTRUCTION_MODE_DIFFERENTIAL
     :return: (torch tensor) potentially transformed tensor
@@ -297,10 +302,10 @@ def reconstruction_mode_transformation(time_series_sensor_data: torch.tensor = N
 
     # depending on mode use pressure data or its derivative
     if mode == Tags.RECONSTRUCTION_MODE_DIFFERENTIAL:
-        zeros = torch.zeros([time_series_sensor_data.shape[0], 1], names=None).to(time_series_sensor_data.device)
-        time_vector = torch.arange(1, time_series_sensor_data.shape[1]+1).to(time_series_sensor_data.device)
-        time_derivative_pressure = time_series_sensor_data[:, 1:] - time_series_sensor_data[:, 0:-1]
-        time_derivative_pressure = torch.cat([time_derivative_pressure, zeros], dim=1)
+        zeros = torch.zeros(time_series_sensor_data.shape[:-1] + (1, )).to(time_series_sensor_data.device)
+        time_vector = torch.arange(1, time_series_sensor_data.shape[-1]+1).to(time_series_sensor_data.device)
+        time_derivative_pressure = time_series_sensor_data[..., 1:] - time_series_sensor_data[..., 0:-1]
+        time_derivative_pressure = torch.cat([time_derivative_pressure, zeros], dim=-1)
         time_derivative_pressure = torch.mul(time_derivative_pressure, time_vector)
         output = time_derivative_pressure  # use time derivative pressure
     elif mode == Tags.RECONSTRUCTION_MODE_PRESSURE:
@@ -328,6 +333,9 @@ def preparing_reconstruction_and_obtaining_reconstruction_settings(
     - computed differential mode if specified
     - perform bandpass filtering if specified
 
+    The time series data is either a single frame of shape (sensor elements, time steps) or a batch of frames of
+    shape (batch, sensor elements, time steps) that share the detection geometry.
+
     Returns:
 
     time_series_sensor_data: (torch tensor) potentially preprocessed time series data
@@ -393,10 +401,10 @@ def preparing_reconstruction_and_obtaining_reconstruction_settings(
     time_series_sensor_data = time_series_sensor_data.to(torch_device)
 
     # array must be of correct dimension
-    assert time_series_sensor_data.ndim == 2, 'Time series data must have exactly 2 dimensions' \
-                                              ', one for the sensor elements and one for time. ' \
-                                              'Stack images and sensor positions for 3D reconstruction' \
-                                              'Apply beamforming per wavelength if you have a 3D array. '
+    assert time_series_sensor_data.ndim in [2, 3], 'Time series data must have 2 dimensions' \
+                                                   ', one for the sensor elements and one for time, ' \
+                                                   'or 3 dimensions for a batch of frames. ' \
+                                                   'Stack images and sensor positions for 3D reconstruction. '
 
     # check reconstruction mode - pressure by default
     if Tags.RECONSTRUCTION_MODE in component_settings:
@@ -470,28 +478,14 @@ def compute_image_dimensions(detection_geometry: DetectionGeometryBase, spacing_
     return xdim, zdim, ydim, xdim_start, xdim_end, ydim_start, ydim_end, zdim_start, zdim_end
 
 
-def compute_delay_and_sum_values(time_series_sensor_data: Tensor, sensor_positions: torch.tensor, xdim: int,
-                                 ydim: int, zdim: int, xdim_start: int, xdim_end: int, ydim_start: int, ydim_end: int,
-                                 zdim_start: int, zdim_end: int, spacing_in_mm: float, speed_of_sound_in_m_per_s: float,
-                                 time_spacing_in_ms: float, logger: Logger, torch_device: torch.device,
-                                 component_settings: Settings) -> Tuple[torch.tensor, int]:
+def compute_pixel_coordinates(xdim: int, ydim: int, zdim: int, xdim_start: float, ydim_start: float,
+                              zdim_start: float, torch_device: torch.device) -> Tuple[Tensor, Tensor, Tensor]:
     """
-    Perform the core computation of Delay and Sum, without summing up the delay dependend values.
+    Computes the pixel coordinates (in units of pixels) of the reconstructed image along each dimension.
 
-    Returns
-    - values (torch tensor) of the time series data corrected for delay and sensor positioning, ready to be summed up
-    - and n_sensor_elements (int) which might be used for later computations
+    :return: tuple with the x, y and z coordinate tensors
     """
 
-    if time_series_sensor_data.shape[0] < sensor_positions.shape[0]:
-        logger.warning("Warning: The time series data has less sensor element entries than the given sensor positions. "
-                       "This might be due to a low simulated resolution, please increase it.")
-
-    n_sensor_elements = time_series_sensor_data.shape[0]
-
-    logger.debug(f'Number of pixels in X dimension: {xdim}, Y dimension: {ydim}, Z dimension: {zdim} '
-                 f',number of sensor elements: {n_sensor_elements}')
-
     x_offset = 0.5 if xdim % 2 == 0 else 0  # to ensure pixels are symmetrically arranged around the 0 like the
     # sensor positions, add an offset of 0.5 pixels if the dimension is even
 
@@ -501,38 +495,401 @@ def compute_delay_and_sum_values(time_series_sensor_data: Tensor, sensor_positio
         z = torch.arange(zdim, device=torch_device, dtype=torch.float32)
     else:
         z = zdim_start + torch.arange(zdim, device=torch_device, dtype=torch.float32)
-    j = torch.arange(n_sensor_elements, device=torch_device, dtype=torch.float32)
+    return x, y, z
+
 
-    xx, yy, zz, jj = torch.meshgrid(x, y, z, j)
-    jj = jj.long()
+def compute_delay_and_sum_values_for_block(time_series_sensor_data: Tensor, sensor_positions: Tensor,
+                                           x: Tensor, y: Tensor, z: Tensor, sensor_elements: slice,
+                                           spacing_in_mm: float, speed_of_sound_in_m_per_s: float,
+                                           time_spacing_in_ms: float, apodization: Tensor = None) -> Tensor:
+    """
+    Computes the delay corrected (and apodized) time series values for an image block spanned by the pixel
+    coordinates `x`, `y` and `z` and the sensor elements selected by `sensor_elements`.
+    Every entry is computed exactly as if the whole image and all sensor elements were processed at once.
+
+    :param apodization: (torch tensor) apodization factors of all sensor elements or None
+    :return: (torch tensor) values of shape (len(x), len(y), len(z), number of selected sensor elements)
+    """
+
+    n_time_steps = time_series_sensor_data.shape[1]
+    jj = torch.arange(sensor_elements.start, sensor_elements.stop, device=time_series_sensor_data.device)
+    xx = x[:, None, None, None]
+    yy = y[None, :, None, None]
+    zz = z[None, None, :, None]
+    positions = sensor_positions[sensor_elements]
 
-    delays = torch.sqrt((yy * spacing_in_mm - sensor_positions[:, 2][jj]) ** 2 +
-                        (xx * spacing_in_mm - sensor_positions[:, 0][jj]) ** 2 +
-                        (zz * spacing_in_mm - sensor_positions[:, 1][jj]) ** 2) \
+    delays = torch.sqrt((yy * spacing_in_mm - positions[:, 2]) ** 2 +
+                        (xx * spacing_in_mm - positions[:, 0]) ** 2 +
+                        (zz * spacing_in_mm - positions[:, 1]) ** 2) \
         / (speed_of_sound_in_m_per_s * time_spacing_in_ms)
 
     # perform index validation
-    invalid_indices = torch.where(torch.logical_or(delays < 0, delays >= float(time_series_sensor_data.shape[1])))
-    torch.clip_(delays, min=0, max=time_series_sensor_data.shape[1] - 1)
+    invalid = torch.logical_or(delays < 0, delays >= float(n_time_steps))
+    torch.clip_(delays, min=0, max=n_time_steps - 1)
 
     # interpolation of delays
     lower_delays = (torch.floor(delays)).long()
     upper_delays = lower_delays + 1
-    torch.clip_(upper_delays, min=0, max=time_series_sensor_data.shape[1] - 1)
+    torch.clip_(upper_delays, min=0, max=n_time_steps - 1)
     lower_values = time_series_sensor_data[jj, lower_delays]
     upper_values = time_series_sensor_data[jj, upper_delays]
     values = lower_values * (upper_delays - delays) + upper_values * (delays - lower_delays)
+    del delays, lower_delays, upper_delays, lower_values, upper_values  # free memory
 
-    # perform apodization if specified
-    if Tags.RECONSTRUCTION_APODIZATION_METHOD in component_settings:
-        apodization = get_apodization_factor(apodization_method=component_settings[Tags.RECONSTRUCTION_APODIZATION_METHOD],
-                                             dimensions=(xdim, ydim, zdim), n_sensor_elements=n_sensor_elements,
-                                             device=torch_device)
-        values = values * apodization
+    if apodization is not None:
+        values = values * apodization[sensor_elements]
 
     # set values of invalid indices to 0 so that they don't influence the result
-    values[invalid_indices] = 0
+    values[invalid] = 0
 
-    del delays  # free memory of delays
+    return values
+
+
+def compute_delay_and_sum_values(time_series_sensor_data: Tensor, sensor_positions: torch.tensor, xdim: int,
+                                 ydim: int, zdim: int, xdim_start: int, xdim_end: int, ydim_start: int, ydim_end: int,
+                                 zdim_start: int, zdim_end: int, spacing_in_mm: float, speed_of_sound_in_m_per_s: float,
+                                 time_spacing_in_ms: float, logger: Logger, torch_device: torch.device,
+                                 component_settings: Settings) -> Tuple[torch.tensor, int]:
+    """
+    Perform the core computation of Delay and Sum, without summing up the delay dependend values.
+    Note that this materialises all values of shape (xdim, ydim, zdim, n_sensor_elements) at once, use
+    `iterate_delay_and_sum_values` to process them in memory-bounded blocks instead.
+
+    Returns
+    - values (torch tensor) of the time series data corrected for delay and sensor positioning, ready to be summed up
+    - and n_sensor_elements (int) which might be used for later computations
+    """
+
+    if time_series_sensor_data.shape[0] < sensor_positions.shape[0]:
+        logger.warning("Warning: The time series data has less sensor element entries than the given sensor positions. "
+                       "This might be due to a low simulated resolution, please increase it.")
+
+    n_sensor_elements = time_series_sensor_data.shape[0]
+
+    logger.debug(f'Number of pixels in X dimension: {xdim}, Y dimension: {ydim}, Z dimension: {zdim} '
+                 f',number of sensor elements: {n_sensor_elements}')
+
+    x, y, z = compute_pixel_coordinates(xdim, ydim, zdim, xdim_start, ydim_start, zdim_start, torch_device)
+    apodization = get_apodization_window(component_settings, n_sensor_elements, torch_device)
+
+    values = compute_delay_and_sum_values_for_block(time_series_sensor_data, sensor_positions, x, y, z,
+                                                    slice(0, n_sensor_elements), spacing_in_mm,
+                                                    speed_of_sound_in_m_per_s, time_spacing_in_ms, apodization)
 
     return values, n_sensor_elements
+
+
+def get_apodization_window(component_settings: Settings, n_sensor_elements: int,
+                           torch_device: torch.device) -> Tensor:
+    """
+    Returns the apodization factors of all sensor elements as a 1D tensor or None if no apodization is specified in
+    `component_settings[Tags.RECONSTRUCTION_APODIZATION_METHOD]`.
+    """
+    if Tags.RECONSTRUCTION_APODIZATION_METHOD not in component_settings:
+        return None
+    return get_apodization_factor(apodization_method=component_settings[Tags.RECONSTRUCTION_APODIZATION_METHOD],
+                                  dimensions=(), n_sensor_elements=n_sensor_elements, device=torch_device)
+
+
+def squeeze_reconstruction(reconstruction: np.ndarray) -> np.ndarray:
+    """
+    Removes the image dimensions of size one from a reconstructed image of shape (xdim, ydim, zdim) or a batch of
+    reconstructed images of shape (batch, xdim, ydim, zdim). The batch dimension is kept, even if it is of size one.
+    """
+    return reconstruction.squeeze(axis=tuple(axis for axis in range(reconstruction.ndim - 3, reconstruction.ndim)
+                                             if reconstruction.shape[axis] == 1))
+
+
+def compute_delay_and_sum_block_sizes(xdim: int, ydim: int, zdim: int, n_sensor_elements: int,
+                                      memory_budget_in_mb: float) -> Tuple[int, int, int, int]:
+    """
+    Computes the block sizes along x, y, z and the sensor elements such that the intermediate tensors of one
+    block of the delay and sum computation fit into the given memory budget.
+    Sensor elements are only split into chunks if not even a single pixel with all sensor elements fits into the
+    budget.
+
+    :return: tuple with the block sizes (x_block, y_block, z_block, sensor_block)
+    """
+    n_elements = max(1, int(memory_budget_in_mb * 1024 * 1024 / DELAY_AND_SUM_BYTES_PER_ELEMENT))
+    sensor_block = min(n_sensor_elements, n_elements)
+    n_pixels = max(1, n_elements // sensor_block)
+    z_block = min(zdim, n_pixels)
+    y_block = min(ydim, max(1, n_pixels // z_block))
+    x_block = min(xdim, max(1, n_pixels // (z_block * y_block)))
+    return x_block, y_block, z_block, sensor_block
+
+
+class DelayAndSumPlan(object):
+    """
+    Frame independent part of the delay and sum based reconstruction algorithms. For every block of the image (see
+    `compute_delay_and_sum_block_sizes`) the plan contains the indices of the time series samples that are
+    interpolated for each pixel and sensor element as well as the interpolation weights, where the weights of
+    invalid delays are set to zero. The plan only depends on the sensor positions, the image grid, the speed of sound
+    and the time spacing, such that it can be reused for every frame and wavelength, which then only gathers the
+    samples and reduces them.
+    The values are identical to the ones computed by `compute_delay_and_sum_values_for_block`.
+    """
+
+    def __init__(self, sensor_positions: Tensor, xdim: int, ydim: int, zdim: int, xdim_start: float,
+                 ydim_start: float, zdim_start: float, spacing_in_mm: float, speed_of_sound_in_m_per_s: float,
+                 time_spacing_in_ms: float, n_time_steps: int, memory_budget_in_mb: float,
+                 torch_device: torch.device, apodization: Tensor = None, precompute: bool = True):
+        """
+        :param precompute: if False, the tables of each block are computed when they are needed instead of being
+            stored in the plan
+        """
+        self.sensor_positions = sensor_positions
+        self.shape = (xdim, ydim, zdim)
+        self.spacing_in_mm = spacing_in_mm
+        self.speed_of_sound_in_m_per_s = speed_of_sound_in_m_per_s
+        self.time_spacing_in_ms = time_spacing_in_ms
+        self.n_time_steps = n_time_steps
+        self.n_sensor_elements = sensor_positions.shape[0]
+        self.apodization = apodization
+        self.x, self.y, self.z = compute_pixel_coordinates(xdim, ydim, zdim, xdim_start, ydim_start, zdim_start,
+                                                           torch_device)
+        self.block_sizes = compute_delay_and_sum_block_sizes(xdim, ydim, zdim, self.n_sensor_elements,
+                                                             memory_budget_in_mb)
+        self.blocks = list(self._iterate_blocks())
+        self.tables = [self.compute_table(*block) for block in self.blocks] if precompute else None
+
+    @staticmethod
+    def estimate_size_in_bytes(xdim: int, ydim: int, zdim: int, n_sensor_elements: int) -> int:
+        """
+        Estimates the memory needed by the tables of a plan (one index and two weights per pixel and sensor element).
+        """
+        return xdim * ydim * zdim * n_sensor_elements * 24
+
+    @property
+    def size_in_bytes(self) -> int:
+        if self.tables is None:
+            return 0
+        return sum(sum(tensor.element_size() * tensor.nelement() for tensor in table) for table in self.tables)
+
+    def _iterate_blocks(self) -> Iterator[Tuple[slice, slice, slice, slice]]:
+        (xdim, ydim, zdim), (x_block, y_block, z_block, sensor_block) = self.shape, self.block_sizes
+        for x_start in range(0, xdim, x_block):
+            for y_start in range(0, ydim, y_block):
+                for z_start in range(0, zdim, z_block):
+                    for sensor_start in range(0, self.n_sensor_elements, sensor_block):
+                        yield (slice(x_start, min(x_start + x_block, xdim)),
+                               slice(y_start, min(y_start + y_block, ydim)),
+                               slice(z_start, min(z_start + z_block, zdim)),
+                               slice(sensor_start, min(sensor_start + sensor_block, self.n_sensor_elements)))
+
+    def compute_table(self, x_slice: slice, y_slice: slice, z_slice: slice,
+                      sensor_slice: slice) -> Tuple[Tensor, Tensor, Tensor]:
+        """
+        Computes the table of one block.
+
+        :return: tuple with the indices of the lower samples in the flattened time series data (padded by one sample
+            per sensor element) and the weights of the lower and upper samples
+        """
+        n_time_steps = self.n_time_steps
+        positions = self.sensor_positions[sensor_slice]
+        xx = self.x[x_slice][:, None, None, None]
+        yy = self.y[y_slice][None, :, None, None]
+        zz = self.z[z_slice][None, None, :, None]
+        delays = torch.sqrt((yy * self.spacing_in_mm - positions[:, 2]) ** 2 +
+                            (xx * self.spacing_in_mm - positions[:, 0]) ** 2 +
+                            (zz * self.spacing_in_mm - positions[:, 1]) ** 2) \
+            / (self.speed_of_sound_in_m_per_s * self.time_spacing_in_ms)
+
+        invalid = torch.logical_or(delays < 0, delays >= float(n_time_steps))
+        torch.clip_(delays, min=0, max=n_time_steps - 1)
+        lower_delays = (torch.floor(delays)).long()
+        upper_delays = lower_delays + 1
+        torch.clip_(upper_delays, min=0, max=n_time_steps - 1)
+        lower_weights = upper_delays - delays
+        upper_weights = delays - lower_delays
+        lower_weights[invalid] = 0
+        upper_weights[invalid] = 0
+
+        jj = torch.arange(sensor_slice.start, sensor_slice.stop, device=delays.device)
+        indices = lower_delays + jj * (n_time_steps + 1)
+        return indices, lower_weights, upper_weights
+
+    def iterate_values(self, time_series_sensor_data: Tensor) -> Iterator[Tuple[tuple, Tensor]]:
+        """
+        Yields the delay corrected (and apodized) values of all blocks for the given time series data, see
+        `iterate_delay_and_sum_values`. For a batch of frames of shape (batch, sensor elements, time steps), the
+        table of each block is applied to all frames before the next block is processed.
+        """
+        n_sensor_elements = self.n_sensor_elements
+        # the padded sample repeats the last sample, such that the upper sample of the last time step is the same as
+        # the clipped one of `compute_delay_and_sum_values_for_block`
+        padded = torch.cat([time_series_sensor_data[..., :n_sensor_elements, :],
+                            time_series_sensor_data[..., :n_sensor_elements, -1:]], dim=-1)
+        padded = padded.reshape(time_series_sensor_data.shape[:-2] + (-1, ))
+        # gathering the samples of several frames at once is not faster than gathering them frame by frame, but
+        # needs more memory
+        frames = [None] if time_series_sensor_data.ndim == 2 else range(time_series_sensor_data.shape[0])
+        for index, (x_slice, y_slice, z_slice, sensor_slice) in enumerate(self.blocks):
+            if self.tables is None:
+                indices, lower_weights, upper_weights = self.compute_table(x_slice, y_slice, z_slice, sensor_slice)
+            else:
+                indices, lower_weights, upper_weights = self.tables[index]
+            for frame in frames:
+                samples = padded if frame is None else padded[frame]
+                values = samples[indices] * lower_weights + samples[indices + 1] * upper_weights
+                if self.apodization is not None:
+                    values = values * self.apodization[sensor_slice]
+                if frame is None:
+                    yield (x_slice, y_slice, z_slice), values
+                else:
+                    yield (frame, x_slice, y_slice, z_slice), values
+
+
+class DelayAndSumPlanCache(object):
+    """
+    Least recently used cache of delay and sum plans with a memory limit. The cache is shared by all reconstructions
+    of a process and keeps its plans after a simulation pipeline has finished. Call `clear()` (e.g.
+    `DELAY_AND_SUM_PLAN_CACHE.clear()`) to free the memory of the cached plans.
+    """
+
+    def __init__(self):
+        self.plans = OrderedDict()
+
+    @property
+    def size_in_bytes(self) -> int:
+        return sum(plan.size_in_bytes for plan in self.plans.values())
+
+    def get(self, key: tuple, create_plan: Callable[[bool], DelayAndSumPlan], estimated_size_in_bytes: int,
+            maximum_size_in_mb: float) -> DelayAndSumPlan:
+        """
+        Returns the cached plan for the given key or creates it with `create_plan(precompute)`. Plans that do not fit
+        into the cache are not precomputed and not cached.
+        """
+        maximum_size_in_bytes = maximum_size_in_mb * 1024 * 1024
+        if key in self.plans:
+            self.plans.move_to_end(key)
+        # plans that exceed a (possibly lowered) limit are evicted, the plan for the given key last
+        while self.plans and self.size_in_bytes > maximum_size_in_bytes:
+            self.plans.popitem(last=False)
+        if key in self.plans:
+            return self.plans[key]
+        if estimated_size_in_bytes > maximum_size_in_bytes:
+            return create_plan(False)
+        while self.plans and self.size_in_bytes + estimated_size_in_bytes > maximum_size_in_bytes:
+            self.plans.popitem(last=False)
+        plan = create_plan(True)
+        self.plans[key] = plan
+        return plan
+
+    def clear(self):
+        """
+        Removes all cached plans.
+        """
+        self.plans.clear()
+
+
+DELAY_AND_SUM_PLAN_CACHE = DelayAndSumPlanCache()
+
+
+def get_delay_and_sum_plan(sensor_positions: Tensor, xdim: int, ydim: int, zdim: int, xdim_start: float,
+                           ydim_start: float, zdim_start: float, spacing_in_mm: float,
+                           speed_of_sound_in_m_per_s: float, time_spacing_in_ms: float, n_time_steps: int,
+                           torch_device: torch.device, component_settings: Settings) -> DelayAndSumPlan:
+    """
+    Returns the (cached) delay and sum plan for the given geometry and image grid. The size of the cache is given by
+    `component_settings[Tags.RECONSTRUCTION_PLAN_CACHE_SIZE_IN_MB]`. By default, it is 0, i.e. plans are only
+    cached if the tag is set.
+    """
+    memory_budget_in_mb = component_settings[Tags.RECONSTRUCTION_MEMORY_BUDGET_IN_MB] \
+        if Tags.RECONSTRUCTION_MEMORY_BUDGET_IN_MB in component_settings else 1024
+    cache_size_in_mb = component_settings[Tags.RECONSTRUCTION_PLAN_CACHE_SIZE_IN_MB] \
+        if Tags.RECONSTRUCTION_PLAN_CACHE_SIZE_IN_MB in component_settings else 0
+    apodization_method = component_settings[Tags.RECONSTRUCTION_APODIZATION_METHOD] \
+        if Tags.RECONSTRUCTION_APODIZATION_METHOD in component_settings else None
+    n_sensor_elements = sensor_positions.shape[0]
+
+    def create_plan(precompute: bool) -> DelayAndSumPlan:
+        apodization = get_apodization_window(component_settings, n_sensor_elements, torch_device)
+        return DelayAndSumPlan(sensor_positions.clone(), xdim, ydim, zdim, xdim_start, ydim_start, zdim_start,
+                               spacing_in_mm, speed_of_sound_in_m_per_s, time_spacing_in_ms, n_time_steps,
+                               memory_budget_in_mb, torch_device, apodization, precompute)
+
+    positions = sensor_positions.cpu().numpy()
+    key = (hashlib.sha1(positions.tobytes()).hexdigest(), positions.shape, str(positions.dtype), xdim, ydim, zdim,
+           float(xdim_start), float(ydim_start), float(zdim_start), float(spacing_in_mm),
+           float(speed_of_sound_in_m_per_s), float(time_spacing_in_ms), n_time_steps, apodization_method,
+           float(memory_budget_in_mb), str(torch_device))
+    estimated_size = DelayAndSumPlan.estimate_size_in_bytes(xdim, ydim, zdim, n_sensor_elements)
+    return DELAY_AND_SUM_PLAN_CACHE.get(key, create_plan, estimated_size, cache_size_in_mb)
+
+
+def iterate_delay_and_sum_values(time_series_sensor_data: Tensor, sensor_positions: Tensor, xdim: int, ydim: int,
+                                 zdim: int, xdim_start: float, ydim_start: float, zdim_start: float,
+                                 spacing_in_mm: float, speed_of_sound_in_m_per_s: float, time_spacing_in_ms: float,
+                                 logger: Logger, torch_device: torch.device, component_settings: Settings
+                                 ) -> Iterator[Tuple[tuple, Tensor]]:
+    """
+    Memory-bounded variant of `compute_delay_and_sum_values`. The image is split into blocks (and, if necessary,
+    the sensor elements into chunks) such that the intermediate tensors stay within the memory budget given by
+    `component_settings[Tags.RECONSTRUCTION_MEMORY_BUDGET_IN_MB]` (default: 1024 MB).
+    The values of each block are computed exactly like in `compute_delay_and_sum_values`, using the cached
+    `DelayAndSumPlan` of the geometry (see `get_delay_and_sum_plan`).
+    The time series data is either a single frame of shape (sensor elements, time steps) or a batch of frames of
+    shape (batch, sensor elements, time steps), which share the plan.
+
+    Yields tuples of
+    - the (x, y, z) slices of the block within the image, preceded by the index of the frame for a batch
+    - the values (torch tensor) of the block for one chunk of sensor elements, ready to be reduced along the last axis
+    """
+
+    if time_series_sensor_data.shape[-2] < sensor_positions.shape[0]:
+        logger.warning("Warning: The time series data has less sensor element entries than the given sensor positions. "
+                       "This might be due to a low simulated resolution, please increase it.")
+
+    n_sensor_elements = time_series_sensor_data.shape[-2]
+
+    plan = get_delay_and_sum_plan(sensor_positions[:n_sensor_elements], xdim, ydim, zdim, xdim_start, ydim_start,
+                                  zdim_start, spacing_in_mm, speed_of_sound_in_m_per_s, time_spacing_in_ms,
+                                  time_series_sensor_data.shape[-1], torch_device, component_settings)
+
+    logger.debug(f'Number of pixels in X dimension: {xdim}, Y dimension: {ydim}, Z dimension: {zdim} '
+                 f',number of sensor elements: {n_sensor_elements}')
+    logger.debug(f"Delay and sum block size: {plan.block_sizes[:3]} pixels and {plan.block_sizes[3]} "
+                 f"sensor elements, plan is {'cached' if plan.tables is not None else 'computed per block'}")
+
+    yield from plan.iterate_values(time_series_sensor_data)
+
+
+def compute_delay_multiply_and_sum(time_series_sensor_data: Tensor, sensor_positions: Tensor, xdim: int, ydim: int,
+                                   zdim: int, xdim_start: float, ydim_start: float, zdim_start: float,
+                                   spacing_in_mm: float, speed_of_sound_in_m_per_s: float, time_spacing_in_ms: float,
+                                   logger: Logger, torch_device: torch.device,
+                                   component_settings: Settings) -> Tuple[Tensor, Tensor]:
+    """
+    Computes the Delay Multiply and Sum image, i.e. the sum of sign(v_n * v_m) * sqrt(|v_n * v_m|) over all sensor
+    pairs n < m of the delay corrected values v. With s = sign(v) * sqrt(|v|) this pairwise sum equals
+    ((sum s)^2 - sum s^2) / 2, so only per-pixel sums are needed and the cost is linear in the number of sensor
+    elements. The values are processed block-wise by `iterate_delay_and_sum_values`.
+
+    Returns
+    - the Delay Multiply and Sum image (torch tensor) of shape (xdim, ydim, zdim), or (batch, xdim, ydim, zdim) for
+      a batch of time series data
+    - the Delay and Sum image (torch tensor) without normalisation, e.g. to obtain the sign for signed DMAS
+    """
+
+    # (sum s)^2 and sum s^2 are of similar size, so their difference is computed from float64 sums to avoid
+    # cancellation errors. The results are returned in the data type of the delay corrected values.
+    sum_s = None
+    for block, values in iterate_delay_and_sum_values(time_series_sensor_data, sensor_positions, xdim, ydim, zdim,
+                                                      xdim_start, ydim_start, zdim_start, spacing_in_mm,
+                                                      speed_of_sound_in_m_per_s, time_spacing_in_ms, logger,
+                                                      torch_device, component_settings):
+        if sum_s is None:
+            values_dtype = values.dtype
+            sum_s = torch.zeros(time_series_sensor_data.shape[:-2] + (xdim, ydim, zdim), dtype=torch.float64,
+                                device=torch_device)
+            sum_s_squared = torch.zeros_like(sum_s)
+            sum_values = torch.zeros_like(sum_s)
+        sum_values[block] += torch.sum(values, dim=-1, dtype=torch.float64)
+        sum_s_squared[block] += torch.sum(torch.abs(values), dim=-1, dtype=torch.float64)  # s^2 = |v|
+        values = torch.sign(values) * torch.sqrt(torch.abs(values))
+        sum_s[block] += torch.sum(values, dim=-1, dtype=torch.float64)
+        del values
+
+    delay_multiply_and_sum = (sum_s ** 2 - sum_s_squared) / 2
+    return delay_multiply_and_sum.to(values_dtype), sum_values.to(values_dtype)
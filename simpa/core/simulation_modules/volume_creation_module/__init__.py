@@ -10,7 +10,8 @@ import numpy as np
 from simpa.core import SimulationModule
 from simpa.utils.dict_path_manager import generate_dict_path
 from simpa.io_handling import save_hdf5
-from simpa.utils.quality_assurance.data_sanity_testing import assert_equal_shapes, assert_array_well_defined
+from simpa.utils.quality_assurance.data_sanity_testing import assert_equal_shapes, assert_array_well_defined, \
+    get_qa_assertion_sample_size
 
 
 class VolumeCreatorModuleBase(SimulationModule):
@@ -58,7 +59,8 @@ class VolumeCreatorModuleBase(SimulationModule):
                 if _volume_name == Tags.DATA_FIELD_OXYGENATION:
                     # oxygenation can have NaN by definition
                     continue
-                assert_array_well_defined(volumes[_volume_name], array_name=_volume_name)
+                assert_array_well_defined(volumes[_volume_name], array_name=_volume_name,
+                                          sample_size=get_qa_assertion_sample_size(self.global_settings))
 
         save_volumes = dict()
         for key, value in volumes.items():
@@ -5,9 +5,31 @@
 from simpa.core.simulation_modules.volume_creation_module import VolumeCreatorModuleBase
 from simpa.utils.libraries.structure_library import Structures
 from simpa.utils import Tags
+from simpa.utils.settings import Settings
+from simpa.utils.tissue_properties import TissueProperties
 import numpy as np
+from copy import deepcopy
 from simpa.utils import create_deformation_settings
 
+WAVELENGTH_DEPENDENT_PROPERTIES = [Tags.DATA_FIELD_ABSORPTION_PER_CM,
+                                   Tags.DATA_FIELD_SCATTERING_PER_CM,
+                                   Tags.DATA_FIELD_ANISOTROPY]
+
+
+def _are_settings_equal(first, second) -> bool:
+    """
+    Compares two (nested) settings values. Unlike `==`, this also works for dictionaries and lists that contain
+    numpy arrays.
+    """
+    if isinstance(first, dict) and isinstance(second, dict):
+        return first.keys() == second.keys() and all(_are_settings_equal(first[key], second[key]) for key in first)
+    if isinstance(first, (list, tuple)) and isinstance(second, (list, tuple)):
+        return (type(first) is type(second) and len(first) == len(second) and
+                all(_are_settings_equal(a, b) for a, b in zip(first, second)))
+    if isinstance(first, np.ndarray) or isinstance(second, np.ndarray):
+        return np.array_equal(first, second)
+    return bool(first == second)
+
 
 class ModelBasedVolumeCreationAdapter(VolumeCreatorModuleBase):
     """
@@ -41,11 +63,57 @@ class ModelBasedVolumeCreationAdapter(VolumeCreatorModuleBase):
 
         simulate(simulation_settings)
 
+    The geometry of the structures does not depend on the wavelength. It is therefore only created once per adapter
+    instance, together with the volume fractions every structure contributes after resolving the priorities.
+    It is created again whenever the structure settings, the volume dimensions or the spacing change.
+    For every wavelength, only the wavelength-dependent optical properties are merged into the volumes.
+    Both steps only work within the bounding box of every structure, so no full-size array is created per structure.
 
     """
 
+    def __init__(self, global_settings: Settings):
+        super(ModelBasedVolumeCreationAdapter, self).__init__(global_settings=global_settings)
+        self.structure_geometries = None
+        self.structure_geometries_settings = None
+        self.wavelength_independent_volumes = None
+        self.random_state_before_structures = None
+        self.random_state_after_structures = None
+
     def create_simulation_volume(self) -> dict:
+        wavelength = self.global_settings[Tags.WAVELENGTH]
 
+        if self.structure_geometries is None or not _are_settings_equal(self.get_structure_geometries_settings(),
+                                                                         self.structure_geometries_settings):
+            self.create_structure_geometries(wavelength)
+        else:
+            self.logger.debug("Re-using the structure geometries of the previous wavelength.")
+            self.skip_random_numbers_of_structure_creation()
+
+        volumes = dict()
+        for key in TissueProperties.property_tags:
+            if key in self.wavelength_independent_volumes:
+                volumes[key] = self.wavelength_independent_volumes[key].copy()
+            else:
+                volumes[key] = np.zeros(self.volume_dimensions_voxels)
+
+        for structure, bounding_box, mask, added_volume_fraction in self.structure_geometries:
+            structure_properties = structure.properties_for_wavelength(wavelength)
+            for key in WAVELENGTH_DEPENDENT_PROPERTIES:
+                if structure_properties[key] is None:
+                    continue
+                volumes[key][bounding_box][mask] += added_volume_fraction * structure_properties[key]
+
+        return volumes
+
+    def create_structure_geometries(self, wavelength):
+        """
+        Creates all structures defined in the settings and resolves their priorities into the volume fraction that
+        every structure adds to every voxel. As the geometry does not depend on the wavelength, this is only done
+        once and the result is re-used by every following call of `create_simulation_volume`. The properties that do
+        not depend on the wavelength are merged into volumes right away.
+
+        :param wavelength: the current wavelength. It is only used to query the wavelength-independent properties.
+        """
         if Tags.SIMULATE_DEFORMED_LAYERS in self.component_settings \
                 and self.component_settings[Tags.SIMULATE_DEFORMED_LAYERS]:
             self.logger.debug("Tags.SIMULATE_DEFORMED_LAYERS in self.component_settings is TRUE")
@@ -59,44 +127,83 @@ class ModelBasedVolumeCreationAdapter(VolumeCreatorModuleBase):
                     cosine_scaling_factor=1)
 
         volumes, x_dim_px, y_dim_px, z_dim_px = self.create_empty_volumes()
+        self.volume_dimensions_voxels = (x_dim_px, y_dim_px, z_dim_px)
+        for key in WAVELENGTH_DEPENDENT_PROPERTIES:
+            del volumes[key]
         global_volume_fractions = np.zeros((x_dim_px, y_dim_px, z_dim_px))
         max_added_fractions = np.zeros((x_dim_px, y_dim_px, z_dim_px))
-        wavelength = self.global_settings[Tags.WAVELENGTH]
 
+        self.random_state_before_structures = np.random.get_state()
         structure_list = Structures(self.global_settings, self.component_settings)
+        self.random_state_after_structures = np.random.get_state()
         priority_sorted_structures = structure_list.sorted_structures
 
+        self.structure_geometries = list()
         for structure in priority_sorted_structures:
             self.logger.debug(type(structure))
 
             structure_properties = structure.properties_for_wavelength(wavelength)
 
-            structure_volume_fractions = structure.geometrical_volume
+            # all voxels outside of the bounding box of the structure are left unchanged, so the priorities only have
+            # to be resolved within it.
+            bounding_box = structure.bounding_box
+            structure_volume_fractions = structure.local_geometrical_volume
+            local_global_volume_fractions = global_volume_fractions[bounding_box]
+            local_max_added_fractions = max_added_fractions[bounding_box]
+
             structure_indexes_mask = structure_volume_fractions > 0
-            global_volume_fractions_mask = global_volume_fractions < 1
+            global_volume_fractions_mask = local_global_volume_fractions < 1
             mask = structure_indexes_mask & global_volume_fractions_mask
-            added_volume_fraction = (global_volume_fractions + structure_volume_fractions)
+            added_volume_fraction = (local_global_volume_fractions + structure_volume_fractions)
 
             added_volume_fraction[added_volume_fraction <= 1 & mask] = structure_volume_fractions[
                 added_volume_fraction <= 1 & mask]
 
             selector_more_than_1 = added_volume_fraction > 1
             if selector_more_than_1.any():
-                remaining_volume_fraction_to_fill = 1 - global_volume_fractions[selector_more_than_1]
+                remaining_volume_fraction_to_fill = 1 - local_global_volume_fractions[selector_more_than_1]
                 fraction_to_be_filled = structure_volume_fractions[selector_more_than_1]
                 added_volume_fraction[selector_more_than_1] = np.min([remaining_volume_fraction_to_fill,
                                                                       fraction_to_be_filled], axis=0)
             for key in volumes.keys():
                 if structure_properties[key] is None:
                     continue
+                local_volume = volumes[key][bounding_box]
                 if key == Tags.DATA_FIELD_SEGMENTATION:
-                    added_fraction_greater_than_any_added_fraction = added_volume_fraction > max_added_fractions
-                    volumes[key][added_fraction_greater_than_any_added_fraction & mask] = structure_properties[key]
-                    max_added_fractions[added_fraction_greater_than_any_added_fraction & mask] = \
+                    added_fraction_greater_than_any_added_fraction = added_volume_fraction > local_max_added_fractions
+                    local_volume[added_fraction_greater_than_any_added_fraction & mask] = structure_properties[key]
+                    local_max_added_fractions[added_fraction_greater_than_any_added_fraction & mask] = \
                         added_volume_fraction[added_fraction_greater_than_any_added_fraction & mask]
                 else:
-                    volumes[key][mask] += added_volume_fraction[mask] * structure_properties[key]
-
-            global_volume_fractions[mask] += added_volume_fraction[mask]
-
-        return volumes
+                    local_volume[mask] += added_volume_fraction[mask] * structure_properties[key]
+
+            local_global_volume_fractions[mask] += added_volume_fraction[mask]
+            self.structure_geometries.append((structure, bounding_box, mask, added_volume_fraction[mask]))
+            # the volume fractions of the structure are not needed anymore once the priorities are resolved
+            structure.geometrical_volume = None
+
+        self.wavelength_independent_volumes = volumes
+        self.structure_geometries_settings = deepcopy(self.get_structure_geometries_settings())
+
+    def get_structure_geometries_settings(self) -> tuple:
+        """
+        :return: all settings the structure geometries depend on, i.e. the structure and deformation settings, the
+            volume dimensions and the spacing.
+        """
+        return (self.component_settings[Tags.STRUCTURES] if Tags.STRUCTURES in self.component_settings else None,
+                self.component_settings[Tags.DEFORMED_LAYERS_SETTINGS]
+                if Tags.DEFORMED_LAYERS_SETTINGS in self.component_settings else None,
+                self.global_settings[Tags.DIM_VOLUME_X_MM], self.global_settings[Tags.DIM_VOLUME_Y_MM],
+                self.global_settings[Tags.DIM_VOLUME_Z_MM], self.global_settings[Tags.SPACING_MM])
+
+    def skip_random_numbers_of_structure_creation(self):
+        """
+        Creating the structures draws random numbers (e.g. for vessel trees). When the cached geometry is re-used,
+        the random number generator is set to the state it would have had after re-creating the structures, so that
+        all following pipeline elements draw the same random numbers as without the cache.
+        """
+        current_state = np.random.get_state()
+        before_state = self.random_state_before_structures
+        if (current_state[0] == before_state[0] and np.array_equal(current_state[1], before_state[1]) and
+                current_state[2:] == before_state[2:]):
+            np.random.set_state(self.random_state_after_structures)
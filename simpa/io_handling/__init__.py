@@ -6,3 +6,6 @@ from simpa.io_handling.io_hdf5 import load_hdf5
 from simpa.io_handling.io_hdf5 import save_hdf5
 from simpa.io_handling.io_hdf5 import load_data_field
 from simpa.io_handling.io_hdf5 import save_data_field
+from simpa.io_handling.io_hdf5 import append_data_field
+from simpa.io_handling.lazy_hdf5 import open_hdf5
+from simpa.io_handling.in_memory_data_store import InMemoryDataStore
@@ -0,0 +1,225 @@
+# SPDX-FileCopyrightText: 2021 Division of Intelligent Medical Systems, DKFZ
+# SPDX-FileCopyrightText: 2021 Janek Groehl
+# SPDX-License-Identifier: MIT
+
+import os
+from collections import OrderedDict
+import numpy as np
+from simpa.io_handling.io_hdf5 import save_hdf5, IN_MEMORY_DATA_STORES
+from simpa.log import Logger
+from simpa.utils.serializer import SerializableSIMPAClass
+
+
+class InMemoryDataStore(object):
+    """
+    Keeps the numerical arrays that are written into a SIMPA output file in memory while the store is open, such
+    that the pipeline elements of a simulation exchange their results without writing them to and reading them from
+    the hdf5 file. While the store is open, :meth:`save_hdf5`, :meth:`save_data_field` and :meth:`load_data_field`
+    transparently use the store for this file. Scalars, strings and serialized objects are still written to the file
+    directly.
+
+    The memory of the store is limited by a budget: if the arrays in memory exceed the budget, the least recently
+    used arrays are spilled to the file. All arrays that are still in memory are written to the file when the store
+    is closed, or before the file is read in any other way (e.g. with :meth:`load_hdf5` or :meth:`open_hdf5`)::
+
+        with InMemoryDataStore(settings[Tags.SIMPA_OUTPUT_PATH], memory_budget_in_mb=2048):
+            for pipeline_element in simulation_pipeline:
+                pipeline_element.run(device)
+
+    """
+
+    def __init__(self, file_path: str, memory_budget_in_mb: float = 2048):
+        """
+        :param file_path: path of the hdf5 file whose arrays are kept in memory.
+        :param memory_budget_in_mb: maximum size of the arrays in memory in MB.
+        """
+        self.logger = Logger()
+        self.file_path = os.path.abspath(file_path)
+        self.memory_budget_in_bytes = memory_budget_in_mb * 1024 ** 2
+        self.memory_in_bytes = 0
+        self.number_of_spilled_arrays = 0
+        # True while the store writes into the file itself, such that these writes are not redirected into the store
+        self.is_writing = False
+        self._arrays = OrderedDict()
+
+    @property
+    def is_open(self) -> bool:
+        return IN_MEMORY_DATA_STORES.get(self.file_path) is self
+
+    def open(self):
+        """
+        Redirects all array writes into the file and all reads of these arrays into the store.
+
+        :raises RuntimeError: if another store is already open for the same file.
+        """
+        if self.file_path in IN_MEMORY_DATA_STORES:
+            raise RuntimeError(f"An in-memory data store is already open for {self.file_path}")
+        IN_MEMORY_DATA_STORES[self.file_path] = self
+
+    def close(self):
+        """
+        Writes all arrays that are in memory into the file and detaches the store from the file.
+        """
+        try:
+            self.persist()
+        finally:
+            if self.is_open:
+                del IN_MEMORY_DATA_STORES[self.file_path]
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+    def __contains__(self, dataset_path: str) -> bool:
+        return self._normalise(dataset_path) in self._arrays
+
+    def __len__(self):
+        return len(self._arrays)
+
+    @staticmethod
+    def _normalise(dataset_path: str) -> str:
+        return "/" + dataset_path.strip("/")
+
+    def _is_storable(self, item) -> bool:
+        return (isinstance(item, np.ndarray) and item.ndim > 0 and item.dtype.kind in "biufc" and
+                item.nbytes <= self.memory_budget_in_bytes)
+
+    def _matching_paths(self, prefix: str = None) -> list:
+        """
+        :return: the paths of all arrays in memory that are located at or below the given path.
+        """
+        if prefix is None or prefix.strip("/") == "":
+            return list(self._arrays.keys())
+        prefix = self._normalise(prefix)
+        return [path for path in self._arrays if path == prefix or path.startswith(prefix + "/")]
+
+    def put(self, dataset_path: str, array: np.ndarray):
+        """
+        Stores a copy of the array under the given dataset path, replacing a previous array at this path.
+        Arrays that do not fit into the memory budget are written to the file instead.
+        """
+        dataset_path = self._normalise(dataset_path)
+        self.discard(dataset_path)
+        if not self._is_storable(array):
+            self._write({dataset_path: array})
+            return
+        self._arrays[dataset_path] = np.array(array, copy=True)
+        self.memory_in_bytes += array.nbytes
+        self._spill()
+
+    def get(self, dataset_path: str, selection=None):
+        """
+        :param dataset_path: path of the dataset in the hdf5 file.
+        :param selection: optional selection (e.g. np.s_[:, 10, :]) of the array.
+        :return: a copy of the (selection of the) array or None if the array is not in memory.
+        """
+        dataset_path = self._normalise(dataset_path)
+        if dataset_path not in self._arrays:
+            return None
+        self._arrays.move_to_end(dataset_path)
+        array = self._arrays[dataset_path]
+        return array.copy() if selection is None else np.array(array[selection], copy=True)
+
+    def set_selection(self, dataset_path: str, selection, data) -> bool:
+        """
+        Overwrites a selection of an array in memory.
+
+        :return: False if the array is not in memory.
+        """
+        dataset_path = self._normalise(dataset_path)
+        if dataset_path not in self._arrays:
+            return False
+        self._arrays.move_to_end(dataset_path)
+        self._arrays[dataset_path][selection] = data
+        return True
+
+    def discard(self, dataset_path: str):
+        """
+        Removes the array at the given path and all arrays below it from memory without writing them to the file.
+        """
+        self._remove(self._matching_paths(dataset_path))
+
+    def clear(self):
+        """
+        Removes all arrays from memory without writing them to the file.
+        """
+        self._arrays.clear()
+        self.memory_in_bytes = 0
+
+    def split(self, dictionary: dict, group_path: str) -> dict:
+        """
+        Puts all numerical arrays of a (nested) dictionary that is written at the given group path into the store.
+
+        :return: a dictionary with the remaining items that have to be written to the file.
+        """
+        remaining = dict()
+        for key, item in dictionary.items():
+            item_path = group_path + str(key)
+            if isinstance(item, dict) and not isinstance(item, SerializableSIMPAClass):
+                remaining_items = self.split(item, item_path + "/")
+                if len(remaining_items) > 0:
+                    remaining[key] = remaining_items
+            elif self._is_storable(item):
+                self.put(item_path, item)
+            else:
+                self.discard(item_path)
+                remaining[key] = item
+        return remaining
+
+    def persist(self, prefix: str = None):
+        """
+        Writes the arrays at or below the given path (all arrays if no path is given) into the file and removes them
+        from memory.
+        """
+        paths = self._matching_paths(prefix)
+        if len(paths) == 0:
+            return
+        self._write({path: self._arrays[path] for path in paths})
+        self._remove(paths)
+
+    def _remove(self, paths: list):
+        for path in paths:
+            self.memory_in_bytes -= self._arrays.pop(path).nbytes
+
+    def _spill(self):
+        """
+        Writes the least recently used arrays into the file until the arrays in memory fit into the budget.
+        """
+        paths = list()
+        memory_in_bytes = self.memory_in_bytes
+        for path, array in self._arrays.items():
+            if memory_in_bytes <= self.memory_budget_in_bytes:
+                break
+            paths.append(path)
+            memory_in_bytes -= array.nbytes
+        if len(paths) == 0:
+            return
+        self.logger.debug(f"Spilling {len(paths)} arrays of the in-memory data store to {self.file_path}")
+        self.number_of_spilled_arrays += len(paths)
+        self._write({path: self._arrays[path] for path in paths})
+        self._remove(paths)
+
+    def _write(self, arrays: dict):
+        """
+        Writes the arrays into the file, with a single write per top level group.
+        """
+        groups = dict()
+        for path, array in arrays.items():
+            keys = path.strip("/").split("/")
+            if len(keys) == 1:
+                groups[keys[0]] = array
+                continue
+            group = groups.setdefault(keys[0], dict())
+            for key in keys[1:-1]:
+                group = group.setdefault(key, dict())
+            group[keys[-1]] = array
+        self.is_writing = True
+        try:
+            for key, group in groups.items():
+                save_hdf5(group, self.file_path, "/" + key + "/")
+        finally:
+            self.is_writing = False
@@ -2,6 +2,7 @@
 # SPDX-FileCopyrightText: 2021 Janek Groehl
 # SPDX-License-Identifier: MIT
 
+import os
 import h5py
 from simpa.io_handling.serialization import SERIALIZATION_MAP
 from simpa.utils.dict_path_manager import generate_dict_path
@@ -12,17 +13,109 @@ from simpa.utils.serializer import SerializableSIMPAClass
 logger = Logger()
 
 
-def save_hdf5(save_item, file_path: str, file_dictionary_path: str = "/", file_compression: str = None):
+# name of the file attribute that stores the default compression of all datasets written into a SIMPA file
+FILE_COMPRESSION_ATTRIBUTE = "simpa_file_compression"
+FILE_COMPRESSION_LEVEL_ATTRIBUTE = "simpa_file_compression_level"
+
+# InMemoryDataStore instances that are currently open, by the absolute path of their file
+IN_MEMORY_DATA_STORES = dict()
+
+
+def get_in_memory_data_store(file_path: str):
+    """
+    :param file_path: Path of an hdf5 file.
+    :returns: the InMemoryDataStore that is open for the given file or None.
+    """
+    if len(IN_MEMORY_DATA_STORES) == 0:
+        return None
+    data_store = IN_MEMORY_DATA_STORES.get(os.path.abspath(file_path))
+    if data_store is None or data_store.is_writing:
+        return None
+    return data_store
+
+
+def get_file_compression(h5file: h5py.File) -> tuple:
+    """
+    :param h5file: an open hdf5 file.
+    :returns: the default compression and compression level of the datasets of the file, see save_hdf5. Both are None
+        if the file is not compressed, the level is None unless the compression is gzip.
+    """
+    compression = h5file.attrs.get(FILE_COMPRESSION_ATTRIBUTE)
+    compression_level = None
+    if compression == "gzip" and FILE_COMPRESSION_LEVEL_ATTRIBUTE in h5file.attrs:
+        compression_level = int(h5file.attrs[FILE_COMPRESSION_LEVEL_ATTRIBUTE])
+    return compression, compression_level
+
+
+def save_hdf5(save_item, file_path: str, file_dictionary_path: str = "/", file_compression: str = None,
+              compression_level: int = None):
     """
     Saves a dictionary with arbitrary content or an item of any kind to an hdf5-file with given filepath.
 
+    Numerical arrays are stored as chunked datasets that are compressed while they are written if a file compression
+    is given. When a new file is created, the compression is stored in the file and used as the default for all
+    subsequent writes into this file. Datasets that already exist are overwritten in place (and resized if
+    necessary), such that rewriting a dataset does not leave unused space in the file.
+    If an InMemoryDataStore is open for the file, numerical arrays are kept in the store instead.
+
     :param save_item: Dictionary to save.
     :param file_path: Path of the file to save the dictionary in.
     :param file_dictionary_path: Path in dictionary structure of existing hdf5 file to store the dictionary in.
     :param file_compression: possible file compression for the hdf5 output file. Values are: gzip, lzf and szip.
+        If None, the default compression stored in an existing file is used.
+    :param compression_level: compression level, only used for gzip (0-9, default 4)
     :returns: :mod:`Null`
     """
 
+    def write_scalar(path, item):
+        """
+        Writes a scalar item or string, replacing an existing dataset at the given path.
+        """
+        try:
+            h5file[path] = item
+        except (OSError, RuntimeError, ValueError):
+            del h5file[path]
+            h5file[path] = item
+
+    def write_array(path, item, compression: str = None):
+        """
+        Writes an array like item. Arrays with numerical data are chunked and compressed if a compression is given.
+        If a dataset already exists at the given path, it is overwritten in place if possible.
+        """
+        compress = isinstance(item, np.ndarray) and compression is not None and item.ndim > 0 and item.size > 0 \
+            and item.dtype.kind in "biufc"
+
+        if path in h5file:
+            existing = h5file[path]
+            if isinstance(existing, h5py.Dataset) and isinstance(item, np.ndarray) and \
+                    existing.dtype == item.dtype and existing.ndim == item.ndim and \
+                    (existing.compression is not None) == compress:
+                if existing.shape == item.shape:
+                    existing[...] = item
+                    return
+                if existing.chunks is not None and all(maximum is None or maximum >= size for maximum, size
+                                                       in zip(existing.maxshape, item.shape)):
+                    existing.resize(item.shape)
+                    existing[...] = item
+                    return
+            del h5file[path]
+
+        try:
+            if compress:
+                h5file.create_dataset(path, data=item, chunks=True, maxshape=(None, ) * item.ndim,
+                                      compression=compression,
+                                      compression_opts=compression_level if compression == "gzip" else None)
+            else:
+                h5file.create_dataset(path, data=item)
+        except RuntimeError as e:
+            logger.critical("item " + str(item) + " of type " + str(type(item)) +
+                            " was not serializable! Full exception: " + str(e))
+            raise e
+        except TypeError as e:
+            logger.critical("The key " + str(path) + " was not of the correct typing for HDF5 handling."
+                            "Make sure this key is not a tuple. " + str(item) + " " + str(type(item)))
+            raise e
+
     def data_grabber(file, path, data_dictionary, compression: str = None):
         """
         Helper function which recursively grabs data from dictionaries in order to store them into hdf5 groups.
@@ -38,52 +131,27 @@ def save_hdf5(save_item, file_path: str, file_dictionary_path: str = "/", file_c
             if isinstance(item, SerializableSIMPAClass):
                 serialized_item = item.serialize()
 
-                data_grabber(file, path + key + "/", serialized_item, file_compression)
+                data_grabber(file, path + key + "/", serialized_item, compression)
             elif not isinstance(item, (list, dict, type(None))):
 
                 if isinstance(item, (bytes, int, np.int64, float, str, bool, np.bool_)):
-                    try:
-                        h5file[path + key] = item
-                    except (OSError, RuntimeError, ValueError):
-                        del h5file[path + key]
-                        h5file[path + key] = item
+                    write_scalar(path + key, item)
                 else:
-                    c = None
-                    if isinstance(item, np.ndarray):
-                        c = compression
-
-                    try:
-                        h5file.create_dataset(path + key, data=item, compression=c)
-                    except (OSError, RuntimeError, ValueError):
-                        del h5file[path + key]
-                        try:
-                            h5file.create_dataset(path + key, data=item, compression=c)
-                        except RuntimeError as e:
-                            logger.critical("item " + str(item) + " of type " + str(type(item)) +
-                                            " was not serializable! Full exception: " + str(e))
-                            raise e
-                    except TypeError as e:
-                        logger.critical("The key " + str(key) + " was not of the correct typing for HDF5 handling."
-                                        "Make sure this key is not a tuple. " + str(item) + " " + str(type(item)))
-                        raise e
+                    write_array(path + key, item, compression)
             elif item is None:
-                try:
-                    h5file[path + key] = "None"
-                except (OSError, RuntimeError, ValueError):
-                    del h5file[path + key]
-                    h5file[path + key] = "None"
+                write_scalar(path + key, "None")
             elif isinstance(item, list):
                 list_dict = dict()
                 for i, list_item in enumerate(item):
                     list_dict[str(i)] = list_item
                 try:
-                    data_grabber(file, path + key + "/list/", list_dict, file_compression)
+                    data_grabber(file, path + key + "/list/", list_dict, compression)
                 except TypeError as e:
                     logger.critical("The key " + str(key) + " was not of the correct typing for HDF5 handling."
                                     "Make sure this key is not a tuple.")
                     raise e
             else:
-                data_grabber(file, path + key + "/", item, file_compression)
+                data_grabber(file, path + key + "/", item, compression)
 
     if file_dictionary_path == "/":
         writing_mode = "w"
@@ -92,15 +160,35 @@ def save_hdf5(save_item, file_path: str, file_dictionary_path: str = "/", file_c
 
     if isinstance(save_item, SerializableSIMPAClass):
         save_item = save_item.serialize()
-    if isinstance(save_item, dict):
-        with h5py.File(file_path, writing_mode) as h5file:
-            data_grabber(h5file, file_dictionary_path, save_item, file_compression)
-    else:
+    if not isinstance(save_item, dict):
         save_key = file_dictionary_path.split("/")[-2]
-        dictionary = {save_key: save_item}
+        save_item = {save_key: save_item}
         file_dictionary_path = "/".join(file_dictionary_path.split("/")[:-2]) + "/"
-        with h5py.File(file_path, writing_mode) as h5file:
-            data_grabber(h5file, file_dictionary_path, dictionary, file_compression)
+
+    data_store = get_in_memory_data_store(file_path)
+    if data_store is not None:
+        if writing_mode == "w":
+            data_store.clear()
+        else:
+            save_item = data_store.split(save_item, file_dictionary_path)
+            if len(save_item) == 0:
+                return
+
+    # track free space persistently, such that space freed by deleted datasets is reused when writing later on
+    create_file = writing_mode == "w" or not os.path.exists(file_path)
+    file_creation_arguments = dict(fs_strategy="fsm", fs_persist=True) if create_file else dict()
+    if create_file and writing_mode == "a":
+        writing_mode = "x"
+    with h5py.File(file_path, writing_mode, **file_creation_arguments) as h5file:
+        if create_file and file_compression is not None:
+            h5file.attrs[FILE_COMPRESSION_ATTRIBUTE] = file_compression
+            if compression_level is not None:
+                h5file.attrs[FILE_COMPRESSION_LEVEL_ATTRIBUTE] = compression_level
+        elif file_compression is None and FILE_COMPRESSION_ATTRIBUTE in h5file.attrs:
+            file_compression = h5file.attrs[FILE_COMPRESSION_ATTRIBUTE]
+            if compression_level is None and FILE_COMPRESSION_LEVEL_ATTRIBUTE in h5file.attrs:
+                compression_level = int(h5file.attrs[FILE_COMPRESSION_LEVEL_ATTRIBUTE])
+        data_grabber(h5file, file_dictionary_path, save_item, file_compression)
 
 
 def load_hdf5(file_path, file_dictionary_path="/"):
@@ -112,6 +200,9 @@ def load_hdf5(file_path, file_dictionary_path="/"):
     :returns: Dictionary
     :rtype: dict
     """
+    data_store = get_in_memory_data_store(file_path)
+    if data_store is not None:
+        data_store.persist(file_dictionary_path)
 
     def data_grabber(file, path):
         """
@@ -162,14 +253,111 @@ def load_hdf5(file_path, file_dictionary_path="/"):
         return data_grabber(h5file, file_dictionary_path)
 
 
-def load_data_field(file_path, data_field, wavelength=None):
-    dict_path = generate_dict_path(data_field, wavelength=wavelength)
-    data_field_key = dict_path.split("/")[-2]
-    dict_path = "/".join(dict_path.split("/")[:-2]) + "/"
-    data = load_hdf5(file_path, dict_path)[data_field_key]
-    return data
+def load_data_field(file_path, data_field, wavelength=None, selection=None):
+    """
+    Loads a single data field from a SIMPA output file. Only the dataset of the requested data field (and wavelength)
+    is read from the file, such that the read time does not depend on the number of other data fields or wavelengths
+    stored in the file.
+
+    :param file_path: Path of the SIMPA output file.
+    :param data_field: Data field to load, e.g. Tags.DATA_FIELD_FLUENCE.
+    :param wavelength: Wavelength of the data field, required for wavelength dependent data fields.
+    :param selection: Optional hyperslab selection (e.g. np.s_[:, 10, :]) that is read instead of the whole dataset.
+    :returns: the data field
+    :raises KeyError: if the data field is not in the file
+    """
+    dataset_path = generate_dict_path(data_field, wavelength=wavelength)[:-1]
+    data_store = get_in_memory_data_store(file_path)
+    if data_store is not None:
+        data = data_store.get(dataset_path, selection)
+        if data is not None:
+            return data
+        # arrays of a group that are still in memory need to be in the file before the group is read
+        data_store.persist(dataset_path)
+    with h5py.File(file_path, "r") as h5file:
+        if dataset_path not in h5file:
+            raise KeyError(f"The data field {dataset_path} is not in the file {file_path}")
+        item = h5file[dataset_path]
+        if isinstance(item, h5py.Dataset):
+            data = item[()] if selection is None else item[selection]
+            if isinstance(data, bytes):
+                data = data.decode("utf-8")
+            elif isinstance(data, np.bool_):
+                data = bool(data)
+            return data
+    if selection is not None:
+        raise ValueError(f"A selection can only be applied to datasets, but {dataset_path} is a group.")
+    return load_hdf5(file_path, dataset_path + "/")
 
 
-def save_data_field(data, file_path, data_field, wavelength=None):
+def save_data_field(data, file_path, data_field, wavelength=None, selection=None):
+    """
+    Saves a single data field into a SIMPA output file. Only the dataset of the given data field (and wavelength) is
+    written.
+
+    :param data: Data to save.
+    :param file_path: Path of the SIMPA output file.
+    :param data_field: Data field to save, e.g. Tags.DATA_FIELD_FLUENCE.
+    :param wavelength: Wavelength of the data field, required for wavelength dependent data fields.
+    :param selection: Optional hyperslab selection (e.g. np.s_[:, 10, :]) of an existing dataset that is overwritten
+        with `data`, leaving the rest of the dataset untouched.
+    """
     dict_path = generate_dict_path(data_field, wavelength=wavelength)
-    save_hdf5(data, file_path, dict_path)
+    if selection is None:
+        save_hdf5(data, file_path, dict_path)
+        return
+    data_store = get_in_memory_data_store(file_path)
+    if data_store is not None and data_store.set_selection(dict_path, selection, data):
+        return
+    with h5py.File(file_path, "a") as h5file:
+        if dict_path[:-1] not in h5file:
+            raise KeyError(f"A selection can only be written into an existing data field, but {dict_path[:-1]} "
+                           f"is not in the file {file_path}")
+        h5file[dict_path[:-1]][selection] = data
+
+
+def append_data_field(data: np.ndarray, file_path: str, data_field, wavelength=None, replace: bool = False):
+    """
+    Appends an array along its first axis to a data field of a SIMPA output file. The data field is stored as a
+    chunked dataset that is resized with every append, such that large data (e.g. the photons of several
+    illuminations) can be written piece by piece without keeping all of it in memory.
+
+    :param data: Array to append, all dimensions but the first must match the existing data field.
+    :param file_path: Path of the SIMPA output file.
+    :param data_field: Data field to append to, e.g. Tags.DATA_FIELD_PHOTON_EXIT_POS.
+    :param wavelength: Wavelength of the data field, required for wavelength dependent data fields.
+    :param replace: If True, an existing data field is replaced by the given data instead of appended to.
+    :raises ValueError: if the data cannot be appended to the existing data field.
+    """
+    data = np.asarray(data)
+    if data.ndim == 0:
+        raise ValueError("Only arrays with at least one dimension can be appended to a data field.")
+    dataset_path = generate_dict_path(data_field, wavelength=wavelength)[:-1]
+    data_store = get_in_memory_data_store(file_path)
+    if data_store is not None:
+        # the data is written into the file directly, so the data field must not be kept in memory
+        if replace:
+            data_store.discard(dataset_path)
+        else:
+            data_store.persist(dataset_path)
+
+    create_file = not os.path.exists(file_path)
+    file_creation_arguments = dict(fs_strategy="fsm", fs_persist=True) if create_file else dict()
+    with h5py.File(file_path, "x" if create_file else "a", **file_creation_arguments) as h5file:
+        if replace and dataset_path in h5file:
+            del h5file[dataset_path]
+        if dataset_path not in h5file:
+            compression, compression_level = get_file_compression(h5file)
+            # chunks of at most about a megabyte
+            row_size = max(1, int(np.prod(data.shape[1:])) * data.dtype.itemsize)
+            chunks = (max(1, min(len(data), 2 ** 20 // row_size)), ) + data.shape[1:]
+            h5file.create_dataset(dataset_path, data=data, chunks=chunks, maxshape=(None, ) + data.shape[1:],
+                                  compression=compression, compression_opts=compression_level)
+            return
+        dataset = h5file[dataset_path]
+        if not isinstance(dataset, h5py.Dataset) or dataset.chunks is None or dataset.maxshape[0] is not None or \
+                dataset.shape[1:] != data.shape[1:]:
+            raise ValueError(f"The data with shape {data.shape} cannot be appended to {dataset_path} in {file_path}.")
+        number_of_rows = dataset.shape[0]
+        dataset.resize(number_of_rows + len(data), axis=0)
+        dataset[number_of_rows:] = data
@@ -6,7 +6,7 @@ import os
 import uuid
 
 from simpa.log import Logger
-from simpa.io_handling import load_data_field, load_hdf5
+from simpa.io_handling import load_data_field, open_hdf5
 from simpa.core.device_digital_twins import DigitalDeviceTwinBase, PhotoacousticDevice
 from simpa.utils import Settings, Tags
 
@@ -39,11 +39,11 @@ class IpascSimpaAdapter(BaseAdapter):
 
         # checking SIMPA settings dictionary
         if settings is None:
-            settings = load_hdf5(hdf5_file_path)
-            if Tags.SETTINGS not in settings:
-                self.logger.error("Unable to recover settings dictionary. Please supply a valid settings dictionary for a "
-                                  "successful export.")
-            settings = settings[Tags.SETTINGS]
+            with open_hdf5(hdf5_file_path) as file:
+                if Tags.SETTINGS not in file:
+                    self.logger.error("Unable to recover settings dictionary. Please supply a valid settings "
+                                      "dictionary for a successful export.")
+                settings = file[Tags.SETTINGS]
         if settings is None or not isinstance(settings, Settings):
             self.logger.error("No settings found at Tags.SETTINGS in the loaded HDF5 file. "
                               "Please supply a valid settings dictionary for a successful export.")
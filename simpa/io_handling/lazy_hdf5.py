@@ -0,0 +1,177 @@
+# SPDX-FileCopyrightText: 2021 Division of Intelligent Medical Systems, DKFZ
+# SPDX-FileCopyrightText: 2021 Janek Groehl
+# SPDX-License-Identifier: MIT
+
+from collections.abc import Mapping
+import h5py
+import numpy as np
+from simpa.io_handling.io_hdf5 import load_hdf5, get_in_memory_data_store
+from simpa.io_handling.serialization import SERIALIZATION_MAP
+
+
+def _decode(value):
+    """
+    Converts a value that was read from an hdf5 dataset in the same way as :meth:`load_hdf5` does.
+    """
+    if isinstance(value, bytes):
+        return value.decode("utf-8")
+    if isinstance(value, np.bool_):
+        return bool(value)
+    return value
+
+
+class LazyHDF5Dataset(object):
+    """
+    Array proxy of an hdf5 dataset. Data is only read from the file when the proxy is sliced or converted into a
+    numpy array, e.g. `dataset[:, 10, :]` only reads a single slice of a volume.
+    Contiguous uncompressed datasets are memory mapped, such that slicing them does not copy any data.
+    """
+
+    def __init__(self, dataset: h5py.Dataset, file_path: str):
+        """
+        :param dataset: the hdf5 dataset that is accessed through this proxy.
+        :param file_path: path of the hdf5 file that contains the dataset.
+        """
+        self.dataset = dataset
+        self.name = dataset.name
+        self.shape = dataset.shape
+        self.dtype = dataset.dtype
+        self.ndim = dataset.ndim
+        self.size = dataset.size
+        self.memory_map = None
+
+        offset = dataset.id.get_offset()
+        if (offset is not None and dataset.size > 0 and dataset.chunks is None and dataset.compression is None
+                and not dataset.external and dataset.dtype.kind in "biufc"):
+            self.memory_map = np.memmap(file_path, dtype=dataset.dtype, mode="r", offset=offset, shape=dataset.shape)
+
+    @property
+    def is_memory_mapped(self) -> bool:
+        """
+        True if the dataset is accessed through a memory map of the file.
+        """
+        return self.memory_map is not None
+
+    def __getitem__(self, selection):
+        if self.memory_map is not None:
+            return np.asarray(self.memory_map[selection])
+        return self.dataset[selection]
+
+    def __array__(self, dtype=None, copy=None):
+        data = self[()]
+        if dtype is not None:
+            data = data.astype(dtype, copy=False)
+        return data
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __repr__(self):
+        return f"<LazyHDF5Dataset {self.name} shape={self.shape} dtype={self.dtype}>"
+
+
+class LazyHDF5Group(Mapping):
+    """
+    Dictionary-like view on a group of a SIMPA hdf5 file. Items are only resolved when they are accessed:
+
+    - Numerical arrays are returned as :class:`LazyHDF5Dataset` proxies.
+    - Scalars and strings are read directly.
+    - Serialized SIMPA objects like :class:`Settings` or devices are deserialized when they are accessed.
+    - Lists are returned as lists of their (lazily resolved) items.
+
+    Keys can be given as strings or as tags, in which case the first entry of the tag is used.
+    """
+
+    def __init__(self, group: h5py.Group, file_path: str):
+        """
+        :param group: the hdf5 group that is accessed through this view.
+        :param file_path: path of the hdf5 file that contains the group.
+        """
+        self.group = group
+        self.file_path = file_path
+
+    def _resolve(self, item):
+        if isinstance(item, h5py.Dataset):
+            if item.shape == () or item.shape is None or item.dtype.kind not in "biufc":
+                return _decode(item[()])
+            return LazyHDF5Dataset(item, self.file_path)
+        if any(key in SERIALIZATION_MAP for key in item.keys()):
+            return load_hdf5(self.file_path, item.name.rstrip("/") + "/")
+        if "list" in item and isinstance(item["list"], h5py.Group):
+            list_group = item["list"]
+            return [self._resolve(list_group[str(index)]) for index in range(len(list_group))]
+        return LazyHDF5Group(item, self.file_path)
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            key = key[0]
+        key = str(key)
+        if key not in self.group:
+            raise KeyError(key)
+        return self._resolve(self.group[key])
+
+    def __contains__(self, key):
+        if isinstance(key, tuple):
+            key = key[0]
+        return str(key) in self.group
+
+    def __iter__(self):
+        return iter(self.group.keys())
+
+    def __len__(self):
+        return len(self.group)
+
+    def load(self):
+        """
+        Loads the complete content of this group into memory.
+
+        :returns: the same dictionary that :meth:`load_hdf5` returns for this group.
+        """
+        return load_hdf5(self.file_path, self.group.name.rstrip("/") + "/")
+
+    def __repr__(self):
+        return f"<LazyHDF5Group {self.group.name} keys={list(self.group.keys())}>"
+
+
+class LazyHDF5File(LazyHDF5Group):
+    """
+    Read-only, lazily evaluated view on a complete SIMPA hdf5 file.
+    The file stays open until :meth:`close` is called or the `with` block is left. Proxies of datasets that are not
+    memory mapped can only be read while the file is open.
+
+    Usage::
+
+        with open_hdf5(path) as file:
+            fluence_slice = get_data_field_from_simpa_output(file, Tags.DATA_FIELD_FLUENCE, 800)[:, 10, :]
+            settings = file[Tags.SETTINGS]
+    """
+
+    def __init__(self, file_path: str):
+        """
+        :param file_path: path of the hdf5 file.
+        """
+        super(LazyHDF5File, self).__init__(h5py.File(file_path, "r"), file_path)
+
+    def close(self):
+        self.group.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def open_hdf5(file_path: str) -> LazyHDF5File:
+    """
+    Opens an hdf5 file for lazy, dictionary-like access. In contrast to :meth:`load_hdf5`, no data is read until it
+    is accessed, such that single slices of large multi-wavelength simulations can be inspected without loading the
+    whole file into memory.
+
+    :param file_path: Path of the file to open.
+    :returns: LazyHDF5File
+    """
+    data_store = get_in_memory_data_store(file_path)
+    if data_store is not None:
+        data_store.persist()
+    return LazyHDF5File(file_path)
@@ -4,7 +4,6 @@
 
 
 import numpy as np
-from scipy.interpolate import interp1d
 
 
 def calculate_oxygenation(molecule_list):
@@ -76,6 +75,7 @@ def create_spline_for_range(xmin_mm=0, xmax_mm=10, maximum_y_elevation_mm=1, spa
 
     constraints = constraints - np.max(constraints)
 
+    from scipy.interpolate import interp1d
     spline = interp1d(locations, constraints, order)
 
     max_el = np.min(spline(np.arange(0, int(round(xmax_voxels)), 1) * spacing))
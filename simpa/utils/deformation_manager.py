@@ -2,10 +2,7 @@
 # SPDX-FileCopyrightText: 2021 Janek Groehl
 # SPDX-License-Identifier: MIT
 
-import matplotlib.pyplot as plt
 from simpa.utils import Tags
-from scipy.interpolate import interp2d
-from scipy.ndimage import gaussian_filter
 import numpy as np
 
 
@@ -18,6 +15,7 @@ def create_deformation_settings(bounds_mm, maximum_z_elevation_mm=1, filter_sigm
     number_of_boundary_points = np.random.randint(4, 6, size=2)
     surface_elevations = np.random.random(size=(number_of_boundary_points[0],
                                                 number_of_boundary_points[1]))
+    from scipy.ndimage import gaussian_filter
     surface_elevations = gaussian_filter(surface_elevations, sigma=filter_sigma)
     surface_elevations = surface_elevations / np.max(surface_elevations)
 
@@ -66,11 +64,13 @@ def get_functional_from_deformation_settings(deformation_settings: dict):
     z_elevations_mm = deformation_settings[Tags.DEFORMATION_Z_ELEVATIONS_MM]
     order = "cubic"
 
+    from scipy.interpolate import interp2d
     functional_mm = interp2d(x_coordinates_mm, y_coordinates_mm, z_elevations_mm, kind=order)
     return functional_mm
 
 
 if __name__ == "__main__":
+    import matplotlib.pyplot as plt
     x_bounds = [0, 9]
     y_bounds = [0, 9]
     max_elevation = 3
@@ -17,6 +17,9 @@ def generate_dict_path(data_field, wavelength: (int, float) = None) -> str:
     if data_field in [Tags.SIMULATIONS, Tags.SETTINGS, Tags.DIGITAL_DEVICE, Tags.SIMULATION_PIPELINE]:
         return "/" + data_field + "/"
 
+    if data_field == Tags.SIMULATION_PROFILE:
+        return "/" + data_field + "/" + ("" if wavelength is None else f"{wavelength}/")
+
     wavelength_dependent_properties = [Tags.DATA_FIELD_ABSORPTION_PER_CM,
                                        Tags.DATA_FIELD_SCATTERING_PER_CM,
                                        Tags.DATA_FIELD_ANISOTROPY]
@@ -3,10 +3,9 @@
 # SPDX-License-Identifier: MIT
 
 import os
-import inspect
 import glob
+from functools import lru_cache
 import numpy as np
-import matplotlib.pylab as plt
 from simpa.utils.libraries.literature_values import OpticalTissueProperties
 from simpa.utils.serializer import SerializableSIMPAClass
 
@@ -69,22 +68,49 @@ class Spectrum(SerializableSIMPAClass, object):
         return deserialized_spectrum
 
 
+@lru_cache(maxsize=None)
+def _load_spectrum_file(file_path: str, modification_time: float):
+    """
+    Loads the wavelengths and values of a spectrum file. The content of every file is only read once per process,
+    the modification time is part of the cache key, such that changed files are read again.
+    """
+    numpy_data = np.load(file_path)
+    return numpy_data["wavelengths"], numpy_data["values"]
+
+
 class SpectraLibrary(object):
+    """
+    Library of the spectra that are stored as .npz files in a folder. The spectrum files are only loaded when they
+    are accessed: looking up a spectrum by name only loads the corresponding file and every file is only read once.
+    """
 
     def __init__(self, folder_name: str, additional_folder_path: str = None):
-        self.spectra = list()
+        self.spectrum_files = list()
+        self._spectra = None
         self.add_spectra_from_folder(folder_name)
         if additional_folder_path is not None:
             self.add_spectra_from_folder(additional_folder_path)
 
     def add_spectra_from_folder(self, folder_name):
-        base_path = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
-        for absorption_spectrum in glob.glob(os.path.join(base_path, folder_name, "*.npz")):
-            name = absorption_spectrum.split(os.path.sep)[-1][:-4]
-            numpy_data = np.load(absorption_spectrum)
-            values = numpy_data["values"]
-            wavelengths = numpy_data["wavelengths"]
-            self.spectra.append(Spectrum(spectrum_name=name, values=values, wavelengths=wavelengths))
+        base_path = os.path.dirname(os.path.abspath(__file__))
+        for absorption_spectrum in sorted(glob.glob(os.path.join(base_path, folder_name, "*.npz"))):
+            name = os.path.basename(absorption_spectrum)[:-4]
+            self.spectrum_files.append((name, absorption_spectrum))
+        self._spectra = None
+
+    @staticmethod
+    def load_spectrum(spectrum_name: str, file_path: str) -> "Spectrum":
+        wavelengths, values = _load_spectrum_file(file_path, os.path.getmtime(file_path))
+        return Spectrum(spectrum_name=spectrum_name, values=values.copy(), wavelengths=wavelengths.copy())
+
+    @property
+    def spectra(self) -> list:
+        """
+        All spectra of the library, which are loaded on first access.
+        """
+        if self._spectra is None:
+            self._spectra = [self.load_spectrum(name, file_path) for name, file_path in self.spectrum_files]
+        return self._spectra
 
     def __next__(self):
         if self.i > 0:
@@ -97,9 +123,13 @@ class SpectraLibrary(object):
         return self
 
     def get_spectra_names(self):
-        return [spectrum.spectrum_name for spectrum in self]
+        return [name for name, _ in reversed(self.spectrum_files)]
 
     def get_spectrum_by_name(self, spectrum_name: str) -> Spectrum:
+        if self._spectra is None:
+            for name, file_path in reversed(self.spectrum_files):
+                if name == spectrum_name:
+                    return self.load_spectrum(name, file_path)
         for spectrum in self:
             if spectrum.spectrum_name == spectrum_name:
                 return spectrum
@@ -163,6 +193,7 @@ def view_saved_spectra(save_path=None, mode="absorption"):
     :param save_path: If not None, then the figure will be saved as a png file to the destination.
     :param mode: string that is "absorption", "scattering", or "anisotropy"
     """
+    import matplotlib.pylab as plt
     plt.figure(figsize=(11, 8))
     if mode == "absorption":
         for spectrum in AbsorptionSpectrumLibrary():
@@ -20,12 +20,19 @@ class GeometricalStructure:
     Most of the GeometricalStructures implement a partial volume effect. So if a voxel has the value 1, it is completely
     enclosed by the GeometricalStructure. If a voxel has a value between 0 and 1, that fraction of the volume is
     occupied by the GeometricalStructure. If a voxel has the value 0, it is outside of the GeometricalStructure.
+
+    Internally, only the bounding box of all enclosed voxels is stored: self.bounding_box is a tuple of slices into
+    the simulation volume and self.local_geometrical_volume holds the volume fractions within these slices. The
+    memory needed by a structure therefore scales with its size and not with the size of the simulation volume.
+    self.geometrical_volume creates the full-size array on demand.
     """
 
     def __init__(self, global_settings: Settings,
                  single_structure_settings: Settings = None):
 
         self.logger = Logger()
+        self.bounding_box = None
+        self.local_geometrical_volume = None
 
         self.voxel_spacing = global_settings[Tags.SPACING_MM]
         volume_x_dim = int(np.round(global_settings[Tags.DIM_VOLUME_X_MM] / self.voxel_spacing))
@@ -67,16 +74,56 @@ class GeometricalStructure:
         self.molecule_composition = single_structure_settings[Tags.MOLECULE_COMPOSITION]
         self.molecule_composition.update_internal_properties()
 
-        self.geometrical_volume = np.zeros(self.volume_dimensions_voxels)
         self.params = self.get_params_from_settings(single_structure_settings)
         self.fill_internal_volume()
 
+    @property
+    def geometrical_volume(self):
+        """
+        The volume fractions of the GeometricalStructure as an array with the size of the simulation volume.
+        This array is created on every access, so use self.bounding_box and self.local_geometrical_volume where
+        possible.
+        """
+        if self.local_geometrical_volume is None:
+            return None
+        geometrical_volume = np.zeros(self.volume_dimensions_voxels, dtype=self.local_geometrical_volume.dtype)
+        geometrical_volume[self.bounding_box] = self.local_geometrical_volume
+        return geometrical_volume
+
+    @geometrical_volume.setter
+    def geometrical_volume(self, geometrical_volume):
+        if geometrical_volume is None:
+            self.bounding_box = None
+            self.local_geometrical_volume = None
+            return
+        self.bounding_box = self.get_bounding_box(geometrical_volume > 0)
+        self.local_geometrical_volume = geometrical_volume[self.bounding_box].copy()
+
     def fill_internal_volume(self):
         """
-        Fills self.geometrical_volume of the GeometricalStructure.
+        Fills self.bounding_box and self.local_geometrical_volume of the GeometricalStructure.
         """
         indices, values = self.get_enclosed_indices()
-        self.geometrical_volume[indices] = values
+        self.bounding_box = self.get_bounding_box(indices)
+        self.local_geometrical_volume = np.zeros([bounds.stop - bounds.start for bounds in self.bounding_box])
+        # all enclosed voxels lie within the bounding box, so the order of the values is the same for both masks
+        self.local_geometrical_volume[indices[self.bounding_box]] = values
+
+    @staticmethod
+    def get_bounding_box(mask: np.ndarray) -> tuple:
+        """
+        Gets the smallest box that contains all voxels of the given mask.
+        :param mask: boolean array with the size of the simulation volume
+        :return: tuple of slices, one for every dimension of the mask. The slices are empty if no voxel is set.
+        """
+        bounding_box = list()
+        for axis in range(mask.ndim):
+            other_axes = tuple(other_axis for other_axis in range(mask.ndim) if other_axis != axis)
+            occupied_indices = np.nonzero(np.any(mask, axis=other_axes))[0]
+            if len(occupied_indices) == 0:
+                return tuple(slice(0, 0) for _ in range(mask.ndim))
+            bounding_box.append(slice(int(occupied_indices[0]), int(occupied_indices[-1]) + 1))
+        return tuple(bounding_box)
 
     @abstractmethod
     def get_enclosed_indices(self):
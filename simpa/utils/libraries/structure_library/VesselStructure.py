@@ -126,10 +126,6 @@ class VesselStructure(GeometricalStructure):
 
         position_array = np.array(position_array)
 
-        x, y, z = np.ogrid[0:self.volume_dimensions_voxels[0],
-                           0:self.volume_dimensions_voxels[1],
-                           0:self.volume_dimensions_voxels[2]]
-
         volume_fractions = np.zeros(self.volume_dimensions_voxels)
 
         if partial_volume:
@@ -138,16 +134,31 @@ class VesselStructure(GeometricalStructure):
             radius_margin = 0.7071
 
         for position, radius in zip(position_array, radius_array):
+            # only voxels closer than radius + 2 * radius_margin to the sample are changed, so the distances are only
+            # evaluated within the bounding box of that sphere.
+            outer_radius = radius + 2 * radius_margin
+            lower_corner = np.maximum(np.floor(position - outer_radius).astype(int), 0)
+            upper_corner = np.minimum(np.ceil(position + outer_radius).astype(int) + 1, self.volume_dimensions_voxels)
+            if np.any(upper_corner <= lower_corner):
+                continue
+
+            x, y, z = np.ogrid[lower_corner[0]:upper_corner[0],
+                               lower_corner[1]:upper_corner[1],
+                               lower_corner[2]:upper_corner[2]]
+            local_volume_fractions = volume_fractions[lower_corner[0]:upper_corner[0],
+                                                      lower_corner[1]:upper_corner[1],
+                                                      lower_corner[2]:upper_corner[2]]
+
             target_radius = np.sqrt((x - position[0]) ** 2 + (y - position[1]) ** 2 + (z - position[2]) ** 2)
 
             filled_mask = target_radius <= radius - 1 + radius_margin
             border_mask = (target_radius > radius - 1 + radius_margin) & \
                           (target_radius < radius + 2 * radius_margin)
 
-            volume_fractions[filled_mask] = 1
-            old_border_values = volume_fractions[border_mask]
+            local_volume_fractions[filled_mask] = 1
+            old_border_values = local_volume_fractions[border_mask]
             new_border_values = 1 - (target_radius - (radius - radius_margin))[border_mask]
-            volume_fractions[border_mask] = np.maximum(old_border_values, new_border_values)
+            local_volume_fractions[border_mask] = np.maximum(old_border_values, new_border_values)
 
         return volume_fractions
 
@@ -0,0 +1,245 @@
+# SPDX-FileCopyrightText: 2021 Division of Intelligent Medical Systems, DKFZ
+# SPDX-FileCopyrightText: 2021 Janek Groehl
+# SPDX-License-Identifier: MIT
+
+import os
+import sys
+import time
+import numpy as np
+from simpa.io_handling.io_hdf5 import load_hdf5, save_hdf5
+from simpa.utils.dict_path_manager import generate_dict_path
+from simpa.utils.tags import Tags
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
+
+# profilers whose `with` block is currently running, innermost last
+_active_stage_profilers = list()
+
+
+def _read_io_counters() -> tuple:
+    """
+    :return: tuple with the number of bytes that the process has read and written (including cached reads and
+        writes) or (nan, nan) if the counters are not available on this platform.
+    """
+    try:
+        with open("/proc/self/io") as io_file:
+            counters = dict(line.split(":") for line in io_file)
+        return int(counters["rchar"]), int(counters["wchar"])
+    except (OSError, KeyError, ValueError):
+        return np.nan, np.nan
+
+
+def _reset_peak_memory() -> bool:
+    """
+    Resets the peak resident set size of the process, such that the peak memory of a single stage can be measured.
+
+    :return: True if the peak memory could be reset (only possible on Linux).
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs_file:
+            clear_refs_file.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _read_peak_memory_in_mb(since_reset: bool) -> float:
+    """
+    :param since_reset: True if the peak memory was reset with _reset_peak_memory.
+    :return: the peak resident set size of the process in MB (since the last reset, if possible) or nan if it is not
+        available on this platform.
+    """
+    if since_reset:
+        try:
+            with open("/proc/self/status") as status_file:
+                for line in status_file:
+                    if line.startswith("VmHWM:"):
+                        return int(line.split()[1]) / 1024
+        except (OSError, ValueError, IndexError):
+            pass
+    if resource is not None:
+        maximum_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is given in bytes on macOS and in kB otherwise
+        return maximum_rss / 1024 ** 2 if sys.platform == "darwin" else maximum_rss / 1024
+    return np.nan
+
+
+class StageProfile(object):
+    """
+    Resources that were used by a single pipeline element for a single wavelength:
+
+    - wall_time_in_s: elapsed wall clock time.
+    - cpu_time_in_s: user and system CPU time of the SIMPA process and of all child processes (e.g. MCX or
+      MATLAB) that finished during the stage.
+    - peak_memory_in_mb: peak resident set size of the SIMPA process during the stage. Where the peak cannot be
+      reset (all platforms but Linux) this is the peak since the start of the process, nan on Windows.
+    - bytes_read / bytes_written: bytes that the SIMPA process read and wrote, including reads from the page cache,
+      nan where this is not available (all platforms but Linux).
+    - details: dictionary with further records of the pipeline element, e.g. the resolution levels of IterativeqPAI.
+      A pipeline element adds them to the profile of its stage, which it gets with `get_current_stage_profile`.
+    """
+
+    FIELDS = ["stage", "wavelength", "wall_time_in_s", "cpu_time_in_s", "peak_memory_in_mb", "bytes_read",
+              "bytes_written", "details"]
+
+    def __init__(self, stage: str, wavelength=None, wall_time_in_s: float = np.nan, cpu_time_in_s: float = np.nan,
+                 peak_memory_in_mb: float = np.nan, bytes_read: float = np.nan, bytes_written: float = np.nan,
+                 details: dict = None):
+        self.stage = stage
+        self.wavelength = wavelength
+        self.wall_time_in_s = wall_time_in_s
+        self.cpu_time_in_s = cpu_time_in_s
+        self.peak_memory_in_mb = peak_memory_in_mb
+        self.bytes_read = bytes_read
+        self.bytes_written = bytes_written
+        self.details = dict() if details is None else details
+
+    def to_dict(self) -> dict:
+        return {field: getattr(self, field) for field in self.FIELDS
+                if getattr(self, field) is not None and not (field == "details" and not self.details)}
+
+    @staticmethod
+    def from_dict(dictionary: dict):
+        return StageProfile(**{field: dictionary[field] for field in StageProfile.FIELDS if field in dictionary})
+
+    def __repr__(self):
+        return (f"StageProfile({self.stage}, wavelength={self.wavelength}, wall_time_in_s={self.wall_time_in_s:.3f}, "
+                f"cpu_time_in_s={self.cpu_time_in_s:.3f}, peak_memory_in_mb={self.peak_memory_in_mb:.1f}, "
+                f"bytes_read={self.bytes_read}, bytes_written={self.bytes_written})")
+
+
+class StageProfiler(object):
+    """
+    Context manager that measures the resources that are used within its `with` block::
+
+        with StageProfiler("OpticalForwardModel", 800) as profiler:
+            optical_adapter.run(device)
+        print(profiler.profile.wall_time_in_s)
+
+    Profilers can be nested. Only the outermost profiler resets the peak memory, so the peak memory of an inner
+    profiler is the peak since the start of the outermost one.
+    """
+
+    def __init__(self, stage: str, wavelength=None):
+        self.profile = StageProfile(stage, wavelength)
+        self._start_times = None
+        self._start_io = None
+        self._peak_memory_was_reset = False
+
+    def __enter__(self):
+        if _active_stage_profilers:
+            # resetting the peak memory would falsify the peak memory of the enclosing stages
+            self._peak_memory_was_reset = _active_stage_profilers[0]._peak_memory_was_reset
+        else:
+            self._peak_memory_was_reset = _reset_peak_memory()
+        _active_stage_profilers.append(self)
+        self._start_io = _read_io_counters()
+        self._start_times = os.times()
+        self._start_wall_time = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        wall_time = time.perf_counter() - self._start_wall_time
+        end_times = os.times()
+        end_io = _read_io_counters()
+        self.profile.wall_time_in_s = wall_time
+        # user, system, children user and children system time
+        self.profile.cpu_time_in_s = sum(end_times[index] - self._start_times[index] for index in range(4))
+        self.profile.peak_memory_in_mb = _read_peak_memory_in_mb(self._peak_memory_was_reset)
+        self.profile.bytes_read = end_io[0] - self._start_io[0]
+        self.profile.bytes_written = end_io[1] - self._start_io[1]
+        _active_stage_profilers.remove(self)
+        return False
+
+
+def get_current_stage_profile():
+    """
+    :return: the StageProfile of the innermost running StageProfiler, e.g. the stage of the pipeline element that is
+        currently run by `simulate`, or None if no stage is profiled.
+    """
+    return _active_stage_profilers[-1].profile if _active_stage_profilers else None
+
+
+class SimulationProfile(object):
+    """
+    Profiles of all stages of a simulation, in the order in which they were run. The profile of a simulation is
+    returned by `simulate` and stored in the SIMPA output file under Tags.SIMULATION_PROFILE, from where it can be
+    loaded with `SimulationProfile.load`.
+    """
+
+    def __init__(self, stages: list = None):
+        self.stages = list() if stages is None else list(stages)
+
+    def add(self, stage_profile: StageProfile):
+        self.stages.append(stage_profile)
+
+    def extend(self, simulation_profile):
+        self.stages.extend(simulation_profile.stages)
+
+    def get_stages(self, stage: str = None, wavelength=None) -> list:
+        """
+        :return: the profiles of all stages with the given name and wavelength (if given).
+        """
+        return [profile for profile in self.stages if (stage is None or profile.stage == stage) and
+                (wavelength is None or profile.wavelength == wavelength)]
+
+    @property
+    def wall_time_in_s(self) -> float:
+        return sum(profile.wall_time_in_s for profile in self.stages)
+
+    @property
+    def cpu_time_in_s(self) -> float:
+        return sum(profile.cpu_time_in_s for profile in self.stages)
+
+    @property
+    def peak_memory_in_mb(self) -> float:
+        return max((profile.peak_memory_in_mb for profile in self.stages), default=np.nan)
+
+    def to_dict(self) -> dict:
+        """
+        :return: dictionary with the list of stage profiles for every wavelength, as it is stored in the hdf5 file.
+        """
+        wavelengths = dict()
+        for profile in self.stages:
+            wavelengths.setdefault(str(profile.wavelength), list()).append(profile.to_dict())
+        return wavelengths
+
+    @staticmethod
+    def from_dict(dictionary: dict):
+        profile = SimulationProfile()
+        for wavelength_profiles in dictionary.values():
+            for stage_profile in wavelength_profiles:
+                profile.add(StageProfile.from_dict(stage_profile))
+        return profile
+
+    def save(self, file_path: str):
+        """
+        Writes the profiles into the Tags.SIMULATION_PROFILE group of the given SIMPA output file.
+        """
+        save_hdf5(self.to_dict(), file_path, generate_dict_path(Tags.SIMULATION_PROFILE))
+
+    @staticmethod
+    def load(file_path: str):
+        """
+        Loads the profiles that are stored in a SIMPA output file.
+        """
+        return SimulationProfile.from_dict(load_hdf5(file_path, generate_dict_path(Tags.SIMULATION_PROFILE)))
+
+    def __len__(self):
+        return len(self.stages)
+
+    def __iter__(self):
+        return iter(self.stages)
+
+    def __str__(self):
+        lines = [f"{'stage':<40} {'wavelength':>10} {'wall [s]':>10} {'cpu [s]':>10} {'peak [MB]':>10} "
+                 f"{'read [MB]':>10} {'written [MB]':>12}"]
+        for profile in self.stages:
+            lines.append(f"{profile.stage:<40} {str(profile.wavelength):>10} {profile.wall_time_in_s:>10.3f} "
+                         f"{profile.cpu_time_in_s:>10.3f} {profile.peak_memory_in_mb:>10.1f} "
+                         f"{profile.bytes_read / 1024 ** 2:>10.1f} {profile.bytes_written / 1024 ** 2:>12.1f}")
+        return "\n".join(lines)
@@ -4,6 +4,36 @@
 
 import numpy as np
 import inspect
+from simpa.utils.tags import Tags
+
+# number of elements that are checked at once, such that the chunks stay in the CPU cache
+CHUNK_SIZE = 2 ** 16
+
+
+def get_caller_info(depth: int = 1):
+    """
+    Returns the frame info of a caller of the function that calls this method. Only the requested frame is
+    inspected, such that this is cheap compared to `inspect.stack()`.
+
+    :param depth: 1 for the caller of the calling function, 2 for its caller and so on.
+    :return: inspect.Traceback of the caller
+    """
+    frame = inspect.currentframe().f_back
+    for _ in range(depth):
+        if frame.f_back is None:
+            break
+        frame = frame.f_back
+    return inspect.getframeinfo(frame)
+
+
+def get_qa_assertion_sample_size(settings) -> int:
+    """
+    :param settings: the global settings of a simulation.
+    :return: the value of Tags.QA_ASSERTION_SAMPLE_SIZE if it is given in the settings, otherwise None.
+    """
+    if settings is not None and Tags.QA_ASSERTION_SAMPLE_SIZE in settings:
+        return settings[Tags.QA_ASSERTION_SAMPLE_SIZE]
+    return None
 
 
 def assert_equal_shapes(numpy_arrays: list):
@@ -26,11 +56,75 @@ def assert_equal_shapes(numpy_arrays: list):
     if not np.sum(np.abs(shapes)) <= 1e-5:
         raise AssertionError("The given volumes did not all have the same"
                              " dimensions. Please double check the simulation"
-                             f" parameters. Called from {inspect.stack()[1].function}")
+                             f" parameters. Called from {get_caller_info().function}")
 
 
-def assert_array_well_defined(array: np.ndarray, assume_non_negativity:bool = False,
-                              assume_positivity=False, array_name:str=None):
+def iterate_chunks(array: np.ndarray, sample_size: int = None):
+    """
+    Iterates over the values of an array in one dimensional chunks of at most CHUNK_SIZE elements. Contiguous arrays
+    are iterated without copying, other arrays are copied chunk by chunk.
+
+    :param array: the array to iterate over.
+    :param sample_size: if given and at most half of the size of the array, only every n-th value of the array is
+        iterated, such that approximately sample_size values that are evenly spread over the array are returned.
+    """
+    if array.size == 0:
+        return
+    step = array.size // max(int(sample_size), 1) if sample_size is not None else 1
+    if step > 1:
+        if array.flags.c_contiguous or array.flags.f_contiguous:
+            array = array.reshape(-1, order="A")[::step]
+        else:
+            array = array[np.unravel_index(np.arange(0, array.size, step), array.shape)]
+    if array.flags.c_contiguous or array.flags.f_contiguous:
+        flat_array = array.reshape(-1, order="A")
+        for start in range(0, array.size, CHUNK_SIZE):
+            yield flat_array[start:start + CHUNK_SIZE]
+        return
+    for chunk in np.nditer(array, flags=["external_loop", "buffered", "zerosize_ok"], buffersize=CHUNK_SIZE,
+                           order="K"):
+        yield chunk
+
+
+def find_ill_defined_values(array: np.ndarray, assume_non_negativity: bool = False,
+                            assume_positivity: bool = False, sample_size: int = None) -> str:
+    """
+    Checks all values of the array in a single chunked pass, without allocating temporary arrays of the size of
+    the input array. Minimum and maximum of every chunk propagate nan and reveal inf, -inf and the sign of the
+    values, only a chunk that fails the check is inspected in detail.
+
+    :return: None if all values are well-defined, otherwise a description of the first problem that was found.
+    """
+    array = np.asarray(array)
+    if array.dtype.kind not in "biufc":
+        array = array.astype(float)
+    if array.dtype.kind == "c":
+        # the real and imaginary parts need to be finite, the sign is checked for the real part
+        if assume_non_negativity or assume_positivity:
+            problem = find_ill_defined_values(array.real, assume_non_negativity, assume_positivity, sample_size)
+            if problem is not None:
+                return problem
+        return find_ill_defined_values(array.imag, sample_size=sample_size)
+    check_finite = array.dtype.kind == "f"
+    if not (check_finite or assume_non_negativity or assume_positivity):
+        return None
+
+    for chunk in iterate_chunks(array, sample_size):
+        minimum = chunk.min()
+        maximum = chunk.max() if check_finite else minimum
+        if check_finite and not (np.isfinite(minimum) and np.isfinite(maximum)):
+            if np.isinf(chunk).any():
+                return "The given array contained values that were inf or -inf."
+            return "The given array contained values that were nan."
+        if assume_positivity and minimum <= 0:
+            return "The given array contained values that were not positive."
+        if assume_non_negativity and minimum < 0:
+            return "The given array contained values that were negative."
+    return None
+
+
+def assert_array_well_defined(array: np.ndarray, assume_non_negativity: bool = False,
+                              assume_positivity=False, array_name: str = None, sample_size: int = None):
     """
     This method tests if all entries of the given array are well-defined (i.e. not np.inf, np.nan, or None).
     The method can be parametrised to be more strict.
@@ -39,27 +133,19 @@ def assert_array_well_defined(array: np.ndarray, assume_non_negativity:bool = Fa
     :param assume_non_negativity: bool (default: False). If true, all values must be greater than or equal to 0.
     :param assume_positivity: bool (default: False). If true, all values must be greater than 0.
     :param array_name: a string that gives more information in case of an error.
+    :param sample_size: int (default: None). If given, only (approximately) this many values, which are evenly
+        spread over the array, are tested. Arrays with less than twice as many values are tested completely.
+        This keeps the cost of the test constant for very large arrays but may miss single ill-defined values.
     :raises AssertionError: if there are any unexpected values in the given array.
     """
 
+    problem = find_ill_defined_values(array, assume_non_negativity, assume_positivity, sample_size)
+    if problem is None:
+        return
+
     if array_name is None:
         array_name = "'Not specified'"
-    caller = inspect.stack()[1]
+    caller = get_caller_info()
     stack_string = f" \n\tArray Name: {array_name} \n\tCaller: {caller.filename}" \
                    f" \n\tline: {caller.lineno} \n\tcode: {caller.code_context}"
-
-    if np.isinf(array).any() or np.isneginf(array).any():
-        raise AssertionError("The given array contained values that were inf or -inf."
-                             f" Info: {stack_string}.")
-
-    if np.isnan(array).any():
-        raise AssertionError("The given array contained values that were nan."
-                             f" Info: {stack_string}.")
-
-    if assume_positivity and (array <= 0).any():
-        raise AssertionError("The given array contained values that were not positive."
-                             f" Info: {stack_string}.")
-
-    if assume_non_negativity and (array < 0).any():
-        raise AssertionError("The given array contained values that were negative."
-                             f" Info: {stack_string}.")
+    raise AssertionError(f"{problem} Info: {stack_string}.")
@@ -42,6 +42,11 @@ class Settings(dict, SerializableSIMPAClass):
             raise ValueError("The value {} ({}) for the key '{}' has to be an instance of: "
                              "{}".format(value, type(value), key[0], key[1]))
 
+    def __reduce__(self):
+        # The dictionary items are restored before the instance attributes when unpickling, so the instance is
+        # created quietly first and the attributes (e.g. verbose) are restored afterwards.
+        return Settings, (None, False), self.__dict__, None, iter(self.items())
+
     def __contains__(self, item):
         if super().__contains__(item) is True:
             return True
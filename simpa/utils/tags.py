@@ -84,7 +84,52 @@ class Tags:
 
     DO_FILE_COMPRESSION = ("minimize_file_size", (bool, np.bool_))
     """
-    If not set to False, the HDF5 file will be optimised after the simulations are done.
+    If not set to False, the datasets in the HDF5 file are compressed while they are written.
+    Usage: simpa.core.simulation.simulate
+    """
+
+    FILE_COMPRESSION = ("file_compression", str)
+    """
+    Compression filter of the datasets in the HDF5 file if Tags.DO_FILE_COMPRESSION is not False.
+    Either "gzip" (default) or "lzf", which is faster but compresses less.\n
+    Usage: simpa.core.simulation.simulate
+    """
+
+    FILE_COMPRESSION_LEVEL = ("file_compression_level", (int, np.integer))
+    """
+    Compression level (0-9) of the gzip compression of the datasets in the HDF5 file. Default is 4.\n
+    Usage: simpa.core.simulation.simulate
+    """
+
+    PARALLEL_WAVELENGTH_EXECUTION = ("parallel_wavelength_execution", (bool, np.bool_))
+    """
+    If True, the simulation pipeline is run for all wavelengths in parallel worker processes. Every worker owns its
+    own copy of the settings and the digital device twin and writes into a temporary HDF5 file that is merged into
+    the SIMPA output once all wavelengths are done. False by default.\n
+    Usage: simpa.core.simulation.simulate
+    """
+
+    NUMBER_OF_WAVELENGTH_WORKERS = ("number_of_wavelength_workers", (int, np.integer))
+    """
+    Maximum number of worker processes used if Tags.PARALLEL_WAVELENGTH_EXECUTION is True.
+    Defaults to the number of CPUs, but never more than the number of wavelengths.\n
+    Usage: simpa.core.simulation.simulate
+    """
+
+    IN_MEMORY_DATA_STORE = ("in_memory_data_store", (bool, np.bool_))
+    """
+    If True, the pipeline elements exchange their numerical results through an in-memory data store instead of
+    writing them to and reading them from the SIMPA output file. The results are written into the output file once
+    all wavelengths are simulated or if they exceed Tags.IN_MEMORY_DATA_STORE_BUDGET_IN_MB. False by default.\n
+    Usage: simpa.core.simulation.simulate
+    """
+
+    IN_MEMORY_DATA_STORE_BUDGET_IN_MB = ("in_memory_data_store_budget_in_mb", Number)
+    """
+    Maximum memory in MB that is used by the in-memory data store if Tags.IN_MEMORY_DATA_STORE is True. The least
+    recently used results are written into the SIMPA output file if the budget is exceeded. Results that are larger
+    than the budget are always written into the file directly. Defaults to 2048 MB. If the wavelengths are simulated
+    in parallel, every worker process has its own budget.\n
     Usage: simpa.core.simulation.simulate
     """
 
@@ -354,6 +399,25 @@ class Tags:
     Usage: module optical_simulation_module
     """
 
+    OPTICAL_MODEL_CONCURRENT_ILLUMINATIONS = ("optical_model_concurrent_illuminations", (int, np.integer))
+    """
+    Maximum number of illumination geometries of a device with multiple illuminators (e.g. the MSOTAcuityEcho) that
+    are simulated at the same time. Every illuminator is simulated by its own copy of the optical adapter in a
+    separate thread, which is efficient for adapters that run an external binary like MCX. The fluences are summed up
+    in the order of the illumination geometries, such that the result does not depend on this number.
+    Defaults to 1, i.e. the illuminators are simulated one after another.\n
+    Usage: module optical_simulation_module
+    """
+
+    OPTICAL_MODEL_SCRATCH_PATH = ("optical_model_scratch_path", str)
+    """
+    Directory in which the optical forward model creates the temporary files that are exchanged with an external
+    binary like MCX. Every simulation of an illuminator uses its own uniquely named workspace directory within this
+    directory, which is removed afterwards. A directory on a tmpfs (e.g. /dev/shm) avoids writing the temporary files
+    to disk. Defaults to Tags.SIMULATION_PATH.\n
+    Usage: module optical_simulation_module, adapter mcx_adapter
+    """
+
     OPTICAL_MODEL_ILLUMINATION_GEOMETRY_JSON_FILE = ("optical_model_illumination_geometry_json_file", str)
     """
     Absolute path of the location of the JSON file containing the IPASC-formatted optical forward 
@@ -400,6 +464,29 @@ class Tags:
     Usage: module optical_modelling, adapter mcx_adapter
     """
 
+    DIFFUSION_SOLVER_TOLERANCE = ("diffusion_solver_tolerance", (int, float, np.number))
+    """
+    Relative residual tolerance of the iterative solver of the diffusion approximation.
+    If not set, a default value of 1e-6 will be assumed.
+    Usage: module optical_modelling, adapter diffusion_adapter
+    """
+
+    DIFFUSION_SOLVER_MAX_ITERATIONS = ("diffusion_solver_max_iterations", (int, np.integer))
+    """
+    Maximum number of iterations of the iterative solver of the diffusion approximation.
+    If not set, a default value of 10000 will be assumed.
+    Usage: module optical_modelling, adapter diffusion_adapter
+    """
+
+    DIFFUSION_SOLVER_WARM_START = ("diffusion_solver_warm_start", (bool, np.bool_))
+    """
+    If True, the iterative solver of the diffusion approximation starts from the diffuse fluence of the previous
+    simulation of the same adapter with the same source and volume shape, which reduces the number of solver
+    iterations if the optical properties change only slightly between the simulations (e.g. in iterative methods).
+    If not set, a default value of False will be assumed.
+    Usage: module optical_modelling, adapter diffusion_adapter
+    """
+
     ILLUMINATION_TYPE = ("optical_model_illumination_type", str)
     """
     Type of the illumination geometry used in mcx.\n
@@ -560,6 +647,12 @@ class Tags:
     Usage: module optical_simulation_module, naming convention
     """
 
+    OPTICAL_MODEL_DIFFUSION = "diffusion"
+    """
+    Corresponds to the diffusion approximation solved on the CPU.\n
+    Usage: module optical_simulation_module, naming convention
+    """
+
     # Supported acoustic models
     ACOUSTIC_MODEL = ("acoustic_model", str)
     """
@@ -751,6 +844,24 @@ class Tags:
     Usage: adapter PyTorchDASAdapter, naming convention
     """
 
+    RECONSTRUCTION_MEMORY_BUDGET_IN_MB = ("reconstruction_memory_budget_in_mb", (int, float, np.number))
+    """
+    Approximate memory budget in MB for the intermediate tensors of the delay and sum based reconstruction
+    algorithms. The image is processed in blocks (and sensor chunks) that fit into this budget. Default is 1024 MB.\n
+    Usage: adapter DelayAndSumAdapter
+    """
+
+    RECONSTRUCTION_PLAN_CACHE_SIZE_IN_MB = ("reconstruction_plan_cache_size_in_mb", (int, float, np.number))
+    """
+    Maximum memory in MB of the cached delay and sum plans, i.e. the precomputed delays, interpolation weights and
+    apodization of a detection geometry and image grid that are reused for all frames and wavelengths. The least
+    recently used plans are evicted first. A value of 0 disables the caching and frees the cached plans. Default is 0,
+    i.e. caching has to be enabled explicitly. The cache is kept after the simulation pipeline has finished; call
+    DELAY_AND_SUM_PLAN_CACHE.clear() from simpa.core.simulation_modules.reconstruction_module.reconstruction_utils
+    to free it.\n
+    Usage: adapter DelayAndSumAdapter, adapter DelayMultiplyAndSumAdapter, adapter SignedDelayMultiplyAndSumAdapter
+    """
+
     RECONSTRUCTION_PERFORM_BANDPASS_FILTERING = ("reconstruction_perform_bandpass_filtering",
                                     (bool, np.bool_))
     """
@@ -1265,6 +1376,13 @@ class Tags:
     Usage: naming convention
     """
 
+    SIMULATION_PROFILE = "simulation_profile"
+    """
+    Location of the resources (wall time, CPU time, peak memory and I/O) that were used by every pipeline element for
+    every wavelength in the SIMPA output file.\n
+    Usage: naming convention
+    """
+
     UPSAMPLED_DATA = "upsampled_data"
     """
     Name of the simulation outputs as upsampled data in the SIMPA output file.\n
@@ -1345,6 +1463,41 @@ class Tags:
     Usage: module algorithms (iterative_qPAI_algorithm.py)
     """
 
+    ITERATIVE_RECONSTRUCTION_ADAPTIVE_PHOTON_BUDGET = ("adaptive_photon_budget", (bool, np.bool_))
+    """
+    If True, the Monte Carlo simulations of the iterative reconstruction start with a fraction of
+    Tags.OPTICAL_MODEL_NUMBER_PHOTONS, which is raised as the relative change of the error approaches
+    Tags.ITERATIVE_RECONSTRUCTION_STOPPING_LEVEL. The iteration that stops the reconstruction and the last possible
+    iteration always use all photons. Default: False.\n
+    Usage: module algorithms (iterative_qPAI_algorithm.py)
+    """
+
+    ITERATIVE_RECONSTRUCTION_MINIMUM_PHOTON_FRACTION = ("minimum_photon_fraction", Number)
+    """
+    Fraction of Tags.OPTICAL_MODEL_NUMBER_PHOTONS that is used by the first iterations if
+    Tags.ITERATIVE_RECONSTRUCTION_ADAPTIVE_PHOTON_BUDGET is True. Default: 1/16.\n
+    Usage: module algorithms (iterative_qPAI_algorithm.py)
+    """
+
+    ITERATIVE_RECONSTRUCTION_RESOLUTION_LEVELS = ("resolution_levels", (int, np.integer))
+    """
+    Number of resolution levels of the coarse-to-fine schedule of the iterative reconstruction. The first iterations
+    run on volumes whose resolution is halved for every additional level. The absorption estimate of each level is
+    upsampled as the initial guess of the next finer level and the last iterations run on the full resolution.
+    The shape, spacing, number of iterations and wall time of every level are stored under "resolution_levels" in
+    the details of the stage profile of the reconstruction.
+    Default: 1 (all iterations on the full resolution).\n
+    Usage: module algorithms (iterative_qPAI_algorithm.py)
+    """
+
+    ITERATIVE_RECONSTRUCTION_COARSE_LEVEL_MAX_ITERATION_NUMBER = ("coarse_level_max_iteration_number",
+                                                                  (int, np.integer))
+    """
+    Maximum number of iterations on each coarse level if Tags.ITERATIVE_RECONSTRUCTION_RESOLUTION_LEVELS is greater
+    than one. A coarse level ends earlier if Tags.ITERATIVE_RECONSTRUCTION_STOPPING_LEVEL is reached. Default: 5.\n
+    Usage: module algorithms (iterative_qPAI_algorithm.py)
+    """
+
     LINEAR_UNMIXING_NON_NEGATIVE = ("linear_unmixing_nonnegative", bool)
     """
     If True, non-negative linear unmixing is performed which solves the 
@@ -1352,6 +1505,27 @@ class Tags:
     Usage: module algorithms, linear unmixing
     """
 
+    LINEAR_UNMIXING_CHUNK_SIZE = ("linear_unmixing_chunk_size", (int, np.integer))
+    """
+    Maximum number of pixels that are solved together by the batched non-negative linear unmixing.
+    Default is 100000.\n
+    Usage: module algorithms, linear unmixing
+    """
+
+    LINEAR_UNMIXING_NUMBER_OF_WORKERS = ("linear_unmixing_number_of_workers", (int, np.integer))
+    """
+    Number of worker processes used by the batched non-negative linear unmixing. Default is 1, i.e. no process pool.\n
+    Usage: module algorithms, linear unmixing
+    """
+
+    LINEAR_UNMIXING_TILE_SIZE = ("linear_unmixing_tile_size", (int, np.integer))
+    """
+    If set, linear unmixing reads the data field tile by tile from the SIMPA output file instead of loading it for all
+    wavelengths at once, and writes the results into the file tile by tile. The tiles are slabs along the first axis
+    of the data field with at most this number of voxels, but at least one slice. Default: None, i.e. no tiling.\n
+    Usage: module algorithms, linear unmixing
+    """
+
     SIMPA_NAMED_ABSORPTION_SPECTRUM_OXYHEMOGLOBIN = "Oxyhemoglobin"
     """
     Name of the spectrum file for oxyhemoglobin chromophore.\n
@@ -1427,6 +1601,14 @@ class Tags:
     Usage: core
     """
 
+    QA_ASSERTION_SAMPLE_SIZE = ("qa_assertion_sample_size", Number)
+    """
+    If given, the quality assessment of the simulated data only tests approximately this many values of every array,
+    which are evenly spread over the array. This keeps the cost of the tests constant for very large volumes but may
+    miss single ill-defined values. By default, all values are tested.
+    Usage: core
+    """
+
     COMPUTE_DIFFUSE_REFLECTANCE = "save_diffuse_reflectance"
     """
     Flag that indicates if the diffuse reflectance should be stored in voxels that are filled with 0 in the surrounding
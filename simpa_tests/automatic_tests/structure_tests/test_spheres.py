@@ -87,3 +87,15 @@ class TestSpheres(unittest.TestCase):
         assert 0 < ss.geometrical_volume[0, 1, 1] < 1
         assert 0 < ss.geometrical_volume[1, 1, 0] < 1
         assert ss.geometrical_volume[1, 1, 1] == 0
+
+    def test_spherical_structure_is_stored_within_its_bounding_box(self):
+        self.sphere_settings[Tags.STRUCTURE_START_MM] = [2.5, 2.5, 2.5]
+        self.sphere_settings[Tags.STRUCTURE_RADIUS_MM] = 0.4
+        ss = SphericalStructure(self.global_settings, self.sphere_settings)
+        assert ss.local_geometrical_volume.shape == (3, 3, 3)
+        assert ss.bounding_box == (slice(1, 4), slice(1, 4), slice(1, 4))
+        geometrical_volume = ss.geometrical_volume
+        assert geometrical_volume.shape == (5, 5, 5)
+        assert np.sum(geometrical_volume) == np.sum(ss.local_geometrical_volume)
+        assert np.all(geometrical_volume[0, :, :] == 0)
+        assert np.all(geometrical_volume[:, :, 4] == 0)
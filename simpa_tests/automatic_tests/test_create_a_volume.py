@@ -7,8 +7,9 @@ from simpa.utils import Tags
 from simpa.utils.settings import Settings
 from simpa.core.simulation import simulate
 import os
+import numpy as np
 from simpa_tests.test_utils import create_test_structure_parameters
-from simpa import ModelBasedVolumeCreationAdapter
+from simpa import ModelBasedVolumeCreationAdapter, TISSUE_LIBRARY
 from simpa.core.device_digital_twins import RSOMExplorerP50
 
 
@@ -40,3 +41,64 @@ class TestCreateVolume(unittest.TestCase):
         if (os.path.exists(settings[Tags.SIMPA_OUTPUT_PATH]) and
            os.path.isfile(settings[Tags.SIMPA_OUTPUT_PATH])):
             os.remove(settings[Tags.SIMPA_OUTPUT_PATH])
+
+    def test_cached_geometry_gives_same_volumes_as_fresh_adapter(self):
+        random_seed = 4711
+        basic_settings = {
+            Tags.WAVELENGTHS: [700, 800],
+            Tags.RANDOM_SEED: random_seed,
+            Tags.SPACING_MM: 0.3,
+            Tags.DIM_VOLUME_Z_MM: 5,
+            Tags.DIM_VOLUME_X_MM: 4,
+            Tags.DIM_VOLUME_Y_MM: 3
+        }
+        settings = Settings(basic_settings)
+        settings.set_volume_creation_settings({Tags.STRUCTURES: create_test_structure_parameters()})
+
+        cached_adapter = ModelBasedVolumeCreationAdapter(settings)
+        for wavelength in settings[Tags.WAVELENGTHS]:
+            settings[Tags.WAVELENGTH] = wavelength
+            np.random.seed(random_seed)
+            cached_volumes = cached_adapter.create_simulation_volume()
+            cached_random_number = np.random.random()
+
+            np.random.seed(random_seed)
+            fresh_volumes = ModelBasedVolumeCreationAdapter(settings).create_simulation_volume()
+            fresh_random_number = np.random.random()
+
+            self.assertEqual(cached_random_number, fresh_random_number)
+            for key in fresh_volumes:
+                np.testing.assert_array_equal(cached_volumes[key], fresh_volumes[key])
+
+    def test_geometry_is_created_again_when_the_settings_change(self):
+        basic_settings = {
+            Tags.RANDOM_SEED: 4711,
+            Tags.WAVELENGTH: 700,
+            Tags.SPACING_MM: 0.3,
+            Tags.DIM_VOLUME_Z_MM: 5,
+            Tags.DIM_VOLUME_X_MM: 4,
+            Tags.DIM_VOLUME_Y_MM: 3
+        }
+        settings = Settings(basic_settings)
+        settings.set_volume_creation_settings({Tags.STRUCTURES: create_test_structure_parameters()})
+        adapter = ModelBasedVolumeCreationAdapter(settings)
+
+        adapter.create_simulation_volume()
+        structure_geometries = adapter.structure_geometries
+        settings[Tags.WAVELENGTH] = 800
+        adapter.create_simulation_volume()
+        self.assertIs(adapter.structure_geometries, structure_geometries)
+
+        settings[Tags.SPACING_MM] = 0.5
+        volumes = adapter.create_simulation_volume()
+        self.assertIsNot(adapter.structure_geometries, structure_geometries)
+        self.assertEqual(volumes[Tags.DATA_FIELD_ABSORPTION_PER_CM].shape, (8, 6, 10))
+
+        structure_geometries = adapter.structure_geometries
+        settings.get_volume_creation_settings()[Tags.STRUCTURES]["background"][Tags.MOLECULE_COMPOSITION] = \
+            TISSUE_LIBRARY.bone()
+        volumes = adapter.create_simulation_volume()
+        self.assertIsNot(adapter.structure_geometries, structure_geometries)
+        fresh_volumes = ModelBasedVolumeCreationAdapter(settings).create_simulation_volume()
+        for key in fresh_volumes:
+            np.testing.assert_array_equal(volumes[key], fresh_volumes[key])
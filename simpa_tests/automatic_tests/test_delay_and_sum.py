@@ -0,0 +1,266 @@
+# SPDX-FileCopyrightText: 2021 Division of Intelligent Medical Systems, DKFZ
+# SPDX-FileCopyrightText: 2021 Janek Groehl
+# SPDX-License-Identifier: MIT
+
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+import numpy as np
+import torch
+from simpa.log import Logger
+from simpa.utils import Tags
+from simpa.io_handling import load_data_field, save_data_field
+from simpa.core.device_digital_twins import LinearArrayDetectionGeometry, PlanarArrayDetectionGeometry
+from simpa.core.simulation_modules.reconstruction_module import create_reconstruction_settings
+from simpa.core.simulation_modules.reconstruction_module import reconstruction_module_delay_and_sum_adapter
+from simpa.core.simulation_modules.reconstruction_module.reconstruction_module_delay_and_sum_adapter import \
+    DelayAndSumAdapter, reconstruct_delay_and_sum_pytorch
+from simpa.core.simulation_modules.reconstruction_module.reconstruction_module_delay_multiply_and_sum_adapter \
+    import DelayMultiplyAndSumAdapter
+from simpa.core.simulation_modules.reconstruction_module.reconstruction_module_signed_delay_multiply_and_sum_adapter \
+    import SignedDelayMultiplyAndSumAdapter
+from simpa.core.simulation_modules.reconstruction_module.reconstruction_utils import \
+    compute_delay_and_sum_block_sizes, compute_delay_and_sum_values, compute_delay_multiply_and_sum, \
+    compute_image_dimensions, iterate_delay_and_sum_values, DELAY_AND_SUM_PLAN_CACHE
+
+
+class TestDelayAndSum(unittest.TestCase):
+
+    def setUp(self):
+        np.random.seed(42)
+        self.linear_geometry = LinearArrayDetectionGeometry(device_position_mm=np.array([5, 5, 0]),
+                                                            number_detector_elements=32, pitch_mm=0.3,
+                                                            field_of_view_extent_mm=np.array([-4, 4, 0, 0, 0, 6]))
+        self.linear_time_series = np.random.randn(32, 400).astype(np.float32)
+        self.planar_geometry = PlanarArrayDetectionGeometry(device_position_mm=np.array([5, 5, 0]),
+                                                            number_detector_elements_x=6,
+                                                            number_detector_elements_y=5, pitch_mm=0.4,
+                                                            field_of_view_extent_mm=np.array([-2, 2, -1, 1, 0, 3]))
+        self.planar_time_series = np.random.randn(30, 300).astype(np.float32)
+
+    def reconstruct(self, time_series, detection_geometry, spacing, memory_budget_in_mb=None,
+                    adapter_class=DelayAndSumAdapter, speed_of_sound=1540, cache_size_in_mb=None):
+        settings = create_reconstruction_settings(speed_of_sound_in_m_per_s=speed_of_sound, time_spacing_in_s=2.5e-8,
+                                                  sensor_spacing_in_mm=spacing,
+                                                  apodization=Tags.RECONSTRUCTION_APODIZATION_HANN)
+        if memory_budget_in_mb is not None:
+            settings.get_reconstruction_settings()[Tags.RECONSTRUCTION_MEMORY_BUDGET_IN_MB] = memory_budget_in_mb
+        if cache_size_in_mb is not None:
+            settings.get_reconstruction_settings()[Tags.RECONSTRUCTION_PLAN_CACHE_SIZE_IN_MB] = cache_size_in_mb
+        return adapter_class(settings).reconstruction_algorithm(time_series.copy(), detection_geometry)
+
+    def pairwise_delay_multiply_and_sum(self, time_series, detection_geometry, spacing):
+        """
+        Reference implementation that explicitly sums sign(v_n * v_m) * sqrt(|v_n * v_m|) over all pairs n < m.
+        """
+        settings = create_reconstruction_settings(speed_of_sound_in_m_per_s=1540, time_spacing_in_s=2.5e-8,
+                                                  sensor_spacing_in_mm=spacing,
+                                                  apodization=Tags.RECONSTRUCTION_APODIZATION_HANN)
+        xdim, zdim, ydim, xdim_start, xdim_end, ydim_start, ydim_end, zdim_start, zdim_end = \
+            compute_image_dimensions(detection_geometry, spacing, Logger())
+        sensor_positions = torch.from_numpy(detection_geometry.get_detector_element_positions_base_mm())
+        if zdim == 1:
+            sensor_positions[:, 1] = 0
+        values, n_sensor_elements = compute_delay_and_sum_values(
+            torch.from_numpy(time_series), sensor_positions, xdim, ydim, zdim, xdim_start, xdim_end, ydim_start,
+            ydim_end, zdim_start, zdim_end, spacing, 1540, 2.5e-5, Logger(), torch.device("cpu"),
+            settings.get_reconstruction_settings())
+        values = values.numpy()
+        products = values[..., :, None] * values[..., None, :]
+        products = np.sign(products) * np.sqrt(np.abs(products))
+        upper_triangle = np.triu(np.ones((n_sensor_elements, n_sensor_elements), dtype=bool), k=1)
+        return products[..., upper_triangle].sum(axis=-1).squeeze(), values.sum(axis=-1).squeeze()
+
+    def reconstruct_in_blocks(self, time_series, detection_geometry, spacing, memory_budget_in_mb):
+        """
+        :return: the reconstruction and the number of blocks in which it was computed
+        """
+        blocks = list()
+
+        def iterate_and_count_blocks(*args, **kwargs):
+            for block, values in iterate_delay_and_sum_values(*args, **kwargs):
+                blocks.append(block)
+                yield block, values
+
+        with patch.object(reconstruction_module_delay_and_sum_adapter, "iterate_delay_and_sum_values",
+                          iterate_and_count_blocks):
+            reconstruction = self.reconstruct(time_series, detection_geometry, spacing, memory_budget_in_mb)
+        return reconstruction, len(blocks)
+
+    def test_block_sizes_respect_memory_budget(self):
+        x_block, y_block, z_block, sensor_block = compute_delay_and_sum_block_sizes(100, 80, 60, 256, 10)
+        assert sensor_block == 256
+        assert z_block == 60
+        assert x_block * y_block * z_block * sensor_block * 96 <= 10 * 1024 * 1024
+
+        # not even a single pixel fits, so the sensor elements have to be chunked
+        assert compute_delay_and_sum_block_sizes(100, 80, 60, 256, 0.001) == (1, 1, 1, 10)
+
+    def test_tiled_2d_reconstruction_is_identical(self):
+        reference = self.reconstruct(self.linear_time_series, self.linear_geometry, 0.2)
+        for memory_budget_in_mb in [0.05, 0.001]:
+            tiled, number_of_blocks = self.reconstruct_in_blocks(self.linear_time_series, self.linear_geometry, 0.2,
+                                                                 memory_budget_in_mb)
+            assert number_of_blocks > 1, f"the reconstruction was not tiled for {memory_budget_in_mb} MB"
+            assert np.array_equal(reference, tiled), f"tiled reconstruction differs for {memory_budget_in_mb} MB"
+
+    def test_tiled_3d_reconstruction_is_identical(self):
+        reference = self.reconstruct(self.planar_time_series, self.planar_geometry, 0.25)
+        assert reference.ndim == 3
+        for memory_budget_in_mb in [0.05, 0.001]:
+            tiled, number_of_blocks = self.reconstruct_in_blocks(self.planar_time_series, self.planar_geometry, 0.25,
+                                                                 memory_budget_in_mb)
+            assert number_of_blocks > 1, f"the reconstruction was not tiled for {memory_budget_in_mb} MB"
+            assert np.array_equal(reference, tiled), f"tiled reconstruction differs for {memory_budget_in_mb} MB"
+
+    def test_delay_multiply_and_sum_matches_pairwise_sum(self):
+        for time_series, geometry, spacing in [(self.linear_time_series, self.linear_geometry, 0.4),
+                                               (self.planar_time_series, self.planar_geometry, 0.5)]:
+            expected_dmas, expected_das = self.pairwise_delay_multiply_and_sum(time_series, geometry, spacing)
+            dmas = self.reconstruct(time_series, geometry, spacing, adapter_class=DelayMultiplyAndSumAdapter)
+            sdmas = self.reconstruct(time_series, geometry, spacing, adapter_class=SignedDelayMultiplyAndSumAdapter)
+            tolerance = 1e-5 * np.max(np.abs(expected_dmas))
+            assert np.allclose(dmas, expected_dmas, rtol=1e-5, atol=tolerance)
+            assert np.allclose(sdmas, np.sign(expected_das) * expected_dmas, rtol=1e-5, atol=tolerance)
+
+    def test_delay_multiply_and_sum_of_many_sensors_matches_float64_reference(self):
+        number_of_sensors = 2048
+        geometry = LinearArrayDetectionGeometry(device_position_mm=np.array([5, 5, 0]),
+                                                number_detector_elements=number_of_sensors, pitch_mm=0.005,
+                                                field_of_view_extent_mm=np.array([-4, 4, 0, 0, 0, 6]))
+        time_series = torch.from_numpy(np.random.randn(number_of_sensors, 400).astype(np.float32))
+        settings = create_reconstruction_settings(speed_of_sound_in_m_per_s=1540, time_spacing_in_s=2.5e-8,
+                                                  sensor_spacing_in_mm=0.4,
+                                                  apodization=Tags.RECONSTRUCTION_APODIZATION_HANN)
+        xdim, zdim, ydim, xdim_start, xdim_end, ydim_start, ydim_end, zdim_start, zdim_end = \
+            compute_image_dimensions(geometry, 0.4, Logger())
+        sensor_positions = torch.from_numpy(geometry.get_detector_element_positions_base_mm().astype(np.float32))
+        sensor_positions[:, 1] = 0
+        values, _ = compute_delay_and_sum_values(time_series, sensor_positions, xdim, ydim, zdim, xdim_start,
+                                                 xdim_end, ydim_start, ydim_end, zdim_start, zdim_end, 0.4, 1540,
+                                                 2.5e-5, Logger(), torch.device("cpu"),
+                                                 settings.get_reconstruction_settings())
+        assert values.dtype == torch.float32
+        values = values.numpy().astype(np.float64)
+        s = np.sign(values) * np.sqrt(np.abs(values))
+        expected_dmas = (np.sum(s, axis=-1) ** 2 - np.sum(np.abs(values), axis=-1)) / 2
+
+        dmas, das = compute_delay_multiply_and_sum(time_series, sensor_positions, xdim, ydim, zdim, xdim_start,
+                                                   ydim_start, zdim_start, 0.4, 1540, 2.5e-5, Logger(),
+                                                   torch.device("cpu"), settings.get_reconstruction_settings())
+        assert dmas.dtype == torch.float32
+        np.testing.assert_allclose(dmas.numpy(), expected_dmas, rtol=0, atol=1e-7 * np.max(np.abs(expected_dmas)))
+        np.testing.assert_allclose(das.numpy(), np.sum(values, axis=-1), rtol=0,
+                                   atol=1e-7 * np.max(np.abs(np.sum(values, axis=-1))))
+
+    def test_tiled_delay_multiply_and_sum_is_identical(self):
+        for adapter_class in [DelayMultiplyAndSumAdapter, SignedDelayMultiplyAndSumAdapter]:
+            reference = self.reconstruct(self.planar_time_series, self.planar_geometry, 0.25,
+                                         adapter_class=adapter_class)
+            tiled = self.reconstruct(self.planar_time_series, self.planar_geometry, 0.25, 0.001,
+                                     adapter_class=adapter_class)
+            assert np.array_equal(reference, tiled)
+
+    def test_plan_values_are_identical_to_direct_computation(self):
+        settings = create_reconstruction_settings(speed_of_sound_in_m_per_s=1540, time_spacing_in_s=2.5e-8,
+                                                  sensor_spacing_in_mm=0.25,
+                                                  apodization=Tags.RECONSTRUCTION_APODIZATION_HANN)
+        xdim, zdim, ydim, xdim_start, xdim_end, ydim_start, ydim_end, zdim_start, zdim_end = \
+            compute_image_dimensions(self.planar_geometry, 0.25, Logger())
+        sensor_positions = torch.from_numpy(self.planar_geometry.get_detector_element_positions_base_mm())
+        # samples beyond the last time step are invalid
+        time_series = torch.from_numpy(self.planar_time_series[:, :40])
+        expected, _ = compute_delay_and_sum_values(time_series, sensor_positions, xdim, ydim, zdim, xdim_start,
+                                                   xdim_end, ydim_start, ydim_end, zdim_start, zdim_end, 0.25, 1540,
+                                                   2.5e-5, Logger(), torch.device("cpu"),
+                                                   settings.get_reconstruction_settings())
+        blocks = list(iterate_delay_and_sum_values(time_series, sensor_positions, xdim, ydim, zdim, xdim_start,
+                                                   ydim_start, zdim_start, 0.25, 1540, 2.5e-5, Logger(),
+                                                   torch.device("cpu"), settings.get_reconstruction_settings()))
+        assert len(blocks) == 1
+        assert torch.count_nonzero(expected) < expected.numel()
+        assert torch.equal(blocks[0][1], expected)
+
+    def test_plans_are_only_cached_if_enabled(self):
+        DELAY_AND_SUM_PLAN_CACHE.clear()
+        uncached = self.reconstruct(self.linear_time_series, self.linear_geometry, 0.2)
+        assert len(DELAY_AND_SUM_PLAN_CACHE.plans) == 0
+
+        first = self.reconstruct(self.linear_time_series, self.linear_geometry, 0.2, cache_size_in_mb=64)
+        assert np.array_equal(first, uncached)
+        assert len(DELAY_AND_SUM_PLAN_CACHE.plans) == 1
+        plan = next(iter(DELAY_AND_SUM_PLAN_CACHE.plans.values()))
+        # other frames with the same geometry reuse the plan
+        second_frame = np.random.randn(*self.linear_time_series.shape).astype(np.float32)
+        self.reconstruct(second_frame, self.linear_geometry, 0.2, adapter_class=SignedDelayMultiplyAndSumAdapter,
+                         cache_size_in_mb=64)
+        assert list(DELAY_AND_SUM_PLAN_CACHE.plans.values()) == [plan]
+        # a different speed of sound needs a new plan
+        self.reconstruct(self.linear_time_series, self.linear_geometry, 0.2, speed_of_sound=1500,
+                         cache_size_in_mb=64)
+        assert len(DELAY_AND_SUM_PLAN_CACHE.plans) == 2
+
+        # reconstructing without a cache size frees the cached plans
+        assert np.array_equal(first, self.reconstruct(self.linear_time_series, self.linear_geometry, 0.2))
+        assert len(DELAY_AND_SUM_PLAN_CACHE.plans) == 0
+
+    def test_plan_cache_evicts_least_recently_used_plans(self):
+        DELAY_AND_SUM_PLAN_CACHE.clear()
+        self.reconstruct(self.linear_time_series, self.linear_geometry, 0.2, speed_of_sound=1500, cache_size_in_mb=64)
+        plan_size_in_mb = DELAY_AND_SUM_PLAN_CACHE.size_in_bytes / 1024 / 1024
+        self.reconstruct(self.linear_time_series, self.linear_geometry, 0.2, speed_of_sound=1540,
+                         cache_size_in_mb=1.5 * plan_size_in_mb)
+        assert len(DELAY_AND_SUM_PLAN_CACHE.plans) == 1
+        assert next(iter(DELAY_AND_SUM_PLAN_CACHE.plans.values())).speed_of_sound_in_m_per_s == 1540
+        assert DELAY_AND_SUM_PLAN_CACHE.size_in_bytes <= 1.5 * plan_size_in_mb * 1024 * 1024
+        DELAY_AND_SUM_PLAN_CACHE.clear()
+
+    def test_batched_reconstruction_is_identical(self):
+        time_series = np.random.randn(3, 32, 400).astype(np.float32)
+        for adapter_class in [DelayAndSumAdapter, DelayMultiplyAndSumAdapter, SignedDelayMultiplyAndSumAdapter]:
+            references = [self.reconstruct(frame, self.linear_geometry, 0.2, adapter_class=adapter_class)
+                          for frame in time_series]
+            # with the small memory budget, the image is tiled
+            for memory_budget_in_mb in [None, 0.001]:
+                batched = self.reconstruct(time_series, self.linear_geometry, 0.2, memory_budget_in_mb,
+                                           adapter_class=adapter_class)
+                assert batched.shape == (3, ) + references[0].shape
+                for reference, reconstruction in zip(references, batched):
+                    assert np.array_equal(reference, reconstruction)
+
+        planar_batch = np.stack([self.planar_time_series, -self.planar_time_series])
+        batched = self.reconstruct(planar_batch, self.planar_geometry, 0.25)
+        assert batched.ndim == 4
+        assert np.array_equal(batched[0], self.reconstruct(self.planar_time_series, self.planar_geometry, 0.25))
+
+    def test_ipasc_time_series_are_reconstructed_per_wavelength_and_frame(self):
+        time_series = np.random.randn(32, 400, 2, 3).astype(np.float32)
+        reconstructions = reconstruct_delay_and_sum_pytorch(time_series, self.linear_geometry,
+                                                            time_spacing_in_s=2.5e-8, sensor_spacing_in_mm=0.2)
+        reference = reconstruct_delay_and_sum_pytorch(time_series[:, :, 1, 2].copy(), self.linear_geometry,
+                                                      time_spacing_in_s=2.5e-8, sensor_spacing_in_mm=0.2)
+        assert reconstructions.shape == (2, 3) + reference.shape
+        assert np.array_equal(reconstructions[1, 2], reference)
+
+    def test_run_batch_matches_run(self):
+        wavelengths = [700, 800, 900]
+        settings = create_reconstruction_settings(speed_of_sound_in_m_per_s=1540, time_spacing_in_s=2.5e-8,
+                                                  sensor_spacing_in_mm=0.2)
+        settings.get_reconstruction_settings()[Tags.RECONSTRUCTION_PERFORM_BANDPASS_FILTERING] = True
+        settings[Tags.WAVELENGTHS] = wavelengths
+        with tempfile.TemporaryDirectory() as temporary_directory:
+            settings[Tags.SIMPA_OUTPUT_PATH] = os.path.join(temporary_directory, "batch.hdf5")
+            for wavelength in wavelengths:
+                save_data_field(np.random.randn(32, 400).astype(np.float32), settings[Tags.SIMPA_OUTPUT_PATH],
+                                Tags.DATA_FIELD_TIME_SERIES_DATA, wavelength)
+
+            adapter = DelayAndSumAdapter(settings)
+            adapter.run_batch(self.linear_geometry)
+            batched = [load_data_field(settings[Tags.SIMPA_OUTPUT_PATH], Tags.DATA_FIELD_RECONSTRUCTED_DATA,
+                                       wavelength) for wavelength in wavelengths]
+            for wavelength, reconstruction in zip(wavelengths, batched):
+                settings[Tags.WAVELENGTH] = wavelength
+                adapter.run(self.linear_geometry)
+                assert np.array_equal(reconstruction, load_data_field(settings[Tags.SIMPA_OUTPUT_PATH],
+                                                                      Tags.DATA_FIELD_RECONSTRUCTED_DATA, wavelength))
@@ -0,0 +1,84 @@
+# SPDX-FileCopyrightText: 2021 Division of Intelligent Medical Systems, DKFZ
+# SPDX-FileCopyrightText: 2021 Janek Groehl
+# SPDX-License-Identifier: MIT
+
+import unittest
+
+import numpy as np
+
+from simpa.core.device_digital_twins import PencilBeamIlluminationGeometry, DiskIlluminationGeometry, \
+    MSOTAcuityIlluminationGeometry, MSOTInVisionIlluminationGeometry
+from simpa.core.simulation_modules.optical_simulation_module.optical_forward_model_diffusion_adapter import \
+    DiffusionApproximationAdapter
+from simpa.utils import Tags, Settings
+
+
+class TestDiffusionApproximation(unittest.TestCase):
+
+    def setUp(self):
+        self.settings = Settings({Tags.SPACING_MM: 0.1}, verbose=False)
+        self.settings.set_optical_settings({Tags.DIFFUSION_SOLVER_TOLERANCE: 1e-8})
+        self.adapter = DiffusionApproximationAdapter(self.settings)
+
+    @staticmethod
+    def homogeneous_medium(shape, absorption_cm=1.0, scattering_cm=100.0, anisotropy=0.9):
+        return np.full(shape, absorption_cm), np.full(shape, scattering_cm), np.full(shape, anisotropy)
+
+    def test_planar_illumination_decays_with_effective_attenuation(self):
+        # a volume with only one voxel in x and y is invariant in these directions, i.e. a planar illumination
+        absorption, scattering, anisotropy = self.homogeneous_medium((1, 1, 400))
+        fluence = self.adapter.forward_model(absorption, scattering, anisotropy,
+                                             PencilBeamIlluminationGeometry())[Tags.DATA_FIELD_FLUENCE][0, 0]
+        depth_mm = np.arange(400) * 0.1
+        decay_per_mm = -np.polyfit(depth_mm[100:200], np.log(fluence[100:200]), 1)[0]
+        effective_attenuation_per_mm = np.sqrt(3 * 0.1 * (0.1 + 1.0))
+        self.assertAlmostEqual(decay_per_mm, effective_attenuation_per_mm, delta=0.01 * effective_attenuation_per_mm)
+
+    def test_two_dimensional_volumes(self):
+        absorption, scattering, anisotropy = self.homogeneous_medium((30, 20))
+        absorption[10:15, 5:10] = 5
+        illumination = PencilBeamIlluminationGeometry(device_position_mm=np.array([1.5, 0.05, 0]))
+        fluence_2d = self.adapter.forward_model(absorption, scattering, anisotropy,
+                                                illumination)[Tags.DATA_FIELD_FLUENCE]
+        fluence_3d = self.adapter.forward_model(absorption[:, np.newaxis, :], scattering[:, np.newaxis, :],
+                                                anisotropy[:, np.newaxis, :], illumination)[Tags.DATA_FIELD_FLUENCE]
+        self.assertEqual(fluence_2d.shape, (30, 20))
+        self.assertEqual(fluence_3d.shape, (30, 1, 20))
+        np.testing.assert_allclose(fluence_2d, fluence_3d[:, 0, :])
+        self.assertTrue(np.all(fluence_2d > 0))
+
+    def test_three_dimensional_disk_illumination(self):
+        absorption, scattering, anisotropy = self.homogeneous_medium((31, 31, 20), absorption_cm=10)
+        illumination = DiskIlluminationGeometry(beam_radius_mm=0.5, device_position_mm=np.array([1.5, 1.5, 0]))
+        fluence = self.adapter.forward_model(absorption, scattering, anisotropy,
+                                             illumination)[Tags.DATA_FIELD_FLUENCE]
+        self.assertEqual(fluence.shape, (31, 31, 20))
+        self.assertTrue(np.all(fluence > 0))
+        np.testing.assert_allclose(fluence, np.transpose(fluence, (1, 0, 2)), rtol=1e-5)
+        np.testing.assert_allclose(fluence, fluence[::-1, :, :], rtol=1e-5)
+        self.assertEqual(np.argmax(fluence[:, 15, 0]), 15)
+        # fluence in 1/cm^2 and absorption in 1/cm, the voxel volume is 1e-6 cm^3
+        absorbed_energy = np.sum(fluence * absorption) * 1e-6
+        self.assertTrue(0.5 < absorbed_energy < 1)
+
+    def test_unsupported_illumination_raises_error(self):
+        absorption, scattering, anisotropy = self.homogeneous_medium((5, 5, 5))
+        for illumination in [MSOTAcuityIlluminationGeometry(), MSOTInVisionIlluminationGeometry()]:
+            with self.subTest(illumination=type(illumination).__name__), self.assertRaises(ValueError):
+                self.adapter.forward_model(absorption, scattering, anisotropy, illumination)
+
+    def test_warm_start_needs_fewer_solver_iterations(self):
+        absorption, scattering, anisotropy = self.homogeneous_medium((31, 1, 40))
+        illumination = PencilBeamIlluminationGeometry(device_position_mm=np.array([1.5, 0.05, 0]))
+        self.settings.get_optical_settings()[Tags.DIFFUSION_SOLVER_WARM_START] = True
+        warm_start_adapter = DiffusionApproximationAdapter(self.settings)
+        warm_start_adapter.forward_model(absorption, scattering, anisotropy, illumination)
+
+        # a slightly changed absorption, as in the iterations of an iterative reconstruction
+        absorption[10:20, :, 10:20] = 1.2
+        cold_start_fluence = self.adapter.forward_model(absorption, scattering, anisotropy,
+                                                        illumination)[Tags.DATA_FIELD_FLUENCE]
+        warm_start_fluence = warm_start_adapter.forward_model(absorption, scattering, anisotropy,
+                                                              illumination)[Tags.DATA_FIELD_FLUENCE]
+        np.testing.assert_allclose(warm_start_fluence, cold_start_fluence, rtol=1e-5)
+        self.assertLess(warm_start_adapter.number_of_solver_iterations, self.adapter.number_of_solver_iterations)
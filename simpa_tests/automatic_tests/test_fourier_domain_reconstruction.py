@@ -0,0 +1,138 @@
+# SPDX-FileCopyrightText: 2021 Division of Intelligent Medical Systems, DKFZ
+# SPDX-FileCopyrightText: 2021 Janek Groehl
+# SPDX-License-Identifier: MIT
+
+import unittest
+import numpy as np
+from simpa.log import Logger
+from simpa.utils import Tags
+from simpa.core.device_digital_twins import LinearArrayDetectionGeometry, PlanarArrayDetectionGeometry, \
+    CurvedArrayDetectionGeometry
+from simpa.core.simulation_modules.acoustic_forward_module.acoustic_forward_module_k_space_adapter import \
+    compute_sensor_matrix, k_space_first_order
+from simpa.core.simulation_modules.reconstruction_module import create_reconstruction_settings
+from simpa.core.simulation_modules.reconstruction_module.reconstruction_module_delay_and_sum_adapter import \
+    DelayAndSumAdapter
+from simpa.core.simulation_modules.reconstruction_module.reconstruction_module_fourier_domain_adapter import \
+    FourierDomainReconstructionAdapter, fourier_domain_reconstruction, reconstruct_fourier_domain
+from simpa.core.simulation_modules.reconstruction_module.reconstruction_utils import compute_image_dimensions, \
+    compute_pixel_coordinates
+
+
+class TestFourierDomainReconstruction(unittest.TestCase):
+
+    def setUp(self):
+        self.speed_of_sound = 1500
+        self.time_spacing = 2.5e-8
+        self.dx_mm = 0.1
+        self.pml_size = 10
+
+    @staticmethod
+    def gaussian(shape, center, sigma):
+        coordinates = np.meshgrid(*[np.arange(size) for size in shape], indexing="ij")
+        squared_distance = sum((coordinate - position) ** 2 for coordinate, position in zip(coordinates, center))
+        return np.exp(-squared_distance / (2 * sigma ** 2)).astype(np.float32)
+
+    def simulate(self, detection_geometry, source_position_mm, lateral_extent_mm, depth_mm, number_time_steps):
+        """
+        Simulates the time series data of a gaussian source with the k-space forward model on a grid with the
+        spacing dx_mm, the sensor elements lie in the first plane after the PML.
+        """
+        positions = detection_geometry.get_detector_element_positions_base_mm()
+        n_lateral = int(round(2 * lateral_extent_mm / self.dx_mm)) + 2 * self.pml_size
+        n_depth = int(round(depth_mm / self.dx_mm)) + 2 * self.pml_size
+        if isinstance(detection_geometry, LinearArrayDetectionGeometry):
+            shape = (n_lateral, n_depth)
+            points = np.stack([positions[:, 0], np.zeros(len(positions))], axis=1)
+        else:
+            shape = (n_lateral, n_lateral, n_depth)
+            points = np.stack([positions[:, 0], positions[:, 1], np.zeros(len(positions))], axis=1)
+        offset = np.asarray([lateral_extent_mm] * (len(shape) - 1) + [0])
+        points = (points + offset) / self.dx_mm + self.pml_size
+        center = (np.asarray(source_position_mm) + offset) / self.dx_mm + self.pml_size
+        initial_pressure = self.gaussian(shape, center, 1.5)
+        return k_space_first_order(initial_pressure, np.full(shape, float(self.speed_of_sound)), np.full(shape, 1000.0),
+                                   self.dx_mm / 1000, self.time_spacing, number_time_steps,
+                                   compute_sensor_matrix(points, np.arange(len(points)), shape),
+                                   pml_size=[self.pml_size] * len(shape)).astype(np.float32)
+
+    def reconstruct(self, time_series, detection_geometry, adapter_class=FourierDomainReconstructionAdapter):
+        settings = create_reconstruction_settings(speed_of_sound_in_m_per_s=self.speed_of_sound,
+                                                  time_spacing_in_s=self.time_spacing,
+                                                  sensor_spacing_in_mm=self.dx_mm)
+        return adapter_class(settings).reconstruction_algorithm(time_series.copy(), detection_geometry)
+
+    def pixel_position_mm(self, detection_geometry, reconstruction):
+        xdim, zdim, ydim, xdim_start, _, ydim_start, _, zdim_start, _ = compute_image_dimensions(
+            detection_geometry, self.dx_mm, Logger())
+        x, y, z = compute_pixel_coordinates(xdim, ydim, zdim, xdim_start, ydim_start, zdim_start, "cpu")
+        index = np.unravel_index(np.argmax(reconstruction), reconstruction.shape)
+        if reconstruction.ndim == 2:
+            return np.asarray([x[index[0]], y[index[1]]]) * self.dx_mm
+        return np.asarray([x[index[0]], z[index[2]], y[index[1]]]) * self.dx_mm
+
+    def test_laterally_constant_source_is_recovered(self):
+        # a source that does not vary laterally emits a plane wave, half of which travels towards the sensors
+        c, dt, n_time_steps = 1500.0, 2.5e-8, 256
+        depth = c * dt * np.arange(n_time_steps)
+        source = np.exp(-((depth - 2e-3) / 1e-4) ** 2 / 2)
+        for n_lateral_axes in [1, 2]:
+            time_series = np.broadcast_to(source / 2, (16, ) * n_lateral_axes + (n_time_steps, ))
+            initial_pressure = fourier_domain_reconstruction(time_series, [1e-4] * n_lateral_axes, dt, c)
+            self.assertEqual(initial_pressure.shape, time_series.shape)
+            np.testing.assert_allclose(initial_pressure, np.broadcast_to(source, time_series.shape), atol=2e-3)
+
+    def test_linear_array_locates_source(self):
+        detection_geometry = LinearArrayDetectionGeometry(device_position_mm=np.array([5, 5, 0]),
+                                                          number_detector_elements=48, pitch_mm=0.2,
+                                                          field_of_view_extent_mm=np.array([-4, 4, 0, 0, 0, 6]))
+        time_series = self.simulate(detection_geometry, [1.0, 3.0], 6, 7, 400)
+        reconstruction = self.reconstruct(time_series, detection_geometry)
+        delay_and_sum = self.reconstruct(time_series, detection_geometry, DelayAndSumAdapter)
+
+        self.assertEqual(reconstruction.shape, delay_and_sum.shape)
+        self.assertEqual(reconstruction.dtype, np.float32)
+        np.testing.assert_allclose(self.pixel_position_mm(detection_geometry, reconstruction), [1.0, 3.0],
+                                   atol=0.15)
+
+    def test_planar_array_locates_source(self):
+        detection_geometry = PlanarArrayDetectionGeometry(device_position_mm=np.array([2, 2, 0]),
+                                                          number_detector_elements_x=12,
+                                                          number_detector_elements_y=10, pitch_mm=0.2,
+                                                          field_of_view_extent_mm=np.array([-1, 1, -1, 1, 0, 2]))
+        time_series = self.simulate(detection_geometry, [0.3, -0.2, 1.2], 1.6, 2.4, 120)
+        reconstruction = self.reconstruct(time_series, detection_geometry)
+
+        self.assertEqual(reconstruction.shape, self.reconstruct(time_series, detection_geometry,
+                                                                DelayAndSumAdapter).shape)
+        np.testing.assert_allclose(self.pixel_position_mm(detection_geometry, reconstruction), [0.3, -0.2, 1.2],
+                                   atol=0.15)
+
+    def test_batched_reconstruction_is_identical(self):
+        detection_geometry = LinearArrayDetectionGeometry(device_position_mm=np.array([5, 5, 0]),
+                                                          number_detector_elements=32, pitch_mm=0.3,
+                                                          field_of_view_extent_mm=np.array([-4, 4, 0, 0, 0, 6]))
+        time_series = np.random.default_rng(42).standard_normal((3, 32, 300)).astype(np.float32)
+        batch = self.reconstruct(time_series, detection_geometry)
+        for frame, reconstruction in zip(time_series, batch):
+            np.testing.assert_allclose(reconstruction, self.reconstruct(frame, detection_geometry), rtol=1e-5,
+                                       atol=1e-5 * np.max(np.abs(batch)))
+
+        # IPASC style data of shape (sensor elements, time steps, wavelengths, frames)
+        ipasc = reconstruct_fourier_domain(np.moveaxis(time_series, 0, -1)[..., None, :], detection_geometry,
+                                           speed_of_sound_in_m_per_s=self.speed_of_sound,
+                                           time_spacing_in_s=self.time_spacing, sensor_spacing_in_mm=self.dx_mm,
+                                           recon_mode=Tags.RECONSTRUCTION_MODE_PRESSURE)
+        np.testing.assert_allclose(ipasc[0], batch, rtol=1e-5, atol=1e-5 * np.max(np.abs(batch)))
+
+    def test_unsupported_geometries_raise_errors(self):
+        curved_array = CurvedArrayDetectionGeometry(device_position_mm=np.array([5, 5, 0]),
+                                                    number_detector_elements=32, radius_mm=10)
+        with self.assertRaises(TypeError):
+            self.reconstruct(np.zeros((32, 100), dtype=np.float32), curved_array)
+
+        linear_array = LinearArrayDetectionGeometry(device_position_mm=np.array([5, 5, 0]),
+                                                    number_detector_elements=32, pitch_mm=0.3,
+                                                    field_of_view_extent_mm=np.array([-4, 4, -1, 1, 0, 6]))
+        with self.assertRaises(ValueError):
+            self.reconstruct(np.zeros((32, 100), dtype=np.float32), linear_array)
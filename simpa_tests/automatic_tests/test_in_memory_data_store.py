@@ -0,0 +1,103 @@
+# SPDX-FileCopyrightText: 2021 Division of Intelligent Medical Systems, DKFZ
+# SPDX-FileCopyrightText: 2021 Janek Groehl
+# SPDX-License-Identifier: MIT
+
+import unittest
+import os
+import h5py
+import numpy as np
+from simpa.io_handling import save_hdf5, load_data_field, save_data_field, open_hdf5, InMemoryDataStore
+from simpa.utils import Tags
+from simpa.utils.dict_path_manager import generate_dict_path
+from simpa_tests.test_utils import assert_equals_recursive
+
+
+class TestInMemoryDataStore(unittest.TestCase):
+
+    def setUp(self):
+        self.file_path = "test_in_memory_data_store.hdf5"
+        save_hdf5({"name": "test"}, self.file_path, file_compression="gzip")
+        self.fluence_path = generate_dict_path(Tags.DATA_FIELD_FLUENCE, wavelength=800)[:-1]
+        self.density_path = generate_dict_path(Tags.DATA_FIELD_DENSITY)[:-1]
+
+    def tearDown(self):
+        if os.path.exists(self.file_path):
+            os.remove(self.file_path)
+
+    def assert_not_in_file(self, dataset_path):
+        with h5py.File(self.file_path, "r") as h5file:
+            self.assertNotIn(dataset_path, h5file)
+
+    def test_arrays_are_exchanged_in_memory_and_written_on_close(self):
+        fluence = np.random.random((10, 20, 30))
+        density = np.random.random((10, 20, 30))
+        with InMemoryDataStore(self.file_path) as data_store:
+            save_data_field(fluence, self.file_path, Tags.DATA_FIELD_FLUENCE, 800)
+            save_hdf5({"simulation_properties": {Tags.DATA_FIELD_DENSITY: density, "units": "kg/m3"}},
+                      self.file_path, "/simulations/")
+            self.assertIn(self.fluence_path, data_store)
+            self.assertIn(self.density_path, data_store)
+            self.assertEqual(data_store.memory_in_bytes, fluence.nbytes + density.nbytes)
+            self.assert_not_in_file(self.fluence_path)
+            # strings are written into the file directly
+            with h5py.File(self.file_path, "r") as h5file:
+                self.assertEqual(h5file["/simulations/simulation_properties/units"][()], b"kg/m3")
+
+            loaded_fluence = load_data_field(self.file_path, Tags.DATA_FIELD_FLUENCE, 800)
+            np.testing.assert_array_equal(loaded_fluence, fluence)
+            np.testing.assert_array_equal(load_data_field(self.file_path, Tags.DATA_FIELD_DENSITY,
+                                                          selection=np.s_[:, 5, :]), density[:, 5, :])
+            # the store returns and keeps copies, such that changing them does not change the stored data
+            loaded_fluence[:] = 0
+            fluence[:] = 1
+            self.assertGreater(np.abs(load_data_field(self.file_path, Tags.DATA_FIELD_FLUENCE, 800) - 1).max(), 0)
+
+            save_data_field(np.zeros((10, 30)), self.file_path, Tags.DATA_FIELD_DENSITY, selection=np.s_[:, 5, :])
+            density[:, 5, :] = 0
+            np.testing.assert_array_equal(load_data_field(self.file_path, Tags.DATA_FIELD_DENSITY), density)
+
+        self.assertFalse(data_store.is_open)
+        self.assertEqual(len(data_store), 0)
+        np.testing.assert_array_equal(load_data_field(self.file_path, Tags.DATA_FIELD_DENSITY), density)
+        with h5py.File(self.file_path, "r") as h5file:
+            self.assertEqual(h5file[self.density_path].compression, "gzip")
+
+    def test_arrays_are_spilled_to_the_file_if_the_budget_is_exceeded(self):
+        arrays = {str(wavelength): np.random.random((64, 64, 64)) for wavelength in [700, 800, 900]}
+        # each array needs 2 MB, so only one array fits into the budget
+        with InMemoryDataStore(self.file_path, memory_budget_in_mb=3) as data_store:
+            for wavelength, array in arrays.items():
+                save_data_field(array, self.file_path, Tags.DATA_FIELD_FLUENCE, wavelength)
+            self.assertEqual(data_store.number_of_spilled_arrays, 2)
+            self.assertLessEqual(data_store.memory_in_bytes, 3 * 1024 ** 2)
+            self.assertIn(generate_dict_path(Tags.DATA_FIELD_FLUENCE, wavelength=900)[:-1], data_store)
+            for wavelength, array in arrays.items():
+                np.testing.assert_array_equal(load_data_field(self.file_path, Tags.DATA_FIELD_FLUENCE, wavelength),
+                                              array)
+            # arrays that are larger than the budget are written into the file directly
+            large_array = np.random.random((128, 128, 32))
+            save_data_field(large_array, self.file_path, Tags.DATA_FIELD_DENSITY)
+            self.assertNotIn(self.density_path, data_store)
+            np.testing.assert_array_equal(load_data_field(self.file_path, Tags.DATA_FIELD_DENSITY), large_array)
+
+    def test_reading_the_file_persists_the_arrays_in_memory(self):
+        unmixing_result = {"oxyhemoglobin": np.random.random((5, 6, 7)),
+                           "deoxyhemoglobin": np.random.random((5, 6, 7))}
+        with InMemoryDataStore(self.file_path) as data_store:
+            save_data_field(unmixing_result, self.file_path, Tags.LINEAR_UNMIXING_RESULT)
+            self.assertEqual(len(data_store), 2)
+            # loading a group writes the arrays of this group into the file first
+            assert_equals_recursive(load_data_field(self.file_path, Tags.LINEAR_UNMIXING_RESULT), unmixing_result)
+            self.assertEqual(len(data_store), 0)
+
+            density = np.random.random((5, 6, 7))
+            save_data_field(density, self.file_path, Tags.DATA_FIELD_DENSITY)
+            with open_hdf5(self.file_path) as file:
+                np.testing.assert_array_equal(file["simulations"]["simulation_properties"][Tags.DATA_FIELD_DENSITY],
+                                              density)
+            self.assertEqual(len(data_store), 0)
+
+    def test_only_one_store_can_be_open_per_file(self):
+        with InMemoryDataStore(self.file_path):
+            with self.assertRaises(RuntimeError):
+                InMemoryDataStore(self.file_path).open()
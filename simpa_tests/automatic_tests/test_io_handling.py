@@ -5,12 +5,16 @@
 import unittest
 from simpa.io_handling import load_hdf5
 from simpa.io_handling import save_hdf5
+from simpa.io_handling import load_data_field, save_data_field, append_data_field, open_hdf5
+from simpa.io_handling.lazy_hdf5 import LazyHDF5Dataset, LazyHDF5Group
 from simpa.utils import Tags
 from simpa.utils.settings import Settings
 from simpa.utils.libraries.tissue_library import TISSUE_LIBRARY, AbsorptionSpectrumLibrary
 from simpa_tests.test_utils import assert_equals_recursive
+from simpa.utils.dict_path_manager import get_data_field_from_simpa_output, generate_dict_path
 from simpa.core.device_digital_twins import *
 import os
+import h5py
 import numpy as np
 
 
@@ -108,3 +112,149 @@ class TestIOHandling(unittest.TestCase):
         save_dictionary = Settings()
         save_dictionary[Tags.DIGITAL_DEVICE] = device
         self.assert_save_and_read_dictionaries_equal(save_dictionary)
+
+    def test_compressed_datasets_are_written_and_resized_in_place(self):
+        save_string = "test_compression.hdf5"
+        try:
+            save_hdf5({"group": {"data": np.ones((20, 30)), "name": "test"}}, save_string, file_compression="gzip",
+                      compression_level=6)
+            # later writes into the file use the compression that was given when the file was created
+            new_data = np.random.random((40, 10))
+            save_hdf5({"data": new_data, "other": np.arange(100)}, save_string, "/group/")
+            with h5py.File(save_string, "r") as h5file:
+                assert h5file["group/data"].compression == "gzip"
+                assert h5file["group/data"].compression_opts == 6
+                assert h5file["group/data"].shape == (40, 10)
+                assert h5file["group/other"].compression == "gzip"
+
+            assert_equals_recursive(load_hdf5(save_string),
+                                    {"group": {"data": new_data, "other": np.arange(100), "name": "test"}})
+        finally:
+            if os.path.exists(save_string):
+                os.remove(save_string)
+
+    def test_saving_into_a_group_creates_a_new_file(self):
+        save_string = "test_new_file.hdf5"
+        try:
+            data = np.random.random((20, 30))
+            save_hdf5({"data": data, "name": "test"}, save_string, "/group/", file_compression="gzip")
+            with h5py.File(save_string, "r") as h5file:
+                assert h5file["group/data"].compression == "gzip"
+            assert_equals_recursive(load_hdf5(save_string), {"group": {"data": data, "name": "test"}})
+        finally:
+            if os.path.exists(save_string):
+                os.remove(save_string)
+
+    def test_uncompressed_file_stays_uncompressed(self):
+        save_string = "test_no_compression.hdf5"
+        try:
+            save_hdf5({"data": np.ones((20, 30))}, save_string)
+            save_hdf5({"more_data": np.ones((20, 30))}, save_string, "/group/")
+            with h5py.File(save_string, "r") as h5file:
+                assert h5file["data"].compression is None
+                assert h5file["group/more_data"].compression is None
+        finally:
+            if os.path.exists(save_string):
+                os.remove(save_string)
+
+    def test_load_and_save_single_data_fields(self):
+        save_string = "test_data_fields.hdf5"
+        try:
+            # appending a data field to a file that does not exist yet creates it
+            save_data_field(np.ones(3), save_string, Tags.DATA_FIELD_SEGMENTATION)
+            np.testing.assert_array_equal(load_data_field(save_string, Tags.DATA_FIELD_SEGMENTATION), np.ones(3))
+            absorption = {str(wavelength): np.random.random((10, 20, 30)) for wavelength in [700, 800, 900]}
+            density = np.random.random((10, 20, 30))
+            save_hdf5({"simulations": {"simulation_properties": {Tags.DATA_FIELD_ABSORPTION_PER_CM: absorption,
+                                                                 Tags.DATA_FIELD_DENSITY: density}}},
+                      save_string, file_compression="gzip")
+
+            np.testing.assert_array_equal(load_data_field(save_string, Tags.DATA_FIELD_ABSORPTION_PER_CM, 800),
+                                          absorption["800"])
+            np.testing.assert_array_equal(load_data_field(save_string, Tags.DATA_FIELD_DENSITY,
+                                                          selection=np.s_[:, 5, :]), density[:, 5, :])
+            np.testing.assert_array_equal(load_data_field(save_string, Tags.DATA_FIELD_ABSORPTION_PER_CM, 900,
+                                                          selection=np.s_[2:4]), absorption["900"][2:4])
+
+            save_data_field(np.zeros((10, 30)), save_string, Tags.DATA_FIELD_DENSITY, selection=np.s_[:, 5, :])
+            density[:, 5, :] = 0
+            np.testing.assert_array_equal(load_data_field(save_string, Tags.DATA_FIELD_DENSITY), density)
+
+            with self.assertRaises(KeyError):
+                load_data_field(save_string, Tags.DATA_FIELD_ABSORPTION_PER_CM, 750)
+            with self.assertRaises(KeyError):
+                save_data_field(np.zeros((10, 30)), save_string, Tags.DATA_FIELD_SPEED_OF_SOUND,
+                                selection=np.s_[:, 5, :])
+        finally:
+            if os.path.exists(save_string):
+                os.remove(save_string)
+
+    def test_append_data_fields(self):
+        save_string = "test_append_data_fields.hdf5"
+        try:
+            save_hdf5({"name": "test"}, save_string, file_compression="gzip")
+            positions = [np.random.random((number_of_photons, 3)).astype(np.float32)
+                         for number_of_photons in [100, 0, 250]]
+            for index, position in enumerate(positions):
+                append_data_field(position, save_string, Tags.DATA_FIELD_PHOTON_EXIT_POS, 800, replace=index == 0)
+            np.testing.assert_array_equal(load_data_field(save_string, Tags.DATA_FIELD_PHOTON_EXIT_POS, 800),
+                                          np.concatenate(positions))
+            with h5py.File(save_string, "r") as h5file:
+                dataset = h5file[generate_dict_path(Tags.DATA_FIELD_PHOTON_EXIT_POS, wavelength=800)[:-1]]
+                assert dataset.compression == "gzip"
+                assert dataset.maxshape == (None, 3)
+
+            # replacing the data field starts it anew
+            append_data_field(positions[0], save_string, Tags.DATA_FIELD_PHOTON_EXIT_POS, 800, replace=True)
+            np.testing.assert_array_equal(load_data_field(save_string, Tags.DATA_FIELD_PHOTON_EXIT_POS, 800),
+                                          positions[0])
+
+            with self.assertRaises(ValueError):
+                append_data_field(np.ones((5, 2)), save_string, Tags.DATA_FIELD_PHOTON_EXIT_POS, 800)
+            # compressed data fields are resizable, uncompressed data fields written by save_data_field are not
+            save_data_field(np.ones((5, 3)), save_string, Tags.DATA_FIELD_PHOTON_EXIT_DIR, 800)
+            append_data_field(np.zeros((2, 3)), save_string, Tags.DATA_FIELD_PHOTON_EXIT_DIR, 800)
+            self.assertEqual(load_data_field(save_string, Tags.DATA_FIELD_PHOTON_EXIT_DIR, 800).shape, (7, 3))
+            os.remove(save_string)
+            save_data_field(np.ones((5, 3)), save_string, Tags.DATA_FIELD_PHOTON_EXIT_DIR, 800)
+            with self.assertRaises(ValueError):
+                append_data_field(np.ones((5, 3)), save_string, Tags.DATA_FIELD_PHOTON_EXIT_DIR, 800)
+        finally:
+            if os.path.exists(save_string):
+                os.remove(save_string)
+
+    def test_lazy_access_matches_load_hdf5(self):
+        for file_compression in [None, "gzip"]:
+            save_string = "test_lazy_access.hdf5"
+            try:
+                settings = Settings()
+                settings[Tags.WAVELENGTHS] = [700, 800]
+                settings[Tags.DIGITAL_DEVICE] = MSOTAcuityEcho()
+                fluence = {"700": np.random.random((10, 20, 30)), "800": np.random.random((10, 20, 30))}
+                save_dictionary = {Tags.SETTINGS: settings,
+                                   "simulations": {"optical_forward_model_output": {Tags.DATA_FIELD_FLUENCE: fluence}},
+                                   "values": [1, "a", 2.5],
+                                   "name": "test"}
+                save_hdf5(save_dictionary, save_string, file_compression=file_compression)
+
+                with open_hdf5(save_string) as file:
+                    assert set(file.keys()) == {Tags.SETTINGS, "simulations", "values", "name"}
+                    assert file["name"] == "test"
+                    assert isinstance(file["simulations"], LazyHDF5Group)
+                    assert isinstance(file[Tags.SETTINGS], Settings)
+                    assert isinstance(file[Tags.SETTINGS][Tags.DIGITAL_DEVICE], MSOTAcuityEcho)
+                    assert file["values"] == [1, "a", 2.5]
+
+                    lazy_fluence = get_data_field_from_simpa_output(file, Tags.DATA_FIELD_FLUENCE, 800)
+                    assert isinstance(lazy_fluence, LazyHDF5Dataset)
+                    assert lazy_fluence.shape == (10, 20, 30)
+                    assert lazy_fluence.is_memory_mapped == (file_compression is None)
+                    np.testing.assert_array_equal(lazy_fluence[:, 5, :], fluence["800"][:, 5, :])
+                    np.testing.assert_array_equal(np.asarray(lazy_fluence), fluence["800"])
+
+                    with self.assertRaises(KeyError):
+                        get_data_field_from_simpa_output(file, Tags.DATA_FIELD_FLUENCE, 900)
+                    assert_equals_recursive(file.load(), load_hdf5(save_string))
+            finally:
+                if os.path.exists(save_string):
+                    os.remove(save_string)
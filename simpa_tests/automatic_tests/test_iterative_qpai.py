@@ -0,0 +1,192 @@
+# SPDX-FileCopyrightText: 2021 Division of Intelligent Medical Systems, DKFZ
+# SPDX-FileCopyrightText: 2021 Janek Groehl
+# SPDX-License-Identifier: MIT
+
+import os
+import stat
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+
+from simpa.core.device_digital_twins import PhotoacousticDevice, PencilBeamIlluminationGeometry
+from simpa.core.processing_components.monospectral.iterative_qPAI_algorithm import IterativeqPAI
+from simpa.core.simulation_modules.optical_simulation_module.optical_forward_model_diffusion_adapter import \
+    DiffusionApproximationAdapter
+from simpa.utils import Tags, Settings
+from simpa.utils.profiling import StageProfiler
+from simpa_tests.test_utils import mcx_stand_in
+
+
+class TestIterativeqPAI(unittest.TestCase):
+
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()
+        self.binary_path = os.path.join(self.temporary_directory.name, "mcx")
+        with open(self.binary_path, "w") as binary_file:
+            binary_file.write(f'#!/bin/sh\nexec "{sys.executable}" "{mcx_stand_in.__file__}" "$@"\n')
+        os.chmod(self.binary_path, os.stat(self.binary_path).st_mode | stat.S_IEXEC)
+        np.random.seed(4711)
+        shape = (10, 8, 12)
+        self.initial_pressure = np.random.random(shape) + 1
+        self.scattering = np.full(shape, 100.0)
+        self.anisotropy = np.full(shape, 0.9)
+        self.device = PhotoacousticDevice(device_position_mm=np.array([5, 4, 0]))
+        self.device.add_illumination_geometry(PencilBeamIlluminationGeometry())
+
+    def tearDown(self):
+        self.temporary_directory.cleanup()
+
+    def get_settings(self, optical_model, component_settings: dict, spacing: float = 1) -> Settings:
+        settings = Settings({
+            Tags.SIMULATION_PATH: self.temporary_directory.name,
+            Tags.VOLUME_NAME: "iterative_qpai",
+            Tags.SPACING_MM: spacing,
+            Tags.DIM_VOLUME_X_MM: 10 * spacing,
+            Tags.DIM_VOLUME_Y_MM: 8 * spacing,
+            Tags.DIM_VOLUME_Z_MM: 12 * spacing,
+            Tags.RANDOM_SEED: 4711,
+            "iterative_qpai_reconstruction": component_settings
+        }, verbose=False)
+        settings.set_optical_settings({
+            Tags.OPTICAL_MODEL: optical_model,
+            Tags.OPTICAL_MODEL_BINARY_PATH: self.binary_path,
+            Tags.OPTICAL_MODEL_NUMBER_PHOTONS: 1e6
+        })
+        return settings
+
+    def get_reconstruction(self, optical_model, component_settings: dict, spacing: float = 1) -> IterativeqPAI:
+        return IterativeqPAI(self.get_settings(optical_model, component_settings, spacing),
+                             "iterative_qpai_reconstruction")
+
+    def reconstruct(self, reconstruction: IterativeqPAI) -> np.ndarray:
+        with patch.object(reconstruction, "extract_initial_data_from_hdf5",
+                          return_value=(self.initial_pressure, self.scattering, self.anisotropy)):
+            absorption, _ = reconstruction.iterative_absorption_reconstruction(self.device)
+        return absorption
+
+    def test_photon_budget_fraction_grows_as_the_error_converges(self):
+        reconstruction = self.get_reconstruction(Tags.OPTICAL_MODEL_MCX, {
+            Tags.ITERATIVE_RECONSTRUCTION_STOPPING_LEVEL: 0.01,
+            Tags.ITERATIVE_RECONSTRUCTION_MINIMUM_PHOTON_FRACTION: 0.1
+        })
+        self.assertEqual(reconstruction.minimum_photon_fraction(), 0.1)
+        # not enough errors to estimate the convergence
+        self.assertEqual(reconstruction.photon_budget_fraction([2.0], 0.1, iteration=1, maximum_iteration_number=10),
+                         0.1)
+        # the error changes by 20 %, which is resolved with a fraction of (0.01 / 0.2)^2 of the photons
+        self.assertEqual(reconstruction.photon_budget_fraction([2.0, 1.6], 0.1, iteration=2,
+                                                               maximum_iteration_number=10), 0.1)
+        self.assertAlmostEqual(reconstruction.photon_budget_fraction([2.0, 1.6], 0.001, iteration=2,
+                                                                     maximum_iteration_number=10), 0.0025)
+        # the error changes by 2 %
+        self.assertAlmostEqual(reconstruction.photon_budget_fraction([2.0, 1.96], 0.1, iteration=2,
+                                                                     maximum_iteration_number=10), 0.25)
+        self.assertEqual(reconstruction.photon_budget_fraction([2.0, 1.999], 0.1, iteration=2,
+                                                               maximum_iteration_number=10), 1.0)
+        # the last possible iteration always uses the full photon budget
+        self.assertEqual(reconstruction.photon_budget_fraction([2.0, 1.6], 0.1, iteration=9,
+                                                               maximum_iteration_number=10), 1.0)
+
+    @unittest.skipIf(sys.platform.startswith("win"), "the MCX stand-in is started through a shell script")
+    def test_adaptive_photon_budget(self):
+        reconstruction = self.get_reconstruction(Tags.OPTICAL_MODEL_MCX, {
+            Tags.DOWNSCALE_FACTOR: 1,
+            Tags.ITERATIVE_RECONSTRUCTION_MAX_ITERATION_NUMBER: 5,
+            Tags.ITERATIVE_RECONSTRUCTION_ADAPTIVE_PHOTON_BUDGET: True
+        })
+        # a constant regularization does not need the noise estimate, which requires PyWavelets
+        with patch.object(reconstruction, "regularization_sigma", return_value=1e-6):
+            absorption = self.reconstruct(reconstruction)
+        self.assertEqual(absorption.shape, self.initial_pressure.shape)
+        photon_budgets = reconstruction.photon_budgets
+        self.assertEqual(photon_budgets[0], 1e6 / 16)
+        self.assertEqual(photon_budgets[-1], 1e6)
+        self.assertTrue(np.all(np.diff(photon_budgets) >= 0))
+        self.assertEqual(reconstruction.optical_settings[Tags.OPTICAL_MODEL_NUMBER_PHOTONS], 1e6)
+
+        reconstruction = self.get_reconstruction(Tags.OPTICAL_MODEL_MCX, {
+            Tags.DOWNSCALE_FACTOR: 1,
+            Tags.ITERATIVE_RECONSTRUCTION_MAX_ITERATION_NUMBER: 5
+        })
+        with patch.object(reconstruction, "regularization_sigma", return_value=1e-6):
+            self.reconstruct(reconstruction)
+        self.assertTrue(all(photon_budget == 1e6 for photon_budget in reconstruction.photon_budgets))
+
+    def test_diffusion_approximation_is_created_once_and_warm_started(self):
+        reconstruction = self.get_reconstruction(Tags.OPTICAL_MODEL_DIFFUSION, {
+            Tags.DOWNSCALE_FACTOR: 1,
+            Tags.ITERATIVE_RECONSTRUCTION_MAX_ITERATION_NUMBER: 3,
+            Tags.ITERATIVE_RECONSTRUCTION_ADAPTIVE_PHOTON_BUDGET: True
+        })
+        with patch.object(reconstruction, "regularization_sigma", return_value=1e-6):
+            absorption = self.reconstruct(reconstruction)
+        self.assertTrue(np.all(np.isfinite(absorption)))
+        forward_model = reconstruction.forward_model_implementation
+        self.assertTrue(forward_model.warm_start)
+        self.assertEqual(len(forward_model.previous_diffuse_fluences), 1)
+        self.assertEqual(reconstruction.photon_budgets, [None] * len(reconstruction.photon_budgets))
+        self.assertIs(reconstruction.get_forward_model_implementation(), forward_model)
+
+    def test_resolution_levels(self):
+        reconstruction = self.get_reconstruction(Tags.OPTICAL_MODEL_DIFFUSION, {})
+        self.assertEqual(reconstruction.resolution_level_factors(), [1])
+        reconstruction = self.get_reconstruction(Tags.OPTICAL_MODEL_DIFFUSION, {
+            Tags.ITERATIVE_RECONSTRUCTION_RESOLUTION_LEVELS: 3
+        })
+        self.assertEqual(reconstruction.resolution_level_factors(), [0.25, 0.5, 1])
+        self.assertEqual(reconstruction.coarse_level_max_iteration_number(), 5)
+
+        # downsampling averages the voxels, upsampling interpolates linearly
+        data = np.arange(24.0).reshape((4, 2, 3))
+        downsampled = IterativeqPAI.resample_to_shape(data, (2, 1, 3))
+        np.testing.assert_allclose(downsampled[:, 0, 0], [np.mean(data[:2, :, 0]), np.mean(data[2:, :, 0])])
+        self.assertEqual(IterativeqPAI.resample_to_shape(data, (8, 2, 3)).shape, (8, 2, 3))
+        self.assertEqual(IterativeqPAI.resample_to_shape(data, (3, 1, 5)).shape, (3, 1, 5))
+
+    def test_multiresolution_reconstruction_is_as_accurate_as_single_level_reconstruction(self):
+        shape = (24, 24, 24)
+        absorption = np.full(shape, 0.5)
+        absorption[9:15, 9:15, 6:12] = 2
+        scattering = np.full(shape, 100.0)
+        anisotropy = np.full(shape, 0.9)
+        self.device = PhotoacousticDevice(device_position_mm=np.array([6, 6, 0]))
+        self.device.add_illumination_geometry(PencilBeamIlluminationGeometry())
+        fluence = DiffusionApproximationAdapter(self.get_settings(Tags.OPTICAL_MODEL_DIFFUSION, {}, 0.5)) \
+            .run_forward_model(self.device.get_illumination_geometry(), self.device, absorption, scattering,
+                               anisotropy)[Tags.DATA_FIELD_FLUENCE]
+        self.initial_pressure = absorption * fluence * (1 + 1e-3 * np.random.standard_normal(shape))
+        self.scattering = scattering
+        self.anisotropy = anisotropy
+
+        errors = dict()
+        for resolution_levels in [1, 3]:
+            reconstruction = self.get_reconstruction(Tags.OPTICAL_MODEL_DIFFUSION, {
+                Tags.DOWNSCALE_FACTOR: 1,
+                Tags.ITERATIVE_RECONSTRUCTION_MAX_ITERATION_NUMBER: 20,
+                Tags.ITERATIVE_RECONSTRUCTION_STOPPING_LEVEL: 1e-3,
+                Tags.ITERATIVE_RECONSTRUCTION_CONSTANT_REGULARIZATION: True,
+                Tags.ITERATIVE_RECONSTRUCTION_REGULARIZATION_SIGMA: 1e-6,
+                Tags.ITERATIVE_RECONSTRUCTION_RESOLUTION_LEVELS: resolution_levels
+            }, spacing=0.5)
+            # the constant regularization does not need the noise estimate, which requires PyWavelets
+            with StageProfiler(type(reconstruction).__name__) as profiler, \
+                    patch.object(reconstruction, "regularization_sigma", return_value=1e-6):
+                reconstructed_absorption = self.reconstruct(reconstruction)
+            self.assertEqual(reconstructed_absorption.shape, shape)
+            self.assertEqual(reconstruction.global_settings[Tags.SPACING_MM], 0.5)
+            errors[resolution_levels] = np.mean(np.abs(reconstructed_absorption - absorption) / absorption)
+            levels = reconstruction.resolution_levels
+            self.assertEqual([level["shape"] for level in levels][-1], shape)
+            self.assertEqual([level["spacing_mm"] for level in levels], [0.5 / factor for factor in
+                                                                        reconstruction.resolution_level_factors()])
+            if resolution_levels == 1:
+                full_resolution_iterations = levels[0]["iterations"]
+            else:
+                self.assertEqual([level["shape"] for level in levels], [(6, 6, 6), (12, 12, 12), shape])
+                self.assertLess(levels[-1]["iterations"], full_resolution_iterations)
+                self.assertTrue(all(level["wall_time_in_s"] > 0 for level in levels))
+            self.assertIs(profiler.profile.details["resolution_levels"], levels)
+        self.assertLess(errors[3], errors[1] + 0.01)
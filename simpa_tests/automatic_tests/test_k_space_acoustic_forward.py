@@ -0,0 +1,167 @@
+# SPDX-FileCopyrightText: 2021 Division of Intelligent Medical Systems, DKFZ
+# SPDX-FileCopyrightText: 2021 Janek Groehl
+# SPDX-License-Identifier: MIT
+
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import numpy as np
+import scipy.fft
+
+from simpa.core.device_digital_twins import LinearArrayDetectionGeometry
+from simpa.core.simulation_modules.acoustic_forward_module.acoustic_forward_module_k_space_adapter import \
+    KSpacePseudospectralAdapter, compute_sensor_matrix, k_space_first_order
+from simpa.io_handling import load_data_field, save_data_field
+from simpa.utils import Tags, Settings
+
+
+class TestKSpaceAcousticForwardModel(unittest.TestCase):
+
+    def setUp(self):
+        self.speed_of_sound = 1500.0
+        self.dx = 1e-4
+        self.dt = 0.3 * self.dx / self.speed_of_sound
+
+    @staticmethod
+    def gaussian(shape, center, sigma):
+        coordinates = np.meshgrid(*[np.arange(size) for size in shape], indexing="ij")
+        squared_distance = sum((coordinate - position) ** 2 for coordinate, position in zip(coordinates, center))
+        return np.exp(-squared_distance / (2 * sigma ** 2)).astype(np.float32)
+
+    def simulate(self, initial_pressure, sensor_points, number_time_steps, pml_size):
+        return k_space_first_order(initial_pressure, np.full(initial_pressure.shape, self.speed_of_sound),
+                                   np.full(initial_pressure.shape, 1000.0), self.dx, self.dt, number_time_steps,
+                                   compute_sensor_matrix(sensor_points, np.arange(len(sensor_points)),
+                                                         initial_pressure.shape),
+                                   pml_size=[pml_size] * initial_pressure.ndim)
+
+    def test_3d_gaussian_source_matches_analytical_solution(self):
+        # for a spherically symmetric source f(r): r p(r, t) = ((r - ct) f(r - ct) + (r + ct) f(r + ct)) / 2
+        shape, sigma, number_time_steps = (48, 48, 48), 2.5, 80
+        distances = np.array([6, 10, 14])
+        sensor_points = np.stack([24 + distances, np.full(3, 24), np.full(3, 24)], axis=1).astype(float)
+        time_series = self.simulate(self.gaussian(shape, (24, 24, 24), sigma), sensor_points, number_time_steps, 8)
+
+        def source(radius):
+            return np.exp(-(radius / (sigma * self.dx)) ** 2 / 2)
+
+        travelled_distance = self.speed_of_sound * np.arange(number_time_steps) * self.dt
+        for distance, simulated in zip(distances * self.dx, time_series):
+            expected = ((distance - travelled_distance) * source(distance - travelled_distance) +
+                        (distance + travelled_distance) * source(distance + travelled_distance)) / (2 * distance)
+            np.testing.assert_allclose(simulated, expected, atol=1e-3 * np.max(np.abs(expected)))
+
+    def test_2d_simulation_with_pml_matches_free_field_solution(self):
+        # reference: exact spectral solution on a grid that is large enough for the waves not to wrap around
+        pml_size, number_time_steps = 20, 300
+        shape = (64 + 2 * pml_size, 64 + 2 * pml_size)
+        initial_pressure = self.gaussian(shape, (pml_size + 20, pml_size + 30), 2.0)
+        sensor_points = np.array([[20, 50], [50, 30], [60, 60]], dtype=float) + pml_size
+        time_series = self.simulate(initial_pressure, sensor_points, number_time_steps, pml_size)
+
+        offset = 200
+        initial_pressure_k = scipy.fft.rfft2(np.pad(initial_pressure, offset))
+        wavenumbers = np.sqrt((2 * np.pi * scipy.fft.fftfreq(shape[0] + 2 * offset, self.dx))[:, None] ** 2 +
+                              (2 * np.pi * scipy.fft.rfftfreq(shape[1] + 2 * offset, self.dx))[None, :] ** 2)
+        indices = tuple((sensor_points.astype(int) + offset).T)
+        expected = np.stack([scipy.fft.irfft2(initial_pressure_k *
+                                              np.cos(self.speed_of_sound * wavenumbers * time_index * self.dt),
+                                              s=(shape[0] + 2 * offset, shape[1] + 2 * offset))[indices]
+                             for time_index in range(number_time_steps)], axis=1)
+        np.testing.assert_allclose(time_series, expected, atol=1e-3 * np.max(np.abs(expected)))
+
+    @staticmethod
+    def create_adapter_settings():
+        settings = Settings({
+            Tags.SPACING_MM: 0.2,
+            Tags.DIM_VOLUME_X_MM: 10.2,
+            Tags.DIM_VOLUME_Y_MM: 2,
+            Tags.DIM_VOLUME_Z_MM: 8,
+            Tags.WAVELENGTH: 800,
+        }, verbose=False)
+        settings.set_acoustic_settings({
+            Tags.KWAVE_PROPERTY_ALPHA_POWER: 1.05,
+            Tags.KWAVE_PROPERTY_PMLSize: [20],
+            Tags.KWAVE_PROPERTY_PMLAlpha: 2.0,
+            Tags.KWAVE_PROPERTY_PMLInside: False,
+            Tags.KWAVE_PROPERTY_INITIAL_PRESSURE_SMOOTHING: True
+        })
+        return settings
+
+    def save_volumes(self, file_path, initial_pressure):
+        shape = initial_pressure.shape
+        save_data_field(np.full(shape, self.speed_of_sound), file_path, Tags.DATA_FIELD_SPEED_OF_SOUND)
+        save_data_field(np.full(shape, 1000.0), file_path, Tags.DATA_FIELD_DENSITY)
+        save_data_field(np.zeros(shape), file_path, Tags.DATA_FIELD_ALPHA_COEFF)
+        save_data_field(initial_pressure, file_path, Tags.DATA_FIELD_INITIAL_PRESSURE, 800)
+
+    def run_adapter(self, settings, device, initial_pressure):
+        with tempfile.TemporaryDirectory() as temporary_directory:
+            settings[Tags.SIMPA_OUTPUT_PATH] = os.path.join(temporary_directory, "k_space.hdf5")
+            self.save_volumes(settings[Tags.SIMPA_OUTPUT_PATH], initial_pressure)
+            KSpacePseudospectralAdapter(settings).run(device)
+            return load_data_field(settings[Tags.SIMPA_OUTPUT_PATH], Tags.DATA_FIELD_TIME_SERIES_DATA, 800)
+
+    def test_adapter_simulates_linear_array(self):
+        settings = self.create_adapter_settings()
+        device = LinearArrayDetectionGeometry(device_position_mm=np.array([5, 1, 0]), number_detector_elements=16,
+                                              pitch_mm=0.3, field_of_view_extent_mm=np.array([-3, 3, 0, 0, 0, 8]))
+        initial_pressure = np.zeros((51, 10, 40))
+        initial_pressure[:, 5, :] = self.gaussian((51, 40), (25, 20), 1.0)
+
+        time_series = self.run_adapter(settings, device, initial_pressure)
+
+        self.assertEqual(time_series.shape, (16, settings[Tags.K_WAVE_SPECIFIC_NT]))
+        self.assertAlmostEqual(settings[Tags.K_WAVE_SPECIFIC_DT], 1 / 40e6)
+        # the array is symmetric around the source
+        np.testing.assert_allclose(time_series, time_series[::-1], atol=1e-4 * np.max(np.abs(time_series)))
+        # the wave front arrives at the elements after travelling from the source in 4 mm depth
+        element_positions = device.get_detector_element_positions_accounting_for_device_position_mm()
+        distances_mm = np.sqrt((element_positions[:, 0] - 5) ** 2 + 4 ** 2)
+        arrival_mm = np.argmax(time_series, axis=1) * settings[Tags.K_WAVE_SPECIFIC_DT] * self.speed_of_sound * 1000
+        np.testing.assert_allclose(arrival_mm, distances_mm, atol=0.3)
+
+    def test_imaging_plane_outside_of_the_volume_is_clamped(self):
+        settings = self.create_adapter_settings()
+        device = LinearArrayDetectionGeometry(device_position_mm=np.array([5, 1.8, 0]), number_detector_elements=16,
+                                              pitch_mm=0.3, field_of_view_extent_mm=np.array([-3, 3, 0, 0, 0, 8]))
+        initial_pressure = np.zeros((51, 10, 40))
+        initial_pressure[:, 9, :] = self.gaussian((51, 40), (25, 20), 1.0)
+        reference = self.run_adapter(settings, device, initial_pressure)
+        self.assertGreater(np.max(np.abs(reference)), 0)
+
+        # the imaging plane at y = 2.5 mm is behind the last plane of the 2 mm thick volume
+        device = LinearArrayDetectionGeometry(device_position_mm=np.array([5, 2.5, 0]), number_detector_elements=16,
+                                              pitch_mm=0.3, field_of_view_extent_mm=np.array([-3, 3, 0, 0, 0, 8]))
+        np.testing.assert_array_equal(self.run_adapter(settings, device, initial_pressure), reference)
+
+    def test_acoustic_simulation_3d_tag_simulates_the_whole_volume(self):
+        device = LinearArrayDetectionGeometry(device_position_mm=np.array([5, 1, 0]), number_detector_elements=16,
+                                              pitch_mm=0.3, field_of_view_extent_mm=np.array([-3, 3, 0, 0, 0, 8]))
+        initial_pressure = np.zeros((51, 10, 40))
+        for simulate_3d, expected_shape in [(False, (51, 40)), (True, (51, 10, 40))]:
+            settings = self.create_adapter_settings()
+            settings.get_acoustic_settings()[Tags.ACOUSTIC_SIMULATION_3D] = simulate_3d
+            with patch.object(KSpacePseudospectralAdapter, "k_space_acoustic_forward_model",
+                              return_value=(np.zeros((16, 10)), 1 / 40e6, 10)) as forward_model:
+                self.run_adapter(settings, device, initial_pressure)
+            simulated_initial_pressure, _, _, _, sensor_positions = forward_model.call_args.args[:5]
+            self.assertEqual(simulated_initial_pressure.shape, expected_shape)
+            self.assertEqual(sensor_positions.shape, (16, len(expected_shape)))
+
+    def test_absorption_attenuates_signal(self):
+        settings = Settings({Tags.SPACING_MM: 0.1}, verbose=False)
+        settings.set_acoustic_settings({Tags.KWAVE_PROPERTY_ALPHA_POWER: 1.05,
+                                        Tags.KWAVE_PROPERTY_INITIAL_PRESSURE_SMOOTHING: False})
+        adapter = KSpacePseudospectralAdapter(settings)
+        initial_pressure = self.gaussian((60, 60), (30, 30), 1.5)
+        positions, orientations = np.array([[3.0, 0.5]]), np.array([[0.0, 1.0]])
+
+        amplitudes = list()
+        for alpha_coeff in [0, 5]:
+            time_series, _, _ = adapter.k_space_acoustic_forward_model(initial_pressure, self.speed_of_sound, 1000,
+                                                                       alpha_coeff, positions, orientations, 0.1, 40)
+            amplitudes.append(np.max(np.abs(time_series)))
+        self.assertLess(amplitudes[1], 0.9 * amplitudes[0])
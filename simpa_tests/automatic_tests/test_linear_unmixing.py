@@ -6,7 +6,10 @@ import unittest
 from unittest.case import expectedFailure
 from simpa.utils import Tags, Settings
 from simpa_tests.test_utils.tissue_models import create_simple_tissue_model
+from simpa_tests.test_utils import assert_equals_recursive
 import simpa as sp
+from simpa.core.processing_components.multispectral.linear_unmixing import batch_nnls
+from scipy.optimize import nnls
 import numpy as np
 import os
 
@@ -251,9 +254,81 @@ class TestLinearUnmixing(unittest.TestCase):
         lu_results = sp.load_data_field(self.settings[Tags.SIMPA_OUTPUT_PATH], Tags.LINEAR_UNMIXING_RESULT)
         self.assert_correct_so2_vales(lu_results["sO2"], tolerance=1e-2)
 
+    def test_tiled_unmixing_matches_unmixing_as_a_whole(self):
+        """
+        This function tests that unmixing the data field tile by tile gives the same result as unmixing it as a whole.
+        """
+        self.logger.info("Testing tiled linear unmixing...")
+        for non_negative in [False, True]:
+            results = list()
+            for tile_size in [None, 2500, 1]:
+                self.settings["linear_unmixing"] = {
+                    Tags.DATA_FIELD: Tags.DATA_FIELD_ABSORPTION_PER_CM,
+                    Tags.LINEAR_UNMIXING_SPECTRA:
+                        sp.get_simpa_internal_absorption_spectra_by_names(
+                            [Tags.SIMPA_NAMED_ABSORPTION_SPECTRUM_DEOXYHEMOGLOBIN,
+                             Tags.SIMPA_NAMED_ABSORPTION_SPECTRUM_OXYHEMOGLOBIN]),
+                    Tags.LINEAR_UNMIXING_COMPUTE_SO2: True,
+                    Tags.WAVELENGTHS: self.WAVELENGTHS,
+                    Tags.LINEAR_UNMIXING_NON_NEGATIVE: non_negative,
+                    Tags.SIGNAL_THRESHOLD: 0.01
+                }
+                if tile_size is not None:
+                    self.settings["linear_unmixing"][Tags.LINEAR_UNMIXING_TILE_SIZE] = tile_size
+                lu = sp.LinearUnmixing(self.settings, "linear_unmixing")
+                self.assertEqual(lu.data is None, tile_size is not None)
+                lu.run()
+                results.append(sp.load_data_field(self.settings[Tags.SIMPA_OUTPUT_PATH],
+                                                  Tags.LINEAR_UNMIXING_RESULT))
+
+            # tiles of 2500 voxels are two slices of the 50 x 20 x 50 volume, tiles of one voxel are one slice
+            self.assertEqual(len(lu.get_tiles((50, 20, 50))), 50)
+            lu.component_settings[Tags.LINEAR_UNMIXING_TILE_SIZE] = 2500
+            self.assertEqual(lu.get_tiles((50, 20, 50))[-1], np.s_[48:50])
+            for result in results[1:]:
+                self.assertEqual(result["wavelengths"], self.WAVELENGTHS)
+                assert_equals_recursive(result["chromophore_concentrations"], results[0]["chromophore_concentrations"])
+                np.testing.assert_array_equal(result["sO2"], results[0]["sO2"])
+            self.assert_correct_so2_vales(results[-1]["sO2"])
+
     def tearDown(self):
         # Clean up file after testing
         if (os.path.exists(self.settings[Tags.SIMPA_OUTPUT_PATH]) and
                 os.path.isfile(self.settings[Tags.SIMPA_OUTPUT_PATH])):
             # Delete the created file
             os.remove(self.settings[Tags.SIMPA_OUTPUT_PATH])
+
+
+class TestBatchNonNegativeLeastSquares(unittest.TestCase):
+
+    def setUp(self):
+        self.random_generator = np.random.default_rng(471)
+
+    def assert_matches_scipy_nnls(self, number_of_wavelengths, number_of_endmembers, **kwargs):
+        endmember_matrix = self.random_generator.random((number_of_wavelengths, number_of_endmembers))
+        data = endmember_matrix @ self.random_generator.normal(size=(number_of_endmembers, 500)) + \
+            self.random_generator.normal(scale=0.5, size=(number_of_wavelengths, 500))
+        result = batch_nnls(endmember_matrix, data, **kwargs)
+        expected = np.stack([nnls(endmember_matrix, data[:, pixel])[0] for pixel in range(data.shape[1])], axis=1)
+        assert result.shape == expected.shape
+        assert np.all(result >= 0)
+        assert np.allclose(result, expected, rtol=1e-8, atol=1e-10)
+
+    def test_batch_nnls_matches_scipy_nnls(self):
+        self.assert_matches_scipy_nnls(6, 2)
+        self.assert_matches_scipy_nnls(6, 4)
+        self.assert_matches_scipy_nnls(16, 8)
+
+    def test_batch_nnls_with_more_endmembers_than_wavelengths(self):
+        self.assert_matches_scipy_nnls(2, 3)
+
+    def test_batch_nnls_in_chunks(self):
+        self.assert_matches_scipy_nnls(6, 3, chunk_size=64)
+
+    def test_batch_nnls_with_zero_data(self):
+        result = batch_nnls(np.eye(3), np.zeros((3, 10)))
+        assert np.array_equal(result, np.zeros((3, 10)))
+
+    def test_batch_nnls_with_mismatching_dimensions(self):
+        with self.assertRaises(ValueError):
+            batch_nnls(np.eye(3), np.zeros((4, 10)))
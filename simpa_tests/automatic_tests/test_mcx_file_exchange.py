@@ -0,0 +1,272 @@
+# SPDX-FileCopyrightText: 2021 Division of Intelligent Medical Systems, DKFZ
+# SPDX-FileCopyrightText: 2021 Janek Groehl
+# SPDX-License-Identifier: MIT
+
+import os
+import stat
+import struct
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+from simpa.core.simulation_modules.optical_simulation_module.optical_forward_model_mcx_adapter import MCXAdapter
+from simpa.core.simulation_modules.optical_simulation_module.optical_forward_model_mcx_reflectance_adapter import \
+    MCXAdapterReflectance
+from simpa.core.device_digital_twins import PencilBeamIlluminationGeometry, PhotoacousticDevice
+from simpa.io_handling import save_hdf5, save_data_field, load_data_field
+from simpa.utils import Tags, Settings
+from simpa_tests.test_utils import mcx_stand_in
+
+
+class TestMCXFileExchange(unittest.TestCase):
+
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()
+        self.settings = Settings({
+            Tags.SIMULATION_PATH: self.temporary_directory.name,
+            Tags.VOLUME_NAME: "mcx_file_exchange",
+            Tags.SPACING_MM: 1
+        })
+        self.settings.set_optical_settings({})
+        np.random.seed(1234)
+        self.absorption_cm = np.random.random((4, 5, 6))
+        self.scattering_cm = np.random.random((4, 5, 6)) * 100
+        self.anisotropy = np.random.random((4, 5, 6))
+
+    def tearDown(self):
+        self.temporary_directory.cleanup()
+
+    def assert_binary_input_is_as_expected(self, adapter):
+        adapter.generate_mcx_bin_input(absorption_cm=self.absorption_cm,
+                                       scattering_cm=self.scattering_cm,
+                                       anisotropy=self.anisotropy,
+                                       assumed_anisotropy=0.9)
+        absorption_mm, scattering_mm = adapter.pre_process_volumes(absorption_cm=self.absorption_cm,
+                                                                   scattering_cm=self.scattering_cm,
+                                                                   anisotropy=self.anisotropy,
+                                                                   assumed_anisotropy=0.9)
+        expected_values = list(np.reshape(np.asarray([absorption_mm, scattering_mm]), 2 * absorption_mm.size, "F"))
+        expected_bytes = struct.pack("f" * len(expected_values), *expected_values)
+
+        input_path = os.path.join(self.temporary_directory.name, "mcx_file_exchange.bin")
+        with open(input_path, "rb") as input_file:
+            self.assertEqual(input_file.read(), expected_bytes)
+        self.assertEqual((adapter.nx, adapter.ny, adapter.nz), np.shape(absorption_mm))
+
+    def test_binary_input(self):
+        self.assert_binary_input_is_as_expected(MCXAdapter(self.settings))
+
+    def test_binary_input_of_reflectance_adapter(self):
+        self.assert_binary_input_is_as_expected(MCXAdapterReflectance(self.settings))
+
+    def test_read_output(self):
+        adapter = MCXAdapter(self.settings)
+        adapter.nx, adapter.ny, adapter.nz, adapter.frames = 4, 5, 6, 1
+        adapter.mcx_volumetric_data_file = os.path.join(self.temporary_directory.name, "mcx_file_exchange_output.mc2")
+        fluence_mm = np.random.random((4, 5, 6)).astype(np.float32)
+        values = list(np.reshape(fluence_mm, fluence_mm.size, "F"))
+        with open(adapter.mcx_volumetric_data_file, "wb") as output_file:
+            output_file.write(struct.pack("f" * len(values), *values))
+
+        fluence = adapter.read_mcx_output()[Tags.DATA_FIELD_FLUENCE]
+        self.assertEqual(fluence.shape, (4, 5, 6))
+        self.assertEqual(fluence.dtype, np.float64)
+        np.testing.assert_array_equal(fluence, fluence_mm.astype(np.float64) * 100)
+
+    def test_read_output_of_reflectance_adapter(self):
+        adapter = MCXAdapterReflectance(self.settings)
+        adapter.nx, adapter.ny, adapter.nz, adapter.frames = 4, 5, 6, 1
+        adapter.padded = True
+        adapter.mcx_volumetric_data_file = os.path.join(self.temporary_directory.name, "mcx_file_exchange_output.mc2")
+        fluence_mm = np.random.random((4, 5, 6)).astype(np.float32)
+        # MCX stores the diffuse reflectance as negative values in the padded layer
+        fluence_mm[:, :, 0] = 0
+        fluence_mm[1, 2, 0] = -0.5
+        fluence_mm[3, 4, 0] = -0.25
+        fluence_mm.reshape(-1, order="F").tofile(adapter.mcx_volumetric_data_file)
+        adapter.component_settings[Tags.COMPUTE_DIFFUSE_REFLECTANCE] = True
+
+        results = adapter.read_mcx_output()
+        fluence = results[Tags.DATA_FIELD_FLUENCE]
+        self.assertEqual(fluence.shape, (4, 5, 5))
+        self.assertEqual(fluence.dtype, np.float64)
+        np.testing.assert_array_equal(fluence, fluence_mm[:, :, 1:].astype(np.float64) * 100)
+        np.testing.assert_array_equal(results[Tags.DATA_FIELD_DIFFUSE_REFLECTANCE], [0.5, 0.25])
+        np.testing.assert_array_equal(results[Tags.DATA_FIELD_DIFFUSE_REFLECTANCE_POS], [[1, 2, 0], [3, 4, 0]])
+
+        fluence_mm[:, :, 0] = 0
+        fluence_mm.reshape(-1, order="F").tofile(adapter.mcx_volumetric_data_file)
+        results = adapter.read_mcx_output()
+        self.assertIsNone(results[Tags.DATA_FIELD_DIFFUSE_REFLECTANCE])
+        self.assertIsNone(results[Tags.DATA_FIELD_DIFFUSE_REFLECTANCE_POS])
+
+        os.remove(adapter.mcx_volumetric_data_file)
+        with self.assertRaises(FileNotFoundError):
+            adapter.read_mcx_output()
+
+    def test_read_photon_data(self):
+        adapter = MCXAdapterReflectance(self.settings)
+        adapter.mcx_photon_data_file = os.path.join(self.temporary_directory.name, "mcx_file_exchange_output.mch")
+        # detector id, partial path lengths of two media, exit positions and directions, followed by 4 byte seeds
+        savedetflag = 1 + 4 + 16 + 32
+        self.assertEqual(adapter.get_mch_columns(savedetflag, maxmedia=2),
+                         {"detid": slice(0, 1), "ppath": slice(1, 3), "p": slice(3, 6), "v": slice(6, 9)})
+        blocks = [np.random.random((number_of_photons, 9)).astype(np.float32) for number_of_photons in [7, 3]]
+        with open(adapter.mcx_photon_data_file, "wb") as photon_data_file:
+            for block in blocks:
+                header = np.zeros(1, dtype=MCXAdapterReflectance.MCH_HEADER)
+                header["magic"] = b"MCXH"
+                header["maxmedia"] = 2
+                header["colcount"] = 9
+                header["savedphoton"] = len(block)
+                header["seedbyte"] = 4
+                header["savedetflag"] = savedetflag
+                self.assertEqual(header.nbytes, 64)
+                photon_data_file.write(header.tobytes())
+                photon_data_file.write(block.tobytes())
+                photon_data_file.write(np.random.bytes(4 * len(block)))
+
+        positions, directions = adapter.read_mcx_photon_data()
+        np.testing.assert_array_equal(positions, np.concatenate(blocks)[:, 3:6])
+        np.testing.assert_array_equal(directions, np.concatenate(blocks)[:, 6:9])
+
+        with open(adapter.mcx_photon_data_file, "wb") as photon_data_file:
+            photon_data_file.write(b"JDAT" + bytes(60))
+        with self.assertRaises(ValueError):
+            adapter.read_mcx_photon_data()
+
+
+@unittest.skipIf(sys.platform.startswith("win"), "the MCX stand-in is started through a shell script")
+class TestMCXWorkspacesAndConcurrentIlluminations(unittest.TestCase):
+
+    def setUp(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()
+        self.simulation_path = os.path.join(self.temporary_directory.name, "simulation")
+        self.scratch_path = os.path.join(self.temporary_directory.name, "scratch")
+        os.mkdir(self.simulation_path)
+        self.binary_path = os.path.join(self.temporary_directory.name, "mcx")
+        with open(self.binary_path, "w") as binary_file:
+            binary_file.write(f'#!/bin/sh\nexec "{sys.executable}" "{mcx_stand_in.__file__}" "$@"\n')
+        os.chmod(self.binary_path, os.stat(self.binary_path).st_mode | stat.S_IEXEC)
+        np.random.seed(1234)
+        self.absorption_cm = np.random.random((4, 5, 6)) + 0.1
+        self.scattering_cm = np.random.random((4, 5, 6)) * 100
+        self.anisotropy = np.random.random((4, 5, 6))
+        self.illumination_geometries = [PencilBeamIlluminationGeometry(device_position_mm=np.array([x, 2, 0]))
+                                        for x in [0, 1, 2, 3]]
+
+    def tearDown(self):
+        os.environ.pop("MCX_STAND_IN_DELAY", None)
+        self.temporary_directory.cleanup()
+
+    def get_settings(self, concurrent_illuminations: int = None, scratch_path: str = None):
+        settings = Settings({
+            Tags.SIMULATION_PATH: self.simulation_path,
+            Tags.VOLUME_NAME: "concurrent_illuminations",
+            Tags.SPACING_MM: 1,
+            Tags.RANDOM_SEED: 1234
+        })
+        optical_settings = {
+            Tags.OPTICAL_MODEL_BINARY_PATH: self.binary_path,
+            Tags.OPTICAL_MODEL_NUMBER_PHOTONS: 1e5
+        }
+        if concurrent_illuminations is not None:
+            optical_settings[Tags.OPTICAL_MODEL_CONCURRENT_ILLUMINATIONS] = concurrent_illuminations
+        if scratch_path is not None:
+            optical_settings[Tags.OPTICAL_MODEL_SCRATCH_PATH] = scratch_path
+        settings.set_optical_settings(optical_settings)
+        return settings
+
+    def expected_fluence(self, illumination_geometries):
+        # see simpa_tests.test_utils.mcx_stand_in, the source positions are given in voxels shifted by 0.5
+        absorption_mm = (self.absorption_cm / 10).astype(np.float32)
+        return np.mean([absorption_mm * np.float32(1 + geometry.device_position_mm[0] + 0.5) * 100
+                        for geometry in illumination_geometries], axis=0)
+
+    def run_forward_model(self, adapter, illumination_geometries):
+        return adapter.run_forward_model(_device=illumination_geometries, device=None,
+                                         absorption=self.absorption_cm, scattering=self.scattering_cm,
+                                         anisotropy=self.anisotropy)[Tags.DATA_FIELD_FLUENCE]
+
+    def test_temporary_files_are_written_into_a_unique_workspace_that_is_removed(self):
+        adapter = MCXAdapter(self.get_settings(scratch_path=self.scratch_path))
+        workspaces = [adapter.create_workspace(), adapter.create_workspace()]
+        self.assertNotEqual(workspaces[0], workspaces[1])
+        self.assertTrue(all(os.path.dirname(workspace) == self.scratch_path for workspace in workspaces))
+        adapter.remove_mcx_output()
+        os.rmdir(workspaces[0])
+
+        fluence = self.run_forward_model(adapter, self.illumination_geometries[1])
+        np.testing.assert_allclose(fluence, self.expected_fluence(self.illumination_geometries[1:2]), rtol=1e-6)
+        self.assertEqual(os.listdir(self.scratch_path), [])
+        self.assertEqual(os.listdir(self.simulation_path), [])
+        self.assertIsNone(adapter.workspace)
+        self.assertEqual(adapter.temporary_output_files, [])
+
+    def test_concurrent_illuminations_are_identical_to_sequential_illuminations(self):
+        # the runs of the concurrent illuminations overlap, so they finish in arbitrary order
+        os.environ["MCX_STAND_IN_DELAY"] = "0.3"
+        fluences = dict()
+        for concurrent_illuminations in [1, 4]:
+            adapter = MCXAdapter(self.get_settings(concurrent_illuminations))
+            fluences[concurrent_illuminations] = self.run_forward_model(adapter, self.illumination_geometries)
+            self.assertEqual(os.listdir(self.simulation_path), [])
+
+        np.testing.assert_allclose(fluences[1], self.expected_fluence(self.illumination_geometries), rtol=1e-6)
+        # the fluences are summed up in the order of the illumination geometries
+        np.testing.assert_array_equal(fluences[1], fluences[4])
+
+    def test_concurrent_illuminations_of_reflectance_adapter(self):
+        fluences = [self.run_forward_model(MCXAdapterReflectance(self.get_settings(concurrent_illuminations)),
+                                           self.illumination_geometries)
+                    for concurrent_illuminations in [1, 3]]
+        np.testing.assert_allclose(fluences[0], self.expected_fluence(self.illumination_geometries), rtol=1e-6)
+        np.testing.assert_array_equal(fluences[0], fluences[1])
+
+    def test_photon_exit_data_is_streamed_into_the_output_file(self):
+        settings = self.get_settings(concurrent_illuminations=2)
+        settings[Tags.SIMPA_OUTPUT_PATH] = os.path.join(self.temporary_directory.name, "output.hdf5")
+        settings[Tags.WAVELENGTH] = 800
+        settings.get_optical_settings()[Tags.COMPUTE_DIFFUSE_REFLECTANCE] = True
+        settings.get_optical_settings()[Tags.COMPUTE_PHOTON_DIRECTION_AT_EXIT] = True
+        save_hdf5({"name": "test"}, settings[Tags.SIMPA_OUTPUT_PATH], file_compression="gzip")
+        for data_field, data in [(Tags.DATA_FIELD_ABSORPTION_PER_CM, self.absorption_cm),
+                                 (Tags.DATA_FIELD_SCATTERING_PER_CM, self.scattering_cm),
+                                 (Tags.DATA_FIELD_ANISOTROPY, self.anisotropy)]:
+            save_data_field(data, settings[Tags.SIMPA_OUTPUT_PATH], data_field, 800)
+        save_data_field(np.ones_like(self.absorption_cm), settings[Tags.SIMPA_OUTPUT_PATH],
+                        Tags.DATA_FIELD_GRUNEISEN_PARAMETER)
+        illumination_geometries = self.illumination_geometries[:3]
+        device = PhotoacousticDevice()
+        for illumination_geometry in illumination_geometries:
+            device.add_illumination_geometry(illumination_geometry)
+
+        expected_results = MCXAdapterReflectance(settings).run_forward_model(
+            _device=illumination_geometries, device=None, absorption=self.absorption_cm,
+            scattering=self.scattering_cm, anisotropy=self.anisotropy)
+        # the stand-in detects one photon per voxel of the surface, which exits at the x position of the source
+        positions = expected_results[Tags.DATA_FIELD_PHOTON_EXIT_POS]
+        self.assertEqual(positions.shape, (3 * 4 * 5, 3))
+        np.testing.assert_array_equal(positions[::20, 2], [0.5, 1.5, 2.5])
+        np.testing.assert_array_equal(expected_results[Tags.DATA_FIELD_DIFFUSE_REFLECTANCE],
+                                      np.repeat(np.float32([1.5, 2.5, 3.5]) / 100, 20))
+
+        # a previous simulation of the same wavelength is replaced
+        for _ in range(2):
+            MCXAdapterReflectance(settings).run(device)
+        for data_field in [Tags.DATA_FIELD_PHOTON_EXIT_POS, Tags.DATA_FIELD_PHOTON_EXIT_DIR,
+                           Tags.DATA_FIELD_DIFFUSE_REFLECTANCE, Tags.DATA_FIELD_DIFFUSE_REFLECTANCE_POS,
+                           Tags.DATA_FIELD_FLUENCE]:
+            np.testing.assert_array_equal(load_data_field(settings[Tags.SIMPA_OUTPUT_PATH], data_field, 800),
+                                          expected_results[data_field])
+        self.assertEqual(os.listdir(self.simulation_path), [])
+
+    def test_failing_simulation_removes_its_workspace(self):
+        settings = self.get_settings(concurrent_illuminations=2, scratch_path=self.scratch_path)
+        adapter = MCXAdapter(settings)
+        self.illumination_geometries[2].device_position_mm = None
+        with self.assertRaises(Exception):
+            self.run_forward_model(adapter, self.illumination_geometries)
+        self.assertEqual(os.listdir(self.scratch_path), [])
@@ -0,0 +1,38 @@
+# SPDX-FileCopyrightText: 2021 Division of Intelligent Medical Systems, DKFZ
+# SPDX-FileCopyrightText: 2021 Janek Groehl
+# SPDX-License-Identifier: MIT
+
+import subprocess
+import sys
+import unittest
+import simpa
+
+
+class TestPackageImport(unittest.TestCase):
+
+    def imported_modules_after(self, statement):
+        """
+        Runs the statement in a fresh interpreter and returns the names of the imported modules.
+        """
+        output = subprocess.run([sys.executable, "-c", f"import sys\n{statement}\nprint(' '.join(sys.modules))"],
+                                check=True, capture_output=True, text=True).stdout
+        return set(output.split())
+
+    def test_heavy_dependencies_are_not_imported(self):
+        modules = self.imported_modules_after("import simpa")
+        for heavy_module in ["torch", "matplotlib", "pacfish", "scipy.signal", "scipy.interpolate", "requests"]:
+            self.assertNotIn(heavy_module, modules)
+
+    def test_lazy_attributes_are_imported_on_access(self):
+        modules = self.imported_modules_after("import simpa\nsimpa.DelayAndSumAdapter")
+        self.assertIn("torch", modules)
+        self.assertNotIn("pacfish", modules)
+
+    def test_all_public_names_are_available(self):
+        for name in simpa.__all__:
+            self.assertIsNotNone(getattr(simpa, name), name)
+        self.assertIn("MCXAdapter", dir(simpa))
+        self.assertIs(simpa.LinearUnmixing,
+                      simpa.core.processing_components.multispectral.linear_unmixing.LinearUnmixing)
+        with self.assertRaises(AttributeError):
+            simpa.NotASimpaAttribute
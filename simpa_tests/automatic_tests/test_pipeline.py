@@ -2,12 +2,15 @@
 # SPDX-FileCopyrightText: 2021 Janek Groehl
 # SPDX-License-Identifier: MIT
 
+import tempfile
 import unittest
 from simpa.utils import Tags
 from simpa.utils.settings import Settings
 from simpa.core.simulation import simulate
 import numpy as np
-from simpa_tests.test_utils import create_test_structure_parameters
+from simpa_tests.test_utils import create_test_structure_parameters, assert_equals_recursive
+from simpa.io_handling import load_hdf5
+from simpa.utils.profiling import SimulationProfile, get_current_stage_profile
 import os
 from simpa import ModelBasedVolumeCreationAdapter
 from simpa.core.simulation_modules.optical_simulation_module.optical_forward_model_test_adapter import \
@@ -71,15 +74,136 @@ class TestPipeline(unittest.TestCase):
                 Tags.LASER_PULSE_ENERGY_IN_MILLIJOULE: 50
         })
 
+        acoustic_adapter = AcousticForwardModelTestAdapter(settings)
+        run_acoustic_adapter = acoustic_adapter.run
+
+        def run_and_record_details(digital_device_twin):
+            run_acoustic_adapter(digital_device_twin)
+            get_current_stage_profile().details["levels"] = [{"iterations": 4, "spacing_mm": 0.5}]
+        acoustic_adapter.run = run_and_record_details
+
         simulation_pipeline = [
             ModelBasedVolumeCreationAdapter(settings),
             OpticalForwardModelTestAdapter(settings),
-            AcousticForwardModelTestAdapter(settings),
+            acoustic_adapter,
         ]
 
-        simulate(simulation_pipeline, settings, RSOMExplorerP50(0.1, 1, 1))
+        simulation_profile = simulate(simulation_pipeline, settings, RSOMExplorerP50(0.1, 1, 1))
+
+        self.assertEqual([profile.stage for profile in simulation_profile],
+                         ["ModelBasedVolumeCreationAdapter", "OpticalForwardModelTestAdapter",
+                          "AcousticForwardModelTestAdapter"])
+        for profile in simulation_profile:
+            self.assertEqual(profile.wavelength, 800)
+            self.assertGreater(profile.wall_time_in_s, 0)
+            self.assertGreater(profile.peak_memory_in_mb, 0)
+        # pipeline elements can add further records to the profile of their stage
+        self.assertEqual([profile.details for profile in simulation_profile],
+                         [{}, {}, {"levels": [{"iterations": 4, "spacing_mm": 0.5}]}])
+        # every stage writes its results into the output file
+        self.assertTrue(all(profile.bytes_written > 0 for profile in simulation_profile.stages[1:]))
+
+        stored_profile = SimulationProfile.load(settings[Tags.SIMPA_OUTPUT_PATH])
+        self.assertEqual([profile.to_dict() for profile in stored_profile],
+                         [profile.to_dict() for profile in simulation_profile])
 
         if (os.path.exists(settings[Tags.SIMPA_OUTPUT_PATH]) and
                 os.path.isfile(settings[Tags.SIMPA_OUTPUT_PATH])):
             # Delete the created file
             os.remove(settings[Tags.SIMPA_OUTPUT_PATH])
+
+    def test_parallel_wavelength_execution_is_identical_to_sequential_execution(self):
+        simulation_outputs = []
+        with tempfile.TemporaryDirectory() as temporary_directory:
+            # the file extension also appears in the name of the directory
+            simulation_path = os.path.join(temporary_directory, "runs.hdf5")
+            os.mkdir(simulation_path)
+            for parallel in [False, True]:
+                np.random.seed(self.RANDOM_SEED)
+                settings = Settings({
+                    Tags.RANDOM_SEED: self.RANDOM_SEED,
+                    Tags.VOLUME_NAME: "TestParallel_" + str(parallel),
+                    Tags.SIMULATION_PATH: simulation_path,
+                    Tags.SPACING_MM: self.SPACING,
+                    Tags.DIM_VOLUME_Z_MM: self.VOLUME_HEIGHT_IN_MM,
+                    Tags.DIM_VOLUME_X_MM: self.VOLUME_WIDTH_IN_MM,
+                    Tags.DIM_VOLUME_Y_MM: self.VOLUME_WIDTH_IN_MM,
+                    Tags.WAVELENGTHS: [700, 800, 900],
+                    Tags.PARALLEL_WAVELENGTH_EXECUTION: parallel,
+                    Tags.NUMBER_OF_WAVELENGTH_WORKERS: 2
+                })
+                settings.set_volume_creation_settings({
+                    Tags.STRUCTURES: create_test_structure_parameters()
+                })
+                settings.set_optical_settings({
+                    Tags.OPTICAL_MODEL_NUMBER_PHOTONS: 1e7,
+                    Tags.LASER_PULSE_ENERGY_IN_MILLIJOULE: 50
+                })
+                settings.set_acoustic_settings({})
+
+                simulation_pipeline = [
+                    ModelBasedVolumeCreationAdapter(settings),
+                    OpticalForwardModelTestAdapter(settings),
+                    AcousticForwardModelTestAdapter(settings),
+                ]
+
+                simulation_profile = simulate(simulation_pipeline, settings, RSOMExplorerP50(0.1, 1, 1))
+                simulation_outputs.append(load_hdf5(settings[Tags.SIMPA_OUTPUT_PATH])[Tags.SIMULATIONS])
+                self.assertEqual(settings[Tags.WAVELENGTH], 900)
+                # the profiles of the worker processes are returned and merged into the output file
+                self.assertEqual([(profile.stage, profile.wavelength) for profile in simulation_profile],
+                                 [(type(element).__name__, wavelength) for wavelength in [700, 800, 900]
+                                  for element in simulation_pipeline])
+                self.assertEqual(len(SimulationProfile.load(settings[Tags.SIMPA_OUTPUT_PATH])), 9)
+                # the files of the worker processes are created next to the output file and removed afterwards
+                self.assertEqual(os.listdir(simulation_path), [os.path.basename(settings[Tags.SIMPA_OUTPUT_PATH])])
+                os.remove(settings[Tags.SIMPA_OUTPUT_PATH])
+
+        assert_equals_recursive(simulation_outputs[0], simulation_outputs[1])
+
+    def test_in_memory_data_store_is_identical_to_file_exchange(self):
+        simulation_outputs = []
+        # in-memory data store, memory budget in MB, parallel wavelength execution
+        configurations = [(False, None, False), (True, None, False), (True, 0.01, False), (True, None, True)]
+        for in_memory_data_store, memory_budget_in_mb, parallel in configurations:
+            np.random.seed(self.RANDOM_SEED)
+            settings = Settings({
+                Tags.RANDOM_SEED: self.RANDOM_SEED,
+                Tags.VOLUME_NAME: "TestInMemoryDataStore",
+                Tags.SIMULATION_PATH: ".",
+                Tags.SPACING_MM: self.SPACING,
+                Tags.DIM_VOLUME_Z_MM: self.VOLUME_HEIGHT_IN_MM,
+                Tags.DIM_VOLUME_X_MM: self.VOLUME_WIDTH_IN_MM,
+                Tags.DIM_VOLUME_Y_MM: self.VOLUME_WIDTH_IN_MM,
+                Tags.WAVELENGTHS: [700, 800],
+                Tags.IN_MEMORY_DATA_STORE: in_memory_data_store,
+                Tags.PARALLEL_WAVELENGTH_EXECUTION: parallel,
+                Tags.NUMBER_OF_WAVELENGTH_WORKERS: 2
+            })
+            if memory_budget_in_mb is not None:
+                settings[Tags.IN_MEMORY_DATA_STORE_BUDGET_IN_MB] = memory_budget_in_mb
+            settings.set_volume_creation_settings({
+                Tags.STRUCTURES: create_test_structure_parameters()
+            })
+            settings.set_optical_settings({
+                Tags.OPTICAL_MODEL_NUMBER_PHOTONS: 1e7,
+                Tags.LASER_PULSE_ENERGY_IN_MILLIJOULE: 50
+            })
+            settings.set_acoustic_settings({})
+
+            simulation_pipeline = [
+                ModelBasedVolumeCreationAdapter(settings),
+                OpticalForwardModelTestAdapter(settings),
+                AcousticForwardModelTestAdapter(settings),
+            ]
+
+            simulation_profile = simulate(simulation_pipeline, settings, RSOMExplorerP50(0.1, 1, 1))
+            simulation_outputs.append(load_hdf5(settings[Tags.SIMPA_OUTPUT_PATH])[Tags.SIMULATIONS])
+            # writing the data store into the output file is profiled as a separate stage
+            self.assertEqual(len(simulation_profile.get_stages("InMemoryDataStore")),
+                             (2 if parallel else 1) if in_memory_data_store else 0)
+            self.assertEqual(len(SimulationProfile.load(settings[Tags.SIMPA_OUTPUT_PATH])), len(simulation_profile))
+            os.remove(settings[Tags.SIMPA_OUTPUT_PATH])
+
+        for simulation_output in simulation_outputs[1:]:
+            assert_equals_recursive(simulation_outputs[0], simulation_output)
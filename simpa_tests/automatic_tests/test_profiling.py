@@ -0,0 +1,83 @@
+# SPDX-FileCopyrightText: 2021 Division of Intelligent Medical Systems, DKFZ
+# SPDX-FileCopyrightText: 2021 Janek Groehl
+# SPDX-License-Identifier: MIT
+
+import os
+import sys
+import tempfile
+import time
+import unittest
+import numpy as np
+from simpa.utils.profiling import SimulationProfile, StageProfile, StageProfiler, get_current_stage_profile
+
+
+class TestProfiling(unittest.TestCase):
+
+    def test_stage_profiler_measures_time(self):
+        with StageProfiler("sleep", 800) as profiler:
+            time.sleep(0.5)
+        self.assertEqual(profiler.profile.stage, "sleep")
+        self.assertEqual(profiler.profile.wavelength, 800)
+        self.assertGreaterEqual(profiler.profile.wall_time_in_s, 0.5)
+        # generous bound, as the CPU time is measured in clock ticks and the suite may run on a loaded machine
+        self.assertLess(profiler.profile.cpu_time_in_s, 0.25)
+
+        with StageProfiler("busy") as profiler:
+            start_time = time.process_time()
+            while time.process_time() - start_time < 0.2:
+                pass
+        # os.times counts whole clock ticks (up to about 16 ms on Windows) for user and system time each
+        self.assertGreater(profiler.profile.cpu_time_in_s, 0.2 - 0.05)
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "peak memory and I/O are only measured per stage on linux")
+    def test_stage_profiler_measures_peak_memory_and_io_of_the_stage(self):
+        with StageProfiler("allocate") as profiler:
+            array = np.ones(50 * 1024 ** 2 // 8)
+            del array
+        with StageProfiler("small") as small_profiler:
+            pass
+        self.assertGreater(profiler.profile.peak_memory_in_mb - small_profiler.profile.peak_memory_in_mb, 40)
+
+        with tempfile.TemporaryDirectory() as temporary_directory:
+            file_path = os.path.join(temporary_directory, "data.npy")
+            with StageProfiler("write") as profiler:
+                np.save(file_path, np.ones(1024 ** 2, dtype=np.uint8))
+            with StageProfiler("read") as read_profiler:
+                np.load(file_path)
+        self.assertGreaterEqual(profiler.profile.bytes_written, 1024 ** 2)
+        self.assertGreaterEqual(read_profiler.profile.bytes_read, 1024 ** 2)
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "peak memory and I/O are only measured per stage on linux")
+    def test_nested_stage_profiler_does_not_reset_the_peak_memory_of_the_enclosing_stage(self):
+        self.assertIsNone(get_current_stage_profile())
+        with StageProfiler("outer") as profiler:
+            array = np.ones(50 * 1024 ** 2 // 8)
+            del array
+            with StageProfiler("inner") as inner_profiler:
+                self.assertIs(get_current_stage_profile(), inner_profiler.profile)
+            self.assertIs(get_current_stage_profile(), profiler.profile)
+        self.assertIsNone(get_current_stage_profile())
+        with StageProfiler("small") as small_profiler:
+            pass
+        self.assertGreater(profiler.profile.peak_memory_in_mb - small_profiler.profile.peak_memory_in_mb, 40)
+        self.assertGreaterEqual(inner_profiler.profile.peak_memory_in_mb, profiler.profile.peak_memory_in_mb - 1)
+
+    def test_simulation_profile_is_saved_and_loaded(self):
+        simulation_profile = SimulationProfile()
+        for wavelength in [700, 800]:
+            for stage in ["VolumeCreation", "OpticalForwardModel"]:
+                simulation_profile.add(StageProfile(stage, wavelength, 1.0, 2.0, 3.0, 4, 5))
+        simulation_profile.stages[-1].details["levels"] = [{"iterations": 3}, {"iterations": 2}]
+
+        self.assertEqual(len(simulation_profile.get_stages(wavelength=800)), 2)
+        self.assertEqual(len(simulation_profile.get_stages(stage="VolumeCreation")), 2)
+        self.assertEqual(simulation_profile.wall_time_in_s, 4.0)
+        self.assertEqual(simulation_profile.peak_memory_in_mb, 3.0)
+        self.assertIn("OpticalForwardModel", str(simulation_profile))
+
+        with tempfile.TemporaryDirectory() as temporary_directory:
+            file_path = os.path.join(temporary_directory, "profile.hdf5")
+            simulation_profile.save(file_path)
+            loaded_profile = SimulationProfile.load(file_path)
+        self.assertEqual([profile.to_dict() for profile in loaded_profile],
+                         [profile.to_dict() for profile in simulation_profile])
@@ -5,6 +5,7 @@
 import unittest
 import numpy as np
 import simpa as sp
+from simpa.utils.quality_assurance.data_sanity_testing import get_qa_assertion_sample_size
 
 
 class TestProcessing(unittest.TestCase):
@@ -96,3 +97,60 @@ class TestProcessing(unittest.TestCase):
         array = np.random.random((5, 6, 7))
         array[3, 3, 2] = None
         sp.assert_array_well_defined(array)
+
+    def test_ill_defined_values_are_found_in_every_chunk(self):
+        array = np.random.random((70, 80, 90))
+        for index in [(0, 0, 0), (35, 40, 45), (69, 79, 89)]:
+            for value in [np.nan, np.inf, -np.inf]:
+                broken_array = array.copy()
+                broken_array[index] = value
+                with self.assertRaises(AssertionError):
+                    sp.assert_array_well_defined(broken_array)
+                # arrays that are not contiguous are tested as well
+                with self.assertRaises(AssertionError):
+                    sp.assert_array_well_defined(broken_array.transpose(2, 0, 1)[:, ::-1])
+                with self.assertRaises(AssertionError):
+                    sp.assert_array_well_defined(np.asfortranarray(broken_array))
+
+    def test_error_message_names_problem_and_caller(self):
+        array = np.random.random((5, 6, 7))
+        array[1, 2, 3] = np.inf
+        with self.assertRaises(AssertionError) as context:
+            sp.assert_array_well_defined(array, array_name="fluence")
+        message = str(context.exception)
+        self.assertIn("inf or -inf", message)
+        self.assertIn("fluence", message)
+        self.assertIn("test_quality_assurance.py", message)
+
+        array[1, 2, 3] = -1
+        with self.assertRaises(AssertionError) as context:
+            sp.assert_array_well_defined(array, assume_non_negativity=True)
+        self.assertIn("negative", str(context.exception))
+
+    def test_integer_and_complex_arrays(self):
+        sp.assert_array_well_defined(np.arange(1, 100), assume_positivity=True)
+        with self.assertRaises(AssertionError):
+            sp.assert_array_well_defined(np.arange(0, 100), assume_positivity=True)
+        array = np.ones(100, dtype=complex)
+        sp.assert_array_well_defined(array, assume_positivity=True)
+        array[50] = complex(1, np.nan)
+        with self.assertRaises(AssertionError):
+            sp.assert_array_well_defined(array)
+
+    def test_sampled_mode(self):
+        array = np.random.random((200, 300, 10))
+        sp.assert_array_well_defined(array, sample_size=1000)
+        array[:10] = np.nan
+        with self.assertRaises(AssertionError):
+            sp.assert_array_well_defined(array, sample_size=1000)
+        with self.assertRaises(AssertionError):
+            sp.assert_array_well_defined(array[:, ::2], sample_size=1000)
+
+        # single values between the samples are not tested
+        array = np.random.random((200, 300, 10))
+        array[100, 150, 5] = np.nan
+        sp.assert_array_well_defined(array, sample_size=1000)
+
+        settings = sp.Settings({sp.Tags.QA_ASSERTION_SAMPLE_SIZE: 1000}, verbose=False)
+        self.assertEqual(get_qa_assertion_sample_size(settings), 1000)
+        self.assertIsNone(get_qa_assertion_sample_size(sp.Settings(verbose=False)))
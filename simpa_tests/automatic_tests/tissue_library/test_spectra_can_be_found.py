@@ -48,3 +48,19 @@ class TestSpectraCanBeFound(unittest.TestCase):
     def test_anisotropy_spectra_invalid(self):
         AnisotropySpectrumLibrary().get_spectrum_by_name("This does not exist")
 
+
+    def test_spectra_are_loaded_lazily(self):
+        lib = AbsorptionSpectrumLibrary()
+        spectrum = lib.get_spectrum_by_name("Water")
+        self.assertIsNone(lib._spectra)
+        self.assertIn("Water", lib.get_spectra_names())
+        self.assertIsNone(lib._spectra)
+
+        self.assertEqual(lib.get_spectra_names(), [spectrum.spectrum_name for spectrum in lib])
+        loaded_spectrum = lib.get_spectrum_by_name("Water")
+        self.assertEqual(spectrum.values.tolist(), loaded_spectrum.values.tolist())
+        self.assertEqual(spectrum.wavelengths.tolist(), loaded_spectrum.wavelengths.tolist())
+
+        # spectra do not share their data with each other
+        spectrum.values[:] = 0
+        self.assertNotEqual(AbsorptionSpectrumLibrary().get_spectrum_by_name("Water").values.max(), 0)
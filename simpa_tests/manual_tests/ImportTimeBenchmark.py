@@ -0,0 +1,73 @@
+# SPDX-FileCopyrightText: 2021 Division of Intelligent Medical Systems, DKFZ
+# SPDX-FileCopyrightText: 2021 Janek Groehl
+# SPDX-License-Identifier: MIT
+
+"""
+This script benchmarks the time that is needed to `import simpa` in a fresh interpreter, which is paid by every
+short-lived worker process and command line invocation. The heavy simulation modules are imported lazily, so their
+import time is measured separately when they are accessed for the first time. Importing all public names of simpa
+corresponds to the eager import of the package that was done before.
+"""
+
+import subprocess
+import sys
+import time
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+from simpa_tests.manual_tests import ManualIntegrationTestClass
+
+
+class ImportTimeBenchmark(ManualIntegrationTestClass):
+
+    def __init__(self, number_of_repetitions=5):
+        self.number_of_repetitions = number_of_repetitions
+        self.statements = {
+            "python": "pass",
+            "import simpa": "import simpa",
+            "import simpa + Settings and a device": "import simpa\nsimpa.Settings()\nsimpa.MSOTAcuityEcho()",
+            "import simpa + DelayAndSumAdapter": "import simpa\nsimpa.DelayAndSumAdapter",
+            "import simpa + all public names": "import simpa\n[getattr(simpa, name) for name in simpa.__all__]",
+        }
+        self.results = dict()
+
+    def setup(self):
+        # fill the file system cache such that the first measurement is not slower than the other ones
+        subprocess.run([sys.executable, "-c", self.statements["import simpa + all public names"]], check=True)
+
+    def perform_test(self):
+        for name, statement in self.statements.items():
+            durations = list()
+            for _ in range(self.number_of_repetitions):
+                start_time = time.time()
+                subprocess.run([sys.executable, "-c", statement], check=True)
+                durations.append(time.time() - start_time)
+            self.results[name] = (np.mean(durations), np.std(durations))
+
+    def visualise_result(self, show_figure_on_screen=True, save_path=None):
+        print(f"Wall time of a fresh interpreter, mean of {self.number_of_repetitions} runs:")
+        for name, (mean, std) in self.results.items():
+            print(f"{name:>38}: {mean:6.3f} +- {std:.3f} s")
+
+        plt.figure(figsize=(8, 4))
+        plt.barh(list(self.results.keys()), [mean for mean, _ in self.results.values()],
+                 xerr=[std for _, std in self.results.values()])
+        plt.xlabel("time [s]")
+        plt.title("Import time of simpa")
+        plt.tight_layout()
+        if show_figure_on_screen:
+            plt.show()
+        else:
+            if save_path is None:
+                save_path = ""
+            plt.savefig(save_path + "import_time_benchmark.png")
+        plt.close()
+
+    def tear_down(self):
+        pass
+
+
+if __name__ == '__main__':
+    test = ImportTimeBenchmark(number_of_repetitions=int(sys.argv[1]) if len(sys.argv) > 1 else 5)
+    test.run_test(show_figure_on_screen=False)
@@ -0,0 +1,116 @@
+# SPDX-FileCopyrightText: 2021 Division of Intelligent Medical Systems, DKFZ
+# SPDX-FileCopyrightText: 2021 Janek Groehl
+# SPDX-License-Identifier: MIT
+
+"""
+This script benchmarks the exchange of data between the pipeline elements of a simulation. The pipeline consists of
+the volume creation and the optical and acoustic test adapters, such that the runtime is dominated by writing the
+results to and reading them from the compressed SIMPA output file. The pipeline is run with the results exchanged
+through the file, with the in-memory data store and with an in-memory data store whose budget is too small to hold
+all results of a wavelength.
+"""
+
+import os
+import sys
+import time
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+from simpa import ModelBasedVolumeCreationAdapter
+from simpa.core.device_digital_twins import RSOMExplorerP50
+from simpa.core.simulation import simulate
+from simpa.core.simulation_modules.acoustic_forward_module.acoustic_forward_model_test_adapter import \
+    AcousticForwardModelTestAdapter
+from simpa.core.simulation_modules.optical_simulation_module.optical_forward_model_test_adapter import \
+    OpticalForwardModelTestAdapter
+from simpa.utils import Tags, Settings
+from simpa_tests.manual_tests import ManualIntegrationTestClass
+from simpa_tests.test_utils import create_test_structure_parameters
+
+
+class InMemoryDataStoreBenchmark(ManualIntegrationTestClass):
+
+    def __init__(self, number_of_repetitions=3, spacing=0.2):
+        self.number_of_repetitions = number_of_repetitions
+        self.spacing = spacing
+        # name: (in-memory data store, memory budget in MB)
+        self.configurations = {
+            "file exchange": (False, None),
+            "in-memory data store": (True, None),
+            "in-memory data store (64 MB budget)": (True, 64),
+        }
+        self.results = dict()
+
+    def setup(self):
+        pass
+
+    def run_simulation(self, in_memory_data_store, memory_budget_in_mb):
+        np.random.seed(4711)
+        settings = Settings({
+            Tags.RANDOM_SEED: 4711,
+            Tags.VOLUME_NAME: "InMemoryDataStoreBenchmark",
+            Tags.SIMULATION_PATH: ".",
+            Tags.SPACING_MM: self.spacing,
+            Tags.DIM_VOLUME_Z_MM: 30,
+            Tags.DIM_VOLUME_X_MM: 40,
+            Tags.DIM_VOLUME_Y_MM: 20,
+            Tags.WAVELENGTHS: [700, 800, 900],
+            Tags.IN_MEMORY_DATA_STORE: in_memory_data_store
+        })
+        if memory_budget_in_mb is not None:
+            settings[Tags.IN_MEMORY_DATA_STORE_BUDGET_IN_MB] = memory_budget_in_mb
+        settings.set_volume_creation_settings({
+            Tags.STRUCTURES: create_test_structure_parameters()
+        })
+        settings.set_optical_settings({
+            Tags.OPTICAL_MODEL_NUMBER_PHOTONS: 1e7,
+            Tags.LASER_PULSE_ENERGY_IN_MILLIJOULE: 50
+        })
+        settings.set_acoustic_settings({})
+        simulation_pipeline = [
+            ModelBasedVolumeCreationAdapter(settings),
+            OpticalForwardModelTestAdapter(settings),
+            AcousticForwardModelTestAdapter(settings),
+        ]
+        start_time = time.perf_counter()
+        simulation_profile = simulate(simulation_pipeline, settings, RSOMExplorerP50(0.1, 1, 1))
+        duration = time.perf_counter() - start_time
+        os.remove(settings[Tags.SIMPA_OUTPUT_PATH])
+        return duration, simulation_profile
+
+    def perform_test(self):
+        for name, (in_memory_data_store, memory_budget_in_mb) in self.configurations.items():
+            durations = list()
+            for _ in range(self.number_of_repetitions):
+                duration, simulation_profile = self.run_simulation(in_memory_data_store, memory_budget_in_mb)
+                durations.append(duration)
+            self.results[name] = (np.mean(durations), np.std(durations), simulation_profile)
+
+    def visualise_result(self, show_figure_on_screen=True, save_path=None):
+        print(f"Wall time of the simulation, mean of {self.number_of_repetitions} runs:")
+        for name, (mean, std, simulation_profile) in self.results.items():
+            print(f"{name:>36}: {mean:6.2f} +- {std:.2f} s")
+            print(simulation_profile)
+
+        plt.figure(figsize=(8, 4))
+        plt.barh(list(self.results.keys()), [mean for mean, _, _ in self.results.values()],
+                 xerr=[std for _, std, _ in self.results.values()])
+        plt.xlabel("time [s]")
+        plt.title("Data exchange between the pipeline elements")
+        plt.tight_layout()
+        if show_figure_on_screen:
+            plt.show()
+        else:
+            if save_path is None:
+                save_path = ""
+            plt.savefig(save_path + "in_memory_data_store_benchmark.png")
+        plt.close()
+
+    def tear_down(self):
+        pass
+
+
+if __name__ == '__main__':
+    test = InMemoryDataStoreBenchmark(number_of_repetitions=int(sys.argv[1]) if len(sys.argv) > 1 else 3)
+    test.run_test(show_figure_on_screen=False)
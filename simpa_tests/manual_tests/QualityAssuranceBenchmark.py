@@ -0,0 +1,107 @@
+# SPDX-FileCopyrightText: 2021 Division of Intelligent Medical Systems, DKFZ
+# SPDX-FileCopyrightText: 2021 Janek Groehl
+# SPDX-License-Identifier: MIT
+
+"""
+This script benchmarks the overhead of the data sanity checks (assert_array_well_defined) that are run after every
+stage of the simulation pipeline. The arrays have the sizes of a simulation of a 40 x 20 x 30 mm volume with a
+spacing of 0.1 mm, a linear array with 256 elements and 4096 time steps, and a reconstructed 3D volume.
+The previous implementation, which made a separate full pass for every check and inspected the whole call stack
+up front, is shown for comparison.
+"""
+
+import inspect
+import sys
+import time
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+from simpa.utils.quality_assurance.data_sanity_testing import assert_array_well_defined
+from simpa_tests.manual_tests import ManualIntegrationTestClass
+
+
+def previous_assert_array_well_defined(array, assume_non_negativity=False, assume_positivity=False):
+    caller = inspect.stack()[1]
+    if np.isinf(array).any() or np.isneginf(array).any():
+        raise AssertionError(f"inf {caller}")
+    if np.isnan(array).any():
+        raise AssertionError(f"nan {caller}")
+    if assume_positivity and (array <= 0).any():
+        raise AssertionError(f"not positive {caller}")
+    if assume_non_negativity and (array < 0).any():
+        raise AssertionError(f"negative {caller}")
+
+
+class QualityAssuranceBenchmark(ManualIntegrationTestClass):
+
+    def __init__(self, number_of_repetitions=5, sample_size=100000):
+        self.number_of_repetitions = number_of_repetitions
+        self.sample_size = sample_size
+        self.stages = dict()
+        self.results = dict()
+
+    def setup(self):
+        random_generator = np.random.default_rng(471)
+        volume_shape = (400, 200, 300)
+        # name: (arrays, assume_non_negativity)
+        self.stages = {
+            "volume creation": ([random_generator.random(volume_shape) for _ in range(7)], False),
+            "optical forward model": ([random_generator.random(volume_shape, dtype=np.float32)
+                                       for _ in range(2)], True),
+            "acoustic forward model": ([random_generator.standard_normal((256, 4096), dtype=np.float32)], False),
+            "reconstruction": ([random_generator.standard_normal(volume_shape, dtype=np.float32)], False),
+        }
+
+    def perform_test(self):
+        methods = {
+            "previous": previous_assert_array_well_defined,
+            "single pass": assert_array_well_defined,
+            f"sampled ({self.sample_size} values)": lambda array, assume_non_negativity:
+                assert_array_well_defined(array, assume_non_negativity, sample_size=self.sample_size),
+        }
+        for method_name, method in methods.items():
+            self.results[method_name] = dict()
+            for stage_name, (arrays, assume_non_negativity) in self.stages.items():
+                start_time = time.perf_counter()
+                for _ in range(self.number_of_repetitions):
+                    for array in arrays:
+                        method(array, assume_non_negativity=assume_non_negativity)
+                self.results[method_name][stage_name] = (time.perf_counter() - start_time) / \
+                    self.number_of_repetitions
+
+    def visualise_result(self, show_figure_on_screen=True, save_path=None):
+        print("Overhead of the data sanity checks per pipeline stage:")
+        for method_name, stages in self.results.items():
+            print(method_name)
+            for stage_name, duration in stages.items():
+                print(f"{stage_name:>28}: {duration * 1000:8.2f} ms")
+
+        stage_names = list(self.stages.keys())
+        positions = np.arange(len(stage_names))
+        width = 0.8 / len(self.results)
+        plt.figure(figsize=(8, 4))
+        for index, (method_name, stages) in enumerate(self.results.items()):
+            plt.bar(positions + index * width, [stages[name] * 1000 for name in stage_names], width,
+                    label=method_name)
+        plt.xticks(positions + 0.4 - width / 2, stage_names)
+        plt.ylabel("time [ms]")
+        plt.yscale("log")
+        plt.legend()
+        plt.title("Overhead of the data sanity checks")
+        plt.tight_layout()
+        if show_figure_on_screen:
+            plt.show()
+        else:
+            if save_path is None:
+                save_path = ""
+            plt.savefig(save_path + "quality_assurance_benchmark.png")
+        plt.close()
+
+    def tear_down(self):
+        pass
+
+
+if __name__ == '__main__':
+    test = QualityAssuranceBenchmark(number_of_repetitions=int(sys.argv[1]) if len(sys.argv) > 1 else 5)
+    test.run_test(show_figure_on_screen=False)
@@ -0,0 +1,142 @@
+# SPDX-FileCopyrightText: 2021 Division of Intelligent Medical Systems, DKFZ
+# SPDX-FileCopyrightText: 2021 Janek Groehl
+# SPDX-License-Identifier: MIT
+
+"""
+This script benchmarks the exchange of volumes between SIMPA and MCX. The binary input file is written and a
+binary output file of the same size is read once with the current implementation of the MCXAdapter and once with the
+previous implementation, which converted the volumes to python lists and used struct.pack / struct.unpack.
+
+Every measurement runs in a fresh process, so that the reported peak resident set size (RSS) only contains the
+memory needed by that measurement. MCX itself is not needed to run this script.
+Be aware that the previous implementation needs in the order of 10 GB of memory for a volume of 400^3 voxels.
+"""
+
+import multiprocessing
+import os
+import resource
+import struct
+import sys
+import tempfile
+import time
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+from simpa.core.simulation_modules.optical_simulation_module.optical_forward_model_mcx_adapter import MCXAdapter
+from simpa.utils import Tags, Settings
+from simpa_tests.manual_tests import ManualIntegrationTestClass
+
+
+def write_input_with_struct(adapter, absorption_cm, scattering_cm, anisotropy):
+    absorption_mm, scattering_mm = adapter.pre_process_volumes(absorption_cm=absorption_cm,
+                                                               scattering_cm=scattering_cm,
+                                                               anisotropy=anisotropy,
+                                                               assumed_anisotropy=0.9)
+    op_array = np.asarray([absorption_mm, scattering_mm])
+    [_, adapter.nx, adapter.ny, adapter.nz] = np.shape(op_array)
+    optical_properties_list = list(np.reshape(op_array, op_array.size, "F"))
+    del absorption_mm, scattering_mm, op_array
+    mcx_input = struct.pack("f" * len(optical_properties_list), *optical_properties_list)
+    del optical_properties_list
+    with open(adapter.global_settings[Tags.SIMULATION_PATH] + "/" +
+              adapter.global_settings[Tags.VOLUME_NAME] + ".bin", "wb") as input_file:
+        input_file.write(mcx_input)
+
+
+def read_output_with_struct(adapter):
+    with open(adapter.mcx_volumetric_data_file, 'rb') as f:
+        data = f.read()
+    data = struct.unpack('%df' % (len(data) / 4), data)
+    fluence = np.asarray(data).reshape([adapter.nx, adapter.ny, adapter.nz, adapter.frames], order='F')
+    fluence *= 100
+    return fluence
+
+
+def measure(implementation, volume_size, simulation_path, queue):
+    settings = Settings({
+        Tags.SIMULATION_PATH: simulation_path,
+        Tags.VOLUME_NAME: f"benchmark_{implementation}",
+        Tags.SPACING_MM: 1
+    }, verbose=False)
+    settings.set_optical_settings({})
+    adapter = MCXAdapter(settings)
+    adapter.frames = 1
+    adapter.mcx_volumetric_data_file = os.path.join(simulation_path, f"benchmark_{implementation}_output.mc2")
+
+    shape = (volume_size, volume_size, volume_size)
+    absorption_cm = np.full(shape, 0.1)
+    scattering_cm = np.full(shape, 100.0)
+    anisotropy = np.full(shape, 0.9)
+    baseline_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    start_time = time.time()
+    if implementation == "struct":
+        write_input_with_struct(adapter, absorption_cm, scattering_cm, anisotropy)
+    else:
+        adapter.generate_mcx_bin_input(absorption_cm, scattering_cm, anisotropy, assumed_anisotropy=0.9)
+    write_time = time.time() - start_time
+    del absorption_cm, scattering_cm, anisotropy
+
+    # MCX writes one float32 value per voxel and time frame
+    np.random.random(shape).astype(np.float32).tofile(adapter.mcx_volumetric_data_file)
+    start_time = time.time()
+    if implementation == "struct":
+        read_output_with_struct(adapter)
+    else:
+        adapter.read_mcx_output()
+    read_time = time.time() - start_time
+
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    queue.put((write_time, read_time, peak_rss_mb - baseline_rss_mb))
+
+
+class MCXFileExchangeBenchmark(ManualIntegrationTestClass):
+
+    def __init__(self, volume_size=400):
+        self.volume_size = volume_size
+        self.implementations = ["struct", "numpy"]
+        self.results = dict()
+        self.temporary_directory = None
+
+    def setup(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()
+
+    def perform_test(self):
+        context = multiprocessing.get_context("spawn")
+        for implementation in self.implementations:
+            queue = context.Queue()
+            process = context.Process(target=measure, args=(implementation, self.volume_size,
+                                                            self.temporary_directory.name, queue))
+            process.start()
+            self.results[implementation] = queue.get()
+            process.join()
+
+    def visualise_result(self, show_figure_on_screen=True, save_path=None):
+        print(f"MCX file exchange of a volume with {self.volume_size}^3 voxels:")
+        for implementation, (write_time, read_time, peak_rss_mb) in self.results.items():
+            print(f"{implementation:>8}: write {write_time:8.2f} s, read {read_time:8.2f} s, "
+                  f"additional peak RSS {peak_rss_mb:10.1f} MB")
+
+        fig, axes = plt.subplots(1, 2, figsize=(8, 4))
+        axes[0].bar(self.implementations, [sum(self.results[impl][:2]) for impl in self.implementations])
+        axes[0].set_ylabel("write + read time [s]")
+        axes[1].bar(self.implementations, [self.results[impl][2] for impl in self.implementations])
+        axes[1].set_ylabel("additional peak RSS [MB]")
+        plt.suptitle(f"MCX file exchange, {self.volume_size}^3 voxels")
+        plt.tight_layout()
+        if show_figure_on_screen:
+            plt.show()
+        else:
+            if save_path is None:
+                save_path = ""
+            plt.savefig(save_path + "mcx_file_exchange_benchmark.png")
+        plt.close()
+
+    def tear_down(self):
+        self.temporary_directory.cleanup()
+
+
+if __name__ == '__main__':
+    test = MCXFileExchangeBenchmark(volume_size=int(sys.argv[1]) if len(sys.argv) > 1 else 400)
+    test.run_test(show_figure_on_screen=False)
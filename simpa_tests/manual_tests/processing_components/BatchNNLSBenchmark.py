@@ -0,0 +1,84 @@
+# SPDX-FileCopyrightText: 2021 Division of Intelligent Medical Systems, DKFZ
+# SPDX-FileCopyrightText: 2021 Janek Groehl
+# SPDX-License-Identifier: MIT
+
+"""
+This script benchmarks the batched non-negative least squares solver used by the non-negative linear unmixing
+against solving every pixel with scipy.optimize.nnls, which was done before.
+The measurements are synthetic multispectral pixels that are mixed from the absorption spectra of SIMPA's spectral
+library with additive noise, such that a part of the concentrations is clipped by the non-negativity constraint.
+"""
+
+import sys
+import time
+
+import matplotlib.pyplot as plt
+import numpy as np
+from scipy.optimize import nnls
+
+import simpa as sp
+from simpa.core.processing_components.multispectral.linear_unmixing import batch_nnls
+from simpa.utils import Tags
+from simpa_tests.manual_tests import ManualIntegrationTestClass
+
+
+class BatchNNLSBenchmark(ManualIntegrationTestClass):
+
+    def __init__(self, number_of_pixels=1000000):
+        self.number_of_pixels = number_of_pixels
+        self.wavelengths = [700, 730, 760, 800, 850, 900]
+        self.spectra_names = [Tags.SIMPA_NAMED_ABSORPTION_SPECTRUM_DEOXYHEMOGLOBIN,
+                              Tags.SIMPA_NAMED_ABSORPTION_SPECTRUM_OXYHEMOGLOBIN,
+                              Tags.SIMPA_NAMED_ABSORPTION_SPECTRUM_WATER,
+                              Tags.SIMPA_NAMED_ABSORPTION_SPECTRUM_FAT]
+        self.results = dict()
+        self.endmember_matrix = None
+        self.data = None
+
+    def setup(self):
+        spectra = sp.get_simpa_internal_absorption_spectra_by_names(self.spectra_names)
+        self.endmember_matrix = np.asarray([[spectrum.get_value_for_wavelength(wavelength) for spectrum in spectra]
+                                            for wavelength in self.wavelengths])
+        random_generator = np.random.default_rng(471)
+        concentrations = random_generator.random((len(self.spectra_names), self.number_of_pixels))
+        signal = self.endmember_matrix @ concentrations
+        self.data = signal + random_generator.normal(scale=0.1 * signal.std(), size=signal.shape)
+
+    def perform_test(self):
+        start_time = time.time()
+        reference = np.stack([nnls(self.endmember_matrix, self.data[:, pixel])[0]
+                              for pixel in range(self.number_of_pixels)], axis=1)
+        self.results["per-pixel nnls"] = (time.time() - start_time, 0.0)
+
+        for number_of_workers in [1, 4]:
+            start_time = time.time()
+            result = batch_nnls(self.endmember_matrix, self.data, number_of_workers=number_of_workers)
+            self.results[f"batch_nnls ({number_of_workers} workers)"] = (time.time() - start_time,
+                                                                         np.abs(result - reference).max())
+
+    def visualise_result(self, show_figure_on_screen=True, save_path=None):
+        print(f"Non-negative unmixing of {self.number_of_pixels} pixels with {len(self.wavelengths)} wavelengths and "
+              f"{len(self.spectra_names)} endmembers:")
+        for name, (duration, max_difference) in self.results.items():
+            print(f"{name:>24}: {duration:8.2f} s, maximum difference to nnls {max_difference:.2e}")
+
+        plt.figure(figsize=(6, 4))
+        plt.bar(list(self.results.keys()), [duration for duration, _ in self.results.values()])
+        plt.ylabel("time [s]")
+        plt.title(f"Non-negative linear unmixing of {self.number_of_pixels} pixels")
+        plt.tight_layout()
+        if show_figure_on_screen:
+            plt.show()
+        else:
+            if save_path is None:
+                save_path = ""
+            plt.savefig(save_path + "batch_nnls_benchmark.png")
+        plt.close()
+
+    def tear_down(self):
+        pass
+
+
+if __name__ == '__main__':
+    test = BatchNNLSBenchmark(number_of_pixels=int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
+    test.run_test(show_figure_on_screen=False)
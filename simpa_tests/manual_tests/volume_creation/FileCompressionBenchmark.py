@@ -0,0 +1,118 @@
+# SPDX-FileCopyrightText: 2021 Division of Intelligent Medical Systems, DKFZ
+# SPDX-FileCopyrightText: 2021 Janek Groehl
+# SPDX-License-Identifier: MIT
+
+"""
+This script benchmarks the compression of the SIMPA output file for a simulation with 20 wavelengths.
+The datasets are compressed while they are written by the simulation modules ("single pass") and this is compared
+to the previous behaviour ("rewrite"), where the uncompressed output file was loaded completely after the simulation
+and written again with gzip compression.
+
+Every measurement runs in a fresh process, so that the reported peak resident set size (RSS) only contains the
+memory needed by that measurement.
+"""
+
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+import simpa as sp
+from simpa.core.simulation_modules.optical_simulation_module.optical_forward_model_test_adapter import \
+    OpticalForwardModelTestAdapter
+from simpa.io_handling import load_hdf5, save_hdf5
+from simpa.utils import Tags, Settings
+from simpa_tests.manual_tests import ManualIntegrationTestClass
+from simpa_tests.test_utils.tissue_models import create_simple_tissue_model
+
+
+def measure(variant, spacing, number_of_wavelengths, simulation_path, queue):
+    settings = Settings({
+        Tags.RANDOM_SEED: 471,
+        Tags.VOLUME_NAME: f"file_compression_benchmark_{variant.replace(' ', '_')}",
+        Tags.SIMULATION_PATH: simulation_path,
+        Tags.SPACING_MM: spacing,
+        Tags.DIM_VOLUME_X_MM: 60,
+        Tags.DIM_VOLUME_Y_MM: 30,
+        Tags.DIM_VOLUME_Z_MM: 60,
+        Tags.WAVELENGTHS: list(np.linspace(700, 900, number_of_wavelengths).astype(int)),
+        Tags.DO_FILE_COMPRESSION: variant == "single pass"
+    }, verbose=False)
+    settings.set_volume_creation_settings({
+        Tags.SIMULATE_DEFORMED_LAYERS: False,
+        Tags.STRUCTURES: create_simple_tissue_model(60, 30)
+    })
+    settings.set_optical_settings({
+        Tags.LASER_PULSE_ENERGY_IN_MILLIJOULE: 50
+    })
+    pipeline = [sp.ModelBasedVolumeCreationAdapter(settings), OpticalForwardModelTestAdapter(settings)]
+    baseline_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    start_time = time.time()
+    sp.simulate(pipeline, settings, sp.PencilBeamIlluminationGeometry())
+    if variant == "rewrite":
+        all_data = load_hdf5(settings[Tags.SIMPA_OUTPUT_PATH])
+        save_hdf5(all_data, settings[Tags.SIMPA_OUTPUT_PATH], file_compression="gzip")
+        del all_data
+    duration = time.time() - start_time
+
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    file_size_mb = os.path.getsize(settings[Tags.SIMPA_OUTPUT_PATH]) / 1024 / 1024
+    os.remove(settings[Tags.SIMPA_OUTPUT_PATH])
+    queue.put((duration, peak_rss_mb - baseline_rss_mb, file_size_mb))
+
+
+class FileCompressionBenchmark(ManualIntegrationTestClass):
+
+    def __init__(self, spacing=0.5, number_of_wavelengths=20):
+        self.spacing = spacing
+        self.number_of_wavelengths = number_of_wavelengths
+        self.variants = ["rewrite", "single pass"]
+        self.results = dict()
+        self.temporary_directory = None
+
+    def setup(self):
+        self.temporary_directory = tempfile.TemporaryDirectory()
+
+    def perform_test(self):
+        context = multiprocessing.get_context("spawn")
+        for variant in self.variants:
+            queue = context.Queue()
+            process = context.Process(target=measure, args=(variant, self.spacing, self.number_of_wavelengths,
+                                                            self.temporary_directory.name, queue))
+            process.start()
+            self.results[variant] = queue.get()
+            process.join()
+
+    def visualise_result(self, show_figure_on_screen=True, save_path=None):
+        print(f"Simulation with {self.number_of_wavelengths} wavelengths and a spacing of {self.spacing} mm:")
+        for variant, (duration, peak_rss_mb, file_size_mb) in self.results.items():
+            print(f"{variant:>12}: {duration:8.2f} s, additional peak RSS {peak_rss_mb:8.1f} MB, "
+                  f"file size {file_size_mb:8.1f} MB")
+
+        fig, axes = plt.subplots(1, 3, figsize=(12, 4))
+        for axis, index, label in zip(axes, range(3), ["time [s]", "additional peak RSS [MB]", "file size [MB]"]):
+            axis.bar(self.variants, [self.results[variant][index] for variant in self.variants])
+            axis.set_ylabel(label)
+        plt.suptitle(f"HDF5 file compression, {self.number_of_wavelengths} wavelengths")
+        plt.tight_layout()
+        if show_figure_on_screen:
+            plt.show()
+        else:
+            if save_path is None:
+                save_path = ""
+            plt.savefig(save_path + "file_compression_benchmark.png")
+        plt.close()
+
+    def tear_down(self):
+        self.temporary_directory.cleanup()
+
+
+if __name__ == '__main__':
+    test = FileCompressionBenchmark(spacing=float(sys.argv[1]) if len(sys.argv) > 1 else 0.5)
+    test.run_test(show_figure_on_screen=False)
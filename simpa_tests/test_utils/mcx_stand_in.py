@@ -0,0 +1,96 @@
+# SPDX-FileCopyrightText: 2021 Division of Intelligent Medical Systems, DKFZ
+# SPDX-FileCopyrightText: 2021 Janek Groehl
+# SPDX-License-Identifier: MIT
+
+"""
+Stand-in for the MCX binary that is used to test the file exchange with the MCX adapters without a GPU. It reads the
+JSON configuration and the volume file that are written by the adapter in the same way as MCX does and writes a
+deterministic fluence into the output file that MCX would write:
+
+    fluence = absorption (per mm) * (1 + x position of the source in voxels)
+
+Voxels without a medium (NaN in the volume file) get a fluence of 0 or, with --saveref, a negative diffuse reflectance
+of -(1 + x position of the source in voxels) / 100. With --savedetflag, one photon per voxel of the first z layer is
+written into a binary .mch file, which exits at (x, y, x position of the source) in the direction (0, 0, -1).
+
+If the environment variable MCX_STAND_IN_DELAY is set, the stand-in waits this many seconds before it writes the
+output, such that simulations that run at the same time overlap. Usage:
+
+    python mcx_stand_in.py -f config.json -O F [--saveref] [-H n --savedetflag XV] [further MCX flags,
+        which are ignored]
+"""
+
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+# columns of a detected photon in an .mch file, as (flag, number of columns), a number of None stands for one column
+# per medium
+MCH_COLUMNS = [("D", 1), ("S", None), ("P", None), ("M", None), ("X", 3), ("V", 3), ("W", 1)]
+
+
+def get_fluence(config: dict, save_reflectance: bool = False) -> np.ndarray:
+    """
+    :param config: the MCX JSON configuration.
+    :param save_reflectance: if True, the diffuse reflectance is stored as negative values in voxels without a medium.
+    :return: the fluence in Fortran order with shape (nx, ny, nz, frames).
+    """
+    nx, ny, nz = config["Domain"]["Dim"]
+    volume = np.fromfile(config["Domain"]["VolumeFile"], dtype=np.float32).reshape((2, nx, ny, nz), order="F")
+    absorption = volume[0]
+    frames = int(round((config["Forward"]["T1"] - config["Forward"]["T0"]) / config["Forward"]["Dt"]))
+    source_factor = np.float32(1 + config["Optode"]["Source"]["Pos"][0])
+    fluence = absorption * source_factor
+    fluence[np.isnan(absorption)] = -source_factor / 100 if save_reflectance else 0
+    return np.repeat(fluence[..., np.newaxis], frames, axis=3)
+
+
+def write_photon_data(config: dict, savedetflag: str, output_path: str):
+    """
+    Writes a single block of detected photons in the binary .mch format of MCX.
+    """
+    nx, ny, _ = config["Domain"]["Dim"]
+    maxmedia = len(config["Domain"]["Media"]) - 1
+    x, y = np.meshgrid(np.arange(nx), np.arange(ny), indexing="ij")
+    columns = list()
+    for flag, number_of_columns in MCH_COLUMNS:
+        if flag not in savedetflag:
+            continue
+        if flag == "X":
+            columns += [x.reshape(-1), y.reshape(-1), np.full(nx * ny, config["Optode"]["Source"]["Pos"][0])]
+        elif flag == "V":
+            columns += [np.zeros(nx * ny), np.zeros(nx * ny), -np.ones(nx * ny)]
+        else:
+            columns += [np.zeros(nx * ny)] * (maxmedia if number_of_columns is None else number_of_columns)
+    data = np.stack(columns, axis=1).astype("<f4")
+    flag_bits = sum(1 << index for index, (flag, _) in enumerate(MCH_COLUMNS) if flag in savedetflag)
+    header = np.array([2, maxmedia, 1, data.shape[1], int(config["Session"]["Photons"]), len(data), len(data)],
+                      dtype="<u4").tobytes()
+    header += np.array([config["Domain"]["LengthUnit"]], dtype="<f4").tobytes()
+    header += np.array([0], dtype="<u4").tobytes()  # seedbyte
+    header += np.array([1], dtype="<f4").tobytes()  # normalizer
+    header += np.array([1, 1, flag_bits, 1, 0], dtype="<u4").tobytes()
+    with open(output_path, "wb") as output_file:
+        output_file.write(b"MCXH" + header)
+        output_file.write(data.tobytes())
+
+
+def main(arguments: list):
+    config_path = arguments[arguments.index("-f") + 1]
+    with open(config_path) as config_file:
+        config = json.load(config_file)
+    fluence = get_fluence(config, save_reflectance="--saveref" in arguments)
+    if "MCX_STAND_IN_DELAY" in os.environ:
+        time.sleep(float(os.environ["MCX_STAND_IN_DELAY"]))
+
+    fluence.astype(np.float32).reshape(-1, order="F").tofile(config["Session"]["ID"] + ".mc2")
+    if "--savedetflag" in arguments:
+        write_photon_data(config, arguments[arguments.index("--savedetflag") + 1],
+                          config["Session"]["ID"] + ".mch")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])